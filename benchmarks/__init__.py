@@ -0,0 +1,12 @@
+"""
+benchmarks package contains the scripts which measure the performance of CaskDB.
+Each module can be run on its own, from the root of the repository:
+
+    python -m benchmarks.startup --keys 1000000
+
+The suite module runs the standard workloads (YCSB, startup, contention...) in one
+go, and compares them against a saved baseline, to catch the regressions:
+
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --baseline baseline.json
+"""
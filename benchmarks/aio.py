@@ -0,0 +1,63 @@
+"""
+aio benchmark measures the throughput of AsyncDiskStorage with 1, 64 and 1024 tasks
+running at the same time. Every set is fsynced (the default sync policy), so the set
+throughput shows how well the concurrent writes are batched.
+
+    python -m benchmarks.aio --ops 20000 --tasks 1 64 1024
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from benchmarks.common import make_key, make_value, report, temp_dir
+from caskdb import AsyncDiskStorage
+
+
+async def run(file_name: str, tasks: int, ops: int, value_size: int) -> None:
+    store = await AsyncDiskStorage.open(file_name)
+    per_task: int = max(1, ops // tasks)
+
+    async def writer(t: int) -> None:
+        for i in range(per_task):
+            n: int = t * per_task + i
+            await store.set(make_key(n), make_value(n, value_size))
+
+    async def reader(t: int) -> None:
+        rng = random.Random(t)
+        for _ in range(per_task):
+            await store.get(make_key(rng.randrange(per_task * tasks)))
+
+    start: float = time.perf_counter()
+    await asyncio.gather(*(writer(t) for t in range(tasks)))
+    set_s: float = time.perf_counter() - start
+    start = time.perf_counter()
+    await asyncio.gather(*(reader(t) for t in range(tasks)))
+    get_s: float = time.perf_counter() - start
+    fsyncs: int = store.store._commit.sync_count
+    await store.close()
+    total: int = per_task * tasks
+    report(
+        f"async tasks={tasks}",
+        sets_per_s=total / set_s,
+        gets_per_s=total / get_s,
+        sets_per_fsync=total / max(1, fsyncs),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ops", type=int, default=20_000)
+    parser.add_argument("--tasks", type=int, nargs="+", default=[1, 64, 1024])
+    parser.add_argument("--value-size", type=int, default=100)
+    args = parser.parse_args()
+    for tasks in args.tasks:
+        with temp_dir() as path:
+            file_name: str = os.path.join(path, "bench.db")
+            asyncio.run(run(file_name, tasks, args.ops, args.value_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+bloom benchmark measures the lookups of the missing keys with and without the Bloom
+filters, for every KeyDir type, along with the memory the filters take and their
+observed false-positive rate:
+
+    python -m benchmarks.bloom --keys 1000000 --fp-rate 0.01 0.001
+"""
+
+import argparse
+import os
+import typing
+
+from benchmarks.common import report, temp_dir, timed, write_records
+from caskdb import DiskStorage, SyncPolicy
+from caskdb.keydir import KEY_DIR_TYPES
+
+
+def run(
+    n: int,
+    lookups: int,
+    key_dir_type: str,
+    fp_rate: typing.Optional[float],
+    segment_size: int,
+) -> None:
+    with temp_dir() as path:
+        file_name: str = os.path.join(path, "bench.db")
+        write_records(file_name, n, 100)
+        # the records are split into sealed segments by a merge, since only those
+        # get filters
+        store = DiskStorage(
+            file_name=file_name,
+            sync_policy=SyncPolicy.os_managed(),
+            max_file_size=segment_size,
+            key_dir_type=key_dir_type,
+            bloom_fp_rate=fp_rate,
+        )
+        store.merge()
+        missing: list[str] = [f"missing{i}" for i in range(lookups)]
+
+        def get_missing() -> None:
+            for key in missing:
+                store.get(key)
+
+        elapsed: float = timed(get_missing)
+        fields: dict[str, typing.Any] = {
+            "segments": len(store.file_ids()),
+            "miss_us": elapsed / lookups * 1e6,
+        }
+        if store.bloom_filters is not None:
+            fields["filter_mb"] = store.bloom_filters.memory_bytes / (1 << 20)
+            fields["observed_fp"] = store.bloom_filters.stats.false_positive_rate
+        report(f"bloom {key_dir_type} fp={fp_rate}", **fields)
+        store.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    parser.add_argument("--fp-rate", type=float, nargs="+", default=[0.01, 0.001])
+    parser.add_argument("--segment-size", type=int, default=16 << 20)
+    args = parser.parse_args()
+    for key_dir_type in KEY_DIR_TYPES:
+        for fp_rate in [None] + args.fp_rate:
+            run(args.keys, args.lookups, key_dir_type, fp_rate, args.segment_size)
+
+
+if __name__ == "__main__":
+    main()
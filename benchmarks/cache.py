@@ -0,0 +1,64 @@
+"""
+cache benchmark replays a Zipfian trace of reads against DiskStorage, with each of the
+cache policies and without any cache. It reports the hit rate and the reads per second.
+A small cache (a few percent of the data) is where the policies differ the most.
+
+    python -m benchmarks.cache --keys 100000 --reads 500000 --cache-ratio 0.05
+"""
+
+import argparse
+import os
+import typing
+
+from benchmarks.common import make_key, report, temp_dir, timed, write_records, zipfian
+from caskdb import DiskStorage
+from caskdb.cache import Cache, new_cache
+
+
+def run(
+    file_name: str, keys: list[str], name: str, cache: typing.Optional[Cache]
+) -> None:
+    store = DiskStorage(file_name=file_name, cache=cache)
+
+    def replay() -> None:
+        for key in keys:
+            store.get(key)
+
+    elapsed: float = timed(replay)
+    store.close()
+    if cache is None:
+        report(name, reads_per_s=len(keys) / elapsed)
+        return
+    report(
+        name,
+        reads_per_s=len(keys) / elapsed,
+        hit_rate=cache.stats.hit_rate,
+        evictions=cache.stats.evictions,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, default=100_000)
+    parser.add_argument("--reads", type=int, default=500_000)
+    parser.add_argument("--value-size", type=int, default=100)
+    parser.add_argument("--skew", type=float, default=0.99)
+    parser.add_argument("--cache-ratio", type=float, default=0.05)
+    args = parser.parse_args()
+    keys: list[str] = [
+        make_key(i) for i in zipfian(args.keys, args.reads, skew=args.skew)
+    ]
+    # the budget is a fraction of the total size of the keys and the values
+    max_bytes: int = int(
+        args.keys * (len(make_key(0)) + args.value_size) * args.cache_ratio
+    )
+    with temp_dir() as path:
+        file_name: str = os.path.join(path, "bench.db")
+        write_records(file_name, args.keys, args.value_size)
+        run(file_name, keys, "no cache", None)
+        for policy in ("fifo", "lru", "lfu", "tinylfu"):
+            run(file_name, keys, policy, new_cache(policy, max_bytes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+checksum benchmark measures the cost of verifying the record checksums: per read,
+for a few value sizes, and per GB of data scanned at the startup (with no hint file,
+so that every record is scanned):
+
+    python -m benchmarks.checksum --keys 100000 --value-size 100 4096
+"""
+
+import argparse
+import os
+import random
+
+from benchmarks.common import make_key, report, temp_dir, timed, write_records
+from caskdb import DiskStorage
+
+
+def reads(file_name: str, keys: list[str], verify: bool) -> float:
+    store = DiskStorage(file_name=file_name, verify_checksums=verify)
+
+    def read_all() -> None:
+        for key in keys:
+            store.get(key)
+
+    elapsed: float = timed(read_all)
+    store.close()
+    return elapsed / len(keys)
+
+
+def startup(file_name: str, verify: bool) -> float:
+    def open_close() -> None:
+        store = DiskStorage(file_name=file_name, verify_checksums=verify)
+        # no hint file is written, as if the store had crashed
+        store.file.close()
+        assert store._file_lock is not None
+        store._file_lock.release()
+
+    return timed(open_close)
+
+
+def run(n: int, reads_count: int, value_size: int) -> None:
+    with temp_dir() as path:
+        file_name: str = os.path.join(path, "bench.db")
+        write_records(file_name, n, value_size)
+        gb: float = os.path.getsize(file_name) / (1 << 30)
+        rng = random.Random(42)
+        keys: list[str] = [make_key(rng.randrange(n)) for _ in range(reads_count)]
+        trusted: float = reads(file_name, keys, verify=False)
+        verified: float = reads(file_name, keys, verify=True)
+        report(
+            f"read value_size={value_size}",
+            trusted_us=trusted * 1e6,
+            verified_us=verified * 1e6,
+            overhead_us=(verified - trusted) * 1e6,
+        )
+        trusted = startup(file_name, verify=False)
+        verified = startup(file_name, verify=True)
+        report(
+            f"startup value_size={value_size}",
+            trusted_s_per_gb=trusted / gb,
+            verified_s_per_gb=verified / gb,
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, default=100_000)
+    parser.add_argument("--reads", type=int, default=200_000)
+    parser.add_argument("--value-size", type=int, nargs="+", default=[100, 4096])
+    args = parser.parse_args()
+    for value_size in args.value_size:
+        run(args.keys, args.reads, value_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+common module has the helpers shared by all the benchmark scripts
+"""
+
+import bisect
+import contextlib
+import itertools
+import os
+import random
+import shutil
+import tempfile
+import time
+import typing
+
+from caskdb.format import encode_kv
+
+
+@contextlib.contextmanager
+def temp_dir(parent: typing.Optional[str] = None) -> typing.Iterator[str]:
+    path: str = tempfile.mkdtemp(prefix="caskdb-bench-", dir=parent)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def timed(fn: typing.Callable[[], typing.Any]) -> float:
+    start: float = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def make_key(i: int) -> str:
+    return f"key{i:012d}"
+
+
+def make_value(i: int, size: int) -> str:
+    return f"{i:x}".rjust(size, "v")[:size]
+
+
+def write_records(path: str, n: int, value_size: int) -> None:
+    """
+    write_records writes n records straight to the data file, bypassing DiskStorage.
+    Loading millions of keys with DiskStorage.set would take a long time, since every
+    set does an fsync.
+    """
+    timestamp: int = int(time.time())
+    with open(path, "ab", buffering=1 << 20) as f:
+        for i in range(n):
+            _, data = encode_kv(timestamp, make_key(i), make_value(i, value_size))
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def zipfian(
+    n: int, count: int, skew: float = 0.99, seed: int = 42, shuffle: bool = True
+) -> list[int]:
+    """
+    zipfian returns count numbers between 0 and n - 1, where the number i is drawn
+    with probability proportional to 1 / (i + 1) ** skew. So a few numbers are very
+    popular, and most are rarely seen, which is how the real workloads access keys.
+    Unless shuffle is unset, the popular numbers are spread over the range rather
+    than being the smallest ones.
+    """
+    weights: typing.Iterator[float] = (1 / (i + 1) ** skew for i in range(n))
+    cdf: list[float] = list(itertools.accumulate(weights))
+    rng = random.Random(seed)
+    total: float = cdf[-1]
+    # shuffle, so that the popular keys are not the ones written first
+    order: list[int] = list(range(n))
+    if shuffle:
+        rng.shuffle(order)
+    return [
+        order[min(n - 1, bisect.bisect(cdf, rng.random() * total))]
+        for _ in range(count)
+    ]
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered: list[float] = sorted(samples)
+    index: int = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+    return ordered[index]
+
+
+def report(name: str, **fields: typing.Any) -> None:
+    values: str = "  ".join(
+        f"{k}={v:.4f}" if isinstance(v, float) else f"{k}={v}"
+        for k, v in fields.items()
+    )
+    print(f"{name:<28} {values}")
@@ -0,0 +1,84 @@
+"""
+compression benchmark reports the compression ratio of JSON values, and the time it
+adds to encoding and decoding a value, for every codec, with and without a trained
+dictionary. Small values are where the dictionary makes the difference:
+
+    python -m benchmarks.compression --values 20000 --fields 5 50
+"""
+
+import argparse
+import json
+import random
+import time
+
+from benchmarks.common import report, timed
+from caskdb.compression import (
+    HAS_ZSTD,
+    Compressor,
+    Decompressor,
+    train_dictionary,
+)
+from caskdb.format import Buffer
+
+
+def make_values(n: int, fields: int, seed: int = 42) -> list[bytes]:
+    rng = random.Random(seed)
+    words: list[str] = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta"]
+    return [
+        json.dumps(
+            {
+                f"field_{j}": rng.choice(words) if j % 2 else rng.randrange(10**6)
+                for j in range(fields)
+            }
+            | {"id": i, "updated_at": int(time.time())}
+        ).encode("utf-8")
+        for i in range(n)
+    ]
+
+
+def run(name: str, compressor: Compressor, values: list[bytes]) -> None:
+    decompressor = Decompressor(compressor.dictionary)
+    stored: list[tuple[int, Buffer]] = []
+
+    def compress() -> None:
+        for value in values:
+            stored.append(compressor.compress(value))
+
+    def decompress() -> None:
+        for flags, data in stored:
+            if flags:
+                decompressor.decompress(flags, data)
+
+    encode_s: float = timed(compress)
+    decode_s: float = timed(decompress)
+    raw: int = sum(len(v) for v in values)
+    report(
+        name,
+        ratio=raw / sum(len(data) for _, data in stored),
+        encode_us=encode_s / len(values) * 1e6,
+        decode_us=decode_s / len(values) * 1e6,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--values", type=int, default=20_000)
+    parser.add_argument("--fields", type=int, nargs="+", default=[5, 50])
+    args = parser.parse_args()
+    codecs: list[str] = ["zlib", "lzma"] + (["zstd"] if HAS_ZSTD else [])
+    for fields in args.fields:
+        values: list[bytes] = make_values(args.values, fields)
+        size: int = sum(len(v) for v in values) // len(values)
+        print(f"values of {size} bytes on average")
+        # the dictionary is trained on values the benchmark doesn't compress
+        samples: list[bytes] = make_values(1000, fields, seed=7)
+        for codec in codecs:
+            run(f"{codec}", Compressor(codec, threshold=0), values)
+            if codec != "lzma":
+                dictionary: bytes = train_dictionary(samples, codec=codec)
+                compressor = Compressor(codec, threshold=0, dictionary=dictionary)
+                run(f"{codec}+dictionary", compressor, values)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+contention benchmark measures the read throughput of a DiskStorage shared by N reader
+threads, while one writer thread keeps overwriting random keys. As a baseline, it also
+runs the readers with every call wrapped in a global lock, the way a store which is not
+thread safe has to be used.
+
+    python -m benchmarks.contention --readers 1 2 4 8 --seconds 2
+"""
+
+import argparse
+import contextlib
+import os
+import random
+import threading
+import time
+import typing
+
+from benchmarks.common import make_key, make_value, report, temp_dir, write_records
+from caskdb import DiskStorage, SyncPolicy
+
+
+def run(file_name: str, args: argparse.Namespace, readers: int, locked: bool) -> None:
+    store = DiskStorage(file_name=file_name, sync_policy=SyncPolicy.os_managed())
+    lock: typing.ContextManager[typing.Any] = (
+        threading.Lock() if locked else contextlib.nullcontext()
+    )
+    stop = threading.Event()
+    reads: list[int] = [0] * readers
+    writes: list[int] = [0]
+
+    def reader(index: int) -> None:
+        rng = random.Random(index)
+        count: int = 0
+        while not stop.is_set():
+            key: str = make_key(rng.randrange(args.keys))
+            with lock:
+                store.get(key)
+            count += 1
+        reads[index] = count
+
+    def writer() -> None:
+        rng = random.Random(-1)
+        while not stop.is_set():
+            i: int = rng.randrange(args.keys)
+            with lock:
+                store.set(make_key(i), make_value(i, args.value_size))
+            writes[0] += 1
+
+    threads: list[threading.Thread] = [
+        threading.Thread(target=reader, args=(i,)) for i in range(readers)
+    ]
+    threads.append(threading.Thread(target=writer))
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    store.close()
+    report(
+        f"{'global lock' if locked else 'concurrent'} readers={readers}",
+        reads_per_s=sum(reads) / args.seconds,
+        writes_per_s=writes[0] / args.seconds,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, default=100_000)
+    parser.add_argument("--value-size", type=int, default=100)
+    parser.add_argument("--readers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+    with temp_dir() as path:
+        file_name: str = os.path.join(path, "bench.db")
+        write_records(file_name, args.keys, args.value_size)
+        for readers in args.readers:
+            for locked in (True, False):
+                run(file_name, args, readers, locked)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+durability benchmark measures the write throughput and latency of DiskStorage.set for
+each of the sync policies. Latency is measured till `set` returns; with the `always`
+policy that includes the fsync.
+
+    python -m benchmarks.durability --writes 2000 --threads 1 8
+"""
+
+import argparse
+import os
+import threading
+import time
+
+from benchmarks.common import make_key, make_value, percentile, report, temp_dir
+from caskdb import DiskStorage
+from caskdb.durability import SyncPolicy
+
+
+def run(policy: SyncPolicy, writes: int, threads: int, value_size: int) -> None:
+    with temp_dir() as path:
+        store = DiskStorage(
+            file_name=os.path.join(path, "bench.db"), sync_policy=policy
+        )
+        latencies: list[list[float]] = [[] for _ in range(threads)]
+        per_thread: int = writes // threads
+
+        def write(n: int) -> None:
+            samples: list[float] = latencies[n]
+            value: str = make_value(n, value_size)
+            for i in range(per_thread):
+                key: str = make_key(n * per_thread + i)
+                start: float = time.perf_counter()
+                store.set(key, value)
+                samples.append(time.perf_counter() - start)
+
+        workers = [threading.Thread(target=write, args=(n,)) for n in range(threads)]
+        start: float = time.perf_counter()
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        store.sync()
+        elapsed: float = time.perf_counter() - start
+        store.close()
+        samples: list[float] = [s for thread in latencies for s in thread]
+        report(
+            f"{policy.mode} threads={threads}",
+            writes_per_s=len(samples) / elapsed,
+            p50_ms=percentile(samples, 50) * 1000,
+            p99_ms=percentile(samples, 99) * 1000,
+            fsyncs=store._commit.sync_count,
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--writes", type=int, default=2000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--value-size", type=int, default=100)
+    parser.add_argument("--interval-ms", type=int, default=10)
+    parser.add_argument("--max-bytes", type=int, default=1 << 20)
+    args = parser.parse_args()
+    policies = [
+        SyncPolicy.always(),
+        SyncPolicy.every_ms(args.interval_ms),
+        SyncPolicy.every_bytes(args.max_bytes),
+        SyncPolicy.os_managed(),
+    ]
+    for threads in args.threads:
+        for policy in policies:
+            run(policy, args.writes, threads, args.value_size)
+
+
+if __name__ == "__main__":
+    main()
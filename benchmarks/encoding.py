@@ -0,0 +1,108 @@
+"""
+encoding benchmark compares the cost per record of encoding and decoding the KV
+pairs given as strings and as bytes. As a baseline, it also times the way encode_kv
+used to build a record: the header and the joined key and value, concatenated. The
+baseline has no checksum, so most of the difference from it is the CRC. Last, it
+compares DiskStorage.get with get_bytes, which returns the value without decoding
+or copying it:
+
+    python -m benchmarks.encoding --records 100000 --value-size 100 4096
+"""
+
+import argparse
+import os
+import struct
+import time
+
+from benchmarks.common import (
+    make_key,
+    make_value,
+    report,
+    temp_dir,
+    timed,
+    write_records,
+)
+from caskdb import DiskStorage
+from caskdb.format import decode_kv, encode_kv, encode_kv_bytes, split_kv
+
+
+def concat_encode(timestamp: int, key: str, value: str) -> bytes:
+    header: bytes = struct.pack("<LLL", timestamp, len(key), len(value))
+    data: bytes = b"".join([str.encode(key), str.encode(value)])
+    return header + data
+
+
+def codec(n: int, value_size: int) -> None:
+    timestamp: int = int(time.time())
+    keys: list[str] = [make_key(i) for i in range(n)]
+    value: str = make_value(0, value_size)
+    key_bytes: list[bytes] = [key.encode("utf-8") for key in keys]
+    value_bytes: bytes = value.encode("utf-8")
+    records: list[bytes] = [encode_kv(timestamp, key, value)[1] for key in keys]
+
+    def concat() -> None:
+        for key in keys:
+            concat_encode(timestamp, key, value)
+
+    def encode_str() -> None:
+        for key in keys:
+            encode_kv(timestamp, key, value)
+
+    def encode_bytes() -> None:
+        for key in key_bytes:
+            encode_kv_bytes(timestamp, key, value_bytes)
+
+    def decode_str() -> None:
+        for record in records:
+            decode_kv(record)
+
+    def decode_bytes() -> None:
+        for record in records:
+            split_kv(record)
+
+    report(
+        f"codec value_size={value_size}",
+        concat_encode_ns=timed(concat) / n * 1e9,
+        str_encode_ns=timed(encode_str) / n * 1e9,
+        bytes_encode_ns=timed(encode_bytes) / n * 1e9,
+        str_decode_ns=timed(decode_str) / n * 1e9,
+        bytes_decode_ns=timed(decode_bytes) / n * 1e9,
+    )
+
+
+def store_reads(n: int, value_size: int) -> None:
+    with temp_dir() as path:
+        file_name: str = os.path.join(path, "bench.db")
+        write_records(file_name, n, value_size)
+        keys: list[str] = [make_key(i) for i in range(n)]
+        key_bytes: list[bytes] = [key.encode("utf-8") for key in keys]
+        store = DiskStorage(file_name=file_name)
+
+        def get() -> None:
+            for key in keys:
+                store.get(key)
+
+        def get_bytes() -> None:
+            for key in key_bytes:
+                store.get_bytes(key)
+
+        report(
+            f"store value_size={value_size}",
+            get_us=timed(get) / n * 1e6,
+            get_bytes_us=timed(get_bytes) / n * 1e6,
+        )
+        store.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--records", type=int, default=100_000)
+    parser.add_argument("--value-size", type=int, nargs="+", default=[100, 4096])
+    args = parser.parse_args()
+    for value_size in args.value_size:
+        codec(args.records, value_size)
+        store_reads(args.records, value_size)
+
+
+if __name__ == "__main__":
+    main()
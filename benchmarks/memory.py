@@ -0,0 +1,141 @@
+"""
+memory benchmark reports the bytes used per key by the KeyDir implementations. The
+keys are counted too, since the dict keeps a str object for every key, while the
+compact KeyDir keeps only their bytes.
+
+The KeyDirs are measured on their own, and inside a real DiskStorage, which is what
+counts: everything the store keeps per key is measured along with its KeyDir. The
+store is measured once the keys are written, and again once it is opened from the
+disk, where the peak of the startup is reported too. The opens are measured three
+ways: as the store was closed, after losing the saved index of the paged KeyDir (the
+KeyDir is rebuilt from the hint files), and after losing the hint files too (every
+record is scanned). The pages of the paged KeyDir live in the page cache, so only
+what it keeps on the heap is counted.
+
+    python -m benchmarks.memory --keys 1000000 10000000 --store-keys 1000000
+"""
+
+import argparse
+import gc
+import os
+import tracemalloc
+import typing
+
+from benchmarks.common import make_key, make_value, report, temp_dir
+from caskdb import DiskStorage, SyncPolicy
+from caskdb.disk_store import HINT_FILE_SUFFIX
+from caskdb.format import KeyEntry
+from caskdb.keydir import new_key_dir
+from caskdb.paged_keydir import INDEX_FILE_SUFFIX
+
+# the store is loaded with set_many, this many keys at a time
+LOAD_BATCH_SIZE: typing.Final[int] = 1000
+
+
+class PlainKeyEntry:
+    # KeyEntry as it was before `__slots__`, with an instance `__dict__`
+    def __init__(self, timestamp: int, position: int, total_size: int, file_id: int):
+        self.timestamp: int = timestamp
+        self.position: int = position
+        self.total_size: int = total_size
+        self.file_id: int = file_id
+
+
+def build(name: str, n: int) -> typing.Any:
+    if name == "dict-plain":
+        plain: dict[str, PlainKeyEntry] = {}
+        for i in range(n):
+            plain[make_key(i)] = PlainKeyEntry(i, i * 100, 100, 0)
+        return plain
+    key_dir = new_key_dir(name)
+    for i in range(n):
+        key_dir[make_key(i)] = KeyEntry(i, i * 100, 100, 0)
+    return key_dir
+
+
+def run(name: str, n: int) -> None:
+    gc.collect()
+    tracemalloc.start()
+    key_dir = build(name, n)
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report(f"{name} keys={n}", bytes_per_key=used / n)
+    del key_dir
+
+
+def open_store(file_name: str, key_dir_type: str) -> DiskStorage:
+    return DiskStorage(
+        file_name=file_name,
+        sync_policy=SyncPolicy.os_managed(),
+        key_dir_type=key_dir_type,
+    )
+
+
+def measure_open(file_name: str, key_dir_type: str) -> tuple[int, int]:
+    # the heap the opened store holds, and the peak of its startup
+    gc.collect()
+    tracemalloc.start()
+    store: DiskStorage = open_store(file_name, key_dir_type)
+    used, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    store.close()
+    return used, peak
+
+
+def remove_files(path: str, suffix: str) -> None:
+    for name in os.listdir(path):
+        if suffix in name:
+            os.remove(os.path.join(path, name))
+
+
+def run_store(key_dir_type: str, n: int, value_size: int) -> None:
+    value: str = make_value(0, value_size)
+    with temp_dir() as path:
+        file_name: str = os.path.join(path, "bench.db")
+        gc.collect()
+        tracemalloc.start()
+        store: DiskStorage = open_store(file_name, key_dir_type)
+        for start in range(0, n, LOAD_BATCH_SIZE):
+            store.set_many(
+                (make_key(i), value)
+                for i in range(start, min(n, start + LOAD_BATCH_SIZE))
+            )
+        gc.collect()
+        set_used, set_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        store.close()
+        reopen_used, reopen_peak = measure_open(file_name, key_dir_type)
+        remove_files(path, INDEX_FILE_SUFFIX)
+        rebuild_used, rebuild_peak = measure_open(file_name, key_dir_type)
+        remove_files(path, INDEX_FILE_SUFFIX)
+        remove_files(path, HINT_FILE_SUFFIX)
+        scan_used, scan_peak = measure_open(file_name, key_dir_type)
+    report(
+        f"store {key_dir_type} keys={n}",
+        set_bytes_per_key=set_used / n,
+        set_peak_bytes_per_key=set_peak / n,
+        reopen_bytes_per_key=reopen_used / n,
+        reopen_peak_bytes_per_key=reopen_peak / n,
+        rebuild_bytes_per_key=rebuild_used / n,
+        rebuild_peak_bytes_per_key=rebuild_peak / n,
+        scan_bytes_per_key=scan_used / n,
+        scan_peak_bytes_per_key=scan_peak / n,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--store-keys", type=int, nargs="+", default=[1_000_000])
+    parser.add_argument("--value-size", type=int, default=100)
+    args = parser.parse_args()
+    for n in args.keys:
+        for name in ("dict-plain", "dict", "compact"):
+            run(name, n)
+    for n in args.store_keys:
+        for key_dir_type in ("dict", "compact", "paged"):
+            run_store(key_dir_type, n, args.value_size)
+
+
+if __name__ == "__main__":
+    main()
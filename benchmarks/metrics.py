@@ -0,0 +1,82 @@
+"""
+metrics benchmark measures what the instrumentation costs: it runs the same reads and
+writes against DiskStorage with and without `metrics`, and reports the operations per
+second of both, along with the latency percentiles of the instrumented run. Writes
+are not fsynced, so that the disk doesn't hide the overhead.
+
+    python -m benchmarks.metrics --keys 100000 --ops 500000
+"""
+
+import argparse
+import os
+import random
+import typing
+
+from benchmarks.common import (
+    make_key,
+    make_value,
+    report,
+    temp_dir,
+    timed,
+    write_records,
+)
+from caskdb import DiskStorage, SyncPolicy
+from caskdb.metrics import GET, SET, Metrics
+
+
+def run(
+    file_name: str,
+    keys: list[str],
+    value: str,
+    metrics: typing.Optional[Metrics],
+) -> tuple[float, float]:
+    store = DiskStorage(
+        file_name=file_name,
+        sync_policy=SyncPolicy.os_managed(),
+        metrics=metrics,
+    )
+
+    def reads() -> None:
+        for key in keys:
+            store.get(key)
+
+    def writes() -> None:
+        for key in keys:
+            store.set(key, value)
+
+    read_s: float = timed(reads)
+    write_s: float = timed(writes)
+    store.close()
+    return len(keys) / read_s, len(keys) / write_s
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, default=100_000)
+    parser.add_argument("--ops", type=int, default=500_000)
+    parser.add_argument("--value-size", type=int, default=100)
+    args = parser.parse_args()
+    rng: random.Random = random.Random(42)
+    keys: list[str] = [make_key(rng.randrange(args.keys)) for _ in range(args.ops)]
+    value: str = make_value(0, args.value_size)
+    with temp_dir() as path:
+        file_name: str = os.path.join(path, "bench.db")
+        write_records(file_name, args.keys, args.value_size)
+        reads, writes = run(file_name, keys, value, None)
+        report("disabled", reads_per_s=reads, writes_per_s=writes)
+        metrics: Metrics = Metrics()
+        reads, writes = run(file_name, keys, value, metrics)
+        report("enabled", reads_per_s=reads, writes_per_s=writes)
+        for op in (GET, SET):
+            histogram = metrics.histograms()[op]
+            report(
+                f"{op} latency",
+                p50_us=histogram.percentile(50) * 1e6,
+                p99_us=histogram.percentile(99) * 1e6,
+                p999_us=histogram.percentile(99.9) * 1e6,
+                max_us=histogram.max * 1e6,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+multiget benchmark compares reading a batch of random keys with DiskStorage.get in a
+loop and with DiskStorage.get_many. It also counts the reads issued to the segments.
+To measure the cold cache numbers, drop the page cache before running it (on Linux:
+`echo 3 > /proc/sys/vm/drop_caches`).
+
+    python -m benchmarks.multiget --keys 100000 --batch 32
+"""
+
+import argparse
+import os
+import random
+import typing
+
+from benchmarks.common import make_key, report, temp_dir, timed, write_records
+from caskdb import DiskStorage
+
+
+def run(
+    file_name: str, batches: list[list[str]], name: str, use_mmap: bool = False
+) -> None:
+    store = DiskStorage(file_name=file_name, use_mmap=use_mmap)
+    reads: list[int] = [0]
+    read = store._readers.read
+
+    def counting_read(file_id: int, position: int, size: int) -> typing.Any:
+        reads[0] += 1
+        return read(file_id, position, size)
+
+    store._readers.read = counting_read  # type: ignore[method-assign]
+
+    def loop() -> None:
+        for batch in batches:
+            for key in batch:
+                store.get(key)
+
+    def many() -> None:
+        for batch in batches:
+            store.get_many(batch)
+
+    elapsed: float = timed(many if name == "get_many" else loop)
+    store.close()
+    report(
+        f"{name} {'mmap' if use_mmap else 'buffered'}",
+        batches_per_s=len(batches) / elapsed,
+        us_per_batch=elapsed / len(batches) * 1e6,
+        reads_per_batch=reads[0] / len(batches),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, default=100_000)
+    parser.add_argument("--batches", type=int, default=5_000)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--value-size", type=int, default=100)
+    args = parser.parse_args()
+    rng = random.Random(42)
+    batches: list[list[str]] = [
+        [make_key(rng.randrange(args.keys)) for _ in range(args.batch)]
+        for _ in range(args.batches)
+    ]
+    with temp_dir() as path:
+        file_name: str = os.path.join(path, "bench.db")
+        write_records(file_name, args.keys, args.value_size)
+        for use_mmap in (False, True):
+            for name in ("get", "get_many"):
+                run(file_name, batches, name, use_mmap)
+
+
+if __name__ == "__main__":
+    main()
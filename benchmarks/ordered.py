@@ -0,0 +1,71 @@
+"""
+ordered benchmark compares the `dict` and the `sorted` KeyDirs on point gets, short
+range scans and a full ordered iteration. The dict KeyDir has to sort all the keys
+for every scan, so it does only a few of them.
+
+    python -m benchmarks.ordered --keys 1000000
+"""
+
+import argparse
+import itertools
+import os
+import random
+
+from benchmarks.common import make_key, report, temp_dir, timed, write_records
+from caskdb import DiskStorage
+
+
+def run(file_name: str, key_dir_type: str, n: int, args: argparse.Namespace) -> None:
+    rng = random.Random(42)
+    load: float = timed(
+        lambda: DiskStorage(file_name=file_name, key_dir_type=key_dir_type)
+    )
+    store = DiskStorage(file_name=file_name, key_dir_type=key_dir_type)
+    keys: list[str] = [make_key(rng.randrange(n)) for _ in range(args.gets)]
+
+    def gets() -> None:
+        for key in keys:
+            store.get(key)
+
+    scans: int = args.scans if key_dir_type == "sorted" else max(1, args.scans // 1000)
+    starts: list[str] = [make_key(rng.randrange(n)) for _ in range(scans)]
+
+    def range_scans() -> None:
+        for start in starts:
+            for _ in itertools.islice(store.scan(start), args.scan_length):
+                pass
+
+    def full_scan() -> None:
+        for _ in store.scan():
+            pass
+
+    get_s: float = timed(gets)
+    scan_s: float = timed(range_scans)
+    full_s: float = timed(full_scan)
+    store.close()
+    report(
+        f"{key_dir_type} keys={n}",
+        load_s=load,
+        gets_per_s=len(keys) / get_s,
+        scans_per_s=scans / scan_s,
+        full_scan_s=full_s,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, default=1_000_000)
+    parser.add_argument("--value-size", type=int, default=100)
+    parser.add_argument("--gets", type=int, default=200_000)
+    parser.add_argument("--scans", type=int, default=20_000)
+    parser.add_argument("--scan-length", type=int, default=10)
+    args = parser.parse_args()
+    with temp_dir() as path:
+        file_name: str = os.path.join(path, "bench.db")
+        write_records(file_name, args.keys, args.value_size)
+        for key_dir_type in ("dict", "sorted"):
+            run(file_name, key_dir_type, args.keys, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+paged benchmark compares the paged KeyDir with the dict one: the startup from the
+segments, the startup from the saved index, and the latency of random gets. The index
+lives in the page cache, so the process memory doesn't grow with the keys.
+
+By default it runs with 1M keys, which fits any machine. The paged KeyDir is meant
+for far more keys than that, so pass the larger counts to see it at 100M:
+
+    python -m benchmarks.paged --keys 1000000 10000000 100000000
+
+At 100M keys, the data takes about 14GB of disk and the index another 6GB, and the
+dict KeyDir needs a lot of memory to load them.
+"""
+
+import argparse
+import gc
+import os
+import random
+import time
+import tracemalloc
+
+from benchmarks.common import (
+    make_key,
+    percentile,
+    report,
+    temp_dir,
+    timed,
+    write_records,
+)
+from caskdb import DiskStorage, SyncPolicy
+from caskdb.paged_keydir import INDEX_FILE_SUFFIX
+
+
+def open_store(file_name: str, key_dir_type: str) -> DiskStorage:
+    return DiskStorage(
+        file_name=file_name,
+        sync_policy=SyncPolicy.os_managed(),
+        key_dir_type=key_dir_type,
+    )
+
+
+def get_latencies(store: DiskStorage, n: int, lookups: int) -> list[float]:
+    rng = random.Random(42)
+    keys: list[str] = [make_key(rng.randrange(n)) for _ in range(lookups)]
+    samples: list[float] = []
+    for key in keys:
+        start: float = time.perf_counter()
+        store.get(key)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def heap_mb(file_name: str, key_dir_type: str) -> float:
+    # the memory the KeyDir takes on the Python heap. The pages of the index are
+    # in the page cache, which the OS can evict at will
+    gc.collect()
+    tracemalloc.start()
+    store: DiskStorage = open_store(file_name, key_dir_type)
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    store.close()
+    return used / (1 << 20)
+
+
+def run(n: int, lookups: int, key_dir_type: str) -> None:
+    with temp_dir() as path:
+        file_name: str = os.path.join(path, "bench.db")
+        write_records(file_name, n, 100)
+        # the first open builds the index of the paged KeyDir, the next ones start
+        # from it
+        stores: list[DiskStorage] = []
+        build_s: float = timed(
+            lambda: stores.append(open_store(file_name, key_dir_type))
+        )
+        stores.pop().close()
+        startup_s: float = timed(
+            lambda: stores.append(open_store(file_name, key_dir_type))
+        )
+        store: DiskStorage = stores[0]
+        get_latencies(store, n, lookups)
+        samples: list[float] = get_latencies(store, n, lookups)
+        store.close()
+        index_path: str = file_name + INDEX_FILE_SUFFIX
+        report(
+            f"paged {key_dir_type} keys={n}",
+            build_s=build_s,
+            startup_s=startup_s,
+            get_p50_us=percentile(samples, 50) * 1e6,
+            get_p99_us=percentile(samples, 99) * 1e6,
+            heap_mb=heap_mb(file_name, key_dir_type),
+            index_mb=(
+                os.path.getsize(index_path) / (1 << 20)
+                if os.path.exists(index_path)
+                else 0.0
+            ),
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--keys",
+        type=int,
+        nargs="+",
+        default=[1_000_000],
+        help="key counts to run with, 1M by default. Check above for 100M",
+    )
+    parser.add_argument("--lookups", type=int, default=100_000)
+    args = parser.parse_args()
+    for n in args.keys:
+        for key_dir_type in ("dict", "paged"):
+            run(n, args.lookups, key_dir_type)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+parallel_startup benchmark times the startup of a store without hint files (i.e. after
+a crash) against the number of the processes which scan its segments. The store is
+written once, as a single segment or split into a few, and opened with every worker
+count in turn. The speedup can't exceed the number of the cores of the machine, and it
+is capped by the merge of the chunks, which is done by the startup itself:
+
+    python -m benchmarks.parallel_startup --keys 1000000 --workers 1 2 4 8
+    python -m benchmarks.parallel_startup --keys 1000000 --segments 8
+"""
+
+import argparse
+import os
+
+from benchmarks.common import report, temp_dir, timed, write_records
+from caskdb import DiskStorage
+
+
+def split(file_name: str, segments: int) -> None:
+    # split moves the records of the data file into that many segments, at the record
+    # boundaries the store itself finds
+    if segments == 1:
+        return
+    store = DiskStorage(file_name=file_name)
+    positions: list[int] = sorted(kv.position for kv in store.key_dir.values())
+    store.close()
+    os.remove(store.hint_path(0))
+    with open(file_name, "rb") as f:
+        data: bytes = f.read()
+    step: int = -(-len(positions) // segments)
+    bounds: list[int] = [positions[i] for i in range(0, len(positions), step)]
+    bounds.append(len(data))
+    for file_id, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        with open(store.segment_path(file_id), "wb") as f:
+            f.write(data[start:end])
+
+
+def run(n: int, value_size: int, segments: int, workers: list[int]) -> None:
+    with temp_dir() as path:
+        file_name: str = os.path.join(path, "bench.db")
+        write_records(file_name, n, value_size)
+        split(file_name, segments)
+
+        def open_close(count: int) -> None:
+            store = DiskStorage(file_name=file_name, startup_workers=count)
+            # no hint file is written, as if the store had crashed
+            store.file.close()
+            assert store._file_lock is not None
+            store._file_lock.release()
+
+        baseline: float = 0.0
+        for count in workers:
+            # the first open warms up the page cache
+            open_close(count)
+            startup: float = timed(lambda: open_close(count))
+            baseline = baseline or startup
+            report(
+                f"parallel_startup keys={n} segments={segments} workers={count}",
+                startup_s=startup,
+                speedup=baseline / startup,
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, nargs="+", default=[1_000_000])
+    parser.add_argument("--value-size", type=int, default=100)
+    parser.add_argument("--segments", type=int, default=1)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    for n in args.keys:
+        run(n, args.value_size, args.segments, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+readers benchmark compares the two ways a reader process can catch up with the
+writer: opening the store again, which loads the whole KeyDir, and `refresh` on a read
+only store, which reads only the records written since the last refresh:
+
+    python -m benchmarks.readers --keys 1000000 --new 1000 10000
+"""
+
+import argparse
+import os
+
+from benchmarks.common import (
+    make_key,
+    make_value,
+    report,
+    temp_dir,
+    timed,
+    write_records,
+)
+from caskdb import DiskStorage, SyncPolicy
+
+
+def run(n: int, new: int, value_size: int) -> None:
+    with temp_dir() as path:
+        file_name: str = os.path.join(path, "bench.db")
+        write_records(file_name, n, value_size)
+        writer = DiskStorage(file_name=file_name, sync_policy=SyncPolicy.os_managed())
+        reader = DiskStorage(file_name=file_name, read_only=True)
+        writer.set_many(
+            (make_key(n + i), make_value(i, value_size)) for i in range(new)
+        )
+        writer.sync()
+
+        def reopen() -> None:
+            DiskStorage(file_name=file_name, read_only=True).close()
+
+        reopen_s: float = timed(reopen)
+        refresh_s: float = timed(reader.refresh)
+        assert reader.get(make_key(n + new - 1)) == make_value(new - 1, value_size)
+        report(
+            f"readers keys={n} new={new}",
+            reopen_s=reopen_s,
+            refresh_s=refresh_s,
+        )
+        reader.close()
+        writer.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, default=1_000_000)
+    parser.add_argument("--new", type=int, nargs="+", default=[1000, 10_000])
+    parser.add_argument("--value-size", type=int, default=100)
+    args = parser.parse_args()
+    for new in args.new:
+        run(args.keys, new, args.value_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+reads benchmark compares the read throughput of DiskStorage.get with the buffered
+file handles and with the memory mapped segments, for random and sequential access.
+
+    python -m benchmarks.reads --keys 100000 --reads 200000
+"""
+
+import argparse
+import os
+import random
+import typing
+
+from benchmarks.common import make_key, report, temp_dir, timed, write_records
+from caskdb import DiskStorage
+
+
+def run(
+    file_name: str, keys: list[str], pattern: str, use_mmap: bool, view: bool
+) -> None:
+    store = DiskStorage(file_name=file_name, use_mmap=use_mmap)
+    get: typing.Callable[[str], typing.Any] = store.get_view if view else store.get
+
+    def read_all() -> None:
+        for key in keys:
+            get(key)
+
+    elapsed: float = timed(read_all)
+    store.close()
+    mode: str = "mmap" if use_mmap else "buffered"
+    api: str = "get_view" if view else "get"
+    report(f"{pattern} {mode} {api}", reads_per_s=len(keys) / elapsed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, default=100_000)
+    parser.add_argument("--reads", type=int, default=200_000)
+    parser.add_argument("--value-size", type=int, default=100)
+    args = parser.parse_args()
+    with temp_dir() as path:
+        file_name: str = os.path.join(path, "bench.db")
+        write_records(file_name, args.keys, args.value_size)
+        rng = random.Random(42)
+        patterns: dict[str, list[str]] = {
+            "sequential": [make_key(i % args.keys) for i in range(args.reads)],
+            "random": [make_key(rng.randrange(args.keys)) for _ in range(args.reads)],
+        }
+        for pattern, keys in patterns.items():
+            for use_mmap in (False, True):
+                for view in (False, True):
+                    run(file_name, keys, pattern, use_mmap, view)
+
+
+if __name__ == "__main__":
+    main()
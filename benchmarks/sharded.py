@@ -0,0 +1,110 @@
+"""
+sharded benchmark measures the throughput of ShardedStorage as the number of the
+shards grows. With the default sync policy every write waits for its fsync, and a
+single DiskStorage syncs one file at a time, so the shards are expected to scale the
+writes as long as the disks can do the fsyncs in parallel. Pass `--dirs` to spread the
+shards over a few disks, round robin:
+
+    python -m benchmarks.sharded --shards 1 2 4 8 16 --seconds 2
+    python -m benchmarks.sharded --dirs /mnt/disk1 /mnt/disk2 --shards 2 4 8
+
+It runs three workloads, one after another:
+
+    set         - `--threads` threads, every one writing a KV pair at a time
+    set_many    - a single thread writing batches of `--batch` pairs
+    get_many    - a single thread reading batches of `--batch` random keys
+"""
+
+import argparse
+import contextlib
+import os
+import random
+import threading
+import time
+import typing
+
+from benchmarks.common import make_key, make_value, report, temp_dir
+from caskdb import ShardedStorage
+
+
+def for_seconds(seconds: float, threads: int, fn: typing.Callable[[int], int]) -> int:
+    # for_seconds runs fn in that many threads, again and again, and returns the
+    # sum of what it returned, i.e. the operations done
+    stop = threading.Event()
+    counts: list[int] = [0] * threads
+
+    def loop(index: int) -> None:
+        while not stop.is_set():
+            counts[index] += fn(index)
+
+    workers: list[threading.Thread] = [
+        threading.Thread(target=loop, args=(i,)) for i in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return sum(counts)
+
+
+def run(dirs: list[str], shards: int, args: argparse.Namespace) -> None:
+    files: dict[str, str] = {}
+    for i in range(shards):
+        path: str = os.path.join(dirs[i % len(dirs)], f"shard{i}")
+        os.makedirs(path)
+        files[f"shard{i}"] = os.path.join(path, "bench.db")
+    store = ShardedStorage(files)
+    rngs: list[random.Random] = [random.Random(i) for i in range(args.threads)]
+    value: str = make_value(0, args.value_size)
+    batch: int = args.batch
+
+    def set_one(index: int) -> int:
+        store.set(make_key(rngs[index].randrange(args.keys)), value)
+        return 1
+
+    def set_many(index: int) -> int:
+        rng: random.Random = rngs[index]
+        store.set_many(
+            [(make_key(rng.randrange(args.keys)), value) for _ in range(batch)]
+        )
+        return batch
+
+    def get_many(index: int) -> int:
+        rng: random.Random = rngs[index]
+        store.get_many([make_key(rng.randrange(args.keys)) for _ in range(batch)])
+        return batch
+
+    sets: int = for_seconds(args.seconds, args.threads, set_one)
+    batched: int = for_seconds(args.seconds, 1, set_many)
+    gets: int = for_seconds(args.seconds, 1, get_many)
+    store.close()
+    report(
+        f"sharded shards={shards}",
+        set_per_s=sets / args.seconds,
+        set_many_per_s=batched / args.seconds,
+        get_many_per_s=gets / args.seconds,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--dirs", nargs="+", default=[])
+    parser.add_argument("--keys", type=int, default=100_000)
+    parser.add_argument("--value-size", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+    for shards in args.shards:
+        with contextlib.ExitStack() as stack:
+            dirs: list[str] = [
+                stack.enter_context(temp_dir(parent)) for parent in args.dirs or [None]
+            ]
+            run(dirs, shards, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+startup benchmark compares the time taken by DiskStorage to build the KeyDir with and
+without the hint file. As a baseline, it also times a naive scan which reads and
+decodes every record, values included, the way the startup used to. The difference
+grows with the size of the values:
+
+    python -m benchmarks.startup --keys 1000000 10000000
+    python -m benchmarks.startup --keys 100000 --value-size 4096
+"""
+
+import argparse
+import os
+
+from benchmarks.common import report, temp_dir, timed, write_records
+from caskdb import DiskStorage
+from caskdb.disk_store import HINT_FILE_SUFFIX
+from caskdb.format import HEADER_SIZE, KeyEntry, decode_header
+
+
+def naive_scan(file_name: str) -> None:
+    key_dir: dict[str, KeyEntry] = {}
+    position: int = 0
+    with open(file_name, "rb") as f:
+        while header := f.read(HEADER_SIZE):
+            timestamp, key_size, value_size = decode_header(header)
+            key: str = f.read(key_size).decode("utf-8")
+            f.read(value_size).decode("utf-8")
+            total_size: int = HEADER_SIZE + key_size + value_size
+            key_dir[key] = KeyEntry(timestamp, position, total_size)
+            position += total_size
+
+
+def run(n: int, value_size: int) -> None:
+    with temp_dir() as path:
+        file_name: str = os.path.join(path, "bench.db")
+        write_records(file_name, n, value_size)
+
+        def open_close() -> None:
+            store = DiskStorage(file_name=file_name)
+            # no hint file is written, as if the store had crashed
+            store.file.close()
+            assert store._file_lock is not None
+            store._file_lock.release()
+
+        naive: float = timed(lambda: naive_scan(file_name))
+        unhinted: float = timed(open_close)
+        # closing the store writes the hint file
+        DiskStorage(file_name=file_name).close()
+        hinted: float = timed(open_close)
+        report(
+            f"startup keys={n}",
+            naive_s=naive,
+            unhinted_s=unhinted,
+            hinted_s=hinted,
+            hint_bytes=os.path.getsize(file_name + HINT_FILE_SUFFIX),
+            data_bytes=os.path.getsize(file_name),
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--value-size", type=int, default=100)
+    args = parser.parse_args()
+    for n in args.keys:
+        run(n, args.value_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,470 @@
+"""
+suite benchmark runs a fixed set of workloads against CaskDB and writes the results as
+JSON. A run can be saved as the baseline, and the later runs compared against it, so
+that a change which makes DiskStorage, the record format or MemoryStorage slower shows
+up as a regression rather than as a hunch.
+
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --baseline baseline.json --tolerance 0.1
+
+The suite has four parts, pick some with --suites:
+
+    ycsb        the YCSB core workloads, against DiskStorage and MemoryStorage, with
+                uniform and Zipfian key choice, for every key and value size given
+    format      encoding and decoding of the records, for every value size given
+    startup     opening a store of N keys: from the hint files, by scanning the
+                segments, and recovering from a torn record at the end
+    contention  a DiskStorage shared by 1..N threads, each doing 90% reads and 10%
+                writes
+
+The YCSB workloads, as in https://github.com/brianfrankcooper/YCSB/wiki/Core-Workloads:
+
+    A   update heavy        50% reads, 50% updates
+    B   read mostly         95% reads, 5% updates
+    C   read only           100% reads
+    D   read latest         95% reads, 5% inserts, the recent keys are the popular ones
+    E   short ranges        95% scans of up to 100 keys, 5% inserts
+    F   read-modify-write   50% reads, 50% reads followed by a write of the key
+
+Every workload runs on a store loaded with --records keys, and every operation is
+timed on its own, so the results have the latency percentiles along with the
+throughput. MemoryStorage can't scan, so it skips E. The workloads are seeded, so two
+runs do exactly the same operations.
+
+Every result has a `value` (e.g. operations per second) and says whether higher is
+better. With --baseline, a result worse than its baseline by more than the tolerance
+is a regression, and the run exits with status 1.
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import typing
+
+from benchmarks.common import make_value, report, temp_dir, timed, zipfian
+from caskdb import DiskStorage, MemoryStorage, SyncPolicy
+from caskdb.format import decode_kv, encode_kv
+from caskdb.metrics import Histogram
+
+# the version of the JSON layout, a baseline of another version is not comparable
+RESULTS_VERSION: typing.Final[int] = 1
+
+DISK: typing.Final[str] = "disk"
+MEMORY: typing.Final[str] = "memory"
+
+UNIFORM: typing.Final[str] = "uniform"
+ZIPFIAN: typing.Final[str] = "zipfian"
+
+READ: typing.Final[str] = "read"
+UPDATE: typing.Final[str] = "update"
+INSERT: typing.Final[str] = "insert"
+SCAN: typing.Final[str] = "scan"
+READ_MODIFY_WRITE: typing.Final[str] = "rmw"
+
+# the longest scan of workload E. The length of a scan is uniform from 1 to this
+MAX_SCAN_LENGTH: typing.Final[int] = 100
+
+# the stores are loaded with set_many, this many keys at a time
+LOAD_BATCH_SIZE: typing.Final[int] = 1000
+
+Store = typing.Union[DiskStorage, MemoryStorage]
+
+
+class Workload:
+    """
+    Workload is a mix of operations, each with its share of all the operations
+
+    Args:
+        description (str): what the workload models
+        mix (dict[str, float]): share of every operation, adding up to 1
+        latest (bool): if set, the reads pick the recently inserted keys, whatever
+            the distribution
+    """
+
+    def __init__(self, description: str, mix: dict[str, float], latest: bool = False):
+        self.description: str = description
+        self.mix: dict[str, float] = mix
+        self.latest: bool = latest
+
+    def operations(self, count: int, rng: random.Random) -> list[str]:
+        operations: list[str] = list(self.mix)
+        return rng.choices(operations, weights=list(self.mix.values()), k=count)
+
+
+WORKLOADS: typing.Final[dict[str, Workload]] = {
+    "A": Workload("update heavy", {READ: 0.5, UPDATE: 0.5}),
+    "B": Workload("read mostly", {READ: 0.95, UPDATE: 0.05}),
+    "C": Workload("read only", {READ: 1.0}),
+    "D": Workload("read latest", {READ: 0.95, INSERT: 0.05}, latest=True),
+    "E": Workload("short ranges", {SCAN: 0.95, INSERT: 0.05}),
+    "F": Workload("read-modify-write", {READ: 0.5, READ_MODIFY_WRITE: 0.5}),
+}
+
+
+class Results:
+    """
+    Results collects the results of a run, and reports them as they come
+
+    Attributes:
+        results (dict[str, dict[str, typing.Any]]): the results by their names
+    """
+
+    def __init__(self) -> None:
+        self.results: dict[str, dict[str, typing.Any]] = {}
+
+    def add(
+        self,
+        name: str,
+        value: float,
+        unit: str,
+        higher_is_better: bool = True,
+        **details: float,
+    ) -> None:
+        self.results[name] = {
+            "value": value,
+            "unit": unit,
+            "higher_is_better": higher_is_better,
+            **details,
+        }
+        report(name, **{unit: value}, **details)
+
+    def add_latencies(self, name: str, count: int, histogram: Histogram) -> None:
+        # the throughput is taken from the sum of the latencies, so that the time
+        # spent picking the keys is not counted
+        self.add(
+            name,
+            count / histogram.total if histogram.total else 0.0,
+            "ops_per_s",
+            p50_us=histogram.percentile(50) * 1e6,
+            p99_us=histogram.percentile(99) * 1e6,
+            p999_us=histogram.percentile(99.9) * 1e6,
+        )
+
+
+def sized_key(i: int, size: int) -> str:
+    # keys of the given size, which sort in the order of i
+    return f"key{i:012d}".rjust(size, "k")
+
+
+def open_store(kind: str, file_name: str, sync: str) -> Store:
+    if kind == MEMORY:
+        return MemoryStorage()
+    return DiskStorage(
+        file_name=file_name,
+        sync_policy=SyncPolicy(sync),
+        # workload E scans, which the sorted KeyDir serves without sorting
+        key_dir_type="sorted",
+    )
+
+
+def load(store: Store, records: int, key_size: int, value: str) -> None:
+    if isinstance(store, MemoryStorage):
+        for i in range(records):
+            store.set(sized_key(i, key_size), value)
+        return
+    for start in range(0, records, LOAD_BATCH_SIZE):
+        store.set_many(
+            (sized_key(i, key_size), value)
+            for i in range(start, min(records, start + LOAD_BATCH_SIZE))
+        )
+    store.sync()
+
+
+def run_workload(
+    store: Store,
+    workload: Workload,
+    distribution: str,
+    records: int,
+    ops: int,
+    key_size: int,
+    value: str,
+    seed: int,
+) -> tuple[int, Histogram]:
+    """
+    run_workload runs ops operations of the workload against the store, which has
+    records keys, and returns the number of the keys it has after the run along with
+    the latencies
+    """
+    rng: random.Random = random.Random(seed)
+    operations: list[str] = workload.operations(ops, rng)
+    # the keys are picked before the run. A Zipfian pick is the rank of the key's
+    # popularity. With `latest`, the rank counts back from the last key inserted
+    if workload.latest:
+        picks: list[int] = zipfian(records, ops, seed=seed, shuffle=False)
+    elif distribution == ZIPFIAN:
+        picks = zipfian(records, ops, seed=seed)
+    else:
+        picks = [rng.randrange(records) for _ in range(ops)]
+    lengths: list[int] = [rng.randint(1, MAX_SCAN_LENGTH) for _ in range(ops)]
+    histogram: Histogram = Histogram()
+    perf_counter: typing.Callable[[], float] = time.perf_counter
+    inserted: int = records
+    for operation, pick, length in zip(operations, picks, lengths):
+        if operation == INSERT:
+            key: str = sized_key(inserted, key_size)
+            inserted += 1
+        elif workload.latest:
+            key = sized_key(max(0, inserted - 1 - pick), key_size)
+        else:
+            key = sized_key(pick, key_size)
+        start: float = perf_counter()
+        if operation == READ:
+            store.get(key)
+        elif operation in (UPDATE, INSERT):
+            store.set(key, value)
+        elif operation == READ_MODIFY_WRITE:
+            store.get(key)
+            store.set(key, value)
+        else:
+            assert isinstance(store, DiskStorage)
+            for _ in itertools.islice(store.scan(key), length):
+                pass
+        histogram.record(perf_counter() - start)
+    return inserted, histogram
+
+
+def ycsb(results: Results, args: argparse.Namespace) -> None:
+    for kind, distribution, key_size, value_size in itertools.product(
+        args.stores, args.distributions, args.key_sizes, args.value_sizes
+    ):
+        value: str = make_value(0, value_size)
+        with temp_dir() as path:
+            store: Store = open_store(kind, os.path.join(path, "bench.db"), args.sync)
+            load(store, args.records, key_size, value)
+            records: int = args.records
+            for name in args.workloads:
+                if name == "E" and isinstance(store, MemoryStorage):
+                    continue
+                records, histogram = run_workload(
+                    store,
+                    WORKLOADS[name],
+                    distribution,
+                    records,
+                    args.ops,
+                    key_size,
+                    value,
+                    args.seed,
+                )
+                results.add_latencies(
+                    f"ycsb.{name}.{kind}.{distribution}.k{key_size}.v{value_size}",
+                    args.ops,
+                    histogram,
+                )
+            store.close()
+
+
+def format_codec(results: Results, args: argparse.Namespace) -> None:
+    timestamp: int = int(time.time())
+    keys: list[str] = [sized_key(i, 16) for i in range(args.ops)]
+    for value_size in args.value_sizes:
+        value: str = make_value(0, value_size)
+        encoded: list[bytes] = []
+
+        def encode() -> None:
+            for key in keys:
+                encoded.append(encode_kv(timestamp, key, value)[1])
+
+        def decode() -> None:
+            for data in encoded:
+                decode_kv(data, verify=True)
+
+        results.add(
+            f"format.encode.v{value_size}", len(keys) / timed(encode), "ops_per_s"
+        )
+        results.add(
+            f"format.decode.v{value_size}", len(keys) / timed(decode), "ops_per_s"
+        )
+
+
+def startup(results: Results, args: argparse.Namespace) -> None:
+    value: str = make_value(0, args.value_sizes[0])
+    for n in args.startup_keys:
+        with temp_dir() as path:
+            file_name: str = os.path.join(path, "bench.db")
+            store: DiskStorage = DiskStorage(
+                file_name=file_name, sync_policy=SyncPolicy.os_managed()
+            )
+            load(store, n, 16, value)
+            store.close()
+
+            def reopen() -> None:
+                DiskStorage(file_name=file_name).close()
+
+            # close writes the hint files, so this startup reads only those
+            results.add(f"startup.hint.n{n}", timed(reopen), "seconds", False)
+            # without them, every record is read
+            for file_id in store.file_ids():
+                os.remove(store.hint_path(file_id))
+            results.add(f"startup.scan.n{n}", timed(reopen), "seconds", False)
+            # a crash in the middle of a write leaves a torn record, which the
+            # startup finds and truncates
+            for file_id in store.file_ids():
+                os.remove(store.hint_path(file_id))
+            with open(file_name, "ab") as f:
+                f.write(encode_kv(0, "torn", value)[1][:-1])
+            results.add(f"startup.recovery.n{n}", timed(reopen), "seconds", False)
+
+
+def contention(results: Results, args: argparse.Namespace) -> None:
+    value: str = make_value(0, args.value_sizes[0])
+    with temp_dir() as path:
+        store: DiskStorage = DiskStorage(
+            file_name=os.path.join(path, "bench.db"),
+            sync_policy=SyncPolicy(args.sync),
+        )
+        load(store, args.records, 16, value)
+        for threads in args.threads:
+            stop: threading.Event = threading.Event()
+            counts: list[int] = [0] * threads
+
+            def worker(index: int) -> None:
+                rng: random.Random = random.Random(args.seed + index)
+                count: int = 0
+                while not stop.is_set():
+                    key: str = sized_key(rng.randrange(args.records), 16)
+                    if rng.random() < 0.9:
+                        store.get(key)
+                    else:
+                        store.set(key, value)
+                    count += 1
+                counts[index] = count
+
+            workers: list[threading.Thread] = [
+                threading.Thread(target=worker, args=(i,)) for i in range(threads)
+            ]
+            start: float = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            time.sleep(args.seconds)
+            stop.set()
+            for thread in workers:
+                thread.join()
+            elapsed: float = time.perf_counter() - start
+            results.add(f"contention.t{threads}", sum(counts) / elapsed, "ops_per_s")
+        store.close()
+
+
+SUITES: typing.Final[
+    dict[str, typing.Callable[[Results, argparse.Namespace], None]]
+] = {
+    "ycsb": ycsb,
+    "format": format_codec,
+    "startup": startup,
+    "contention": contention,
+}
+
+
+def compare(
+    results: dict[str, dict[str, typing.Any]],
+    baseline: dict[str, dict[str, typing.Any]],
+    tolerance: float,
+) -> list[str]:
+    """
+    compare reports every result along with its baseline, and returns the names of
+    the results which are worse than their baselines by more than the tolerance, a
+    fraction of the baseline. The results missing from either side are skipped
+    """
+    regressions: list[str] = []
+    for name, result in results.items():
+        base: typing.Optional[dict[str, typing.Any]] = baseline.get(name)
+        if base is None or not base["value"] or not result["value"]:
+            continue
+        # change is the improvement over the baseline: above 1 is better, whether
+        # the value is a throughput or a time
+        change: float = result["value"] / base["value"]
+        if not result["higher_is_better"]:
+            change = 1 / change
+        regressed: bool = change < 1 - tolerance
+        if regressed:
+            regressions.append(name)
+        report(
+            name,
+            baseline=float(base["value"]),
+            current=float(result["value"]),
+            change_pct=(change - 1) * 100,
+            regression=regressed,
+        )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--suites", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument(
+        "--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS)
+    )
+    parser.add_argument(
+        "--stores", nargs="+", choices=(DISK, MEMORY), default=[DISK, MEMORY]
+    )
+    parser.add_argument(
+        "--distributions",
+        nargs="+",
+        choices=(UNIFORM, ZIPFIAN),
+        default=[UNIFORM, ZIPFIAN],
+    )
+    parser.add_argument("--key-sizes", type=int, nargs="+", default=[16])
+    parser.add_argument("--value-sizes", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--records", type=int, default=50_000)
+    parser.add_argument("--ops", type=int, default=50_000)
+    parser.add_argument("--startup-keys", type=int, nargs="+", default=[100_000])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--sync", choices=("always", "os"), default="os")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--output", default="-", help="file to write the JSON results to, - for stdout"
+    )
+    parser.add_argument("--baseline", help="JSON results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+    for key_size in args.key_sizes:
+        if key_size < len(sized_key(0, 0)):
+            parser.error(f"key sizes must be at least {len(sized_key(0, 0))}")
+
+    results: Results = Results()
+    # the JSON goes to stdout by default, so the progress goes to stderr
+    progress: typing.TextIO = sys.stderr if args.output == "-" else sys.stdout
+    with contextlib.redirect_stdout(progress):
+        for suite in args.suites:
+            SUITES[suite](results, args)
+    run: dict[str, typing.Any] = {
+        "version": RESULTS_VERSION,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": {
+            k: v for k, v in vars(args).items() if k not in ("output", "baseline")
+        },
+        "results": results.results,
+    }
+    if args.output == "-":
+        json.dump(run, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(run, f, indent=2)
+    if args.baseline is None:
+        return
+    with open(args.baseline) as f:
+        baseline: dict[str, typing.Any] = json.load(f)
+    if baseline.get("version") != RESULTS_VERSION:
+        sys.exit(f"{args.baseline} has results of another version")
+    with contextlib.redirect_stdout(progress):
+        regressions: list[str] = compare(
+            results.results, baseline["results"], args.tolerance
+        )
+    if regressions:
+        sys.exit(f"{len(regressions)} regressions: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,17 @@
-from caskdb.disk_store import DiskStorage
+from caskdb.async_store import AsyncDiskStorage
+from caskdb.disk_store import DiskStorage, WriteBatch
+from caskdb.durability import SyncPolicy
+from caskdb.format import ChecksumError, FormatError
 from caskdb.memory_store import MemoryStorage
+from caskdb.sharded_store import ShardedStorage
 
-__all__ = ["DiskStorage", "MemoryStorage"]
+__all__ = [
+    "AsyncDiskStorage",
+    "ChecksumError",
+    "DiskStorage",
+    "FormatError",
+    "MemoryStorage",
+    "ShardedStorage",
+    "SyncPolicy",
+    "WriteBatch",
+]
@@ -0,0 +1,3 @@
+from caskdb.server import main
+
+main()
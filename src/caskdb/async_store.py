@@ -0,0 +1,298 @@
+"""
+async_store module implements AsyncDiskStorage, the asyncio front-end of DiskStorage.
+
+DiskStorage is a blocking API: `get` waits for the disk read and `set` waits for the
+fsync. Called from a coroutine, they would block the event loop, and with it every
+other task. AsyncDiskStorage runs them in a bounded pool of threads instead, and the
+coroutines await the results.
+
+The writes are batched. A `set` only queues its KV pair and waits. A single flush task
+writes all the queued pairs with one `DiskStorage.set_many`, i.e. one write and one
+fsync, and then wakes up all the waiting coroutines. While a flush is running, the new
+writes queue up for the next one. So the more tasks write at the same time, the larger
+the batches get, and the fsync cost is shared among them. The writes are applied in the
+order they were made. The pairs are encoded before they are queued, so a pair the
+store can't take fails only the coroutine which gave it. If a batch fails anyway, its
+writes are retried one by one, and each coroutine gets the result of its own write.
+
+The reads go to the thread pool as they come. DiskStorage reads with `os.pread`, so
+the concurrent reads don't wait for each other.
+
+Typical usage example:
+
+    store = await AsyncDiskStorage.open("books.db")
+    await store.set("othello", "shakespeare")
+    author: str = await store.get("othello")
+    await store.close()
+"""
+
+import asyncio
+import concurrent.futures
+import typing
+
+from caskdb.disk_store import DiskStorage
+from caskdb.format import Buffer, decode_key, encode_key
+
+# threads of the I/O pool, by default
+DEFAULT_MAX_WORKERS: typing.Final[int] = 8
+
+# a queued write: the pairs to set, or the key to delete. The future of a delete
+# resolves to whether the key existed
+_SET: typing.Final[str] = "set"
+_DELETE: typing.Final[str] = "delete"
+
+_T = typing.TypeVar("_T")
+
+# the KV pairs of a queued write, encoded to bytes
+_Pairs = typing.Sequence[tuple[bytes, Buffer]]
+
+
+class _Write:
+    __slots__ = ("op", "items", "key", "future")
+
+    def __init__(
+        self,
+        op: str,
+        future: "asyncio.Future[typing.Any]",
+        items: _Pairs = (),
+        key: str = "",
+    ):
+        self.op: str = op
+        self.items: _Pairs = items
+        self.key: str = key
+        self.future: asyncio.Future[typing.Any] = future
+
+
+def _encode(items: typing.Iterable[tuple[str, str]]) -> _Pairs:
+    # encodes the pairs the way DiskStorage.set_many does. It raises for a pair
+    # which is not strings
+    return [(encode_key(key), value.encode("utf-8")) for key, value in items]
+
+
+def _check(items: typing.Iterable[tuple[bytes, Buffer]]) -> _Pairs:
+    # raises for a pair which is not bytes, as DiskStorage.set_many_bytes would
+    pairs: list[tuple[bytes, Buffer]] = list(items)
+    for key, value in pairs:
+        if not isinstance(key, (bytes, bytearray, memoryview)) or not isinstance(
+            value, (bytes, bytearray, memoryview)
+        ):
+            raise TypeError("keys and values must be bytes-like objects")
+    return pairs
+
+
+class AsyncDiskStorage:
+    """
+    AsyncDiskStorage wraps a DiskStorage for the use from asyncio. Create it with
+    `open`, which does the blocking startup of the store in the thread pool, or pass
+    an existing DiskStorage. All the methods have to be called from the same event
+    loop.
+
+    Args:
+        store (DiskStorage): the store to wrap. AsyncDiskStorage owns it from now on,
+            and closes it on `close`
+        max_workers (int): number of the threads doing the I/O
+
+    Attributes:
+        store (DiskStorage): the wrapped store
+    """
+
+    def __init__(self, store: DiskStorage, max_workers: int = DEFAULT_MAX_WORKERS):
+        if max_workers <= 0:
+            raise ValueError("max_workers must be positive")
+        self.store: DiskStorage = store
+        self._executor: concurrent.futures.ThreadPoolExecutor = (
+            concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="caskdb-io"
+            )
+        )
+        self._queue: list[_Write] = []
+        self._flusher: typing.Optional[asyncio.Task[None]] = None
+
+    @classmethod
+    async def open(
+        cls,
+        file_name: str = "data.db",
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        **options: typing.Any,
+    ) -> "AsyncDiskStorage":
+        """
+        open creates the DiskStorage in a thread, so that a long startup does not
+        block the event loop
+
+        Args:
+            file_name (str): name of the data file
+            max_workers (int): number of the threads doing the I/O
+            options: the other arguments of DiskStorage, e.g. `sync_policy`
+        """
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        store: DiskStorage = await loop.run_in_executor(
+            None, lambda: DiskStorage(file_name, **options)
+        )
+        return cls(store, max_workers)
+
+    async def get(self, key: str) -> str:
+        return await self._run(self.store.get, key)
+
+    async def get_many(self, keys: typing.Sequence[str]) -> list[str]:
+        return await self._run(self.store.get_many, keys)
+
+    async def get_bytes(self, key: bytes) -> memoryview:
+        return await self._run(self.store.get_bytes, key)
+
+    async def get_many_bytes(self, keys: typing.Sequence[bytes]) -> list[memoryview]:
+        return await self._run(self.store.get_many_bytes, keys)
+
+    async def lookup_bytes(self, key: bytes) -> typing.Optional[memoryview]:
+        return await self._run(self.store.lookup_bytes, key)
+
+    async def lookup_many_bytes(
+        self, keys: typing.Sequence[bytes]
+    ) -> list[typing.Optional[memoryview]]:
+        return await self._run(self.store.lookup_many_bytes, keys)
+
+    async def set(self, key: str, value: str) -> None:
+        """
+        set stores the key and value. It returns once the pair is written. With the
+        `always` sync policy (the default), it is durable by then too
+        """
+        await self._enqueue(
+            _Write(_SET, self._new_future(), items=_encode([(key, value)]))
+        )
+
+    async def set_many(self, items: typing.Iterable[tuple[str, str]]) -> None:
+        """
+        set_many stores all the KV pairs. They are written in the same batch
+        """
+        await self._enqueue(_Write(_SET, self._new_future(), items=_encode(items)))
+
+    async def set_bytes(self, key: bytes, value: Buffer) -> None:
+        """
+        set_bytes stores the key and value given as bytes, check DiskStorage.set_bytes.
+        It is batched along with the other writes, like set
+        """
+        await self._enqueue(
+            _Write(_SET, self._new_future(), items=_check([(key, value)]))
+        )
+
+    async def set_many_bytes(
+        self, items: typing.Iterable[tuple[bytes, Buffer]]
+    ) -> None:
+        await self._enqueue(_Write(_SET, self._new_future(), items=_check(items)))
+
+    async def delete(self, key: str) -> bool:
+        """
+        delete removes the key, and returns whether it existed. Of the concurrent
+        deletes of a key, only one finds it, check DiskStorage.discard
+        """
+        existed: bool = await self._enqueue(
+            _Write(_DELETE, self._new_future(), key=key)
+        )
+        return existed
+
+    async def delete_bytes(self, key: bytes) -> bool:
+        return await self.delete(decode_key(key))
+
+    async def sync(self) -> None:
+        await self._run(self.store.sync)
+
+    async def run(self, fn: typing.Callable[..., _T], *args: typing.Any) -> _T:
+        """
+        run calls the function in the I/O threads, and returns its result. It is for
+        the blocking work on the store which has no method here, e.g. iterating over
+        its keys
+        """
+        return await self._run(fn, *args)
+
+    async def close(self) -> None:
+        """
+        close waits for the queued writes, closes the store and stops the threads
+        """
+        while self._flusher is not None:
+            await asyncio.shield(self._flusher)
+        await self._run(self.store.close)
+        self._executor.shutdown()
+
+    async def __aenter__(self) -> "AsyncDiskStorage":
+        return self
+
+    async def __aexit__(self, *_: typing.Any) -> None:
+        await self.close()
+
+    async def _run(self, fn: typing.Callable[..., _T], *args: typing.Any) -> _T:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _new_future(self) -> "asyncio.Future[typing.Any]":
+        return asyncio.get_running_loop().create_future()
+
+    async def _enqueue(self, write: _Write) -> typing.Any:
+        self._queue.append(write)
+        if self._flusher is None:
+            self._flusher = asyncio.ensure_future(self._flush())
+        return await write.future
+
+    async def _flush(self) -> None:
+        # keeps flushing till the queue is empty. The writes queued while a batch is
+        # being written go into the next batch
+        try:
+            while self._queue:
+                batch: list[_Write] = self._queue
+                self._queue = []
+                try:
+                    results: list[typing.Any] = await self._run(self._apply, batch)
+                except Exception as e:
+                    results = [e] * len(batch)
+                for write, result in zip(batch, results):
+                    if write.future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        write.future.set_exception(result)
+                    else:
+                        write.future.set_result(result)
+        finally:
+            self._flusher = None
+
+    def _apply(self, batch: list[_Write]) -> list[typing.Any]:
+        # runs in a thread, and returns the result of every write, or its error. The
+        # consecutive sets go in one set_many_bytes, and a delete in between splits
+        # them, to keep the writes in order
+        #
+        # With the `always` sync policy, set_many_bytes returns after the fsync. With
+        # the others, the store makes the writes durable in the background, and we
+        # don't wait for it
+        results: list[typing.Any] = []
+        start: int = 0
+        for i, write in enumerate(batch):
+            if write.op == _SET:
+                continue
+            results.extend(self._set_many(batch[start:i]))
+            try:
+                results.append(self.store.discard(write.key) is not None)
+            except Exception as e:
+                results.append(e)
+            start = i + 1
+        results.extend(self._set_many(batch[start:]))
+        return results
+
+    def _set_many(self, writes: list[_Write]) -> list[typing.Optional[Exception]]:
+        # if the whole group fails, the writes are retried one by one, so that only
+        # the failing ones get the error. Rewriting a pair which did get written is
+        # harmless, the last value wins anyway
+        if not writes:
+            return []
+        try:
+            self.store.set_many_bytes(
+                [pair for write in writes for pair in write.items]
+            )
+            return [None] * len(writes)
+        except Exception as e:
+            if len(writes) == 1:
+                return [e]
+        errors: list[typing.Optional[Exception]] = []
+        for write in writes:
+            try:
+                self.store.set_many_bytes(write.items)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
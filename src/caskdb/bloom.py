@@ -0,0 +1,401 @@
+"""
+bloom module implements the Bloom filters, which answer "is this key in the store?"
+without looking at the KeyDir or the disk, for most of the keys which are not.
+
+A Bloom filter is an array of bits. Adding a key sets `num_hashes` bits of it, picked
+by the hashes of the key. A lookup checks the same bits: if any of them is not set,
+the key was never added. If all of them are set, the key was probably added, but the
+bits may have been set by the other keys, a false positive. So a filter never says no
+to a key it has, and says yes to a key it doesn't have only at the false-positive rate
+it was sized for. A filter of 1% takes about 10 bits per key, whatever the size of the
+keys, and 0.1% takes about 15.
+
+DiskStorage keeps a filter for every sealed segment, with the keys whose last record in
+the segment is a live one. The filter of a segment is built when it is sealed (i.e.
+when its hint file is written), or when a merge writes it, and it is saved next to the
+segment, with the `.bloom` suffix. A sealed segment never changes, so its filter is
+valid for good, and the startup loads it as is. The keys written to the active segment
+go into a GrowingBloomFilter, since there is no telling how many of them there will
+be; it is dropped once the segment is sealed and has a filter of its own. A key which
+none of the filters has does not exist: the lookup stops there.
+
+A KeyDir kept in memory answers a missing key quickly too, quicker than the filters
+in fact, since its hash table is probed in C. The filters pay off when a lookup in the
+KeyDir may have to go to the disk, and they tell how much of the key space a segment
+covers without reading it.
+
+The filters can't forget a key. A key deleted or overwritten since stays in the filter
+of its old segment till the segment is merged away, and its lookups are false
+positives too, which the observed false-positive rate counts.
+
+The positions of the bits come from two hashes of the key, CRC32 and Adler-32, which
+are combined into `num_hashes` of them (Kirsch and Mitzenmacher, "Less Hashing, Same
+Performance"). Python's own `hash` would be quicker, but it changes from process to
+process, and the filters are saved.
+
+Typical usage example:
+
+    disk = DiskStorage(file_name="books.db", bloom_fp_rate=0.01)
+    disk.get("missing")
+    print(disk.bloom_filters.memory_bytes, disk.bloom_filters.stats)
+"""
+
+import math
+import os
+import struct
+import threading
+import typing
+import zlib
+
+from caskdb.format import encode_key
+
+# false-positive rate of the filters, by default
+DEFAULT_FP_RATE: typing.Final[float] = 0.01
+
+# the filter of a segment is stored next to it, with this suffix
+BLOOM_FILE_SUFFIX: typing.Final[str] = ".bloom"
+
+# the first filter of a GrowingBloomFilter is sized for these many keys. Every next
+# filter is twice the size, and has this fraction of the false-positive rate of the
+# one before
+GROWING_INITIAL_CAPACITY: typing.Final[int] = 1 << 12
+GROWING_TIGHTENING_RATIO: typing.Final[float] = 0.8
+
+# a saved filter starts with a header, followed by the bits:
+#
+# ┌──────────────┬────────────┬──────────┬─────────┐
+# │ segment_size │ num_hashes │ num_bits │  keys   │
+# └──────────────┴────────────┴──────────┴─────────┘
+# ├──── 8 ───────┼──── 4 ─────┼─── 8 ────┼─── 8 ───┤
+#
+# The size of the segment it was built for tells a stale filter (e.g. of a segment
+# which was replaced) from a valid one
+BLOOM_HEADER: typing.Final[struct.Struct] = struct.Struct("<QLQQ")
+
+LN2_SQUARED: typing.Final[float] = math.log(2) ** 2
+
+
+def _hashes(key: str) -> tuple[int, int]:
+    # the two base hashes of the key. The second one must be odd, so that the
+    # positions it steps through don't repeat early
+    data: bytes = encode_key(key)
+    return zlib.crc32(data), zlib.adler32(data) | 1
+
+
+class BloomFilter:
+    """
+    BloomFilter is a set of keys which may say a key is in it when it is not, but never
+    the other way around
+
+    Args:
+        capacity (int): number of the keys the filter is sized for. More keys than
+            this can be added, but the false-positive rate goes up
+        fp_rate (float): false-positive rate at the capacity, between 0 and 1
+
+    Raises:
+        ValueError: if the capacity is negative, or the rate is not between 0 and 1
+
+    Attributes:
+        num_bits (int): size of the filter in bits
+        num_hashes (int): number of the bits set for every key
+        count (int): number of the keys added
+    """
+
+    def __init__(self, capacity: int, fp_rate: float = DEFAULT_FP_RATE):
+        if capacity < 0:
+            raise ValueError("capacity must not be negative")
+        if not 0 < fp_rate < 1:
+            raise ValueError("fp_rate must be between 0 and 1")
+        capacity = max(capacity, 1)
+        # the optimal sizes, for n keys and the rate p:
+        #   bits   m = -n * ln(p) / ln(2) ** 2
+        #   hashes k = m / n * ln(2)
+        num_bits: int = max(64, math.ceil(-capacity * math.log(fp_rate) / LN2_SQUARED))
+        self.num_bits: int = num_bits
+        self.num_hashes: int = max(1, round(num_bits / capacity * math.log(2)))
+        self.count: int = 0
+        self._bits: bytearray = bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def from_keys(
+        cls, keys: typing.Collection[str], fp_rate: float = DEFAULT_FP_RATE
+    ) -> "BloomFilter":
+        """
+        from_keys builds a filter sized for the keys, and adds them to it
+        """
+        bloom: BloomFilter = cls(len(keys), fp_rate)
+        for key in keys:
+            bloom.add(key)
+        return bloom
+
+    @property
+    def memory_bytes(self) -> int:
+        """
+        memory_bytes is the size of the bits of the filter
+        """
+        return len(self._bits)
+
+    def add(self, key: str) -> None:
+        h1, h2 = _hashes(key)
+        bits: bytearray = self._bits
+        m: int = self.num_bits
+        for i in range(self.num_hashes):
+            position: int = (h1 + i * h2) % m
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        return self.contains_hashes(*_hashes(key))
+
+    def contains_hashes(self, h1: int, h2: int) -> bool:
+        # the lookup by the hashes of the key, so that checking many filters hashes
+        # the key only once
+        bits: bytearray = self._bits
+        m: int = self.num_bits
+        for i in range(self.num_hashes):
+            position: int = (h1 + i * h2) % m
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def to_bytes(self, segment_size: int) -> bytes:
+        header: bytes = BLOOM_HEADER.pack(
+            segment_size, self.num_hashes, self.num_bits, self.count
+        )
+        return header + self._bits
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> tuple[int, "BloomFilter"]:
+        """
+        from_bytes is the reverse of to_bytes: it returns the segment size the filter
+        was saved with, and the filter
+
+        Raises:
+            ValueError: if the data is not a saved filter
+        """
+        if len(data) < BLOOM_HEADER.size:
+            raise ValueError("truncated bloom filter")
+        segment_size, num_hashes, num_bits, count = BLOOM_HEADER.unpack_from(data)
+        bits: bytearray = bytearray(data[BLOOM_HEADER.size :])
+        if num_hashes == 0 or len(bits) != (num_bits + 7) // 8:
+            raise ValueError("corrupt bloom filter")
+        bloom: BloomFilter = cls.__new__(cls)
+        bloom.num_bits, bloom.num_hashes, bloom.count = num_bits, num_hashes, count
+        bloom._bits = bits
+        return segment_size, bloom
+
+
+class GrowingBloomFilter:
+    """
+    GrowingBloomFilter is a Bloom filter for an unknown number of keys. It is a chain of
+    BloomFilters: once the last one is full, a new one twice its size, and with a lower
+    false-positive rate, is started. The rates form a geometric series which adds up
+    to fp_rate, so the false-positive rate of the whole chain stays under it however
+    many keys are added, for a few bits per key more than a filter sized for the keys
+    up front (Almeida et al., "Scalable Bloom Filters").
+
+    Keys are added by a single writer, while the readers look them up. A new filter is
+    appended by swapping in a new list, so a reader always iterates over a complete one
+
+    Args:
+        fp_rate (float): false-positive rate of the whole chain, between 0 and 1
+        capacity (int): number of the keys the first filter is sized for
+    """
+
+    def __init__(
+        self, fp_rate: float = DEFAULT_FP_RATE, capacity: int = GROWING_INITIAL_CAPACITY
+    ):
+        self._capacity: int = max(capacity, 1)
+        self._fp_rate: float = fp_rate * (1 - GROWING_TIGHTENING_RATIO)
+        self._filters: list[BloomFilter] = [BloomFilter(self._capacity, self._fp_rate)]
+
+    @property
+    def count(self) -> int:
+        return sum(bloom.count for bloom in self._filters)
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(bloom.memory_bytes for bloom in self._filters)
+
+    def add(self, key: str) -> None:
+        if self._filters[-1].count >= self._capacity:
+            self._capacity *= 2
+            self._fp_rate *= GROWING_TIGHTENING_RATIO
+            self._filters = self._filters + [BloomFilter(self._capacity, self._fp_rate)]
+        self._filters[-1].add(key)
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        return self.contains_hashes(*_hashes(key))
+
+    def contains_hashes(self, h1: int, h2: int) -> bool:
+        # the larger filters, which came last, have most of the keys
+        for bloom in reversed(self._filters):
+            if bloom.contains_hashes(h1, h2):
+                return True
+        return False
+
+
+def load_bloom_filter(path: str, segment_size: int) -> typing.Optional[BloomFilter]:
+    """
+    load_bloom_filter returns the filter saved at the path, or None if there is no
+    such file, or it was saved for a segment of another size
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        data: bytes = f.read()
+    try:
+        saved_size, bloom = BloomFilter.from_bytes(data)
+    except ValueError:
+        return None
+    if saved_size != segment_size:
+        return None
+    return bloom
+
+
+def save_bloom_filter(path: str, bloom: BloomFilter, segment_size: int) -> None:
+    """
+    save_bloom_filter stores the filter of a segment of the given size at the path.
+    Like the hint files, it is written to a temporary file first and renamed
+    """
+    temp_path: str = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(bloom.to_bytes(segment_size))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class BloomStats:
+    """
+    BloomStats keeps the counters of the lookups which went through the filters
+
+    Attributes:
+        lookups (int): lookups checked against the filters
+        negatives (int): lookups which the filters answered, without the KeyDir
+        false_positives (int): lookups which passed the filters, but the key did not
+            exist
+    """
+
+    def __init__(self) -> None:
+        self.lookups: int = 0
+        self.negatives: int = 0
+        self.false_positives: int = 0
+
+    @property
+    def false_positive_rate(self) -> float:
+        """
+        false_positive_rate is the fraction of the lookups of missing keys which
+        passed the filters
+        """
+        missing: int = self.negatives + self.false_positives
+        return self.false_positives / missing if missing else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"BloomStats(lookups={self.lookups}, negatives={self.negatives}, "
+            f"false_positives={self.false_positives})"
+        )
+
+
+class BloomFilters:
+    """
+    BloomFilters holds the filters of the sealed segments of a DiskStorage, and the
+    growing filter of its active segment
+
+    The set of the filters is replaced as a whole when a segment is sealed or merged
+    away, rather than modified, so the readers iterate over it without a lock. The
+    lock only serialises the replacements, since a merge adds its filters while the
+    writers may be sealing segments
+
+    Args:
+        fp_rate (float): false-positive rate of the filters built
+
+    Attributes:
+        fp_rate (float): false-positive rate of the filters built
+        stats (BloomStats): counters of the lookups
+        active (GrowingBloomFilter): the keys written to the active segment
+    """
+
+    def __init__(self, fp_rate: float = DEFAULT_FP_RATE):
+        if not 0 < fp_rate < 1:
+            raise ValueError("fp_rate must be between 0 and 1")
+        self.fp_rate: float = fp_rate
+        self.stats: BloomStats = BloomStats()
+        self.active: GrowingBloomFilter = GrowingBloomFilter(fp_rate)
+        self._filters: dict[int, BloomFilter] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def memory_bytes(self) -> int:
+        """
+        memory_bytes is the memory taken by the bits of all the filters
+        """
+        return self.active.memory_bytes + sum(
+            bloom.memory_bytes for bloom in self._filters.values()
+        )
+
+    def __len__(self) -> int:
+        return len(self._filters)
+
+    def get(self, file_id: int) -> typing.Optional[BloomFilter]:
+        return self._filters.get(file_id)
+
+    def build(self, keys: typing.Collection[str]) -> BloomFilter:
+        return BloomFilter.from_keys(keys, self.fp_rate)
+
+    def add(self, file_id: int, bloom: BloomFilter) -> None:
+        with self._lock:
+            filters: dict[int, BloomFilter] = dict(self._filters)
+            filters[file_id] = bloom
+            self._filters = filters
+
+    def remove(self, file_ids: typing.Iterable[int]) -> None:
+        with self._lock:
+            filters: dict[int, BloomFilter] = dict(self._filters)
+            for file_id in file_ids:
+                filters.pop(file_id, None)
+            self._filters = filters
+
+    def seal(self, file_id: int, bloom: BloomFilter) -> None:
+        """
+        seal adds the filter of the segment which was the active one, and starts an
+        empty filter for the next one
+        """
+        # the filter of the segment goes in before the growing one is dropped, and
+        # might_contain reads them in the other order, so a reader finds the keys of
+        # the segment in one or the other
+        self.add(file_id, bloom)
+        self.active = GrowingBloomFilter(self.fp_rate)
+
+    def replace(
+        self,
+        filters: dict[int, BloomFilter],
+        active: typing.Optional[GrowingBloomFilter] = None,
+    ) -> None:
+        with self._lock:
+            self._filters = filters
+            self.active = (
+                active if active is not None else GrowingBloomFilter(self.fp_rate)
+            )
+
+    def might_contain(self, key: str) -> bool:
+        """
+        might_contain returns False if none of the segments has the key, and True if
+        some of them may have it
+        """
+        self.stats.lookups += 1
+        h1, h2 = _hashes(key)
+        # the active segment first, check seal for why
+        if self.active.contains_hashes(h1, h2):
+            return True
+        # the segments sealed last are more likely to have the key, so they go first
+        for bloom in reversed(self._filters.values()):
+            if bloom.contains_hashes(h1, h2):
+                return True
+        self.stats.negatives += 1
+        return False
@@ -0,0 +1,462 @@
+"""
+cache module provides the in-process value caches which DiskStorage can keep in front
+of the disk. A hot key which is read thousands of times a second would otherwise cost
+a disk read and a decode every time.
+
+A cache has a budget in bytes, and once it is full, it has to evict something to make
+space for a new value. Which value to evict is decided by the eviction policy:
+
+    FIFOCache   - evicts the value which was cached first
+    LRUCache    - evicts the value which was read least recently
+    LFUCache    - evicts the value which was read least often
+    TinyLFUCache - W-TinyLFU: a small LRU window in front of a segmented LRU, where a
+                  new value replaces an old one only if it is read more often. Access
+                  frequencies are estimated with a count-min sketch, which fades out
+                  over time. Read more: https://arxiv.org/abs/1512.00727
+
+The size of an entry is taken as the length of the key plus the length of the value,
+so the budget is approximate for the non-ASCII strings.
+
+All the caches are thread safe.
+
+Typical usage example:
+
+    disk = DiskStorage(file_name="books.db", cache=LRUCache(max_bytes=64 << 20))
+    disk.get("othello")
+    print(disk.cache.stats.hit_rate)
+"""
+
+import abc
+import collections
+import threading
+import typing
+
+FIFO: typing.Final[str] = "fifo"
+LRU: typing.Final[str] = "lru"
+LFU: typing.Final[str] = "lfu"
+TINY_LFU: typing.Final[str] = "tinylfu"
+
+
+class CacheStats:
+    """
+    CacheStats keeps the counters of a cache
+
+    Attributes:
+        hits (int): lookups which found the value in the cache
+        misses (int): lookups which did not
+        evictions (int): values evicted to make space for the others
+    """
+
+    def __init__(self) -> None:
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups: int = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __repr__(self) -> str:
+        return (
+            f"CacheStats(hits={self.hits}, misses={self.misses}, "
+            f"evictions={self.evictions})"
+        )
+
+
+def entry_size(key: str, value: str) -> int:
+    return len(key) + len(value)
+
+
+class Cache(abc.ABC):
+    """
+    Cache is the base class of the caches. The subclasses implement the eviction
+    policy with `__len__`, `_get`, `_put`, `_remove` and `_clear`, and Cache takes
+    care of the locking and the stats. A subclass which misses any of them can't be
+    instantiated.
+
+    Args:
+        max_bytes (int): the budget of the cache. A value larger than the budget is
+            never cached
+
+    Attributes:
+        max_bytes (int): the budget of the cache
+        size (int): bytes taken by the cached values
+        stats (CacheStats): hits, misses and evictions
+    """
+
+    def __init__(self, max_bytes: int):
+        if max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        self.max_bytes: int = max_bytes
+        self.size: int = 0
+        self.stats: CacheStats = CacheStats()
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(self, key: str) -> typing.Optional[str]:
+        """
+        get returns the cached value of the key, or None if it is not cached
+        """
+        with self._lock:
+            value: typing.Optional[str] = self._get(key)
+            if value is None:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        """
+        put caches the value of the key, evicting other values if needed
+        """
+        if entry_size(key, value) > self.max_bytes:
+            self.invalidate(key)
+            return
+        with self._lock:
+            self._remove(key)
+            self._put(key, value)
+
+    def invalidate(self, key: str) -> None:
+        """
+        invalidate removes the key from the cache, if it is there
+        """
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+            self.size = 0
+
+    @abc.abstractmethod
+    def __len__(self) -> int: ...
+
+    @abc.abstractmethod
+    def _get(self, key: str) -> typing.Optional[str]: ...
+
+    @abc.abstractmethod
+    def _put(self, key: str, value: str) -> None:
+        # the key is never in the cache when _put is called
+        ...
+
+    @abc.abstractmethod
+    def _remove(self, key: str) -> None: ...
+
+    @abc.abstractmethod
+    def _clear(self) -> None: ...
+
+
+class FIFOCache(Cache):
+    def __init__(self, max_bytes: int):
+        super().__init__(max_bytes)
+        self._data: collections.OrderedDict[str, str] = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _get(self, key: str) -> typing.Optional[str]:
+        return self._data.get(key)
+
+    def _put(self, key: str, value: str) -> None:
+        self._data[key] = value
+        self.size += entry_size(key, value)
+        while self.size > self.max_bytes:
+            old_key, old_value = self._data.popitem(last=False)
+            self.size -= entry_size(old_key, old_value)
+            self.stats.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        value: typing.Optional[str] = self._data.pop(key, None)
+        if value is not None:
+            self.size -= entry_size(key, value)
+
+    def _clear(self) -> None:
+        self._data.clear()
+
+
+class LRUCache(FIFOCache):
+    # same as FIFO, except that every hit moves the key to the end of the queue
+    def _get(self, key: str) -> typing.Optional[str]:
+        value: typing.Optional[str] = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+
+class LFUCache(Cache):
+    """
+    LFUCache evicts the value with the least number of hits. The values with the
+    same number of hits are kept in the order of their last hit, and the least recent
+    of them is evicted first. All the operations take constant time.
+    """
+
+    def __init__(self, max_bytes: int):
+        super().__init__(max_bytes)
+        # key -> (value, frequency)
+        self._data: dict[str, tuple[str, int]] = {}
+        # frequency -> keys with that frequency, the least recently used first
+        self._buckets: dict[int, collections.OrderedDict[str, None]] = {}
+        self._min_frequency: int = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _get(self, key: str) -> typing.Optional[str]:
+        item: typing.Optional[tuple[str, int]] = self._data.get(key)
+        if item is None:
+            return None
+        value, frequency = item
+        # link before unlinking, so that the key is in some bucket when the minimum
+        # frequency is recomputed
+        self._link(key, frequency + 1)
+        self._unlink(key, frequency)
+        self._data[key] = (value, frequency + 1)
+        return value
+
+    def _put(self, key: str, value: str) -> None:
+        size: int = entry_size(key, value)
+        while self.size + size > self.max_bytes:
+            bucket: collections.OrderedDict[str, None] = self._buckets[
+                self._min_frequency
+            ]
+            victim: str = next(iter(bucket))
+            self._remove(victim)
+            self.stats.evictions += 1
+        self._data[key] = (value, 1)
+        self._link(key, 1)
+        self._min_frequency = 1
+        self.size += size
+
+    def _remove(self, key: str) -> None:
+        item: typing.Optional[tuple[str, int]] = self._data.pop(key, None)
+        if item is None:
+            return
+        value, frequency = item
+        self._unlink(key, frequency)
+        self.size -= entry_size(key, value)
+
+    def _clear(self) -> None:
+        self._data.clear()
+        self._buckets.clear()
+        self._min_frequency = 0
+
+    def _link(self, key: str, frequency: int) -> None:
+        self._buckets.setdefault(frequency, collections.OrderedDict())[key] = None
+
+    def _unlink(self, key: str, frequency: int) -> None:
+        bucket: collections.OrderedDict[str, None] = self._buckets[frequency]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[frequency]
+            if self._min_frequency == frequency:
+                self._min_frequency = min(self._buckets, default=0)
+
+
+class CountMinSketch:
+    """
+    CountMinSketch estimates how often a key was seen, in a fixed amount of memory.
+    Every key increments one counter in each of the rows, and the estimate is the
+    smallest of those counters. The counters saturate at 15, and once `sample_size`
+    keys have been recorded, all of them are halved. So the keys which were popular a
+    while ago fade out.
+
+    Args:
+        width (int): counters per row, rounded up to a power of two
+        sample_size (int): number of increments after which the counters are halved
+    """
+
+    DEPTH: typing.Final[int] = 4
+    MAX_COUNT: typing.Final[int] = 15
+    # maps every counter value to its half, to age all the counters in one go
+    HALVE: typing.Final[bytes] = bytes(i >> 1 for i in range(256))
+
+    def __init__(self, width: int, sample_size: int):
+        self.width: int = 16
+        while self.width < width:
+            self.width *= 2
+        self.mask: int = self.width - 1
+        self.sample_size: int = sample_size
+        self.additions: int = 0
+        self.table: bytearray = bytearray(self.width * self.DEPTH)
+
+    def _indexes(self, key: str) -> tuple[int, int, int, int]:
+        # the index in every row is derived from the hash of the key with double
+        # hashing, h1 + row * h2, instead of hashing the key once per row
+        h: int = hash(key)
+        h1: int = h & 0xFFFFFFFF
+        h2: int = ((h >> 32) & 0xFFFFFFFF) | 1
+        mask: int = self.mask
+        width: int = self.width
+        return (
+            h1 & mask,
+            width + ((h1 + h2) & mask),
+            2 * width + ((h1 + 2 * h2) & mask),
+            3 * width + ((h1 + 3 * h2) & mask),
+        )
+
+    def increment(self, key: str) -> None:
+        table: bytearray = self.table
+        for index in self._indexes(key):
+            if table[index] < self.MAX_COUNT:
+                table[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self._reset()
+
+    def estimate(self, key: str) -> int:
+        table: bytearray = self.table
+        a, b, c, d = self._indexes(key)
+        return min(table[a], table[b], table[c], table[d])
+
+    def _reset(self) -> None:
+        self.table = bytearray(self.table.translate(self.HALVE))
+        self.additions //= 2
+
+
+class TinyLFUCache(Cache):
+    """
+    TinyLFUCache implements W-TinyLFU. New values enter a small LRU window (1% of the
+    budget). A value evicted from the window competes with the value the main cache
+    would evict next, and the one seen more often by the sketch stays. The main cache
+    is a segmented LRU: values enter its probation segment, and move to the protected
+    segment (80% of the main cache) on a hit.
+
+    Args:
+        max_bytes (int): the budget of the cache
+        expected_entries (int): rough number of the values which fit in the budget.
+            It sizes the frequency sketch
+    """
+
+    WINDOW_RATIO: typing.Final[float] = 0.01
+    PROTECTED_RATIO: typing.Final[float] = 0.8
+
+    def __init__(self, max_bytes: int, expected_entries: int = 10_000):
+        super().__init__(max_bytes)
+        self.window_bytes: int = max(1, int(max_bytes * self.WINDOW_RATIO))
+        self.main_bytes: int = max_bytes - self.window_bytes
+        self.protected_bytes: int = int(self.main_bytes * self.PROTECTED_RATIO)
+        self.sketch: CountMinSketch = CountMinSketch(
+            expected_entries, sample_size=10 * expected_entries
+        )
+        self._window: collections.OrderedDict[str, str] = collections.OrderedDict()
+        self._probation: collections.OrderedDict[str, str] = collections.OrderedDict()
+        self._protected: collections.OrderedDict[str, str] = collections.OrderedDict()
+        self._window_size: int = 0
+        self._probation_size: int = 0
+        self._protected_size: int = 0
+
+    def __len__(self) -> int:
+        return len(self._window) + len(self._probation) + len(self._protected)
+
+    def _get(self, key: str) -> typing.Optional[str]:
+        self.sketch.increment(key)
+        value: typing.Optional[str] = self._window.get(key)
+        if value is not None:
+            self._window.move_to_end(key)
+            return value
+        value = self._protected.get(key)
+        if value is not None:
+            self._protected.move_to_end(key)
+            return value
+        value = self._probation.pop(key, None)
+        if value is None:
+            return None
+        # promote to the protected segment, demoting its LRU values if it overflows
+        size: int = entry_size(key, value)
+        self._probation_size -= size
+        self._protected[key] = value
+        self._protected_size += size
+        while self._protected_size > self.protected_bytes and len(self._protected) > 1:
+            old_key, old_value = self._protected.popitem(last=False)
+            old_size: int = entry_size(old_key, old_value)
+            self._protected_size -= old_size
+            self._probation[old_key] = old_value
+            self._probation_size += old_size
+        return value
+
+    def _put(self, key: str, value: str) -> None:
+        # the sketch counts the reads only. A value is put in the cache after a
+        # missed read, which is counted already
+        size: int = entry_size(key, value)
+        self._window[key] = value
+        self._window_size += size
+        self.size += size
+        while self._window_size > self.window_bytes:
+            candidate, candidate_value = self._window.popitem(last=False)
+            candidate_size: int = entry_size(candidate, candidate_value)
+            self._window_size -= candidate_size
+            self.size -= candidate_size
+            self._admit(candidate, candidate_value)
+
+    def _admit(self, candidate: str, value: str) -> None:
+        # the candidate evicted from the window gets into the main cache only if it
+        # is more popular than the victims it has to displace
+        size: int = entry_size(candidate, value)
+        victims: list[tuple[str, str]] = []
+        freed: int = 0
+        main_size: int = self._probation_size + self._protected_size
+        segments: tuple[collections.OrderedDict[str, str], ...] = (
+            self._probation,
+            self._protected,
+        )
+        candidate_frequency: int = self.sketch.estimate(candidate)
+        for segment in segments:
+            for victim, victim_value in segment.items():
+                if main_size - freed + size <= self.main_bytes:
+                    break
+                if self.sketch.estimate(victim) >= candidate_frequency:
+                    self.stats.evictions += 1
+                    return
+                victims.append((victim, victim_value))
+                freed += entry_size(victim, victim_value)
+        if main_size - freed + size > self.main_bytes:
+            self.stats.evictions += 1
+            return
+        for victim, _ in victims:
+            self._remove(victim)
+            self.stats.evictions += 1
+        self._probation[candidate] = value
+        self._probation_size += size
+        self.size += size
+
+    def _remove(self, key: str) -> None:
+        for segment in (self._window, self._probation, self._protected):
+            value: typing.Optional[str] = segment.pop(key, None)
+            if value is None:
+                continue
+            size: int = entry_size(key, value)
+            self.size -= size
+            if segment is self._window:
+                self._window_size -= size
+            elif segment is self._probation:
+                self._probation_size -= size
+            else:
+                self._protected_size -= size
+            return
+
+    def _clear(self) -> None:
+        for segment in (self._window, self._probation, self._protected):
+            segment.clear()
+        self._window_size = self._probation_size = self._protected_size = 0
+
+
+def new_cache(policy: str, max_bytes: int) -> Cache:
+    """
+    new_cache creates a cache with the given eviction policy
+
+    Args:
+        policy (str): one of `fifo`, `lru`, `lfu` or `tinylfu`
+        max_bytes (int): the budget of the cache
+
+    Raises:
+        ValueError: if the policy is unknown
+    """
+    caches: dict[str, typing.Callable[[int], Cache]] = {
+        FIFO: FIFOCache,
+        LRU: LRUCache,
+        LFU: LFUCache,
+        TINY_LFU: TinyLFUCache,
+    }
+    if policy not in caches:
+        raise ValueError(f"unknown cache policy: {policy}")
+    return caches[policy](max_bytes)
@@ -0,0 +1,111 @@
+"""
+compaction module runs the merge of DiskStorage in the background.
+
+DiskStorage never modifies a record once written. When a key is overwritten, the old
+record stays in its segment, taking up the disk space and the startup time. Merge
+(called compaction elsewhere) reclaims that space: it copies only the live records of
+the sealed segments to new segments and deletes the old ones. Check DiskStorage.merge
+for how it is done.
+
+Compactor watches the dead-byte ratio of the sealed segments, i.e. how much of a
+segment is taken by stale records. Whenever a segment crosses the threshold, it merges
+such segments in a background thread, so the writers are blocked only for the short
+time it takes to swap the KeyDir entries.
+
+Typical usage example:
+
+    disk = DiskStorage("books.db", max_file_size=64 << 20, merge_threshold=0.5)
+    # or, merge whenever you want:
+    disk.merge()
+    print(disk.merge_stats.bytes_reclaimed)
+"""
+
+import logging
+import threading
+import typing
+
+if typing.TYPE_CHECKING:
+    from caskdb.disk_store import DiskStorage
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class MergeStats:
+    """
+    MergeStats keeps the metrics of the merges done by a DiskStorage
+
+    Attributes:
+        merges (int): number of merges done
+        bytes_reclaimed (int): total disk space reclaimed by the merges
+        last_duration (float): time taken by the last merge, in seconds
+        total_duration (float): time taken by all the merges, in seconds
+    """
+
+    def __init__(self) -> None:
+        self.merges: int = 0
+        self.bytes_reclaimed: int = 0
+        self.last_duration: float = 0.0
+        self.total_duration: float = 0.0
+
+    def record(self, bytes_reclaimed: int, duration: float) -> None:
+        self.merges += 1
+        self.bytes_reclaimed += bytes_reclaimed
+        self.last_duration = duration
+        self.total_duration += duration
+
+
+class Compactor:
+    """
+    Compactor merges the segments of a DiskStorage in a background thread, whenever
+    their dead-byte ratio crosses the threshold
+
+    Args:
+        store (DiskStorage): the store to compact
+        threshold (float): dead-byte ratio, between 0 and 1, above which a sealed
+            segment is merged
+
+    Raises:
+        ValueError: if the threshold is not between 0 and 1
+    """
+
+    def __init__(self, store: "DiskStorage", threshold: float):
+        if not 0 < threshold <= 1:
+            raise ValueError("threshold must be between 0 and 1")
+        self.store: "DiskStorage" = store
+        self.threshold: float = threshold
+        self._wake: threading.Event = threading.Event()
+        self._stop: bool = False
+        self._thread: threading.Thread = threading.Thread(
+            target=self._run, name="caskdb-compactor", daemon=True
+        )
+        self._thread.start()
+
+    def trigger(self) -> None:
+        """
+        trigger wakes up the compactor, which checks for the segments to merge
+        """
+        self._wake.set()
+
+    def close(self) -> None:
+        """
+        close stops the compactor, waiting for the running merge to finish
+        """
+        self._stop = True
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            if self._stop:
+                return
+            self._wake.clear()
+            # a failed merge (e.g. the disk is full) leaves the store as it was. It is
+            # logged, and tried again on the next trigger: letting it kill the thread
+            # would stop the compaction for good, without anyone noticing
+            try:
+                file_ids: list[int] = self.store.merge_candidates(self.threshold)
+                if file_ids:
+                    self.store.merge(file_ids)
+            except Exception:
+                logger.exception("background merge failed")
@@ -0,0 +1,261 @@
+"""
+compression module implements the optional compression of the values.
+
+Values like JSON documents compress several times over. Stored compressed, they take
+less disk and less page cache, and the startup has fewer bytes to scan. Every record
+says in its header how its value was compressed: the low bits of the flags byte have
+the id of the codec. So the records compressed with different codecs, or not at all,
+can live in the same segment, and the codec of a store can be changed at any time. The
+old records are still read with their own codec.
+
+Compression takes time, and small values gain little from it. So the values smaller
+than the `threshold` are stored as they are, and so is a value which doesn't get any
+smaller.
+
+A small value compresses poorly on its own, since there is little in it to find
+repetitions in. A dictionary helps: the compressor starts with the dictionary in its
+window, so the field names which every JSON value repeats compress even in a value of
+a hundred bytes. Train one from a sample of the values with `train_dictionary`. The
+dictionary is saved next to the data file, since the records compressed with it
+cannot be read without it. A store has only one dictionary.
+
+The codecs are zlib and lzma from the standard library, and zstd if the `zstandard`
+package is installed (`pip install caskdb[zstd]`). lzma compresses the most but is
+slow; zstd is the fastest, and it supports dictionaries much like zlib does.
+
+Typical usage example:
+
+    compressor = Compressor("zlib", threshold=256)
+    disk: DiskStorage = DiskStorage(file_name="books.db", compressor=compressor)
+"""
+
+import lzma
+import os
+import threading
+import typing
+import zlib
+
+from caskdb.format import Buffer
+
+try:
+    import zstandard
+
+    HAS_ZSTD: bool = True
+except ImportError:
+    HAS_ZSTD = False
+
+# codec ids, as stored in the low bits of the flags of a record. NONE means the value
+# is stored as is
+NONE: typing.Final[int] = 0
+ZLIB: typing.Final[int] = 1
+LZMA: typing.Final[int] = 2
+ZSTD: typing.Final[int] = 3
+CODECS: typing.Final[dict[str, int]] = {"zlib": ZLIB, "lzma": LZMA, "zstd": ZSTD}
+CODEC_MASK: typing.Final[int] = 0x0F
+# set in the flags, if the value was compressed with the dictionary of the store
+DICTIONARY_FLAG: typing.Final[int] = 0x10
+
+# values smaller than these many bytes are not compressed, by default
+DEFAULT_THRESHOLD: typing.Final[int] = 128
+
+# zlib can use at most the last 32KB of a dictionary, its window size
+DEFAULT_DICTIONARY_SIZE: typing.Final[int] = 32 << 10
+
+# the dictionary of a data file is stored next to it, with this suffix
+DICTIONARY_FILE_SUFFIX: typing.Final[str] = ".dict"
+
+
+class Compressor:
+    """
+    Compressor compresses the values written to a DiskStorage
+
+    Args:
+        codec (str): one of "zlib", "lzma" and "zstd"
+        threshold (int): values smaller than these many bytes are stored as is
+        level (int): compression level of the codec. Defaults to the default level
+            of the codec
+        dictionary (bytes): dictionary to compress the values with, check
+            `train_dictionary`. lzma does not support one
+
+    Raises:
+        ValueError: if the codec is not known, or not available
+    """
+
+    def __init__(
+        self,
+        codec: str = "zlib",
+        threshold: int = DEFAULT_THRESHOLD,
+        level: typing.Optional[int] = None,
+        dictionary: typing.Optional[bytes] = None,
+    ):
+        if codec not in CODECS:
+            raise ValueError(f"unknown codec {codec}")
+        if codec == "zstd" and not HAS_ZSTD:
+            raise ValueError("zstd needs the zstandard package")
+        if codec == "lzma" and dictionary:
+            raise ValueError("lzma does not support a dictionary")
+        if threshold < 0:
+            raise ValueError("threshold must not be negative")
+        self.codec: str = codec
+        self.threshold: int = threshold
+        self.level: typing.Optional[int] = level
+        self.dictionary: typing.Optional[bytes] = dictionary or None
+        self.flags: int = CODECS[codec] | (DICTIONARY_FLAG if dictionary else 0)
+        self._local: threading.local = threading.local()
+
+    def compress(self, value: Buffer) -> tuple[int, Buffer]:
+        """
+        compress returns the flags of the record and the value to store, which is
+        the compressed value, or the value itself if it was not worth compressing
+        """
+        if len(value) < self.threshold:
+            return NONE, value
+        data: bytes = self._compress(value)
+        if len(data) >= len(value):
+            return NONE, value
+        return self.flags, data
+
+    def _compress(self, value: Buffer) -> bytes:
+        level: typing.Optional[int] = self.level
+        if self.codec == "lzma":
+            return lzma.compress(value, preset=level)
+        if self.codec == "zstd":
+            # the zstd compressors must not be shared between threads
+            compressor = getattr(self._local, "zstd", None)
+            if compressor is None:
+                compressor = zstandard.ZstdCompressor(
+                    level=3 if level is None else level,
+                    dict_data=_zstd_dictionary(self.dictionary),
+                )
+                self._local.zstd = compressor
+            return typing.cast(bytes, compressor.compress(value))
+        if self.dictionary is None:
+            return zlib.compress(value, -1 if level is None else level)
+        # loading the dictionary is a good part of the cost for a small value. So
+        # we load it once, and copy the primed compressor for every value. The
+        # values are compressed as raw deflate streams, without the zlib header and
+        # trailer: a raw stream takes the dictionary up front, so the decompressor
+        # is primed right away too. The record has a checksum of its own anyway
+        primed = getattr(self._local, "zlib", None)
+        if primed is None:
+            primed = zlib.compressobj(
+                -1 if level is None else level,
+                zlib.DEFLATED,
+                -zlib.MAX_WBITS,
+                zdict=self.dictionary,
+            )
+            self._local.zlib = primed
+        compressor = primed.copy()
+        return compressor.compress(value) + compressor.flush()
+
+
+class Decompressor:
+    """
+    Decompressor decompresses the values read from a DiskStorage, whichever codec they
+    were compressed with
+
+    Args:
+        dictionary (bytes): the dictionary of the store, if it has one
+    """
+
+    def __init__(self, dictionary: typing.Optional[bytes] = None):
+        self.dictionary: typing.Optional[bytes] = dictionary
+        self._local: threading.local = threading.local()
+
+    def decompress(self, flags: int, data: Buffer) -> bytes:
+        """
+        decompress returns the value, given the flags of its record and the stored
+        value
+
+        Raises:
+            ValueError: if the codec is not known or not available, or the value was
+                compressed with a dictionary and there is none
+        """
+        codec: int = flags & CODEC_MASK
+        dictionary: typing.Optional[bytes] = None
+        if flags & DICTIONARY_FLAG:
+            if self.dictionary is None:
+                raise ValueError("the value needs a dictionary, the store has none")
+            dictionary = self.dictionary
+        if codec == ZLIB:
+            if dictionary is None:
+                return zlib.decompress(data)
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=dictionary)
+            return decompressor.decompress(data) + decompressor.flush()
+        if codec == LZMA:
+            return lzma.decompress(data)
+        if codec == ZSTD and HAS_ZSTD:
+            key: str = "dict" if dictionary is not None else "plain"
+            # like the compressors, the zstd decompressors are one per thread
+            zstd: typing.Any = getattr(self._local, key, None)
+            if zstd is None:
+                zstd = zstandard.ZstdDecompressor(
+                    dict_data=_zstd_dictionary(dictionary)
+                )
+                setattr(self._local, key, zstd)
+            return typing.cast(bytes, zstd.decompress(data))
+        raise ValueError(f"unknown codec id {codec}")
+
+
+def _zstd_dictionary(dictionary: typing.Optional[bytes]) -> typing.Any:
+    if dictionary is None:
+        return None
+    return zstandard.ZstdCompressionDict(dictionary)
+
+
+def train_dictionary(
+    samples: typing.Iterable[Buffer],
+    size: int = DEFAULT_DICTIONARY_SIZE,
+    codec: str = "zlib",
+) -> bytes:
+    """
+    train_dictionary builds a compression dictionary from a sample of the values
+
+    With zstd, the samples go to its dictionary trainer. zlib has no trainer, but the
+    samples themselves make a good dictionary: the values have most of their structure
+    in common, and that is what the compressor finds in the dictionary. zlib looks back
+    only 32KB, so the dictionary is the last `size` bytes of the samples.
+
+    Args:
+        samples (typing.Iterable[Buffer]): values like the ones to be compressed
+        size (int): size of the dictionary in bytes
+        codec (str): the codec which will use the dictionary
+
+    Returns:
+        the dictionary
+    """
+    if codec == "zstd":
+        if not HAS_ZSTD:
+            raise ValueError("zstd needs the zstandard package")
+        trained = zstandard.train_dictionary(size, [bytes(s) for s in samples])
+        return typing.cast(bytes, trained.as_bytes())
+    if codec != "zlib":
+        raise ValueError(f"{codec} does not support a dictionary")
+    data: bytearray = bytearray()
+    for sample in samples:
+        data += sample
+    return bytes(data[-size:])
+
+
+def load_dictionary(path: str) -> typing.Optional[bytes]:
+    """
+    load_dictionary returns the dictionary stored at the path, or None if there is
+    no such file
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def save_dictionary(path: str, dictionary: bytes) -> None:
+    """
+    save_dictionary stores the dictionary at the path. Like the hint files, it is
+    written to a temporary file first and renamed, so that it is never half written
+    """
+    temp_path: str = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(dictionary)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
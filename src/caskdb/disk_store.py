@@ -4,12 +4,107 @@ disk
 
 DiskStorage provides two simple operations to get and set key value pairs. Both key
 and value need to be of string type, and all the data is persisted to disk.
-During startup, DiskStorage loads all the existing KV pair metadata, and it will
-throw an error if the file is invalid or corrupt.
+During startup, DiskStorage loads all the existing KV pair metadata. Only the headers
+and the keys are read, the values are skipped. A record left incomplete by a crash at
+the end of a segment is dropped. Pass `progress` to follow a long startup.
 
 Note that if the database file is large, the initialisation will take time
 accordingly. The initialisation is also a blocking operation; till it is completed,
-we cannot use the database.
+we cannot use the database. To keep the startup quick, DiskStorage writes a hint file
+next to the database file when it is closed. On the next startup, the KeyDir is loaded
+from the hint file, and only the records written after it are read from the data file.
+What has to be read can be spread over a few processes with `startup_workers`, check
+the scan module.
+
+The data is written to numbered segment files. The first segment is the file_name
+itself, and the next ones are named file_name.1, file_name.2 and so on, in the same
+directory. Only the last segment is written to, and once it grows beyond
+`max_file_size`, it is sealed and a new segment is started. Sealed segments are never
+modified again.
+
+Overwritten records stay in their segments till the segments are merged. Merge copies
+the live records of the segments to new segments and deletes the old ones. It can be
+run with `merge`, or in the background whenever the dead-byte ratio of a segment
+crosses `merge_threshold`. Check the compaction module for more.
+
+Reads go through regular file handles by default. With `use_mmap`, the segments are
+memory mapped instead, and the values are served straight from the mapping. Such a
+store can also hand out the values as memoryview slices of the mapping, without
+copying them, with `get_view`.
+
+The KeyDir is a dict by default. For stores with a lot of keys, pass
+`key_dir_type="compact"` to use a KeyDir which takes a fraction of the memory. Check
+the keydir module for more. For more keys than the RAM can hold, `key_dir_type="paged"`
+keeps the KeyDir in memory mapped files next to the data file instead. After a clean
+close, such a store starts without reading its segments at all. Check the
+paged_keydir module.
+
+Keys are deleted with `delete`, which appends a tombstone record for the key, and
+drops the key from the KeyDir. The startup skips the deleted keys, and merge drops the
+tombstones once no older segment may have a record of the key. So a deleted key costs
+neither memory nor startup time.
+
+Many KV pairs can be written in one go with `set_many`, or with a WriteBatch. A batch
+is written with a single write and made durable with a single fsync, and the KeyDir is
+updated only after the whole batch is written. Like a `set`, the KeyDir is updated
+before the fsync, so the readers may see a batch which is not durable yet. If we crash
+while writing a batch, the startup finds the batch incomplete and drops it entirely.
+
+The keys can be scanned in order with `scan` and `prefix`, which read the values from
+the disk lazily, as the pairs are consumed. For large stores, use
+`key_dir_type="sorted"`, whose KeyDir keeps the keys sorted. The other KeyDirs sort
+all the keys on every scan.
+
+Similarly, many keys can be read in one go with `get_many`. It sorts the reads by
+their location on the disk and merges the nearby ones, so that a few large reads fetch
+all the values.
+
+Hot keys can be served from memory, with a value cache in front of the disk. Pass a
+`cache` (e.g. `LRUCache(max_bytes=64 << 20)`) and the values read by `get` are kept
+in it, till they are evicted or overwritten. Check the cache module for the policies.
+
+DiskStorage is safe to share between threads. The writes (`set`, `set_many`, `delete`
+and the KeyDir swap of a merge) are serialised by a single write lock. The reads take
+no lock of their own: they look up the KeyDir, and read the record with `os.pread`,
+which doesn't share a file cursor with the other readers or the writer. A reader racing
+with a merge finds the old segment gone, and retries with the new KeyEntry. Only
+`close` must not run while the other threads use the store.
+
+Only one process may write to a store; the writer holds an advisory lock on the lock
+file next to the data file (check the locking module), and a second writer fails to
+open the store. Any number of processes can open it with `read_only=True` along with
+the writer. A read only store does not see the new writes by itself: `refresh` reads
+the records appended since the last refresh, so it is as cheap as the writes it
+catches up with. With `use_mmap`, the segments are mapped read only, so all the
+processes share the same pages of the OS page cache, rather than each keeping its own
+copy of the data. In a pre-fork server, open the store before forking: the workers
+inherit the KeyDir (copy-on-write) instead of each of them scanning the segments.
+
+Every record carries a CRC32 checksum, which is verified whenever the record is read,
+so a torn or rotten record raises ChecksumError rather than returning garbage. The
+startup verifies the records it scans too. A bad record which nothing valid follows in
+the active segment is the torn tail of a crash, and is truncated. Any other bad record
+is skipped, the scan resumes at the next good one. Pass `verify_checksums=False` to
+skip the checks on a trusted disk.
+
+Values can be stored compressed: pass a `compressor` (e.g. `Compressor("zlib")`), and
+the values larger than its threshold are compressed before they are written. Every
+record has the codec of its value in its header, so the reads don't need to be told.
+Check the compression module for the codecs and the dictionaries.
+
+With `bloom_fp_rate`, every sealed segment gets a Bloom filter of its keys, saved next
+to it, and the keys of the active segment go into a filter which grows with them. A
+lookup of a key which none of the filters has is answered right there. The filters
+report their memory and their observed false-positive rate in `bloom_filters`. Check
+the bloom module for more.
+
+By default, every `set` is fsynced before it returns. Check the durability module for
+the other sync policies, which trade durability for write throughput.
+
+`stats` returns the state of the store: live keys, dead bytes, file size, cache hit
+rate and so on. Pass `metrics` to also get the latency histograms of the gets, the
+sets, the fsyncs, the startup and the merges, and to hook them up to your own
+monitoring. Without it, the store runs uninstrumented. Check the metrics module.
 
 Typical usage example:
 
@@ -20,11 +115,79 @@ Typical usage example:
     disk["hamlet"] = "shakespeare"
 """
 
+import collections
+import concurrent.futures
+import io
+import itertools
+import logging
+import mmap
 import os.path
+import re
+import sys
+import threading
 import time
 import typing
 
-from caskdb.format import KeyEntry, encode_kv, decode_kv, HEADER_SIZE, decode_header
+from caskdb.bloom import (
+    BLOOM_FILE_SUFFIX,
+    BloomFilter,
+    BloomFilters,
+    GrowingBloomFilter,
+    load_bloom_filter,
+    save_bloom_filter,
+)
+from caskdb.cache import Cache
+from caskdb.compaction import Compactor, MergeStats
+from caskdb.compression import (
+    DICTIONARY_FILE_SUFFIX,
+    Compressor,
+    Decompressor,
+    load_dictionary,
+    save_dictionary,
+)
+from caskdb.durability import GroupCommit, SyncPolicy, done_future
+from caskdb.format import (
+    BATCH_MARKER,
+    TOMBSTONE,
+    KeyEntry,
+    encode_batch_header,
+    Buffer,
+    decode_key,
+    encode_key,
+    encode_kv_bytes,
+    encode_kv_into,
+    encode_tombstone,
+    encode_hint,
+    HEADER_SIZE,
+    HINT_HEADER_SIZE,
+    decode_header,
+    decode_hint_header,
+    record_size,
+    split_record,
+)
+from caskdb.keydir import DICT, PAGED, SortedKeyDir, new_key_dir, segment_items
+from caskdb.locking import LOCK_FILE_SUFFIX, FileLock
+from caskdb.metrics import (
+    DELETE,
+    GET,
+    GET_MANY,
+    MERGE,
+    SET,
+    SET_MANY,
+    STARTUP,
+    Metrics,
+    StoreStats,
+)
+from caskdb.paged_keydir import INDEX_FILE_SUFFIX, PagedKeyDir
+from caskdb.scan import (
+    ScannedChunk,
+    check_format,
+    merge_chunks,
+    next_record,
+    plan_chunks,
+    scan_chunk,
+    scan_records,
+)
 
 # We use `file.seek` method to move our cursor to certain byte offset for read
 # or write operations. The method takes two parameters file.seek(offset, whence).
@@ -38,6 +201,32 @@ from caskdb.format import KeyEntry, encode_kv, decode_kv, HEADER_SIZE, decode_he
 # https://docs.python.org/3.7/tutorial/inputoutput.html#methods-of-file-objects
 DEFAULT_WHENCE: typing.Final[int] = 0
 
+# hint file of a data file is stored next to it, with this suffix
+HINT_FILE_SUFFIX: typing.Final[str] = ".hint"
+
+# maximum number of segment files kept open for reading at a time
+DEFAULT_MAX_OPEN_FILES: typing.Final[int] = 64
+
+# merge output is written to a temporary file with this suffix, and renamed once done
+MERGE_FILE_SUFFIX: typing.Final[str] = ".merge"
+
+# when a merge seals the active segment, the next one skips these many ids. The merges
+# which run before it is sealed write their output to the skipped ids, so they don't
+# have to seal it again
+MERGE_RESERVED_IDS: typing.Final[int] = 16
+
+# get_many merges two reads into one if the gap between them is at most these many
+# bytes. Reading a few extra bytes is cheaper than another syscall (and another seek
+# on a spinning disk). A merged read is capped at GET_MANY_MAX_READ bytes
+GET_MANY_MAX_GAP: typing.Final[int] = 4096
+GET_MANY_MAX_READ: typing.Final[int] = 1 << 20
+
+# positional reads don't move the file cursor, so the readers can share a file
+# without a lock. Windows doesn't have them
+HAS_PREAD: typing.Final[bool] = hasattr(os, "pread")
+
+logger: logging.Logger = logging.getLogger(__name__)
+
 
 # DiskStorage is a Log-Structured Hash Table as described in the BitCask paper. We
 # keep appending the data to a file, like a log. DiskStorage maintains an in-memory
@@ -63,9 +252,305 @@ DEFAULT_WHENCE: typing.Final[int] = 0
 #       time too
 #   - Deleted keys need to be purged from the file to reduce the file size
 #
+# A single ever growing file is hard to manage, we cannot back it up or clean it up
+# piecewise. So the data is split into segments, each identified by a file id. The
+# file ids only grow, and KeyEntry keeps the file id along with the position. When
+# the active segment is full, we seal it and start a new one. At the startup, the
+# segments are read in the order of their ids, so the latest record of a key wins.
+#
+# To reduce the startup time, we write a hint file whenever a segment is sealed (i.e.
+# rolled over or closed). A hint file contains the KeyDir entries of the last record of
+# every key in that segment, without their values. Since the segment is append only,
+# the hint file always describes a prefix of it. So at the startup, we load the KeyDir
+# from the hint file, and then scan only the tail of the segment which was written
+# after the hint.
+#
+# Merge makes sure the above order still gives us the latest records. Merge outputs
+# take the file ids right after the active segment, and the active segment is sealed
+# and moved after them. So the merged records come after every segment they were
+# merged from, but before any record written while the merge was running. If we crash
+# in the middle of a merge, the old segments are still there, and the merged segments
+# which follow them have the same records, nothing is lost.
+#
 # Read the paper for more details: https://riak.com/assets/bitcask-intro.pdf
 
 
+def prefix_end(prefix: str) -> typing.Optional[str]:
+    """
+    prefix_end returns the smallest string which is larger than every string starting
+    with the prefix, or None if there is no such string (e.g. for an empty prefix)
+    """
+    stripped: str = prefix.rstrip(chr(sys.maxunicode))
+    if not stripped:
+        return None
+    return stripped[:-1] + chr(ord(stripped[-1]) + 1)
+
+
+def write_hint_file(
+    hint_path: str, entries: typing.Iterable[tuple[str, KeyEntry]]
+) -> None:
+    """
+    write_hint_file writes the entries, given as (key, KeyEntry) pairs, to the hint
+    file. The entries are written to a temporary file first, which is then renamed to
+    hint_path
+    """
+    temp_file_name: str = hint_path + ".tmp"
+    with open(temp_file_name, "wb") as f:
+        for key, kv in entries:
+            f.write(encode_hint(kv.timestamp, key, kv.position, kv.total_size))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file_name, hint_path)
+
+
+class _MergeWriter:
+    """
+    _MergeWriter writes the merged records to the reserved file ids. The records are
+    written to temporary files, which are renamed to the segment names along with
+    their hint files once all the records are written and synced. A file is created
+    only once it has a record to hold, so a merge of dead records leaves nothing behind.
+    """
+
+    def __init__(self, store: "DiskStorage", file_ids: list[int]):
+        self.store: "DiskStorage" = store
+        self.file_ids: list[int] = file_ids
+        self.index: int = 0
+        self.sizes: dict[int, int] = {}
+        self.entries: dict[int, dict[str, KeyEntry]] = {}
+        self.file: typing.Optional[typing.BinaryIO] = None
+
+    def write(
+        self, key: str, timestamp: int, record: bytes, tombstone: bool = False
+    ) -> KeyEntry:
+        file_id: int = self.file_ids[self.index]
+        max_size: typing.Optional[int] = self.store.max_file_size
+        # move to the next reserved id when the current one is full. If we run out of
+        # the reserved ids, the last one takes the rest of the records
+        if (
+            max_size is not None
+            and self.sizes.get(file_id, 0) > 0
+            and self.sizes[file_id] + len(record) > max_size
+            and self.index + 1 < len(self.file_ids)
+        ):
+            self._seal()
+            self.index += 1
+            file_id = self.file_ids[self.index]
+        if self.file is None:
+            self.sizes[file_id] = 0
+            self.entries[file_id] = {}
+            self.file = open(self._temp_path(file_id), "wb")
+        kv: KeyEntry = KeyEntry(
+            timestamp,
+            self.sizes[file_id],
+            TOMBSTONE if tombstone else len(record),
+            file_id,
+        )
+        self.file.write(record)
+        self.sizes[file_id] += len(record)
+        self.entries[file_id][key] = kv
+        return kv
+
+    def finish(self) -> dict[int, int]:
+        # returns the sizes of the merged segments, none if no record was live
+        if self.file is not None:
+            self._seal()
+        for file_id in self.sizes:
+            write_hint_file(
+                self.store.hint_path(file_id), self.entries[file_id].items()
+            )
+            os.replace(self._temp_path(file_id), self.store.segment_path(file_id))
+        return self.sizes
+
+    def _seal(self) -> None:
+        assert self.file is not None
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+
+    def _temp_path(self, file_id: int) -> str:
+        return self.store.segment_path(file_id) + MERGE_FILE_SUFFIX
+
+
+class _ReadHandle:
+    """
+    _ReadHandle is an open segment file of _ReadPool, along with the number of reads
+    using it right now. An evicted handle is closed only once its last read is done,
+    so that a read never sees its file descriptor closed (or worse, reused for another
+    file) under it.
+    """
+
+    __slots__ = ("file", "readers", "evicted")
+
+    def __init__(self, file: typing.BinaryIO):
+        self.file: typing.BinaryIO = file
+        self.readers: int = 0
+        self.evicted: bool = False
+
+
+class _ReadPool:
+    """
+    _ReadPool keeps the segment files open for reading. Opening a file for every read
+    is expensive, but keeping all of them open could run us out of file descriptors.
+    So at most `max_open_files` are kept open, and the least recently used one is
+    closed when we need to open another.
+
+    The reads are positional (`os.pread`), which don't use the file cursor. So many
+    threads can read from the same file at the same time, and the lock is held only to
+    find the file. On the platforms without pread (Windows), the lock is held for the
+    seek and the read.
+    """
+
+    def __init__(self, path: typing.Callable[[int], str], max_open_files: int):
+        self.path: typing.Callable[[int], str] = path
+        self.max_open_files: int = max_open_files
+        self.files: collections.OrderedDict[int, _ReadHandle] = (
+            collections.OrderedDict()
+        )
+        # ids of the segments removed by a merge. Segment ids are never reused
+        self.retired: set[int] = set()
+        self.lock: threading.Lock = threading.Lock()
+
+    def read(self, file_id: int, position: int, size: int) -> bytes:
+        with self.lock:
+            handle: typing.Optional[_ReadHandle] = self.files.get(file_id)
+            if handle is None:
+                if file_id in self.retired:
+                    raise FileNotFoundError(self.path(file_id))
+                handle = _ReadHandle(open(self.path(file_id), "rb"))
+                self.files[file_id] = handle
+                if len(self.files) > self.max_open_files:
+                    _, old = self.files.popitem(last=False)
+                    self._release(old)
+            else:
+                self.files.move_to_end(file_id)
+            if not HAS_PREAD:
+                handle.file.seek(position, DEFAULT_WHENCE)
+                return handle.file.read(size)
+            handle.readers += 1
+        try:
+            return os.pread(handle.file.fileno(), size, position)
+        finally:
+            with self.lock:
+                handle.readers -= 1
+                if handle.evicted and handle.readers == 0:
+                    handle.file.close()
+
+    def evict(self, file_id: int) -> None:
+        # the segment is about to be removed. A reader which looked up its KeyEntry
+        # before the merge must not open the segment again, it gets a
+        # FileNotFoundError and looks up the KeyEntry again
+        with self.lock:
+            self.retired.add(file_id)
+            handle: typing.Optional[_ReadHandle] = self.files.pop(file_id, None)
+            if handle is not None:
+                self._release(handle)
+
+    def close(self) -> None:
+        with self.lock:
+            for handle in self.files.values():
+                self._release(handle)
+            self.files.clear()
+
+    def _release(self, handle: _ReadHandle) -> None:
+        # must be called with the lock held
+        handle.evicted = True
+        if handle.readers == 0:
+            handle.file.close()
+
+
+class WriteBatch:
+    """
+    WriteBatch collects KV pairs and writes them to the DiskStorage in one go, with
+    `commit`. When used as a context manager, the batch is committed on exit, unless
+    an exception was raised. If a key is set more than once, the last value wins.
+
+    Typical usage example:
+
+        with disk.batch() as batch:
+            batch.set("othello", "shakespeare")
+            batch["hamlet"] = "shakespeare"
+
+    Args:
+        store (DiskStorage): the store to write to
+    """
+
+    def __init__(self, store: "DiskStorage"):
+        self.store: "DiskStorage" = store
+        self.items: dict[str, str] = {}
+
+    def set(self, key: str, value: str) -> None:
+        self.items[key] = value
+
+    def commit(self) -> "concurrent.futures.Future[None]":
+        """
+        commit writes the batch to the disk. Returns a future which resolves once the
+        batch is durable
+        """
+        items: dict[str, str] = self.items
+        self.items = {}
+        return self.store.set_many(items.items())
+
+    def __setitem__(self, key: str, value: str) -> None:
+        self.set(key, value)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __enter__(self) -> "WriteBatch":
+        return self
+
+    def __exit__(self, exc_type: typing.Any, *_: typing.Any) -> None:
+        if exc_type is None:
+            self.commit()
+
+
+class _MmapPool:
+    """
+    _MmapPool memory maps the segment files for reading. A read does not need any
+    syscall, it is a slice of the mapping. Sealed segments are mapped only once. The
+    active segment keeps growing, so it is mapped again whenever a read goes past the
+    end of its current mapping. At most `max_open_files` segments are kept mapped.
+
+    We never close a mapping ourselves, since the callers may still hold memoryview
+    slices of it. A mapping is dropped from the pool, and it is unmapped once the last
+    slice of it is gone.
+    """
+
+    def __init__(self, path: typing.Callable[[int], str], max_open_files: int):
+        self.path: typing.Callable[[int], str] = path
+        self.max_open_files: int = max_open_files
+        self.maps: collections.OrderedDict[int, mmap.mmap] = collections.OrderedDict()
+        self.retired: set[int] = set()
+        self.lock: threading.Lock = threading.Lock()
+
+    def read(self, file_id: int, position: int, size: int) -> memoryview:
+        end: int = position + size
+        with self.lock:
+            m: typing.Optional[mmap.mmap] = self.maps.get(file_id)
+            if m is None or len(m) < end:
+                if file_id in self.retired:
+                    raise FileNotFoundError(self.path(file_id))
+                with open(self.path(file_id), "rb") as f:
+                    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.maps[file_id] = m
+                self.maps.move_to_end(file_id)
+                if len(self.maps) > self.max_open_files:
+                    self.maps.popitem(last=False)
+            else:
+                self.maps.move_to_end(file_id)
+        return memoryview(m)[position:end]
+
+    def evict(self, file_id: int) -> None:
+        with self.lock:
+            self.retired.add(file_id)
+            self.maps.pop(file_id, None)
+
+    def close(self) -> None:
+        with self.lock:
+            self.maps.clear()
+
+
 class DiskStorage:
     """
     Implements the KV store on the disk
@@ -73,56 +558,451 @@ class DiskStorage:
     Args:
         file_name (str): name of the file where all the data will be written. Just
             passing the file name will save the data in the current directory. You may
-            pass the full file location too.
+            pass the full file location too. The following segments are created next
+            to it as file_name.1, file_name.2 and so on.
+        sync_policy (SyncPolicy): decides when the writes are fsynced to the disk.
+            Defaults to SyncPolicy.always(), which fsyncs every write
+        max_file_size (int): size in bytes after which the active segment is sealed
+            and a new one is started. By default, there is no limit and all the data is
+            written to a single file
+        max_open_files (int): maximum number of segments kept open for reading
+        merge_threshold (float): if set, sealed segments whose dead-byte ratio crosses
+            it are merged in a background thread. It should be between 0 and 1
+        use_mmap (bool): if set, the segments are memory mapped for reading
+        key_dir_type (str): type of the KeyDir, `dict` (the default), `compact`,
+            `sorted` or `paged`. A read only store can't use the `paged` one, the
+            writer updates its files in place
+        cache (Cache): if set, the values read from the disk are cached in it
+        progress (typing.Callable[[int, int], None]): if set, it is called during the
+            startup with the bytes of the segments read so far and the total bytes
+        read_only (bool): if set, the store is opened for reading only, along with the
+            writer which may have it open in another process. Call `refresh` to see
+            the writes done after the store was opened
+        verify_checksums (bool): if set (the default), the records are verified
+            against their checksums when they are read, and at the startup. Turn it
+            off to trade the check for faster reads, when the disk is trusted
+        compressor (typing.Optional[Compressor]): if set, the values are compressed
+            with it. The values are decompressed on reads whether it is set or not
+        bloom_fp_rate (typing.Optional[float]): if set, the sealed segments get Bloom
+            filters of this false-positive rate, which answer the lookups of the
+            missing keys. It should be between 0 and 1
+        startup_workers (int): number of the processes which scan the segments at
+            the startup. By default, the startup scans them by itself. It pays off
+            when there is a lot to scan, e.g. after a crash (check the scan module)
+        metrics (typing.Optional[Metrics]): if set, the operations are timed and
+            recorded in it. Check the metrics module
+
+    Raises:
+        BlockingIOError: if another writer has the store open already
+        FormatError: if a segment was written in another record format, e.g. by an
+            older caskdb. The segments are left as they are
+        ValueError: if the compressor has a dictionary, and the store has another,
+            bloom_fp_rate is not between 0 and 1, a read only store asks for the
+            paged KeyDir, or startup_workers is not positive
 
     Attributes:
-        file_name (str): name of the file where all the data will be written. Just
-            passing the file name will save the data in the current directory. You may
-            pass the full file location too.
-        file (typing.BinaryIO): file object pointing the file_name
-        write_position (int): current cursor position in the file where the data can be
-            written
-        key_dir (dict[str, KeyEntry]): is a map of key and KeyEntry being the value.
-            KeyEntry contains the position of the byte offset in the file where the
-            value exists. key_dir map acts as in-memory index to fetch the values
-            quickly from the disk
+        file_name (str): name of the first segment file. Just passing the file name
+            will save the data in the current directory. You may pass the full file
+            location too.
+        file_id (int): id of the active segment, the one we are appending to
+        file (typing.BinaryIO): file object pointing the active segment
+        write_position (int): current cursor position in the active segment where the
+            data can be written
+        key_dir (typing.MutableMapping[str, KeyEntry]): is a map of key and KeyEntry
+            being the value. KeyEntry contains the segment and the position of the byte
+            offset in the segment where the value exists. key_dir map acts as in-memory
+            index to fetch the values quickly from the disk
+        sync_policy (SyncPolicy): decides when the writes are fsynced to the disk
+        max_file_size (typing.Optional[int]): size after which a segment is sealed
+        merge_stats (MergeStats): metrics of the merges done so far
+        cache (typing.Optional[Cache]): the value cache, if any
+        read_only (bool): whether the store is open for reading only
+        verify_checksums (bool): whether the records are verified when read
+        compressor (typing.Optional[Compressor]): compresses the values written
+        bloom_filters (typing.Optional[BloomFilters]): the Bloom filters of the
+            segments, if any, along with their stats
+        metrics (typing.Optional[Metrics]): the latencies of the operations, if the
+            store is instrumented
     """
 
-    def __init__(self, file_name: str = "data.db"):
+    def __init__(
+        self,
+        file_name: str = "data.db",
+        sync_policy: typing.Optional[SyncPolicy] = None,
+        max_file_size: typing.Optional[int] = None,
+        max_open_files: int = DEFAULT_MAX_OPEN_FILES,
+        merge_threshold: typing.Optional[float] = None,
+        use_mmap: bool = False,
+        key_dir_type: str = DICT,
+        cache: typing.Optional[Cache] = None,
+        progress: typing.Optional[typing.Callable[[int, int], None]] = None,
+        read_only: bool = False,
+        verify_checksums: bool = True,
+        compressor: typing.Optional[Compressor] = None,
+        bloom_fp_rate: typing.Optional[float] = None,
+        startup_workers: int = 1,
+        metrics: typing.Optional[Metrics] = None,
+    ):
+        if max_file_size is not None and max_file_size <= 0:
+            raise ValueError("max_file_size must be positive")
+        if max_open_files <= 0:
+            raise ValueError("max_open_files must be positive")
+        if read_only and merge_threshold is not None:
+            raise ValueError("a read only store can't merge")
+        if read_only and key_dir_type == PAGED:
+            raise ValueError("a read only store can't use the paged key dir")
+        if startup_workers <= 0:
+            raise ValueError("startup_workers must be positive")
+        self.read_only: bool = read_only
+        self.verify_checksums: bool = verify_checksums
         self.file_name: str = file_name
+        self.max_file_size: typing.Optional[int] = max_file_size
+        self.file_id: int = 0
         self.write_position: int = 0
-        self.key_dir: dict[str, KeyEntry] = {}
-        # if the file exists already, then we will load the key_dir
-        if os.path.exists(file_name):
-            self._init_key_dir()
+        self._key_dir_type: str = key_dir_type
+        self.key_dir: typing.MutableMapping[str, KeyEntry] = {}
+        self.cache: typing.Optional[Cache] = cache
+        self.compressor: typing.Optional[Compressor] = compressor
+        self.bloom_filters: typing.Optional[BloomFilters] = (
+            BloomFilters(bloom_fp_rate) if bloom_fp_rate is not None else None
+        )
+        self._progress: typing.Optional[typing.Callable[[int, int], None]] = progress
+        self._startup_workers: int = startup_workers
+        self.metrics: typing.Optional[Metrics] = metrics
+        # _active_tombstones has the tombstones written to the active segment, of the
+        # keys which are still deleted. Once the segment is sealed, they go into its
+        # hint file along with the KeyDir entries which point to the segment. The
+        # entries are in the KeyDir anyway, only the tombstones have to be kept
+        self._active_tombstones: dict[str, KeyEntry] = {}
+        # size and live bytes (bytes taken by the records KeyDir points to) of every
+        # segment. The rest of the segment is dead, and can be reclaimed by a merge
+        self._file_sizes: dict[int, int] = {}
+        self._live_bytes: dict[int, int] = {}
+        # only one process may write to the store. The lock is taken before we load
+        # the KeyDir, since the startup may truncate a torn tail of a segment
+        self._file_lock: typing.Optional[FileLock] = None
+        if not read_only:
+            self._file_lock = FileLock(file_name + LOCK_FILE_SUFFIX)
+        try:
+            # the paged KeyDir opens its files, so it is created under the lock too
+            self.key_dir = new_key_dir(key_dir_type, file_name + INDEX_FILE_SUFFIX)
+            self._decompressor: Decompressor = self._open_dictionary()
+            # if the segments exist already, then we will load the key_dir
+            file_ids: list[int] = self._list_file_ids()
+            if file_ids:
+                start: float = time.perf_counter()
+                self._init_key_dir(file_ids, self.key_dir)
+                if metrics is not None:
+                    metrics.observe(
+                        STARTUP,
+                        time.perf_counter() - start,
+                        sum(self._file_sizes.values()),
+                    )
+        except BaseException:
+            if isinstance(self.key_dir, PagedKeyDir):
+                self.key_dir.close()
+            if self._file_lock is not None:
+                self._file_lock.release()
+            raise
+        self._readers: typing.Union[_ReadPool, _MmapPool] = (
+            _MmapPool(self.segment_path, max_open_files)
+            if use_mmap
+            else _ReadPool(self.segment_path, max_open_files)
+        )
+        # writes are serialised by the write lock (of a read only store, it serialises
+        # the refreshes). The lock is not held while we wait for the fsync, so that
+        # the writers behind us can append their records and get synced together
+        # with ours
+        self._write_lock: threading.Lock = threading.Lock()
+        self._file_sizes.setdefault(self.file_id, self.write_position)
+        # only one merge runs at a time
+        self._merge_lock: threading.Lock = threading.Lock()
+        self.merge_stats: MergeStats = MergeStats()
+        self._compactor: typing.Optional[Compactor] = None
+        if metrics is not None:
+            self._instrument(metrics)
+        if read_only:
+            return
         # we open the file in `a+b` mode:
         # a - says the writes are append only. `a+` means we want append and read
         # b - says that we are operating the file in binary mode (as opposed to the
         #     default string mode)
-        self.file: typing.BinaryIO = open(file_name, "a+b")
+        self.file: typing.BinaryIO = open(self.segment_path(self.file_id), "a+b")
+        self.sync_policy: SyncPolicy = sync_policy or SyncPolicy.always()
+        self._commit: GroupCommit = GroupCommit(self.file, self.sync_policy, metrics)
+        if merge_threshold is not None:
+            self._compactor = Compactor(self, merge_threshold)
 
-    def set(self, key: str, value: str) -> None:
+    def segment_path(self, file_id: int) -> str:
+        """
+        segment_path returns the path of the segment file with the given id
+        """
+        if file_id == 0:
+            return self.file_name
+        return f"{self.file_name}.{file_id}"
+
+    def hint_path(self, file_id: int) -> str:
+        """
+        hint_path returns the path of the hint file of the given segment
+        """
+        return self.segment_path(file_id) + HINT_FILE_SUFFIX
+
+    def bloom_path(self, file_id: int) -> str:
+        """
+        bloom_path returns the path of the Bloom filter of the given segment
+        """
+        return self.segment_path(file_id) + BLOOM_FILE_SUFFIX
+
+    def file_ids(self) -> list[int]:
+        """
+        file_ids returns the ids of all the segments, the active one being the last
+        """
+        return self._list_file_ids()
+
+    def set(self, key: str, value: str) -> "concurrent.futures.Future[None]":
         """
         set stores the key and value on the disk
 
         Args:
             key (str): the key
             value (str): the value
+
+        Returns:
+            a future which resolves once the record is durable on the disk. With the
+            default sync policy, it is resolved already
+
+        Raises:
+            io.UnsupportedOperation: if the store is read only
+        """
+        return self._set(key, encode_key(key), value.encode("utf-8"))
+
+    def set_bytes(self, key: bytes, value: Buffer) -> "concurrent.futures.Future[None]":
+        """
+        set_bytes stores the key and value given as bytes. The value is written as
+        is, without any encoding. The key need not be valid UTF-8
+
+        Args:
+            key (bytes): the key
+            value (Buffer): the value, as bytes, bytearray or memoryview
+
+        Returns:
+            a future which resolves once the record is durable on the disk
+
+        Raises:
+            io.UnsupportedOperation: if the store is read only
         """
+        return self._set(decode_key(key), key, value)
+
+    def _set(
+        self, key: str, key_bytes: bytes, value: Buffer
+    ) -> "concurrent.futures.Future[None]":
+        self._check_writable()
         # The steps to save a KV to disk is simple:
         # 1. Encode the KV into bytes
-        # 2. Write the bytes to disk by appending to the file
+        # 2. Write the bytes to disk by appending to the active segment
         # 3. Update KeyDir with the KeyEntry of this key
         timestamp: int = int(time.time())
-        sz, data = encode_kv(timestamp=timestamp, key=key, value=value)
-        # notice we don't do file seek while writing
-        self._write(data)
-        kv: KeyEntry = KeyEntry(
-            timestamp=timestamp, position=self.write_position, total_size=sz
+        flags, stored = self._compress(value)
+        sz, data = encode_kv_bytes(timestamp, key_bytes, stored, flags)
+        with self._write_lock:
+            self._maybe_rollover(sz)
+            # notice we don't do file seek while writing
+            self._write(data)
+            self._file_sizes[self.file_id] += sz
+            kv: KeyEntry = KeyEntry(
+                timestamp=timestamp,
+                position=self.write_position,
+                total_size=sz,
+                file_id=self.file_id,
+            )
+            # the filter has the key before the KeyDir does, so that a reader which
+            # finds it in the KeyDir doesn't miss it in the filter
+            if self.bloom_filters is not None:
+                self.bloom_filters.active.add(key)
+            self._put(key, kv)
+            # the cache is invalidated only after the KeyDir is updated, check
+            # _fill_cache for why. A merge doesn't change the values, so it leaves
+            # the cache alone
+            if self.cache is not None:
+                self.cache.invalidate(key)
+            self._active_tombstones.pop(key, None)
+            # update last write position, so that next record can be written from
+            # this point
+            self.write_position += sz
+            ticket: int = self._commit.appended(sz)
+        # 4. Make the record durable, as per the sync policy
+        return self._commit.commit(ticket)
+
+    def set_many(
+        self, items: typing.Iterable[tuple[str, str]]
+    ) -> "concurrent.futures.Future[None]":
+        """
+        set_many stores all the KV pairs on the disk as a single batch. The batch is
+        written with one write and made durable with one fsync. A batch torn by a
+        crash is dropped at the startup, so after a restart either all the pairs are
+        there, or none of them are.
+
+        The pairs go into the KeyDir once the whole batch is written, but before it
+        is fsynced, like the record of a `set`: the readers may see them before they
+        are durable. With the dict KeyDir, they see all the pairs at once. The other
+        KeyDirs take the keys one by one, so a reader may see some of them before
+        the rest
+
+        Args:
+            items (typing.Iterable[tuple[str, str]]): the KV pairs. If a key repeats,
+                the last value wins
+
+        Returns:
+            a future which resolves once the batch is durable on the disk
+
+        Raises:
+            struct.error: if the batch is larger than 4GB
+            io.UnsupportedOperation: if the store is read only
+        """
+        return self._set_many(
+            [(key, encode_key(key), value.encode("utf-8")) for key, value in items]
         )
-        self.key_dir[key] = kv
-        # update last write position, so that next record can be written from this point
-        self.write_position += sz
+
+    def set_many_bytes(
+        self, items: typing.Iterable[tuple[bytes, Buffer]]
+    ) -> "concurrent.futures.Future[None]":
+        """
+        set_many_bytes is set_many for the KV pairs given as bytes, check set_bytes
+
+        Args:
+            items (typing.Iterable[tuple[bytes, Buffer]]): the KV pairs
+
+        Returns:
+            a future which resolves once the batch is durable on the disk
+
+        Raises:
+            struct.error: if the batch is larger than 4GB
+            io.UnsupportedOperation: if the store is read only
+        """
+        return self._set_many([(decode_key(key), key, value) for key, value in items])
+
+    def _set_many(
+        self, encoded: list[tuple[str, bytes, Buffer]]
+    ) -> "concurrent.futures.Future[None]":
+        self._check_writable()
+        if not encoded:
+            return done_future()
+        # the values are compressed before we take the lock, so that the other
+        # writers don't wait for it
+        records: list[tuple[str, bytes, int, Buffer]] = [
+            (key, key_bytes, *self._compress(value))
+            for key, key_bytes, value in encoded
+        ]
+        # we allocate the buffer for the whole batch once, and encode all the records
+        # straight into it
+        batch_size: int = sum(HEADER_SIZE + len(k) + len(v) for _, k, _, v in records)
+        buffer: bytearray = bytearray(HEADER_SIZE + batch_size)
+        timestamp: int = int(time.time())
+        buffer[:HEADER_SIZE] = encode_batch_header(timestamp, batch_size)
+        with self._write_lock:
+            self._maybe_rollover(len(buffer))
+            entries: dict[str, KeyEntry] = {}
+            offset: int = HEADER_SIZE
+            for key, key_bytes, flags, stored in records:
+                sz: int = encode_kv_into(
+                    buffer, offset, timestamp, key_bytes, stored, flags
+                )
+                entries[key] = KeyEntry(
+                    timestamp=timestamp,
+                    position=self.write_position + offset,
+                    total_size=sz,
+                    file_id=self.file_id,
+                )
+                offset += sz
+            self._write(buffer)
+            self._file_sizes[self.file_id] += len(buffer)
+            # the batch is published before it is durable, like a single record. It
+            # can't wait for the fsync: the KeyDir is updated under the write lock,
+            # in the order of the writes, and the fsync is done outside of it, so that
+            # the writers behind us get synced along with us
+            if self.bloom_filters is not None:
+                for key in entries:
+                    self.bloom_filters.active.add(key)
+            self._put_many(entries)
+            for key in entries:
+                if self.cache is not None:
+                    self.cache.invalidate(key)
+                self._active_tombstones.pop(key, None)
+            self.write_position += len(buffer)
+            ticket: int = self._commit.appended(len(buffer))
+        return self._commit.commit(ticket)
+
+    def delete(self, key: str) -> "concurrent.futures.Future[None]":
+        """
+        delete removes the key. It appends a tombstone for the key to the disk, so
+        that the key stays deleted after a restart, and drops the key from the KeyDir
+        right away. Deleting a key which does not exist does nothing
+
+        Args:
+            key (str): the key
+
+        Returns:
+            a future which resolves once the tombstone is durable on the disk
+
+        Raises:
+            io.UnsupportedOperation: if the store is read only
+        """
+        future: typing.Optional[concurrent.futures.Future[None]] = self._discard(key)
+        return done_future() if future is None else future
+
+    def discard(self, key: str) -> typing.Optional["concurrent.futures.Future[None]"]:
+        """
+        discard is delete, which also tells whether the key existed. It is decided
+        under the write lock, so of the concurrent deletes of a key, only one finds it
+
+        Args:
+            key (str): the key
+
+        Returns:
+            a future which resolves once the tombstone is durable on the disk, or None
+            if the key did not exist
+
+        Raises:
+            io.UnsupportedOperation: if the store is read only
+        """
+        return self._discard(key)
+
+    def _discard(self, key: str) -> typing.Optional["concurrent.futures.Future[None]"]:
+        self._check_writable()
+        timestamp: int = int(time.time())
+        sz, data = encode_tombstone(timestamp, key)
+        with self._write_lock:
+            old: typing.Optional[KeyEntry] = self.key_dir.get(key)
+            if old is None:
+                return None
+            self._maybe_rollover(sz)
+            self._write(data)
+            self._file_sizes[self.file_id] += sz
+            del self.key_dir[key]
+            if self.cache is not None:
+                self.cache.invalidate(key)
+            # the old record is dead now, and so is the tombstone itself. Merge drops
+            # the tombstone once no older segment may have a record of the key
+            self._live_bytes[old.file_id] -= old.total_size
+            self._maybe_trigger_merge(old.file_id)
+            self._active_tombstones[key] = KeyEntry(
+                timestamp, self.write_position, TOMBSTONE, self.file_id
+            )
+            self.write_position += sz
+            ticket: int = self._commit.appended(sz)
+        return self._commit.commit(ticket)
+
+    def delete_bytes(self, key: bytes) -> "concurrent.futures.Future[None]":
+        """
+        delete_bytes removes the key given as bytes, check delete
+        """
+        return self.delete(decode_key(key))
+
+    def batch(self) -> WriteBatch:
+        """
+        batch returns a new WriteBatch for this store
+        """
+        return WriteBatch(self)
 
     def get(self, key: str) -> str:
         """
@@ -134,23 +1014,701 @@ class DiskStorage:
 
         Returns:
             string
+
+        Raises:
+            ChecksumError: if the record read doesn't match its checksum
         """
         # How get works?
         # 1. Check if there is any KeyEntry record for the key in KeyDir
         # 2. Return an empty string if key doesn't exist
         # 3. If it exists, then read KeyEntry.total_size bytes starting from the
-        #    KeyEntry.position from the disk
+        #    KeyEntry.position from the segment KeyEntry.file_id
         # 4. Decode the bytes into valid KV pair and return the value
+        cache: typing.Optional[Cache] = self.cache
+        if cache is None:
+            return self._get(key)
+        value: typing.Optional[str] = cache.get(key)
+        if value is not None:
+            return value
         kv: typing.Optional[KeyEntry] = self.key_dir.get(key)
-        if not kv:
+        value = self._get(key)
+        if kv is not None:
+            self._fill_cache(cache, key, kv, value)
+        return value
+
+    def get_many(self, keys: typing.Sequence[str]) -> list[str]:
+        """
+        get_many retrieves the values of all the keys from the disk. The values are
+        returned in the same order as the keys, with an empty string for the keys
+        which don't exist.
+
+        Args:
+            keys (typing.Sequence[str]): the keys
+
+        Returns:
+            list of the values
+
+        Raises:
+            ChecksumError: if a record read doesn't match its checksum
+        """
+        # How get_many works?
+        # 1. Look up the KeyEntry of every key in KeyDir
+        # 2. Sort the entries by the segment and the position in it
+        # 3. Merge the entries which are close to each other into a single read
+        # 4. Do the reads, and decode every value from its slice of the read
+        cache: typing.Optional[Cache] = self.cache
+        if cache is None:
+            return self._get_many(keys)
+        # only the keys missing from the cache are read from the disk
+        cached: list[typing.Optional[str]] = [cache.get(key) for key in keys]
+        missing: list[int] = [i for i, value in enumerate(cached) if value is None]
+        entries: list[typing.Optional[KeyEntry]] = [
+            self.key_dir.get(keys[i]) for i in missing
+        ]
+        fetched: list[str] = self._get_many([keys[i] for i in missing])
+        for i, kv, value in zip(missing, entries, fetched):
+            cached[i] = value
+            if kv is not None:
+                self._fill_cache(cache, keys[i], kv, value)
+        return typing.cast(list[str], cached)
+
+    def _get_many(self, keys: typing.Sequence[str]) -> list[str]:
+        # get_many without the cache
+        return [str(value, "utf-8") for value in self._get_many_views(keys)]
+
+    def _get_many_views(self, keys: typing.Sequence[str]) -> list[memoryview]:
+        return [
+            memoryview(b"") if value is None else value
+            for value in self._find_many(keys)
+        ]
+
+    def _find_many(
+        self, keys: typing.Sequence[str]
+    ) -> list[typing.Optional[memoryview]]:
+        # _find_many reads the values of the keys, None for the missing ones
+        if isinstance(self._readers, _MmapPool):
+            # reads from a mapping don't cost a syscall, so there is nothing to save
+            # by merging them
+            return [self._find(key) for key in keys]
+        values: list[typing.Optional[memoryview]] = [None] * len(keys)
+        located: list[tuple[int, int, int, int]] = []
+        for index, key in enumerate(keys):
+            kv: typing.Optional[KeyEntry] = self._lookup(key)
+            if kv:
+                located.append((kv.file_id, kv.position, kv.total_size, index))
+        located.sort()
+        start: int = 0
+        while start < len(located):
+            file_id, read_from, size, _ = located[start]
+            read_to: int = read_from + size
+            end: int = start + 1
+            while end < len(located):
+                next_file_id, position, size, _ = located[end]
+                if (
+                    next_file_id != file_id
+                    or position - read_to > GET_MANY_MAX_GAP
+                    or position + size - read_from > GET_MANY_MAX_READ
+                ):
+                    break
+                read_to = max(read_to, position + size)
+                end += 1
+            try:
+                data: memoryview = memoryview(
+                    self._readers.read(file_id, read_from, read_to - read_from)
+                )
+            except FileNotFoundError:
+                # the segment was merged away, fall back to reading them one by one
+                for _, _, _, index in located[start:end]:
+                    values[index] = self._find(keys[index])
+            else:
+                for _, position, size, index in located[start:end]:
+                    offset: int = position - read_from
+                    values[index] = self._value(data[offset : offset + size])
+            start = end
+        return values
+
+    def scan(
+        self,
+        start: typing.Optional[str] = None,
+        end: typing.Optional[str] = None,
+        reverse: bool = False,
+    ) -> typing.Iterator[tuple[str, str]]:
+        """
+        scan returns the KV pairs whose keys are from start (inclusive) till end
+        (exclusive), in the order of the keys. The values are read from the disk only
+        as the pairs are consumed, so scanning a few keys off a large range is cheap.
+
+        Args:
+            start (str): the smallest key to return. Defaults to the first key
+            end (str): the key to stop before. Defaults to after the last key
+            reverse (bool): if set, the pairs are returned from the largest key
+
+        Returns:
+            iterator of (key, value) tuples
+        """
+        key_dir: typing.MutableMapping[str, KeyEntry] = self.key_dir
+        for key in self.keys(start, end, reverse):
+            # skip the keys deleted since we listed them
+            if key in key_dir:
+                yield key, self.get(key)
+
+    def keys(
+        self,
+        start: typing.Optional[str] = None,
+        end: typing.Optional[str] = None,
+        reverse: bool = False,
+    ) -> typing.Iterable[str]:
+        """
+        keys returns the keys from start (inclusive) till end (exclusive), in order,
+        like `scan` but without the values. A key deleted while the keys are iterated
+        over may still be returned
+
+        Args:
+            start (str): the smallest key to return. Defaults to the first key
+            end (str): the key to stop before. Defaults to after the last key
+            reverse (bool): if set, the keys are returned from the largest one
+
+        Returns:
+            iterable of the keys
+        """
+        key_dir: typing.MutableMapping[str, KeyEntry] = self.key_dir
+        if isinstance(key_dir, SortedKeyDir):
+            return key_dir.irange(start, end, reverse)
+        # the unordered KeyDirs have to sort all the keys first. We make a copy, since
+        # the writers may modify the KeyDir while we iterate
+        return sorted(
+            (
+                key
+                for key in list(key_dir)
+                if (start is None or key >= start) and (end is None or key < end)
+            ),
+            reverse=reverse,
+        )
+
+    def prefix(
+        self, prefix: str, reverse: bool = False
+    ) -> typing.Iterator[tuple[str, str]]:
+        """
+        prefix returns the KV pairs whose keys start with the prefix, in the order of
+        the keys. Like `scan`, the values are read lazily
+
+        Args:
+            prefix (str): the prefix
+            reverse (bool): if set, the pairs are returned from the largest key
+
+        Returns:
+            iterator of (key, value) tuples
+        """
+        return self.scan(prefix, prefix_end(prefix), reverse)
+
+    def get_view(self, key: str) -> memoryview:
+        """
+        get_view retrieves the value from the disk as a memoryview. With `use_mmap`,
+        it is a slice of the memory mapped segment and no bytes are copied. If the key
+        does not exist then it returns an empty memoryview
+
+        Args:
+            key (str): the key
+
+        Returns:
+            memoryview of the value bytes. A compressed value is decompressed, so it
+            is a view of the decompressed bytes instead
+
+        Raises:
+            ChecksumError: if the record read doesn't match its checksum
+        """
+        return self._view(key)
+
+    def get_bytes(self, key: bytes) -> memoryview:
+        """
+        get_bytes retrieves the value of the key given as bytes. The value is not
+        decoded or copied, it is a memoryview slice of the bytes read from the disk
+        (or of the mapping, with `use_mmap`). If the key does not exist then it
+        returns an empty memoryview. The value cache is not used
+
+        Args:
+            key (bytes): the key
+
+        Returns:
+            memoryview of the value bytes
+
+        Raises:
+            ChecksumError: if the record read doesn't match its checksum
+        """
+        return self._view(decode_key(key))
+
+    def get_many_bytes(self, keys: typing.Sequence[bytes]) -> list[memoryview]:
+        """
+        get_many_bytes is get_many for the keys given as bytes. Like get_bytes, the
+        values are memoryview slices of the reads, and the value cache is not used
+
+        Args:
+            keys (typing.Sequence[bytes]): the keys
+
+        Returns:
+            list of the values, an empty memoryview for the keys which don't exist
+
+        Raises:
+            ChecksumError: if a record read doesn't match its checksum
+        """
+        return self._get_many_views([decode_key(key) for key in keys])
+
+    def lookup_bytes(self, key: bytes) -> typing.Optional[memoryview]:
+        """
+        lookup_bytes is get_bytes which tells a missing key apart from an empty value:
+        it returns None if the key does not exist. The key is looked up once, so the
+        answer can't be torn by a delete in between
+
+        Args:
+            key (bytes): the key
+
+        Returns:
+            memoryview of the value bytes, or None
+
+        Raises:
+            ChecksumError: if the record read doesn't match its checksum
+        """
+        return self._find(decode_key(key))
+
+    def lookup_many_bytes(
+        self, keys: typing.Sequence[bytes]
+    ) -> list[typing.Optional[memoryview]]:
+        """
+        lookup_many_bytes is get_many_bytes with None for the keys which don't exist,
+        check lookup_bytes
+
+        Args:
+            keys (typing.Sequence[bytes]): the keys
+
+        Returns:
+            list of the values, None for the keys which don't exist
+
+        Raises:
+            ChecksumError: if a record read doesn't match its checksum
+        """
+        return self._find_many([decode_key(key) for key in keys])
+
+    def _find(self, key: str) -> typing.Optional[memoryview]:
+        # lookup_bytes without the metrics
+        data: typing.Union[bytes, memoryview, None] = self._read(key)
+        if data is None:
+            return None
+        return self._value(data)
+
+    def _view(self, key: str) -> memoryview:
+        # get_view without the metrics
+        data: typing.Union[bytes, memoryview, None] = self._read(key)
+        if data is None:
+            return memoryview(b"")
+        return self._value(data)
+
+    def _get(self, key: str) -> str:
+        # get without the cache
+        data: typing.Union[bytes, memoryview, None] = self._read(key)
+        if data is None:
             return ""
-        #  move the current pointer to the right offset
-        self.file.seek(kv.position, DEFAULT_WHENCE)
-        data: bytes = self.file.read(kv.total_size)
-        _, _, value = decode_kv(data)
+        return str(self._value(data), "utf-8")
+
+    def _value(self, data: typing.Union[bytes, memoryview]) -> memoryview:
+        # _value returns the value of the encoded record, decompressed if it was
+        # compressed
+        _, flags, _, value = split_record(data, self.verify_checksums)
+        if flags:
+            return memoryview(self._decompressor.decompress(flags, value))
         return value
 
-    def _write(self, data: bytes) -> None:
+    def _compress(self, value: Buffer) -> tuple[int, Buffer]:
+        if self.compressor is None:
+            return 0, value
+        return self.compressor.compress(value)
+
+    def _open_dictionary(self) -> Decompressor:
+        # the dictionary of the store is saved along with the first compressor
+        # which has one. The records compressed with it need it to be read, so it
+        # can't be replaced
+        path: str = self.file_name + DICTIONARY_FILE_SUFFIX
+        dictionary: typing.Optional[bytes] = load_dictionary(path)
+        compressor: typing.Optional[Compressor] = self.compressor
+        if compressor is not None and compressor.dictionary is not None:
+            if dictionary is None:
+                dictionary = compressor.dictionary
+                if not self.read_only:
+                    save_dictionary(path, dictionary)
+            elif dictionary != compressor.dictionary:
+                raise ValueError("the store has another compression dictionary")
+        return Decompressor(dictionary)
+
+    def _fill_cache(self, cache: Cache, key: str, kv: KeyEntry, value: str) -> None:
+        # the value was read from the record kv points to. A set may have replaced
+        # that record meanwhile, and invalidated the cache before we put the old value
+        # in it. Since a set updates the KeyDir before it invalidates the cache,
+        # checking the KeyDir after the put catches that
+        cache.put(key, value)
+        if self.key_dir.get(key) != kv:
+            cache.invalidate(key)
+
+    def _read(self, key: str) -> typing.Union[bytes, memoryview, None]:
+        # _read returns the encoded record of the key, or None if there is no such key
+        kv: typing.Optional[KeyEntry] = self._lookup(key)
+        if not kv:
+            return None
+        # we don't read from the append handle, every segment has its own read handle
+        # (or a mapping)
+        while True:
+            try:
+                return self._readers.read(kv.file_id, kv.position, kv.total_size)
+            except FileNotFoundError:
+                # the segment was merged and deleted after we looked up the KeyEntry.
+                # The KeyDir points to the merged segment by now (or to an even newer
+                # one, if another merge ran meanwhile)
+                latest: typing.Optional[KeyEntry] = self.key_dir.get(key)
+                if not latest:
+                    return None
+                if latest == kv:
+                    raise
+                kv = latest
+
+    def _lookup(self, key: str) -> typing.Optional[KeyEntry]:
+        # _lookup returns the KeyEntry of the key. With the Bloom filters, a key which
+        # none of the segments may have, the active one included, is not looked up in
+        # the KeyDir at all
+        filters: typing.Optional[BloomFilters] = self.bloom_filters
+        if filters is None:
+            return self.key_dir.get(key)
+        if not filters.might_contain(key):
+            return None
+        kv: typing.Optional[KeyEntry] = self.key_dir.get(key)
+        if kv is None:
+            filters.stats.false_positives += 1
+        return kv
+
+    def merge(self, file_ids: typing.Optional[list[int]] = None) -> int:
+        """
+        merge rewrites the live records of the given segments into new segments, and
+        deletes the old ones. If no segments are given, all of them are merged,
+        including the active one. The writers are blocked only while the active segment
+        is sealed and while the KeyDir entries are swapped, the records are copied
+        without holding any lock.
+
+        Args:
+            file_ids (list[int]): ids of the segments to merge
+
+        Returns:
+            number of bytes reclaimed
+
+        Raises:
+            io.UnsupportedOperation: if the store is read only
+        """
+        self._check_writable()
+        with self._merge_lock:
+            start: float = time.perf_counter()
+            with self._write_lock:
+                active: int = self.file_id
+                if file_ids is None:
+                    inputs: list[int] = sorted(self._file_sizes)
+                else:
+                    inputs = sorted(set(file_ids) & set(self._file_sizes))
+                if not inputs:
+                    return 0
+                # the merged records have to come after every sealed segment, and
+                # before every record written from now on. We reserve a file id for
+                # every input, the merged records can't take more space than the
+                # inputs. If the active segment is not merged, the output takes the
+                # ids which are free right below it, and it is not sealed
+                last_sealed: int = max(
+                    (i for i in self._file_sizes if i != active), default=-1
+                )
+                output_ids: list[int] = list(
+                    range(last_sealed + 1, min(last_sealed + 1 + len(inputs), active))
+                )
+                if active in inputs or not output_ids:
+                    # an empty active segment would be left behind after sealing it
+                    if self.write_position == 0 and active not in inputs:
+                        inputs.append(active)
+                    output_ids = list(range(active + 1, active + len(inputs) + 1))
+                    self._rollover(next_file_id=output_ids[-1] + 1 + MERGE_RESERVED_IDS)
+                # a tombstone has to be kept as long as an older segment may have a
+                # record of its key. The segments which are not merged survive
+                survivors: list[int] = [i for i in self._file_sizes if i not in inputs]
+                oldest_survivor: typing.Optional[int] = min(survivors, default=None)
+
+            writer: _MergeWriter = _MergeWriter(self, output_ids)
+            swaps: list[tuple[str, KeyEntry, KeyEntry]] = []
+            for file_id in inputs:
+                keep_tombstones: bool = (
+                    oldest_survivor is not None and oldest_survivor < file_id
+                )
+                self._merge_segment(file_id, writer, swaps, keep_tombstones)
+            output_sizes: dict[int, int] = writer.finish()
+            # the filters of the merged segments go in before the KeyDir points to
+            # them
+            if self.bloom_filters is not None:
+                for file_id, size in output_sizes.items():
+                    self.bloom_filters.add(
+                        file_id,
+                        self._segment_filter(file_id, size, writer.entries[file_id]),
+                    )
+
+            with self._write_lock:
+                for key, old, new in swaps:
+                    current: typing.Optional[KeyEntry] = self.key_dir.get(key)
+                    # if the key was overwritten while we were merging, then the merged
+                    # record is a stale one
+                    if (
+                        current is not None
+                        and current.file_id == old.file_id
+                        and current.position == old.position
+                    ):
+                        self._put(key, new)
+                for file_id, size in output_sizes.items():
+                    self._file_sizes[file_id] = size
+                    self._live_bytes.setdefault(file_id, 0)
+                reclaimed: int = -sum(output_sizes.values())
+                for file_id in inputs:
+                    reclaimed += self._file_sizes.pop(file_id, 0)
+                    self._live_bytes.pop(file_id, None)
+                if self.bloom_filters is not None:
+                    self.bloom_filters.remove(inputs)
+
+            for file_id in inputs:
+                self._readers.evict(file_id)
+                os.remove(self.segment_path(file_id))
+                for path in (self.hint_path(file_id), self.bloom_path(file_id)):
+                    if os.path.exists(path):
+                        os.remove(path)
+            duration: float = time.perf_counter() - start
+            self.merge_stats.record(reclaimed, duration)
+            if self.metrics is not None:
+                self.metrics.observe(MERGE, duration, reclaimed)
+            return reclaimed
+
+    def merge_candidates(self, threshold: float) -> list[int]:
+        """
+        merge_candidates returns the ids of the sealed segments whose dead-byte ratio
+        is at least the threshold
+        """
+        return [
+            file_id
+            for file_id, ratio in self.dead_byte_ratios().items()
+            if file_id != self.file_id and ratio >= threshold
+        ]
+
+    def dead_byte_ratios(self) -> dict[int, float]:
+        """
+        dead_byte_ratios returns the fraction of every segment taken by stale records,
+        which a merge would reclaim. An empty sealed segment is all dead, since a merge
+        reclaims its files
+        """
+        with self._write_lock:
+            return {
+                file_id: (
+                    (size - self._live_bytes.get(file_id, 0)) / size if size else 1.0
+                )
+                for file_id, size in self._file_sizes.items()
+                if size > 0 or file_id != self.file_id
+            }
+
+    def stats(self) -> StoreStats:
+        """
+        stats returns a snapshot of the state of the store, along with the latencies
+        of its operations if it is instrumented. It is cheap enough to be polled
+        """
+        with self._write_lock:
+            file_size: int = sum(self._file_sizes.values())
+            live_bytes: int = sum(self._live_bytes.values())
+            segments: int = len(self._file_sizes)
+        return StoreStats(
+            live_keys=len(self.key_dir),
+            segments=segments,
+            file_size=file_size,
+            dead_bytes=file_size - live_bytes,
+            bytes_written=0 if self.read_only else self._commit.written,
+            syncs=0 if self.read_only else self._commit.sync_count,
+            merges=self.merge_stats.merges,
+            bytes_reclaimed=self.merge_stats.bytes_reclaimed,
+            cache_hit_rate=(
+                self.cache.stats.hit_rate if self.cache is not None else None
+            ),
+            bloom_false_positive_rate=(
+                self.bloom_filters.stats.false_positive_rate
+                if self.bloom_filters is not None
+                else None
+            ),
+            operations=self.metrics.histograms() if self.metrics is not None else {},
+        )
+
+    def _instrument(self, metrics: Metrics) -> None:
+        # the public methods are replaced on the instance by their timed versions,
+        # so an uninstrumented store keeps the plain methods, and pays nothing. The
+        # wrapped methods call each other only through the private ones (e.g.
+        # get_bytes calls _view, not get_view), so every call is observed once.
+        # delete_bytes is left alone, it goes through delete
+        def total_size(values: list[typing.Any]) -> int:
+            return sum(len(value) for value in values if value is not None)
+
+        def value_size(value: typing.Any) -> int:
+            return 0 if value is None else len(value)
+
+        methods: list[tuple[str, str, typing.Optional[typing.Callable[..., int]]]] = [
+            ("get", GET, len),
+            ("get_view", GET, len),
+            ("get_bytes", GET, len),
+            ("lookup_bytes", GET, value_size),
+            ("get_many", GET_MANY, total_size),
+            ("get_many_bytes", GET_MANY, total_size),
+            ("lookup_many_bytes", GET_MANY, total_size),
+            ("set", SET, None),
+            ("set_bytes", SET, None),
+            ("set_many", SET_MANY, None),
+            ("set_many_bytes", SET_MANY, None),
+            ("delete", DELETE, None),
+            ("discard", DELETE, None),
+        ]
+        for name, operation, size in methods:
+            setattr(self, name, metrics.timed(operation, getattr(self, name), size))
+
+    def sync(self) -> None:
+        """
+        sync makes all the writes done so far durable, irrespective of the sync policy
+        """
+        self._check_writable()
+        self._commit.sync()
+
+    def refresh(self) -> int:
+        """
+        refresh brings the KeyDir of a read only store up to date with the writer. The
+        records appended since the last refresh are read from where it stopped, so a
+        refresh costs only as much as the new records. If the writer has merged some
+        segments since, the KeyDir is loaded again from the segments, mostly from
+        their hint files. A writable store is always up to date, and it does nothing.
+
+        Returns:
+            number of the records read
+        """
+        if not self.read_only:
+            return 0
+        with self._write_lock:
+            while True:
+                try:
+                    return self._refresh()
+                except FileNotFoundError:
+                    # the writer removed a segment while we were reading it, the
+                    # next attempt sees what the merge left behind
+                    continue
+
+    def _check_writable(self) -> None:
+        if self.read_only:
+            raise io.UnsupportedOperation("the store is open read only")
+
+    def _refresh(self) -> int:
+        file_ids: list[int] = self._list_file_ids()
+        # the segments only ever get new records appended, or new segments are
+        # started after them. Anything else is the work of a merge
+        if any(i not in file_ids for i in self._file_sizes) or any(
+            i < self.file_id and i not in self._file_sizes for i in file_ids
+        ):
+            return self._reload(file_ids)
+        count: int = 0
+        for file_id in file_ids:
+            if file_id < self.file_id:
+                continue
+            # only the new records are applied, the older ones are in the KeyDir
+            # already
+            new: dict[str, KeyEntry] = {}
+            if file_id > self.file_id:
+                # the writer has sealed the segment we were reading. Its records are
+                # all in the KeyDir by now, since it came before this one
+                if self.bloom_filters is not None:
+                    self.bloom_filters.seal(
+                        self.file_id,
+                        self._segment_filter(
+                            self.file_id, self.write_position, load=True
+                        ),
+                    )
+                self.file_id = file_id
+                self.write_position = self._load_hint_file(file_id, new)
+            self.write_position = self._scan_segment(
+                file_id, self.write_position, new, 0, 0
+            )
+            if self.bloom_filters is not None:
+                for key, kv in new.items():
+                    if kv.total_size != TOMBSTONE:
+                        self.bloom_filters.active.add(key)
+            self._apply_entries(self.key_dir, new)
+            if self.cache is not None:
+                for key in new:
+                    self.cache.invalidate(key)
+            self._file_sizes[file_id] = self.write_position
+            count += len(new)
+        return count
+
+    def _reload(self, file_ids: list[int]) -> int:
+        # the new KeyDir is built on the side, the readers keep using the old one
+        # till it is ready
+        key_dir: typing.MutableMapping[str, KeyEntry] = new_key_dir(self._key_dir_type)
+        retired: list[int] = [i for i in self._file_sizes if i not in file_ids]
+        self._file_sizes = {}
+        self._live_bytes = {}
+        self._init_key_dir(file_ids, key_dir)
+        self.key_dir = key_dir
+        for file_id in retired:
+            self._readers.evict(file_id)
+        if self.cache is not None:
+            self.cache.clear()
+        return len(key_dir)
+
+    def _apply_entries(
+        self,
+        key_dir: typing.MutableMapping[str, KeyEntry],
+        entries: dict[str, KeyEntry],
+    ) -> None:
+        # entries has the last record of every key in a segment, so the KeyDir is
+        # updated once per segment rather than once per record. The keys whose last
+        # record is a tombstone are dropped from it
+        live: dict[str, KeyEntry] = {}
+        for key, kv in entries.items():
+            if kv.total_size == TOMBSTONE:
+                key_dir.pop(key, None)
+            else:
+                live[key] = kv
+        key_dir.update(live)
+
+    def _put(self, key: str, kv: KeyEntry) -> None:
+        # _put updates the KeyDir and the live bytes of the segments. The segment
+        # of the old record gets some dead bytes, which may make it worth merging
+        old: typing.Optional[KeyEntry] = self.key_dir.get(key)
+        self.key_dir[key] = kv
+        self._live_bytes[kv.file_id] = (
+            self._live_bytes.get(kv.file_id, 0) + kv.total_size
+        )
+        if old is None:
+            return
+        self._live_bytes[old.file_id] -= old.total_size
+        self._maybe_trigger_merge(old.file_id)
+
+    def _maybe_trigger_merge(self, file_id: int) -> None:
+        # wakes up the compactor if the segment got too many dead bytes
+        if self._compactor is not None and file_id != self.file_id:
+            size: int = self._file_sizes[file_id]
+            dead: int = size - self._live_bytes[file_id]
+            if dead >= size * self._compactor.threshold:
+                self._compactor.trigger()
+
+    def _put_many(self, entries: dict[str, KeyEntry]) -> None:
+        # _put_many updates the KeyDir with all the entries at once. The dict KeyDir
+        # is updated with a single `dict.update`, so that no reader sees only some of
+        # them (the compact KeyDir updates the keys one by one)
+        old: list[typing.Optional[KeyEntry]] = [self.key_dir.get(k) for k in entries]
+        self.key_dir.update(entries)
+        for kv in old:
+            if kv is not None:
+                self._live_bytes[kv.file_id] -= kv.total_size
+        for kv in entries.values():
+            self._live_bytes[kv.file_id] = (
+                self._live_bytes.get(kv.file_id, 0) + kv.total_size
+            )
+
+    def _write(self, data: typing.Union[bytes, bytearray]) -> None:
         # saving stuff to a file reliably is hard!
         # if you would like to explore and learn more, then
         # start from here: https://danluu.com/file-consistency/
@@ -160,46 +1718,530 @@ class DiskStorage:
         # runtime buffer to the os buffer
         # read more about here: https://docs.python.org/3/library/os.html#os.fsync
         self.file.flush()
-        # calling fsync after every write is important, this assures that our writes
-        # are actually persisted to the disk
-        os.fsync(self.file.fileno())
+        # calling fsync is important, this assures that our writes are actually
+        # persisted to the disk. We leave it to GroupCommit, which calls fsync as per
+        # the sync policy and makes one fsync cover many writes
+
+    def _maybe_rollover(self, size: int) -> None:
+        # must be called with the write lock held. We seal the active segment if the
+        # next record does not fit in it. An empty segment is never sealed, so a
+        # record larger than max_file_size gets a segment of its own
+        if self.max_file_size is None or self.write_position == 0:
+            return
+        if self.write_position + size <= self.max_file_size:
+            return
+        self._rollover()
 
-    def _init_key_dir(self) -> None:
-        # we will initialise the key_dir by reading the contents of the file, record by
-        # record. As we read each record, we will also update our KeyDir with the
-        # corresponding KeyEntry
+    def _rollover(self, next_file_id: typing.Optional[int] = None) -> None:
+        # sealing a segment: make it durable, write its hint file and start a new one.
+        # Merge passes the next file id, since it reserves a few ids for its output
+        old_file: typing.BinaryIO = self.file
+        old_file_id: int = self.file_id
+        old_file.flush()
+        self.file_id = next_file_id if next_file_id is not None else old_file_id + 1
+        self.file = open(self.segment_path(self.file_id), "a+b")
+        self._commit.set_file(self.file)
+        old_file.close()
+        self._write_hint_file(old_file_id, self.write_position)
+        if self.bloom_filters is not None:
+            self.bloom_filters.seal(
+                old_file_id, self._segment_filter(old_file_id, self.write_position)
+            )
+        self._active_tombstones = {}
+        self._file_sizes[self.file_id] = 0
+        self.write_position = 0
+
+    def _merge_segment(
+        self,
+        file_id: int,
+        writer: "_MergeWriter",
+        swaps: list[tuple[str, KeyEntry, KeyEntry]],
+        keep_tombstones: bool,
+    ) -> None:
+        # copy the records of the segment which the KeyDir still points to. The
+        # records are copied as is, so they keep their original timestamps.
         #
-        # NOTE: this method is a blocking one, if the DB size is yuge then it will take
-        # a lot of time to startup
-        print("****----------initialising the database----------****")
-        with open(self.file_name, "rb") as f:
+        # The tombstones of the keys which are still deleted are copied only if
+        # keep_tombstones is set, i.e. if an older segment survives this merge. If the
+        # key was set again after the tombstone, the tombstone is stale. Any set after
+        # this point goes to a segment after the merge output, so the copied tombstone
+        # can't hide it.
+        position: int = 0
+        with open(self.segment_path(file_id), "rb") as f:
             while header_bytes := f.read(HEADER_SIZE):
                 timestamp, key_size, value_size = decode_header(data=header_bytes)
-                key_bytes = f.read(key_size)
-                value_bytes = f.read(value_size)
-                key = key_bytes.decode("utf-8")
-                value = value_bytes.decode("utf-8")
-                total_size = HEADER_SIZE + key_size + value_size
-                kv = KeyEntry(
-                    timestamp=timestamp,
-                    position=self.write_position,
-                    total_size=total_size,
+                if key_size == BATCH_MARKER:
+                    # merged records are no longer part of any batch
+                    position += HEADER_SIZE
+                    continue
+                key_bytes: bytes = f.read(key_size)
+                total_size: int = record_size(key_size, value_size)
+                key: str = decode_key(key_bytes)
+                kv: typing.Optional[KeyEntry] = self.key_dir.get(key)
+                if value_size == TOMBSTONE:
+                    if keep_tombstones and kv is None:
+                        writer.write(key, timestamp, header_bytes + key_bytes, True)
+                elif kv is None or kv.file_id != file_id or kv.position != position:
+                    f.seek(value_size, 1)
+                else:
+                    record: bytes = header_bytes + key_bytes + f.read(value_size)
+                    swaps.append((key, kv, writer.write(key, kv.timestamp, record)))
+                position += total_size
+
+    def _list_file_ids(self) -> list[int]:
+        directory: str = os.path.dirname(self.file_name) or "."
+        base: str = os.path.basename(self.file_name)
+        pattern: re.Pattern[str] = re.compile(re.escape(base) + r"(?:\.(\d+))?")
+        file_ids: list[int] = []
+        for name in os.listdir(directory):
+            match: typing.Optional[re.Match[str]] = pattern.fullmatch(name)
+            if match:
+                file_ids.append(int(match.group(1) or 0))
+        return sorted(file_ids)
+
+    def _init_key_dir(
+        self, file_ids: list[int], key_dir: typing.MutableMapping[str, KeyEntry]
+    ) -> None:
+        # we will initialise the key_dir by reading the contents of the segments, in
+        # the order of their ids, record by record. As we read each record, we will
+        # also update our KeyDir with the corresponding KeyEntry
+        #
+        # NOTE: this method is a blocking one, if the DB size is yuge then it will take
+        # a lot of time to startup. The hint files help here, we load whatever we can
+        # from them, and read only the remaining records from the segments
+        logger.info("initialising the database from %d segments", len(file_ids))
+        if isinstance(key_dir, PagedKeyDir) and key_dir.meta is not None:
+            if self._resume_index(file_ids, key_dir):
+                return
+            # the segments have changed since the index was saved, or the active
+            # one has a torn record to truncate. Either way, we start over
+            key_dir.clear()
+        # a segment of another format would look torn to the scan, and be truncated
+        for file_id in file_ids:
+            check_format(self.segment_path(file_id))
+        sizes: list[int] = [os.path.getsize(self.segment_path(i)) for i in file_ids]
+        total: int = sum(sizes)
+        done: int = 0
+        for file_id, size, end in zip(
+            file_ids, sizes, self._scan_segments(file_ids, sizes, key_dir)
+        ):
+            self.file_id = file_id
+            if end < size:
+                end = self._skip_bad_records(
+                    file_id, end, size, key_dir, file_id == file_ids[-1]
+                )
+            self.write_position = end
+            self._file_sizes[file_id] = self.write_position
+            done += size
+            if self._progress is not None:
+                self._progress(done, total)
+        tombstones: dict[str, KeyEntry] = self._drop_tombstones(key_dir)
+        # the segments before the last one are sealed, they get Bloom filters. The
+        # ones which were not saved are built from the KeyDir, now that it is complete
+        filters: dict[int, BloomFilter] = {}
+        if self.bloom_filters is not None:
+            for file_id in file_ids[:-1]:
+                filters[file_id] = self._segment_filter(
+                    file_id, self._file_sizes[file_id], load=True, key_dir=key_dir
                 )
-                self.key_dir[key] = kv
-                self.write_position += total_size
-                print(f"loaded k={key}, v={value}")
-        print("****----------initialisation complete----------****")
+        self._activate(
+            tombstones,
+            (key for key, _ in segment_items(key_dir, self.file_id)),
+            filters,
+        )
+        logger.info("initialised the database with %d keys", len(key_dir))
+
+    def _skip_bad_records(
+        self,
+        file_id: int,
+        position: int,
+        size: int,
+        key_dir: typing.MutableMapping[str, KeyEntry],
+        last: bool,
+    ) -> int:
+        # the scan of the segment stopped at a bad record at the position. A crash
+        # tears at most the records being written, which are at the end of the active
+        # segment: nothing valid follows them. Such a tail is truncated, so that we
+        # don't append after it. A read only store leaves it alone, the writer may
+        # still be writing it.
+        #
+        # Any other bad record is not a crash, the bytes rotted. The records after it
+        # are still good, so the scan resumes at the next valid record, and the bad
+        # bytes are left in place for a merge to drop. Returns the end of the segment
+        path: str = self.segment_path(file_id)
+        while position < size:
+            found: int = next_record(path, position)
+            if found < 0:
+                if not last:
+                    logger.error(
+                        "segment %d has corrupt bytes from %d on, skipping them",
+                        file_id,
+                        position,
+                    )
+                    return size
+                if not self.read_only:
+                    logger.warning(
+                        "segment %d has an incomplete record at %d, truncating it",
+                        file_id,
+                        position,
+                    )
+                    os.truncate(path, position)
+                return position
+            logger.error(
+                "segment %d has corrupt bytes from %d to %d, skipping them",
+                file_id,
+                position,
+                found,
+            )
+            position = self._scan_segment(file_id, found, key_dir, 0, 0)
+        return position
+
+    def _drop_tombstones(
+        self, key_dir: typing.MutableMapping[str, KeyEntry]
+    ) -> dict[str, KeyEntry]:
+        # the scan puts the tombstones in the KeyDir like any other record, so that a
+        # tombstone hides the records of its key in the older segments, and is hidden
+        # by the newer ones. Once all the segments are read, the keys whose last
+        # record is a tombstone are dropped, and the live bytes of the segments are
+        # counted. The tombstones of the active segment are returned, they go into
+        # its hint file once it is sealed
+        count: int = 0
+        for kv in key_dir.values():
+            if kv.total_size == TOMBSTONE:
+                count += 1
+            else:
+                self._live_bytes[kv.file_id] = (
+                    self._live_bytes.get(kv.file_id, 0) + kv.total_size
+                )
+        if not count:
+            return {}
+        dead: list[tuple[str, KeyEntry]] = [
+            (key, kv) for key, kv in key_dir.items() if kv.total_size == TOMBSTONE
+        ]
+        for key, _ in dead:
+            del key_dir[key]
+        return {key: kv for key, kv in dead if kv.file_id == self.file_id}
+
+    def _scan_segments(
+        self,
+        file_ids: list[int],
+        sizes: list[int],
+        key_dir: typing.MutableMapping[str, KeyEntry],
+    ) -> typing.Iterator[int]:
+        # _scan_segments reads the segments in order, from their hint files and the
+        # records after them, straight into the KeyDir. It yields the end of the
+        # last good record of every segment, once the segment is read
+        if self._startup_workers > 1:
+            yield from self._scan_segments_parallel(file_ids, sizes, key_dir)
+            return
+        total: int = sum(sizes)
+        done: int = 0
+        for file_id, size in zip(file_ids, sizes):
+            hinted_end: int = self._load_hint_file(file_id, key_dir)
+            yield self._scan_segment(file_id, hinted_end, key_dir, done, total)
+            done += size
+
+    def _scan_segments_parallel(
+        self,
+        file_ids: list[int],
+        sizes: list[int],
+        key_dir: typing.MutableMapping[str, KeyEntry],
+    ) -> typing.Iterator[int]:
+        # the parallel version of _scan_segments. The parts of the segments after
+        # their hint files are split into chunks, which the worker processes scan. A
+        # segment is applied as soon as its chunks, and those of the segments before
+        # it, are done: its hint file first, and then its chunks. So the workers keep
+        # scanning the next segments while we apply one.
+        #
+        # A part which fits in a single chunk is not worth sending to a worker, it is
+        # scanned here. So the pool is started only if there is enough to scan
+        workers: int = self._startup_workers
+        total: int = sum(sizes)
+        pool: typing.Optional[concurrent.futures.ProcessPoolExecutor] = None
+        pending: collections.deque[
+            tuple[int, int, int, list[concurrent.futures.Future[ScannedChunk]]]
+        ] = collections.deque()
+
+        def finish() -> int:
+            file_id, done, start, futures = pending.popleft()
+            self._load_hint_file(file_id, key_dir)
+            if not futures:
+                return self._scan_segment(file_id, start, key_dir, done, total)
+            report = self._progress
+
+            def progress(position: int) -> None:
+                assert report is not None
+                report(done + position, total)
+
+            return merge_chunks(
+                self.segment_path(file_id),
+                file_id,
+                start,
+                (future.result() for future in futures),
+                key_dir,
+                self.verify_checksums,
+                progress if report is not None and total else None,
+            )
+
+        try:
+            done: int = 0
+            for file_id, size in zip(file_ids, sizes):
+                # only the end of the hint file is needed to plan the chunks, its
+                # entries are applied in finish
+                start: int = self._load_hint_file(file_id)
+                chunks: list[tuple[int, int]] = plan_chunks(start, size, workers)
+                futures: list[concurrent.futures.Future[ScannedChunk]] = []
+                if len(chunks) > 1:
+                    if pool is None:
+                        pool = concurrent.futures.ProcessPoolExecutor(workers)
+                    futures = [
+                        pool.submit(
+                            scan_chunk,
+                            self.segment_path(file_id),
+                            file_id,
+                            chunk_start,
+                            stop,
+                            chunk_start == start,
+                            self.verify_checksums,
+                        )
+                        for chunk_start, stop in chunks
+                    ]
+                pending.append((file_id, done, start, futures))
+                done += size
+                while pending and all(future.done() for future in pending[0][3]):
+                    yield finish()
+            while pending:
+                yield finish()
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    def _resume_index(self, file_ids: list[int], key_dir: PagedKeyDir) -> bool:
+        # _resume_index starts the store from the saved paged KeyDir, if the segments
+        # are exactly the ones it was saved with. Only the keys of the active segment
+        # are read, for its tombstones and its Bloom filter. close seals the active
+        # segment, so there are none
+        assert key_dir.meta is not None
+        sizes: dict[int, int] = {
+            file_id: os.path.getsize(self.segment_path(file_id)) for file_id in file_ids
+        }
+        if sizes != key_dir.meta.file_sizes:
+            logger.info("the segments have changed since the index was saved")
+            return False
+        last: int = file_ids[-1]
+        entries: dict[str, KeyEntry] = {}
+        hinted_end: int = self._load_hint_file(last, entries)
+        if self._scan_segment(last, hinted_end, entries, 0, 0) != sizes[last]:
+            return False
+        filters: dict[int, BloomFilter] = {}
+        if self.bloom_filters is not None:
+            for file_id in file_ids[:-1]:
+                filters[file_id] = self._segment_filter(
+                    file_id, sizes[file_id], load=True, key_dir=key_dir
+                )
+        self._activate(
+            {key: kv for key, kv in entries.items() if kv.total_size == TOMBSTONE},
+            (key for key, kv in entries.items() if kv.total_size != TOMBSTONE),
+            filters,
+        )
+        self.file_id = last
+        self.write_position = sizes[last]
+        self._file_sizes = sizes
+        self._live_bytes = dict(key_dir.meta.live_bytes)
+        logger.info("resumed the database from its index with %d keys", len(key_dir))
+        return True
+
+    def _activate(
+        self,
+        tombstones: dict[str, KeyEntry],
+        keys: typing.Iterable[str],
+        filters: dict[int, BloomFilter],
+    ) -> None:
+        # the startup is done: the tombstones and the live keys are the ones of the
+        # last segment, which is the active one, and the filters those of the sealed
+        # segments. They are assigned only now, so that a refresh doesn't show a
+        # reader the filters of some other segment meanwhile
+        self._active_tombstones = tombstones
+        if self.bloom_filters is None:
+            return
+        active: GrowingBloomFilter = GrowingBloomFilter(self.bloom_filters.fp_rate)
+        for key in keys:
+            active.add(key)
+        self.bloom_filters.replace(filters, active)
+
+    def _scan_segment(
+        self,
+        file_id: int,
+        position: int,
+        entries: typing.MutableMapping[str, KeyEntry],
+        done: int,
+        total: int,
+    ) -> int:
+        # _scan_segment reads the records of the segment from the position onwards
+        # into entries, and returns the end of the last good record. Check the scan
+        # module for how
+        report = self._progress
+
+        def progress(position: int) -> None:
+            assert report is not None
+            report(done + position, total)
+
+        return scan_records(
+            self.segment_path(file_id),
+            file_id,
+            position,
+            entries,
+            self.verify_checksums,
+            progress=progress if report is not None and total else None,
+        )
+
+    def _load_hint_file(
+        self,
+        file_id: int,
+        entries: typing.Optional[typing.MutableMapping[str, KeyEntry]] = None,
+    ) -> int:
+        # _load_hint_file loads the entries of the segment from its hint file and
+        # returns the byte offset in the segment till which the hint file is valid.
+        # The records after this offset need to be read from the segment. Without
+        # entries, only the offset is returned.
+        #
+        # The hint file contains only the last record of every key, so the last record
+        # in it need not be the last record we had written. That is fine, since the
+        # records between them are stale anyway and reading them again from the
+        # segment gives us the same KeyDir.
+        #
+        # The entries may be the KeyDir itself, so the hint file is checked as a whole
+        # before any of its entries is applied: the first pass reads only the headers,
+        # and the second one the keys
+        hint_path: str = self.hint_path(file_id)
+        if not os.path.exists(hint_path):
+            return 0
+        with open(hint_path, "rb") as f:
+            data: bytes = f.read()
+        hinted_end: int = 0
+        offset: int = 0
+        size: int = len(data)
+        while offset < size:
+            if offset + HINT_HEADER_SIZE > size:
+                return 0
+            _, key_size, position, total_size = decode_hint_header(data, offset)
+            offset += HINT_HEADER_SIZE + key_size
+            if offset > size:
+                return 0
+            # the hint of a tombstone has no size, the tombstone is just the header
+            # and the key
+            if total_size == TOMBSTONE:
+                end: int = position + HEADER_SIZE + key_size
+            else:
+                end = position + total_size
+            if end > hinted_end:
+                hinted_end = end
+        # a hint file which claims more data than the segment has, does not belong
+        # to it (e.g. the segment was replaced). We ignore such hint file.
+        if hinted_end > os.path.getsize(self.segment_path(file_id)):
+            return 0
+        if entries is None:
+            return hinted_end
+        offset = 0
+        while offset < size:
+            timestamp, key_size, position, total_size = decode_hint_header(data, offset)
+            offset += HINT_HEADER_SIZE
+            key: str = decode_key(data[offset : offset + key_size])
+            offset += key_size
+            entries[key] = KeyEntry(timestamp, position, total_size, file_id)
+        return hinted_end
+
+    def _segment_filter(
+        self,
+        file_id: int,
+        size: int,
+        entries: typing.Optional[dict[str, KeyEntry]] = None,
+        load: bool = False,
+        key_dir: typing.Optional[typing.Mapping[str, KeyEntry]] = None,
+    ) -> BloomFilter:
+        # _segment_filter returns the Bloom filter of a sealed segment, built from the
+        # last records of its keys. With load, the saved filter is used instead, if it
+        # was saved for a segment of this size. A writable store saves the filters it
+        # builds. If the entries are not at hand, the live keys of the segment are the
+        # ones the KeyDir (the store's own, unless another is given) points to it.
+        # They are counted first and added after, so that they are never all held at
+        # once
+        assert self.bloom_filters is not None
+        path: str = self.bloom_path(file_id)
+        bloom: typing.Optional[BloomFilter] = (
+            load_bloom_filter(path, size) if load else None
+        )
+        if bloom is None:
+            if entries is not None:
+                bloom = self.bloom_filters.build(
+                    [key for key, kv in entries.items() if kv.total_size != TOMBSTONE]
+                )
+            else:
+                if key_dir is None:
+                    key_dir = self.key_dir
+                count: int = sum(1 for _ in segment_items(key_dir, file_id))
+                bloom = BloomFilter(count, self.bloom_filters.fp_rate)
+                for key, _ in segment_items(key_dir, file_id):
+                    bloom.add(key)
+            if not self.read_only:
+                save_bloom_filter(path, bloom, size)
+        return bloom
+
+    def _write_hint_file(self, file_id: int, size: int) -> None:
+        # the hint file of the active segment is written when it is sealed: the
+        # KeyDir entries which point to the segment, and the tombstones of the keys
+        # it deleted. Finding the entries takes a pass over the KeyDir, unless the
+        # segment is empty.
+        #
+        # We first write the hint file to a temporary file, and then rename it.
+        # Rename is atomic, so a crash in between would never leave us with a half
+        # written hint file
+        entries: typing.Iterable[tuple[str, KeyEntry]] = (
+            segment_items(self.key_dir, file_id) if size > 0 else ()
+        )
+        write_hint_file(
+            self.hint_path(file_id),
+            itertools.chain(entries, self._active_tombstones.items()),
+        )
 
     def close(self) -> None:
+        if self.read_only:
+            self._readers.close()
+            return
+        # a running merge has to finish first, it is still using the segments
+        if self._compactor is not None:
+            self._compactor.close()
+        # the paged KeyDir lets the next startup skip reading the keys, except for
+        # the keys of the active segment, which go into its hint file once it is
+        # sealed. So we seal it now, and the next startup gets an empty one
+        if isinstance(self.key_dir, PagedKeyDir) and self.write_position > 0:
+            self._rollover()
         # before we close the file, we need to safely write the contents in the buffers
         # to the disk. Check documentation of DiskStorage._write() to understand
         # following the operations
         self.file.flush()
-        os.fsync(self.file.fileno())
+        # closing the group commit does the final fsync and resolves all the pending
+        # futures
+        self._commit.close()
         self.file.close()
+        self._readers.close()
+        # the active segment is sealed now, so this is the right time to write its
+        # hint file
+        self._write_hint_file(self.file_id, self.write_position)
+        # and to save the paged KeyDir, which describes the segments as they are now
+        if isinstance(self.key_dir, PagedKeyDir):
+            self.key_dir.save(self._file_sizes, self._live_bytes)
+            self.key_dir.close()
+        if self._file_lock is not None:
+            self._file_lock.release()
 
     def __setitem__(self, key: str, value: str) -> None:
-        return self.set(key, value)
+        self.set(key, value)
 
     def __getitem__(self, item: str) -> str:
         return self.get(item)
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self.key_dir:
+            raise KeyError(key)
+        self.delete(key)
@@ -0,0 +1,276 @@
+"""
+durability module decides when the data written by DiskStorage is made durable, i.e.
+when we call fsync on the data file.
+
+Calling fsync after every write is the safest option, but it is also the slowest one.
+A disk can do only a few hundred fsyncs per second, and every write has to wait for
+its own fsync. SyncPolicy lets the user trade some durability for throughput:
+
+    always      - fsync before `set` returns. This is the default
+    interval    - fsync in the background every N milliseconds
+    bytes       - fsync once N bytes have been written since the last fsync
+    os          - never fsync on our own, the OS flushes its buffers whenever it wants.
+                  We still fsync on `sync` and `close`
+
+Irrespective of the policy, the writes are group committed. When multiple writers
+are waiting for an fsync, a single fsync makes all of them durable. The writer which
+gets to fsync first (the leader) syncs everything written so far, and the writers
+queued behind it find their data already synced.
+
+Every write gets a `concurrent.futures.Future`, which resolves once the write is
+durable. The callers who don't care can ignore it. The writes waiting for the same
+fsync share a single future, so the writes which are never waited for cost nothing,
+however long the policy lets them wait (e.g. with `os`, till `sync` or `close`).
+
+Typical usage example:
+
+    disk = DiskStorage(file_name="books.db", sync_policy=SyncPolicy.every_ms(10))
+    future = disk.set(key="othello", value="shakespeare")
+    # wait till the write is on the disk
+    future.result()
+"""
+
+import concurrent.futures
+import os
+import threading
+import time
+import typing
+
+from caskdb.metrics import FSYNC, Metrics
+
+ALWAYS: typing.Final[str] = "always"
+INTERVAL: typing.Final[str] = "interval"
+BYTES: typing.Final[str] = "bytes"
+OS: typing.Final[str] = "os"
+
+_MODES: typing.Final[tuple[str, ...]] = (ALWAYS, INTERVAL, BYTES, OS)
+
+
+def _done_future() -> "concurrent.futures.Future[None]":
+    future: concurrent.futures.Future[None] = concurrent.futures.Future()
+    future.set_result(None)
+    return future
+
+
+# A future which is already resolved. Writes which are durable by the time they
+# return share this one, instead of allocating a new future every time
+_DONE: typing.Final["concurrent.futures.Future[None]"] = _done_future()
+
+
+def done_future() -> "concurrent.futures.Future[None]":
+    """
+    done_future returns a future which is already resolved
+    """
+    return _DONE
+
+
+class SyncPolicy:
+    """
+    SyncPolicy describes when the writes are fsynced to the disk. Use one of the
+    class methods to create it.
+
+    Args:
+        mode (str): one of `always`, `interval`, `bytes` or `os`
+        interval_ms (int): for the `interval` mode, milliseconds between two fsyncs
+        max_bytes (int): for the `bytes` mode, unsynced bytes which trigger an fsync
+
+    Raises:
+        ValueError: if the mode is unknown or its parameter is not positive
+    """
+
+    def __init__(self, mode: str = ALWAYS, interval_ms: int = 0, max_bytes: int = 0):
+        if mode not in _MODES:
+            raise ValueError(f"unknown sync mode: {mode}")
+        if mode == INTERVAL and interval_ms <= 0:
+            raise ValueError("interval_ms must be positive")
+        if mode == BYTES and max_bytes <= 0:
+            raise ValueError("max_bytes must be positive")
+        self.mode: str = mode
+        self.interval_ms: int = interval_ms
+        self.max_bytes: int = max_bytes
+
+    @classmethod
+    def always(cls) -> "SyncPolicy":
+        return cls(ALWAYS)
+
+    @classmethod
+    def every_ms(cls, interval_ms: int) -> "SyncPolicy":
+        return cls(INTERVAL, interval_ms=interval_ms)
+
+    @classmethod
+    def every_bytes(cls, max_bytes: int) -> "SyncPolicy":
+        return cls(BYTES, max_bytes=max_bytes)
+
+    @classmethod
+    def os_managed(cls) -> "SyncPolicy":
+        return cls(OS)
+
+    def __repr__(self) -> str:
+        return (
+            f"SyncPolicy(mode={self.mode!r}, interval_ms={self.interval_ms}, "
+            f"max_bytes={self.max_bytes})"
+        )
+
+
+class GroupCommit:
+    """
+    GroupCommit tracks the bytes appended to a file and fsyncs them as per the
+    SyncPolicy. The bytes are counted from the creation of GroupCommit, not from the
+    beginning of the file. A writer appends the data, flushes it to the OS and then
+    calls `appended`, which returns a ticket. The writer then calls `commit` with the
+    ticket, outside any lock it may hold, so that other writers can append while this
+    one waits for the fsync.
+
+    Args:
+        file (typing.BinaryIO): the file which is being appended to
+        policy (SyncPolicy): decides when to fsync
+        metrics (typing.Optional[Metrics]): if set, the fsyncs are timed
+
+    Attributes:
+        written (int): bytes appended so far
+        synced (int): bytes known to be durable
+        sync_count (int): number of fsyncs done so far
+    """
+
+    def __init__(
+        self,
+        file: typing.BinaryIO,
+        policy: SyncPolicy,
+        metrics: typing.Optional[Metrics] = None,
+    ):
+        self.file: typing.BinaryIO = file
+        self.policy: SyncPolicy = policy
+        self.metrics: typing.Optional[Metrics] = metrics
+        self.written: int = 0
+        self.synced: int = 0
+        self.sync_count: int = 0
+        # _lock guards the counters and the futures. _sync_lock makes sure there is
+        # only one fsync at a time, the writers which queue behind it are the ones
+        # which get coalesced
+        self._lock: threading.Lock = threading.Lock()
+        self._sync_lock: threading.Lock = threading.Lock()
+        # _pending is the future of the writes which the next fsync covers. It is
+        # created by the first writer who waits for that fsync, and shared by the
+        # rest of them. _syncing is the ticket which the running fsync covers,
+        # along with its future, if anyone waits for it
+        self._pending: typing.Optional[concurrent.futures.Future[None]] = None
+        self._syncing: typing.Optional[
+            tuple[int, typing.Optional[concurrent.futures.Future[None]]]
+        ] = None
+        self._stop: threading.Event = threading.Event()
+        self._thread: typing.Optional[threading.Thread] = None
+        if policy.mode == INTERVAL:
+            self._thread = threading.Thread(
+                target=self._run, name="caskdb-group-commit", daemon=True
+            )
+            self._thread.start()
+
+    def appended(self, size: int) -> int:
+        """
+        appended records that size bytes were written and flushed to the OS. Returns
+        the ticket for this write, which is to be passed to `commit`
+        """
+        with self._lock:
+            self.written += size
+            return self.written
+
+    def commit(self, ticket: int) -> "concurrent.futures.Future[None]":
+        """
+        commit applies the sync policy for the write identified by the ticket. It
+        returns a future which resolves when the write is durable. For the `always`
+        mode the write is already durable when commit returns.
+        """
+        mode: str = self.policy.mode
+        if mode == ALWAYS:
+            self.sync_to(ticket)
+            return _DONE
+        if mode == BYTES and ticket - self.synced >= self.policy.max_bytes:
+            self.sync_to(ticket)
+        return self._future_for(ticket)
+
+    def sync_to(self, ticket: int) -> None:
+        """
+        sync_to makes sure all the writes till the ticket are durable. If another
+        thread's fsync has covered the ticket already, it returns without an fsync
+        """
+        with self._sync_lock:
+            if self.synced >= ticket:
+                return
+            self._sync()
+
+    def sync(self) -> None:
+        """
+        sync fsyncs everything written so far, irrespective of the policy
+        """
+        with self._sync_lock:
+            self._sync()
+
+    def set_file(self, file: typing.BinaryIO) -> None:
+        """
+        set_file switches the file being appended to. Everything written to the old
+        file is synced first
+        """
+        with self._sync_lock:
+            self._sync()
+            self.file = file
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.sync()
+
+    def _sync(self) -> None:
+        # must be called with _sync_lock held. Whatever is written till now has been
+        # flushed to the OS by the writers, so one fsync covers all of it. The
+        # writers who got the pending future did so for the tickets up to this
+        # point, so it becomes the future of this fsync, in the same step
+        with self._lock:
+            upto: int = self.written
+            self._syncing = (upto, self._pending)
+            self._pending = None
+        try:
+            if self.synced < upto:
+                if self.metrics is None:
+                    os.fsync(self.file.fileno())
+                else:
+                    start: float = time.perf_counter()
+                    os.fsync(self.file.fileno())
+                    self.metrics.observe(
+                        FSYNC, time.perf_counter() - start, upto - self.synced
+                    )
+                self.sync_count += 1
+        except BaseException as e:
+            with self._lock:
+                _, future = self._syncing
+                self._syncing = None
+            if future is not None:
+                future.set_exception(e)
+            raise
+        with self._lock:
+            self.synced = upto
+            _, future = self._syncing
+            self._syncing = None
+        if future is not None:
+            future.set_result(None)
+
+    def _future_for(self, ticket: int) -> "concurrent.futures.Future[None]":
+        with self._lock:
+            if self.synced >= ticket:
+                return _DONE
+            # the fsync running right now may cover the ticket already
+            if self._syncing is not None and self._syncing[0] >= ticket:
+                upto, future = self._syncing
+                if future is None:
+                    future = concurrent.futures.Future()
+                    self._syncing = (upto, future)
+                return future
+            if self._pending is None:
+                self._pending = concurrent.futures.Future()
+            return self._pending
+
+    def _run(self) -> None:
+        interval: float = self.policy.interval_ms / 1000
+        while not self._stop.wait(interval):
+            if self.synced < self.written:
+                self.sync()
@@ -28,6 +28,16 @@ format module provides two functions which help us with serialisation of data.
     encode_kv - takes the key value pair and encodes them into bytes
     decode_kv - takes a bunch of bytes and decodes them into key value pairs
 
+Both work with strings. The keys and values are stored as bytes, and their bytes
+versions, encode_kv_bytes and split_kv, skip the UTF-8 encoding and decoding of the
+values entirely. The string functions are thin wrappers around them.
+
+The keys are kept as strings in memory, e.g. in the KeyDir, so a key given as bytes
+is converted to a string with encode_key and decode_key. They use the
+`surrogateescape` error handler: the bytes which aren't valid UTF-8 are mapped to lone
+surrogates in the string, and back to the same bytes. So any bytes can be a key, and
+a valid UTF-8 key is the same whether it is given as a string or as bytes.
+
 **workshop note**
 
 For the workshop, the functions will have the following signature:
@@ -38,24 +48,37 @@ For the workshop, the functions will have the following signature:
 
 import struct
 import typing
+import zlib
 
 # Our key value pair, when stored on disk looks like this:
-#   ┌───────────┬──────────┬────────────┬─────┬───────┐
-#   │ timestamp │ key_size │ value_size │ key │ value │
-#   └───────────┴──────────┴────────────┴─────┴───────┘
+#   ┌─────┬─────────┬───────┬───────────┬──────────┬────────────┬─────┬─────┐
+#   │ crc │ version │ flags │ timestamp │ key_size │ value_size │ key │ val │
+#   └─────┴─────────┴───────┴───────────┴──────────┴────────────┴─────┴─────┘
 #
 # This is analogous to a typical database's row (or a record). The total length of
 # the row is variable, depending on the contents of the key and value.
 #
-# The first three fields form the header:
-#   ┌───────────────┬──────────────┬────────────────┐
-#   │ timestamp(4B) │ key_size(4B) │ value_size(4B) │
-#   └───────────────┴──────────────┴────────────────┘
+# The first six fields form the header:
+#   ┌─────────┬─────────────┬───────────┬───────────┬──────────┬────────────┐
+#   │ crc(4B) │ version(1B) │ flags(1B) │ timestamp │ key_size │ value_size │
+#   └─────────┴─────────────┴───────────┴───────────┴──────────┴────────────┘
+#
+# where each of the last three is 4 bytes long, giving our header a fixed length of 18
+# bytes.
 #
-# These three fields store unsigned integers of size 4 bytes, giving our header a
-# fixed length of 12 bytes. Timestamp field stores the time the record we
-# inserted in unix epoch seconds. Key size and value size fields store the length of
-# bytes occupied by the key and value. The maximum integer
+# The crc is the CRC32 checksum of everything that follows it in the record: the rest
+# of the header, the key and the value. A record which was torn by a crash, or whose
+# bytes rotted on the disk, doesn't match its checksum, so we can tell it apart from
+# a good one instead of returning garbage. The version is the version of this layout,
+# FORMAT_VERSION. A record of any other version is not one we know how to read. The
+# flags say how the value is stored. Their low bits have the id of the codec the value
+# is compressed with, 0 if it is not compressed. Check the compression module for
+# more.
+#
+# The last three fields store unsigned integers of size 4 bytes. Timestamp field
+# stores the time the record we inserted in unix epoch seconds. Key size and value
+# size fields store the length of bytes occupied by the key and value. The maximum
+# integer
 # stored by 4 bytes is 4,294,967,295 (2 ** 32 - 1), roughly ~4.2GB. So, the size of
 # each key or value cannot exceed this. Theoretically, a single row can be as large
 # as ~8.4GB.
@@ -70,10 +93,82 @@ import typing
 # Check the struct documentation https://docs.python.org/3/library/struct.html
 # to understand how to construct such a string.
 #
-# `<` - lil endian to be used to encode the integer
-# `L` - represents long unsigned int (4 bytes). We have three fields, hence `LLL`
-HEADER_FORMAT: typing.Final[str] = "<LLL"
-HEADER_SIZE: typing.Final[int] = 12
+# `<` - lil endian to be used to encode the integer, without any padding
+# `L` - represents long unsigned int (4 bytes)
+# `B` - represents unsigned char (1 byte)
+HEADER_FORMAT: typing.Final[str] = "<LBBLLL"
+HEADER_SIZE: typing.Final[int] = 18
+# the compiled format, which saves parsing the format string on every call. Use it
+# in the hot loops, like the startup scan
+HEADER: typing.Final[struct.Struct] = struct.Struct(HEADER_FORMAT)
+
+# the checksum is computed over the record bytes after the crc field. BODY is the
+# header without the crc, which is packed first so that it can be checksummed
+CRC_SIZE: typing.Final[int] = 4
+CRC: typing.Final[struct.Struct] = struct.Struct("<L")
+BODY: typing.Final[struct.Struct] = struct.Struct("<BBLLL")
+
+# version of the record layout above
+FORMAT_VERSION: typing.Final[int] = 1
+
+# A batch of records is appended with a single write. To find out at the startup
+# whether the whole batch made it to the disk, the records of a batch are preceded by a
+# batch header. It looks like a regular header, with the key size set to BATCH_MARKER
+# and the value size set to the total size of the records that follow:
+#   ┌─────┬───────────┬────────────────────────┬────────────────┬─────────┬─────┐
+#   │ ... │ timestamp │ key_size(BATCH_MARKER) │ batch_size(4B) │ record1 │ ... │
+#   └─────┴───────────┴────────────────────────┴────────────────┴─────────┴─────┘
+#
+# (the crc, version and flags come first, like in every header. The crc of the batch
+# header covers just the header, the records have their own)
+#
+# If the file ends before batch_size bytes, the batch was torn by a crash, and none of
+# its records are applied. No key can be BATCH_MARKER bytes long, so it can't be
+# mistaken for a record.
+BATCH_MARKER: typing.Final[int] = 2**32 - 1
+
+# A deleted key is recorded with a tombstone. It is a record with the value size set to
+# TOMBSTONE, and no value bytes at all:
+#   ┌─────┬───────────┬──────────────┬───────────────────────┬─────┐
+#   │ ... │ timestamp │ key_size(4B) │ value_size(TOMBSTONE) │ key │
+#   └─────┴───────────┴──────────────┴───────────────────────┴─────┘
+#
+# The tombstone hides the older records of the key, which may still be in the older
+# segments. In the hint files, the total size of a tombstone entry is set to TOMBSTONE.
+# So, a value can be at most TOMBSTONE - 1 bytes long.
+TOMBSTONE: typing.Final[int] = 2**32 - 1
+
+# Hint files are the sidecars described in the Bitcask paper. For every live record
+# of a data file, the hint file keeps just enough to rebuild the KeyDir entry without
+# touching the data file at all:
+#   ┌───────────────┬──────────────┬──────────────┬────────────────┬─────┐
+#   │ timestamp(4B) │ key_size(4B) │ position(8B) │ total_size(4B) │ key │
+#   └───────────────┴──────────────┴──────────────┴────────────────┴─────┘
+#
+# The position is stored in 8 bytes (`Q` - unsigned long long), since a data file can
+# grow well beyond 4GB even though a single record cannot. Notice that the value is not
+# stored in the hint file, which keeps them small and quick to load.
+HINT_HEADER_FORMAT: typing.Final[str] = "<LLQL"
+HINT_HEADER_SIZE: typing.Final[int] = 20
+HINT_HEADER: typing.Final[struct.Struct] = struct.Struct(HINT_HEADER_FORMAT)
+
+# the types a value can be given as, to the bytes functions
+Buffer = typing.Union[bytes, bytearray, memoryview]
+
+
+class ChecksumError(ValueError):
+    """
+    ChecksumError is raised when a record doesn't match its checksum, or it has a
+    version we don't know. Either way, the bytes read are not the record we wrote.
+    """
+
+
+class FormatError(ValueError):
+    """
+    FormatError is raised when a segment is not in the record format of this version,
+    e.g. it was written by an older caskdb with the 12 byte header. The store refuses
+    to open it, instead of taking its records for torn ones and truncating them.
+    """
 
 
 class KeyEntry:
@@ -89,12 +184,37 @@ class KeyEntry:
             exists
         total_size(int): Total size of bytes of the value. We use this value to know
             how many bytes we need to read from the file
+        file_id(int): The id of the segment file which has the data
     """
 
-    def __init__(self, timestamp: int, position: int, total_size: int):
+    # KeyDir keeps a KeyEntry for every key, so we don't want every one of them to
+    # carry an instance `__dict__` around. With `__slots__` the attributes are stored
+    # in fixed slots of the object, which saves more than a hundred bytes per entry
+    __slots__ = ("timestamp", "position", "total_size", "file_id")
+
+    def __init__(
+        self, timestamp: int, position: int, total_size: int, file_id: int = 0
+    ):
         self.timestamp: int = timestamp
         self.position: int = position
         self.total_size: int = total_size
+        self.file_id: int = file_id
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, KeyEntry):
+            return NotImplemented
+        return (
+            self.timestamp == other.timestamp
+            and self.position == other.position
+            and self.total_size == other.total_size
+            and self.file_id == other.file_id
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"KeyEntry(timestamp={self.timestamp}, position={self.position}, "
+            f"total_size={self.total_size}, file_id={self.file_id})"
+        )
 
 
 def encode_header(timestamp: int, key_size: int, value_size: int) -> bytes:
@@ -109,12 +229,45 @@ def encode_header(timestamp: int, key_size: int, value_size: int) -> bytes:
         value_size (int): size of the value (cannot exceed the maximum)
 
     Returns:
-        byte object containing the encoded data
+        byte object containing the encoded data. The checksum covers just the header,
+        so it is the complete record only if it has no key and value bytes
 
     Raises:
         struct.error when parameters don't match the specific type / size
     """
-    return struct.pack(HEADER_FORMAT, timestamp, key_size, value_size)
+    return _encode_record(timestamp, key_size, value_size, b"", b"")
+
+
+def _encode_record(
+    timestamp: int,
+    key_size: int,
+    value_size: int,
+    key: bytes,
+    value: Buffer,
+    flags: int = 0,
+) -> bytes:
+    body: bytes = BODY.pack(FORMAT_VERSION, flags, timestamp, key_size, value_size)
+    # zlib.crc32 takes the checksum so far as its second argument, so we can
+    # checksum the parts without joining them first. The join is the only copy of
+    # the key and the value
+    crc: int = zlib.crc32(value, zlib.crc32(key, zlib.crc32(body)))
+    return b"".join((CRC.pack(crc), body, key, value))
+
+
+def encode_key(key: str) -> bytes:
+    """
+    encode_key returns the bytes of the key, as stored on the disk. It is the
+    reverse of decode_key
+    """
+    return key.encode("utf-8", "surrogateescape")
+
+
+def decode_key(data: Buffer) -> str:
+    """
+    decode_key returns the key, given its bytes. Any bytes are a valid key, check the
+    module documentation for how
+    """
+    return str(data, "utf-8", "surrogateescape")
 
 
 def encode_kv(timestamp: int, key: str, value: str) -> tuple[int, bytes]:
@@ -133,17 +286,152 @@ def encode_kv(timestamp: int, key: str, value: str) -> tuple[int, bytes]:
     Raises:
         struct.error when parameters don't match the specific type / size
     """
-    header: bytes = encode_header(timestamp, len(key), len(value))
-    data: bytes = b"".join([str.encode(key), str.encode(value)])
-    return HEADER_SIZE + len(data), header + data
+    return encode_kv_bytes(timestamp, encode_key(key), value.encode("utf-8"))
 
 
-def decode_kv(data: bytes) -> tuple[int, str, str]:
+def encode_kv_bytes(
+    timestamp: int, key: bytes, value: Buffer, flags: int = 0
+) -> tuple[int, bytes]:
     """
-    decode_kv decodes the data bytes into appropriate KV pair
+    encode_kv_bytes encodes the KV pair given as bytes. The sizes in the header are
+    the byte lengths, which for a string need not be the number of characters
 
     Args:
-        data (bytes): byte object containing the encoded KV data
+        timestamp (int): Timestamp at which we wrote the KV pair to the disk
+        key (bytes): the key
+        value (Buffer): the value, as bytes, bytearray or memoryview
+        flags (int): the flags of the record, e.g. the codec the value is
+            compressed with
+
+    Returns:
+        tuple containing the size of encoded bytes and the byte object
+
+    Raises:
+        struct.error when parameters don't match the specific type / size
+    """
+    data: bytes = _encode_record(timestamp, len(key), len(value), key, value, flags)
+    return len(data), data
+
+
+def encode_kv_into(
+    buffer: bytearray,
+    offset: int,
+    timestamp: int,
+    key: bytes,
+    value: Buffer,
+    flags: int = 0,
+) -> int:
+    """
+    encode_kv_into encodes the KV pair into the buffer at the given offset, instead
+    of allocating new bytes. It is meant for writing many records in one go, into a
+    buffer allocated once for all of them.
+
+    Args:
+        buffer (bytearray): the buffer to write to. It needs to have enough space
+        offset (int): byte offset in the buffer where the record starts
+        timestamp (int): Timestamp at which we wrote the KV pair to the disk
+        key (bytes): the encoded key
+        value (Buffer): the encoded value
+        flags (int): the flags of the record
+
+    Returns:
+        size of the encoded record
+
+    Raises:
+        struct.error when parameters don't match the specific type / size
+    """
+    BODY.pack_into(
+        buffer,
+        offset + CRC_SIZE,
+        FORMAT_VERSION,
+        flags,
+        timestamp,
+        len(key),
+        len(value),
+    )
+    key_start: int = offset + HEADER_SIZE
+    value_start: int = key_start + len(key)
+    end: int = value_start + len(value)
+    buffer[key_start:value_start] = key
+    buffer[value_start:end] = value
+    with memoryview(buffer) as view:
+        CRC.pack_into(buffer, offset, zlib.crc32(view[offset + CRC_SIZE : end]))
+    return end - offset
+
+
+def encode_batch_header(timestamp: int, batch_size: int) -> bytes:
+    """
+    encode_batch_header encodes the header which precedes the records of a batch
+
+    Args:
+        timestamp (int): Timestamp at which we wrote the batch to the disk
+        batch_size (int): total size of the records of the batch
+
+    Returns:
+        byte object containing the encoded batch header
+
+    Raises:
+        struct.error when the batch is too large
+    """
+    return encode_header(timestamp, BATCH_MARKER, batch_size)
+
+
+def encode_tombstone(timestamp: int, key: str) -> tuple[int, bytes]:
+    """
+    encode_tombstone encodes the tombstone record of a deleted key
+
+    Args:
+        timestamp (int): Timestamp at which the key was deleted
+        key (str): the key
+
+    Returns:
+        tuple: size of the tombstone and the tombstone itself, in bytes
+    """
+    key_bytes: bytes = encode_key(key)
+    data: bytes = _encode_record(timestamp, len(key_bytes), TOMBSTONE, key_bytes, b"")
+    return len(data), data
+
+
+def record_size(key_size: int, value_size: int) -> int:
+    """
+    record_size returns the total size of a record, given the key size and the value
+    size from its header. It takes care of the tombstones, which have no value bytes
+    """
+    if value_size == TOMBSTONE:
+        return HEADER_SIZE + key_size
+    return HEADER_SIZE + key_size + value_size
+
+
+def verify_record(data: typing.Union[bytes, memoryview]) -> None:
+    """
+    verify_record checks the version and the checksum of the encoded record
+
+    Args:
+        data (bytes): byte object containing the whole record
+
+    Raises:
+        ChecksumError: if the record is not the one we wrote
+    """
+    crc, version = HEADER.unpack_from(data)[:2]
+    if version != FORMAT_VERSION:
+        raise ChecksumError(f"unknown record version {version}")
+    with memoryview(data) as view:
+        if zlib.crc32(view[CRC_SIZE:]) != crc:
+            raise ChecksumError("record does not match its checksum")
+
+
+def decode_kv(
+    data: typing.Union[bytes, memoryview], verify: bool = False
+) -> tuple[int, str, str]:
+    """
+    decode_kv decodes the data bytes into appropriate KV pair. The value is returned
+    as stored, so a compressed one has to be decompressed by the caller, check
+    split_record
+
+    Args:
+        data (bytes): byte object containing the encoded KV data. It can be a
+            memoryview too, e.g. of a memory mapped file
+        verify (bool): if set, the checksum of the record is verified first
 
     Returns:
         A tuple containing:
@@ -156,15 +444,70 @@ def decode_kv(data: bytes) -> tuple[int, str, str]:
         struct.error: when parameters don't match the specific type / size
         IndexError: if the length of bytes is shorter than expected
         UnicodeDecodeError: if the key or values bytes could not be decoded to string
+        ChecksumError: if verify is set, and the record doesn't match its checksum
     """
-    timestamp, key_size, value_size = struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])
-    key_bytes: bytes = data[HEADER_SIZE : HEADER_SIZE + key_size]
-    value_bytes: bytes = data[HEADER_SIZE + key_size :]
-    key: str = key_bytes.decode("utf-8")
-    value: str = value_bytes.decode("utf-8")
+    timestamp, key_bytes, value_bytes = split_kv(data, verify)
+    key: str = decode_key(key_bytes)
+    value: str = str(value_bytes, "utf-8")
     return timestamp, key, value
 
 
+def split_kv(
+    data: typing.Union[bytes, memoryview], verify: bool = False
+) -> tuple[int, memoryview, memoryview]:
+    """
+    split_kv splits the encoded KV data into the key and value bytes, without copying
+    them. The returned key and value are memoryview slices of data
+
+    Args:
+        data (bytes): byte object containing the encoded KV data
+        verify (bool): if set, the checksum of the record is verified first
+
+    Returns:
+        A tuple containing:
+
+            timestamp (int): timestamp in epoch seconds
+            key (memoryview): the key bytes
+            value (memoryview): the value bytes
+
+    Raises:
+        struct.error: when parameters don't match the specific type / size
+        ChecksumError: if verify is set, and the record doesn't match its checksum
+    """
+    timestamp, _, key, value = split_record(data, verify)
+    return timestamp, key, value
+
+
+def split_record(
+    data: typing.Union[bytes, memoryview], verify: bool = False
+) -> tuple[int, int, memoryview, memoryview]:
+    """
+    split_record is split_kv, which also returns the flags of the record
+
+    Args:
+        data (bytes): byte object containing the encoded KV data
+        verify (bool): if set, the checksum of the record is verified first
+
+    Returns:
+        A tuple containing:
+
+            timestamp (int): timestamp in epoch seconds
+            flags (int): flags of the record, e.g. the codec of the value
+            key (memoryview): the key bytes
+            value (memoryview): the value bytes, as stored
+
+    Raises:
+        struct.error: when parameters don't match the specific type / size
+        ChecksumError: if verify is set, and the record doesn't match its checksum
+    """
+    if verify:
+        verify_record(data)
+    view: memoryview = memoryview(data)
+    _, _, flags, timestamp, key_size, value_size = HEADER.unpack_from(view)
+    key_end: int = HEADER_SIZE + key_size
+    return timestamp, flags, view[HEADER_SIZE:key_end], view[key_end:]
+
+
 def decode_header(data: bytes) -> tuple[int, int, int]:
     """
     decode_header decodes the bytes into header using the `HEADER_FORMAT` format
@@ -183,5 +526,52 @@ def decode_header(data: bytes) -> tuple[int, int, int]:
     Raises:
         struct.error: when parameters don't match the specific type / size
     """
-    timestamp, key_size, value_size = struct.unpack(HEADER_FORMAT, data)
+    _, _, _, timestamp, key_size, value_size = HEADER.unpack(data)
     return timestamp, key_size, value_size
+
+
+def encode_hint(timestamp: int, key: str, position: int, total_size: int) -> bytes:
+    """
+    encode_hint encodes a KeyDir entry into bytes, as stored in the hint file
+
+    Args:
+        timestamp (int): Timestamp at which the KV pair was written to the disk
+        key (str): the key
+        position (int): byte offset of the record in the data file
+        total_size (int): total size of the record in the data file
+
+    Returns:
+        byte object containing the encoded hint entry
+
+    Raises:
+        struct.error when parameters don't match the specific type / size
+    """
+    key_bytes: bytes = encode_key(key)
+    header: bytes = struct.pack(
+        HINT_HEADER_FORMAT, timestamp, len(key_bytes), position, total_size
+    )
+    return header + key_bytes
+
+
+def decode_hint_header(data: bytes, offset: int = 0) -> tuple[int, int, int, int]:
+    """
+    decode_hint_header decodes the fixed size part of a hint entry
+
+    Args:
+        data (bytes): byte object containing the encoded hint header
+        offset (int): byte offset in data where the hint header starts. Passing the
+            offset lets the caller decode a whole hint file without slicing it
+
+    Returns:
+        A tuple containing:
+
+            timestamp (int): timestamp in epoch seconds
+            key_size (int): size of the key
+            position (int): byte offset of the record in the data file
+            total_size (int): total size of the record in the data file
+
+    Raises:
+        struct.error: when parameters don't match the specific type / size
+    """
+    timestamp, key_size, position, total_size = HINT_HEADER.unpack_from(data, offset)
+    return timestamp, key_size, position, total_size
@@ -0,0 +1,529 @@
+"""
+keydir module provides the implementations of KeyDir, the in-memory index of
+DiskStorage which maps every key to the KeyEntry of its latest record.
+
+The simplest KeyDir is a Python dict, which is what DiskStorage uses by default. It is
+fast, but it is not frugal with memory. Every key costs a dict slot, a str object for
+the key and a KeyEntry object, well over a hundred bytes even for short keys. With tens
+of millions of keys, the KeyDir would not fit in the RAM.
+
+CompactKeyDir keeps the same data in a handful of flat arrays instead:
+
+    - the key bytes, one after another, in a single bytearray
+    - the timestamp, position, total size and file id of every entry, each in an
+      `array` of fixed size integers
+    - an open addressing hash table of the entry numbers
+
+which costs about sixty bytes per key plus the key itself. The price is paid in the
+lookups: every `get` creates a KeyEntry object, and the key has to be encoded to
+compare it with the stored bytes.
+
+SortedKeyDir keeps the keys in order, next to a dict of the entries. It is what makes
+the range and prefix scans of DiskStorage possible. The point lookups go to the dict,
+so they cost the same as with the default KeyDir, while the writes of new keys pay
+for keeping them sorted.
+
+PagedKeyDir keeps the table of CompactKeyDir in memory mapped files instead, for the
+stores with more keys than the RAM can hold. Check the paged_keydir module.
+
+Use `new_key_dir` to create a KeyDir by its type:
+
+    key_dir = new_key_dir("compact")
+
+and `segment_items` to find the keys of a segment in any of them.
+"""
+
+import array
+import bisect
+import itertools
+import typing
+
+from caskdb.format import KeyEntry, decode_key, encode_key
+from caskdb.paged_keydir import PagedKeyDir
+
+DICT: typing.Final[str] = "dict"
+COMPACT: typing.Final[str] = "compact"
+SORTED: typing.Final[str] = "sorted"
+PAGED: typing.Final[str] = "paged"
+
+KEY_DIR_TYPES: typing.Final[tuple[str, ...]] = (DICT, COMPACT, SORTED, PAGED)
+
+
+def new_key_dir(
+    key_dir_type: str = DICT, path: typing.Optional[str] = None
+) -> typing.MutableMapping[str, KeyEntry]:
+    """
+    new_key_dir creates an empty KeyDir of the given type
+
+    Args:
+        key_dir_type (str): one of `dict`, `compact`, `sorted` or `paged`
+        path (str): path of the index file, needed by the `paged` KeyDir. It opens
+            the index saved there, if there is one
+
+    Raises:
+        ValueError: if the type is unknown, or the path is missing
+    """
+    if key_dir_type == DICT:
+        return {}
+    if key_dir_type == COMPACT:
+        return CompactKeyDir()
+    if key_dir_type == SORTED:
+        return SortedKeyDir()
+    if key_dir_type == PAGED:
+        if path is None:
+            raise ValueError("the paged key dir needs a path")
+        return PagedKeyDir(path)
+    raise ValueError(f"unknown key dir type: {key_dir_type}")
+
+
+def segment_items(
+    key_dir: typing.Mapping[str, KeyEntry], file_id: int
+) -> typing.Iterator[tuple[str, KeyEntry]]:
+    """
+    segment_items returns the keys of the KeyDir whose entries point to the segment,
+    along with their entries. It goes over the whole KeyDir, but the KeyDirs which
+    keep their entries in arrays or files check the file id of an entry before they
+    create its key
+    """
+    if isinstance(key_dir, (CompactKeyDir, SortedKeyDir, PagedKeyDir)):
+        return key_dir.segment_items(file_id)
+    return ((key, kv) for key, kv in key_dir.items() if kv.file_id == file_id)
+
+
+# slots of the hash table hold the row number of the entry, or one of these
+_EMPTY: typing.Final[int] = -1
+_DELETED: typing.Final[int] = -2
+
+_MIN_CAPACITY: typing.Final[int] = 8
+
+
+class _Table:
+    """
+    _Table holds all the arrays of CompactKeyDir. Rows are only appended, never
+    modified: updating a key appends a new row and points its slot to it. So a reader
+    which looked up a slot always finds a complete row, even if a writer is updating
+    the same key at that moment. When the table is full, or has too many dead rows, a
+    new table is built and swapped in with a single assignment.
+    """
+
+    def __init__(self, capacity: int):
+        self.slots: array.array[int] = array.array("q", [_EMPTY]) * capacity
+        self.mask: int = capacity - 1
+        # number of slots which are not empty, including the deleted ones. An empty
+        # slot ends a probe, so deleted slots count towards the load too
+        self.used: int = 0
+        self.live: int = 0
+        self.hashes: array.array[int] = array.array("q")
+        self.key_offsets: array.array[int] = array.array("Q")
+        self.key_sizes: array.array[int] = array.array("I")
+        self.timestamps: array.array[int] = array.array("I")
+        self.positions: array.array[int] = array.array("Q")
+        self.total_sizes: array.array[int] = array.array("I")
+        self.file_ids: array.array[int] = array.array("I")
+        self.keys: bytearray = bytearray()
+
+    def find(self, key: str, h: int) -> int:
+        # returns the slot of the key, or -1 if the key is not present
+        slots: array.array[int] = self.slots
+        i: int = h & self.mask
+        key_bytes: typing.Optional[bytes] = None
+        while True:
+            row: int = slots[i]
+            if row == _EMPTY:
+                return -1
+            if row >= 0 and self.hashes[row] == h:
+                if key_bytes is None:
+                    key_bytes = encode_key(key)
+                offset: int = self.key_offsets[row]
+                if self.keys[offset : offset + self.key_sizes[row]] == key_bytes:
+                    return i
+            i = (i + 1) & self.mask
+
+    def free_slot(self, h: int) -> int:
+        # returns the first slot on the probe sequence which can take a new key
+        slots: array.array[int] = self.slots
+        i: int = h & self.mask
+        while slots[i] >= 0:
+            i = (i + 1) & self.mask
+        return i
+
+    def append_row(self, h: int, key_bytes: bytes, kv: KeyEntry) -> int:
+        self.hashes.append(h)
+        self.key_offsets.append(len(self.keys))
+        self.key_sizes.append(len(key_bytes))
+        self.keys += key_bytes
+        self.timestamps.append(kv.timestamp)
+        self.positions.append(kv.position)
+        self.total_sizes.append(kv.total_size)
+        self.file_ids.append(kv.file_id)
+        return len(self.hashes) - 1
+
+    def entry(self, row: int) -> KeyEntry:
+        return KeyEntry(
+            self.timestamps[row],
+            self.positions[row],
+            self.total_sizes[row],
+            self.file_ids[row],
+        )
+
+    def key(self, row: int) -> str:
+        offset: int = self.key_offsets[row]
+        return decode_key(self.keys[offset : offset + self.key_sizes[row]])
+
+    def rows(self) -> typing.Iterator[int]:
+        for row in self.slots:
+            if row >= 0:
+                yield row
+
+
+class CompactKeyDir(typing.MutableMapping[str, KeyEntry]):
+    """
+    CompactKeyDir is a KeyDir which keeps the entries in flat arrays, instead of
+    Python objects. It behaves like a dict of KeyEntry, except that the KeyEntry
+    objects it returns are created on every lookup, so modifying them does not modify
+    the KeyDir.
+
+    The KeyDir can be read from many threads while one thread writes to it. Multiple
+    writers need to be serialised by the caller, DiskStorage does that with its write
+    lock.
+    """
+
+    def __init__(self) -> None:
+        self._table: _Table = _Table(_MIN_CAPACITY)
+
+    def __getitem__(self, key: str) -> KeyEntry:
+        table: _Table = self._table
+        slot: int = table.find(key, hash(key))
+        if slot < 0:
+            raise KeyError(key)
+        return table.entry(table.slots[slot])
+
+    def get(  # type: ignore[override]
+        self, key: str, default: typing.Optional[KeyEntry] = None
+    ) -> typing.Optional[KeyEntry]:
+        # same as the one from Mapping, minus the cost of raising KeyError
+        table: _Table = self._table
+        slot: int = table.find(key, hash(key))
+        if slot < 0:
+            return default
+        return table.entry(table.slots[slot])
+
+    def __setitem__(self, key: str, kv: KeyEntry) -> None:
+        table: _Table = self._table
+        h: int = hash(key)
+        slot: int = table.find(key, h)
+        key_bytes: bytes = encode_key(key)
+        row: int = table.append_row(h, key_bytes, kv)
+        if slot >= 0:
+            # the old row stays in the arrays as garbage, till the next rebuild
+            table.slots[slot] = row
+        else:
+            slot = table.free_slot(h)
+            if table.slots[slot] == _EMPTY:
+                table.used += 1
+            table.slots[slot] = row
+            table.live += 1
+        self._maybe_rebuild()
+
+    def __delitem__(self, key: str) -> None:
+        table: _Table = self._table
+        slot: int = table.find(key, hash(key))
+        if slot < 0:
+            raise KeyError(key)
+        table.slots[slot] = _DELETED
+        table.live -= 1
+        self._maybe_rebuild()
+
+    def __iter__(self) -> typing.Iterator[str]:
+        table: _Table = self._table
+        for row in table.rows():
+            yield table.key(row)
+
+    def __len__(self) -> int:
+        return self._table.live
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        return self._table.find(key, hash(key)) >= 0
+
+    def values(self) -> "typing.ValuesView[KeyEntry]":
+        return _Values(self)
+
+    def items(self) -> "typing.ItemsView[str, KeyEntry]":
+        return _Items(self)
+
+    def clear(self) -> None:
+        self._table = _Table(_MIN_CAPACITY)
+
+    def segment_items(self, file_id: int) -> typing.Iterator[tuple[str, KeyEntry]]:
+        table: _Table = self._table
+        file_ids: array.array[int] = table.file_ids
+        for row in table.rows():
+            if file_ids[row] == file_id:
+                yield table.key(row), table.entry(row)
+
+    def _maybe_rebuild(self) -> None:
+        table: _Table = self._table
+        capacity: int = table.mask + 1
+        rows: int = len(table.hashes)
+        # keep the load under 2/3, and drop the garbage rows once they outnumber
+        # the live ones
+        if table.used * 3 < capacity * 2 and rows < 2 * table.live + _MIN_CAPACITY:
+            return
+        # the new table starts half full, so that we don't rebuild again right away
+        new_capacity: int = _MIN_CAPACITY
+        while new_capacity < table.live * 2:
+            new_capacity *= 2
+        new_table: _Table = _Table(new_capacity)
+        for row in table.rows():
+            h: int = table.hashes[row]
+            offset: int = table.key_offsets[row]
+            key_bytes: bytes = bytes(table.keys[offset : offset + table.key_sizes[row]])
+            slot: int = new_table.free_slot(h)
+            new_table.slots[slot] = new_table.append_row(h, key_bytes, table.entry(row))
+        new_table.used = new_table.live = table.live
+        self._table = new_table
+
+
+class _Values(typing.ValuesView[KeyEntry]):
+    # iterates over the rows directly, instead of looking up every key again
+    _mapping: CompactKeyDir
+
+    def __iter__(self) -> typing.Iterator[KeyEntry]:
+        table: _Table = self._mapping._table
+        for row in table.rows():
+            yield table.entry(row)
+
+
+class _Items(typing.ItemsView[str, KeyEntry]):
+    _mapping: CompactKeyDir
+
+    def __iter__(self) -> typing.Iterator[tuple[str, KeyEntry]]:
+        table: _Table = self._mapping._table
+        for row in table.rows():
+            yield table.key(row), table.entry(row)
+
+
+# SortedKeyDir keeps the keys in sorted lists of about these many keys each. A new key
+# is inserted into one short list, instead of shifting all the keys after it
+_SUBLIST_SIZE: typing.Final[int] = 512
+
+
+class _SortedIndex:
+    """
+    _SortedIndex is the list of the sorted sublists of SortedKeyDir, along with the
+    largest key of every sublist, to find the sublist of a key with a binary search.
+    Keys are inserted into and deleted from the sublists in place. When a sublist is
+    split or removed, a new _SortedIndex is swapped in with a single assignment, so a
+    reader never sees the two lists out of step with each other.
+    """
+
+    def __init__(self, sublists: list[list[str]]):
+        self.sublists: list[list[str]] = sublists
+        self.maxes: list[str] = [sublist[-1] for sublist in sublists]
+
+    @classmethod
+    def from_sorted(cls, keys: list[str]) -> "_SortedIndex":
+        return cls(
+            [keys[i : i + _SUBLIST_SIZE] for i in range(0, len(keys), _SUBLIST_SIZE)]
+        )
+
+
+class SortedKeyDir(typing.MutableMapping[str, KeyEntry]):
+    """
+    SortedKeyDir is a KeyDir which iterates over the keys in sorted order. The entries
+    are kept in a dict, and the keys are also kept in sorted sublists (a simpler
+    cousin of the B-tree), which back the ordered iteration with `irange`.
+
+    The KeyDir can be read and iterated from many threads while one thread writes to
+    it. The iterators don't fail when the KeyDir is modified under them: they never
+    return a key twice, and they always return the keys in order, but they may or may
+    not see the keys inserted after they were created.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[str, KeyEntry] = {}
+        self._index: _SortedIndex = _SortedIndex([])
+
+    def __getitem__(self, key: str) -> KeyEntry:
+        return self._entries[key]
+
+    def get(  # type: ignore[override]
+        self, key: str, default: typing.Optional[KeyEntry] = None
+    ) -> typing.Optional[KeyEntry]:
+        return self._entries.get(key, default)
+
+    def __setitem__(self, key: str, kv: KeyEntry) -> None:
+        is_new: bool = key not in self._entries
+        self._entries[key] = kv
+        if is_new:
+            self._insert(key)
+
+    def __delitem__(self, key: str) -> None:
+        del self._entries[key]
+        index: _SortedIndex = self._index
+        i: int = bisect.bisect_left(index.maxes, key)
+        sublist: list[str] = index.sublists[i]
+        del sublist[bisect.bisect_left(sublist, key)]
+        if not sublist:
+            self._index = _SortedIndex(index.sublists[:i] + index.sublists[i + 1 :])
+        elif index.maxes[i] == key:
+            index.maxes[i] = sublist[-1]
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return self.irange()
+
+    def __reversed__(self) -> typing.Iterator[str]:
+        return self.irange(reverse=True)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._entries
+
+    def update(self, other: typing.Any = (), /, **kwargs: KeyEntry) -> None:
+        # at the startup the KeyDir is loaded with a lot of keys at once. Sorting
+        # all of them in one go is much quicker than inserting them one by one
+        items: typing.Iterable[tuple[str, KeyEntry]] = (
+            other.items() if hasattr(other, "items") else other
+        )
+        entries: dict[str, KeyEntry] = self._entries
+        new_keys: list[str] = []
+        for key, kv in itertools.chain(items, kwargs.items()):
+            if key not in entries:
+                new_keys.append(key)
+            entries[key] = kv
+        if len(new_keys) * 8 > len(entries):
+            self._index = _SortedIndex.from_sorted(sorted(entries))
+            return
+        for key in new_keys:
+            self._insert(key)
+
+    def values(self) -> "typing.ValuesView[KeyEntry]":
+        return _SortedValues(self)
+
+    def items(self) -> "typing.ItemsView[str, KeyEntry]":
+        return _SortedItems(self)
+
+    def clear(self) -> None:
+        self._entries = {}
+        self._index = _SortedIndex([])
+
+    def segment_items(self, file_id: int) -> typing.Iterator[tuple[str, KeyEntry]]:
+        # the order doesn't matter here, so the dict is quicker than irange
+        return ((key, kv) for key, kv in self._entries.items() if kv.file_id == file_id)
+
+    def irange(
+        self,
+        start: typing.Optional[str] = None,
+        end: typing.Optional[str] = None,
+        reverse: bool = False,
+    ) -> typing.Iterator[str]:
+        """
+        irange returns the keys from start (inclusive) till end (exclusive) in order,
+        or in the reverse order. The keys are found lazily, as the iterator is
+        consumed
+
+        Args:
+            start (str): the smallest key to return. Defaults to the first key
+            end (str): the key to stop before. Defaults to after the last key
+            reverse (bool): if set, the keys are returned from the largest one
+        """
+        # we copy out one sublist at a time, and find the next one again with the last
+        # key we returned. So the iteration carries on correctly even if the
+        # sublists were split or removed meanwhile
+        if reverse:
+            batches: typing.Iterator[list[str]] = self._batches_before(end)
+        else:
+            batches = self._batches_after(start)
+        for batch in batches:
+            # only the last batch needs to be checked against the bound
+            if reverse and start is not None and batch[-1] < start:
+                yield from itertools.takewhile(lambda key: key >= start, batch)
+                return
+            if not reverse and end is not None and batch[-1] >= end:
+                yield from itertools.takewhile(lambda key: key < end, batch)
+                return
+            yield from batch
+
+    def _batches_after(self, key: typing.Optional[str]) -> typing.Iterator[list[str]]:
+        # yields the sorted keys from the key (inclusive), a sublist at a time
+        inclusive: bool = True
+        while True:
+            index: _SortedIndex = self._index
+            find = bisect.bisect_left if inclusive else bisect.bisect_right
+            i: int = 0 if key is None else find(index.maxes, key)
+            batch: list[str] = []
+            while not batch and i < len(index.sublists):
+                sublist: list[str] = index.sublists[i]
+                j: int = 0 if key is None else find(sublist, key)
+                batch = sublist[j:]
+                i += 1
+            if not batch:
+                return
+            yield batch
+            key, inclusive = batch[-1], False
+
+    def _batches_before(self, key: typing.Optional[str]) -> typing.Iterator[list[str]]:
+        # yields the keys before the key (exclusive) in reverse, a sublist at a time
+        while True:
+            index: _SortedIndex = self._index
+            i: int = len(index.sublists) - 1
+            if key is not None:
+                i = min(i, bisect.bisect_left(index.maxes, key))
+            batch: list[str] = []
+            while not batch and i >= 0:
+                sublist: list[str] = index.sublists[i]
+                j: int = (
+                    len(sublist) if key is None else bisect.bisect_left(sublist, key)
+                )
+                batch = sublist[:j]
+                batch.reverse()
+                i -= 1
+            if not batch:
+                return
+            yield batch
+            key = batch[-1]
+
+    def _insert(self, key: str) -> None:
+        index: _SortedIndex = self._index
+        if not index.sublists:
+            self._index = _SortedIndex([[key]])
+            return
+        i: int = bisect.bisect_left(index.maxes, key)
+        if i == len(index.maxes):
+            # the largest key so far, goes at the end of the last sublist
+            i -= 1
+            index.sublists[i].append(key)
+            index.maxes[i] = key
+        else:
+            bisect.insort(index.sublists[i], key)
+        sublist: list[str] = index.sublists[i]
+        if len(sublist) > 2 * _SUBLIST_SIZE:
+            # the halves are new lists, the old one stays as is for the readers
+            # which hold the old index
+            self._index = _SortedIndex(
+                index.sublists[:i]
+                + [sublist[:_SUBLIST_SIZE], sublist[_SUBLIST_SIZE:]]
+                + index.sublists[i + 1 :]
+            )
+
+
+class _SortedValues(typing.ValuesView[KeyEntry]):
+    # looks up the entries of the sorted keys without going through __getitem__
+    _mapping: SortedKeyDir
+
+    def __iter__(self) -> typing.Iterator[KeyEntry]:
+        entries: dict[str, KeyEntry] = self._mapping._entries
+        return map(entries.__getitem__, self._mapping.irange())
+
+
+class _SortedItems(typing.ItemsView[str, KeyEntry]):
+    _mapping: SortedKeyDir
+
+    def __iter__(self) -> typing.Iterator[tuple[str, KeyEntry]]:
+        entries: dict[str, KeyEntry] = self._mapping._entries
+        for key in self._mapping.irange():
+            yield key, entries[key]
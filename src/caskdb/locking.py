@@ -0,0 +1,77 @@
+"""
+locking module provides the advisory file lock which makes sure that only one process
+writes to a store at a time.
+
+Two writers appending to the same segment would interleave their records, and each
+would build a KeyDir which knows nothing about the records of the other. So a writable
+DiskStorage takes an exclusive lock on a lock file next to the data file, and holds it
+till it is closed. A second writer fails right away, instead of waiting. The read only
+stores don't take the lock, any number of them can open the store along with the
+writer.
+
+The lock is advisory: it stops only the processes which take it too. The OS releases
+it when the process exits, so a crashed writer doesn't leave the store locked.
+"""
+
+import errno
+import os
+import sys
+import typing
+
+# the lock file of a data file is stored next to it, with this suffix
+LOCK_FILE_SUFFIX: typing.Final[str] = ".lock"
+
+if sys.platform == "win32":
+    import msvcrt
+
+    def _lock(fd: int) -> None:
+        # locks the first byte of the file, which is enough to be exclusive
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+    def _unlock(fd: int) -> None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+else:
+    import fcntl
+
+    def _lock(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _unlock(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class FileLock:
+    """
+    FileLock is an exclusive advisory lock on a file. The file is created if it does
+    not exist, and it is left in place when the lock is released.
+
+    Args:
+        path (str): path of the lock file
+
+    Raises:
+        BlockingIOError: if another process (or another FileLock in this one) holds
+            the lock
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        self._fd: typing.Optional[int] = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            _lock(self._fd)
+        except OSError:
+            os.close(self._fd)
+            self._fd = None
+            raise BlockingIOError(
+                errno.EWOULDBLOCK, f"{path} is locked by another writer"
+            )
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        try:
+            _unlock(self._fd)
+        finally:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,334 @@
+"""
+metrics module instruments DiskStorage: it counts the operations, and keeps a latency
+histogram of every kind of them. These are the operations tracked:
+
+    get         - get, get_view, get_bytes and lookup_bytes
+    get_many    - get_many, get_many_bytes and lookup_many_bytes
+    set         - set and set_bytes, till the write returns (the fsync included, if the
+                  sync policy fsyncs every write)
+    set_many    - set_many and set_many_bytes
+    delete      - delete, delete_bytes and discard
+    fsync       - the fsyncs of the data file
+    startup     - the load of the KeyDir when the store is opened
+    merge       - the merges, run by hand or by the compactor
+
+Instrumentation is off by default, and then it costs nothing: the store runs exactly
+the code it runs without it. Pass `metrics=Metrics()` to turn it on. Only then the
+methods above are wrapped with the timers, when the store is opened.
+
+The histograms are log-linear, like HdrHistogram: every power of two is split into
+a few linear buckets. So a histogram takes a few kilobytes whatever the latencies are,
+and a percentile read off it is within 1/SUB_BUCKETS of the real one.
+
+The timings can also be shipped elsewhere (to Prometheus, statsd, logs...): a hook
+is called with every observation, right after it is recorded. Keep hooks quick, they
+run on the caller's thread, in the hot path.
+
+DiskStorage.stats() returns a StoreStats, which has the histograms along with the
+state of the store: live keys, dead bytes, file size, cache hit rate and so on. The
+state is available whether the instrumentation is on or not.
+
+Typical usage example:
+
+    metrics = Metrics()
+    metrics.add_hook(lambda op, seconds, size: print(op, seconds, size))
+    disk = DiskStorage(file_name="books.db", metrics=metrics)
+    disk.get("othello")
+    stats: StoreStats = disk.stats()
+    print(stats.live_keys, stats.operations["get"].percentile(99))
+"""
+
+import functools
+import threading
+import time
+import typing
+
+GET: typing.Final[str] = "get"
+GET_MANY: typing.Final[str] = "get_many"
+SET: typing.Final[str] = "set"
+SET_MANY: typing.Final[str] = "set_many"
+DELETE: typing.Final[str] = "delete"
+FSYNC: typing.Final[str] = "fsync"
+STARTUP: typing.Final[str] = "startup"
+MERGE: typing.Final[str] = "merge"
+
+OPERATIONS: typing.Final[tuple[str, ...]] = (
+    GET,
+    GET_MANY,
+    SET,
+    SET_MANY,
+    DELETE,
+    FSYNC,
+    STARTUP,
+    MERGE,
+)
+
+# every power of two is split into 2 ** SUB_BUCKET_BITS buckets. With 3 bits, the
+# buckets are at most 12.5% wide
+SUB_BUCKET_BITS: typing.Final[int] = 3
+SUB_BUCKETS: typing.Final[int] = 1 << SUB_BUCKET_BITS
+
+# latencies are kept in nanoseconds. Anything over 2 ** 45 ns (~9.8 hours) falls in
+# the last bucket
+MAX_LATENCY_BITS: typing.Final[int] = 45
+BUCKETS: typing.Final[int] = (MAX_LATENCY_BITS - SUB_BUCKET_BITS + 1) * SUB_BUCKETS
+
+# a hook is called with the operation, its latency in seconds, and the bytes it
+# moved (0 when not known, e.g. for a merge it is the bytes reclaimed)
+Hook = typing.Callable[[str, float, int], None]
+
+T = typing.TypeVar("T")
+
+
+def bucket_index(nanoseconds: int) -> int:
+    """
+    bucket_index returns the index of the histogram bucket the latency falls in. The
+    latencies below SUB_BUCKETS ns get a bucket each, the larger ones share their
+    power of two with SUB_BUCKETS - 1 others
+    """
+    if nanoseconds < SUB_BUCKETS:
+        return max(nanoseconds, 0)
+    # the top SUB_BUCKET_BITS + 1 bits of the latency pick the bucket: the position
+    # of the highest bit is the power of two, and the rest the bucket within it
+    shift: int = nanoseconds.bit_length() - SUB_BUCKET_BITS - 1
+    index: int = ((shift + 1) << SUB_BUCKET_BITS) + (nanoseconds >> shift) - SUB_BUCKETS
+    return min(index, BUCKETS - 1)
+
+
+def bucket_start(index: int) -> int:
+    """
+    bucket_start returns the smallest latency, in nanoseconds, of the bucket
+    """
+    if index < SUB_BUCKETS:
+        return index
+    shift: int = (index >> SUB_BUCKET_BITS) - 1
+    return ((index & (SUB_BUCKETS - 1)) + SUB_BUCKETS) << shift
+
+
+class Histogram:
+    """
+    Histogram counts the latencies of an operation in log-linear buckets. It is not
+    thread safe by itself, Metrics holds a lock around it
+
+    Attributes:
+        count (int): number of latencies recorded
+        total (float): sum of the latencies, in seconds
+        max (float): the largest latency, in seconds
+        bytes (int): sum of the sizes recorded along with the latencies
+    """
+
+    def __init__(self) -> None:
+        self.count: int = 0
+        self.total: float = 0.0
+        self.max: float = 0.0
+        self.bytes: int = 0
+        self._buckets: list[int] = [0] * BUCKETS
+
+    def record(self, seconds: float, size: int = 0) -> None:
+        self.count += 1
+        self.total += seconds
+        self.bytes += size
+        if seconds > self.max:
+            self.max = seconds
+        self._buckets[bucket_index(int(seconds * 1e9))] += 1
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p: float) -> float:
+        """
+        percentile returns the latency, in seconds, which p percent of the recorded
+        ones are at or below. It is the end of the bucket the percentile falls in,
+        so it overestimates by at most the width of the bucket. Returns 0 if nothing
+        was recorded
+
+        Raises:
+            ValueError: if p is not between 0 and 100
+        """
+        if not 0 <= p <= 100:
+            raise ValueError("p must be between 0 and 100")
+        if not self.count:
+            return 0.0
+        # the rank of the latency we are looking for, counting from 1
+        rank: int = max(1, -int(-p * self.count // 100))
+        seen: int = 0
+        for index, count in enumerate(self._buckets):
+            seen += count
+            if seen >= rank:
+                return min(bucket_start(index + 1) / 1e9, self.max)
+        return self.max
+
+    def copy(self) -> "Histogram":
+        histogram: Histogram = Histogram()
+        histogram.count = self.count
+        histogram.total = self.total
+        histogram.max = self.max
+        histogram.bytes = self.bytes
+        histogram._buckets = list(self._buckets)
+        return histogram
+
+    def as_dict(self) -> dict[str, float]:
+        return {
+            "count": self.count,
+            "bytes": self.bytes,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+            "max": self.max,
+        }
+
+    def __repr__(self) -> str:
+        return (
+            f"Histogram(count={self.count}, mean={self.mean:.6f}, "
+            f"p99={self.percentile(99):.6f}, max={self.max:.6f})"
+        )
+
+
+class Metrics:
+    """
+    Metrics collects the latencies of the operations of a store, and passes them on
+    to the hooks. It is thread safe, and can be shared by many stores (e.g. the shards
+    of a ShardedStorage), which are then reported together
+
+    Args:
+        hooks (typing.Iterable[Hook]): called with every latency recorded
+
+    Attributes:
+        hooks (list[Hook]): the hooks
+    """
+
+    def __init__(self, hooks: typing.Iterable[Hook] = ()) -> None:
+        self.hooks: list[Hook] = list(hooks)
+        self._histograms: dict[str, Histogram] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def add_hook(self, hook: Hook) -> None:
+        self.hooks.append(hook)
+
+    def observe(self, operation: str, seconds: float, size: int = 0) -> None:
+        """
+        observe records that the operation took the given seconds, and moved size
+        bytes
+        """
+        with self._lock:
+            histogram: typing.Optional[Histogram] = self._histograms.get(operation)
+            if histogram is None:
+                histogram = self._histograms[operation] = Histogram()
+            histogram.record(seconds, size)
+        for hook in self.hooks:
+            hook(operation, seconds, size)
+
+    def timed(
+        self,
+        operation: str,
+        method: typing.Callable[..., T],
+        size: typing.Optional[typing.Callable[[T], int]] = None,
+    ) -> typing.Callable[..., T]:
+        """
+        timed wraps the method, so that every call of it is observed as the
+        operation. The size of a call is taken from its result, with the size
+        function. A call which raises is not observed
+        """
+        perf_counter: typing.Callable[[], float] = time.perf_counter
+        observe: typing.Callable[[str, float, int], None] = self.observe
+
+        @functools.wraps(method)
+        def wrapper(*args: typing.Any, **kwargs: typing.Any) -> T:
+            start: float = perf_counter()
+            result: T = method(*args, **kwargs)
+            observe(
+                operation,
+                perf_counter() - start,
+                size(result) if size is not None else 0,
+            )
+            return result
+
+        return wrapper
+
+    def histograms(self) -> dict[str, Histogram]:
+        """
+        histograms returns a copy of the histograms of the operations observed so far
+        """
+        with self._lock:
+            return {op: h.copy() for op, h in self._histograms.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+
+
+class StoreStats:
+    """
+    StoreStats is a snapshot of the state of a DiskStorage, returned by its `stats`
+
+    Attributes:
+        live_keys (int): keys in the KeyDir
+        segments (int): number of the segments
+        file_size (int): total size of the segments, in bytes
+        dead_bytes (int): bytes of the segments taken by the stale records and the
+            tombstones, which a merge would reclaim
+        bytes_written (int): bytes appended since the store was opened
+        syncs (int): fsyncs done since the store was opened
+        merges (int): merges done since the store was opened
+        bytes_reclaimed (int): bytes reclaimed by the merges
+        cache_hit_rate (typing.Optional[float]): hit rate of the value cache, None if
+            there is no cache
+        bloom_false_positive_rate (typing.Optional[float]): observed false-positive
+            rate of the Bloom filters, None if there are no filters
+        operations (dict[str, Histogram]): latencies of the operations, empty when the
+            store is not instrumented
+    """
+
+    def __init__(
+        self,
+        live_keys: int = 0,
+        segments: int = 0,
+        file_size: int = 0,
+        dead_bytes: int = 0,
+        bytes_written: int = 0,
+        syncs: int = 0,
+        merges: int = 0,
+        bytes_reclaimed: int = 0,
+        cache_hit_rate: typing.Optional[float] = None,
+        bloom_false_positive_rate: typing.Optional[float] = None,
+        operations: typing.Optional[dict[str, Histogram]] = None,
+    ) -> None:
+        self.live_keys: int = live_keys
+        self.segments: int = segments
+        self.file_size: int = file_size
+        self.dead_bytes: int = dead_bytes
+        self.bytes_written: int = bytes_written
+        self.syncs: int = syncs
+        self.merges: int = merges
+        self.bytes_reclaimed: int = bytes_reclaimed
+        self.cache_hit_rate: typing.Optional[float] = cache_hit_rate
+        self.bloom_false_positive_rate: typing.Optional[float] = (
+            bloom_false_positive_rate
+        )
+        self.operations: dict[str, Histogram] = operations or {}
+
+    @property
+    def dead_byte_ratio(self) -> float:
+        return self.dead_bytes / self.file_size if self.file_size else 0.0
+
+    def as_dict(self) -> dict[str, typing.Any]:
+        """
+        as_dict returns the stats as a dict of plain values, e.g. to dump it as JSON
+        """
+        stats: dict[str, typing.Any] = {
+            key: value for key, value in vars(self).items() if key != "operations"
+        }
+        stats["dead_byte_ratio"] = self.dead_byte_ratio
+        stats["operations"] = {
+            op: histogram.as_dict() for op, histogram in self.operations.items()
+        }
+        return stats
+
+    def __repr__(self) -> str:
+        return (
+            f"StoreStats(live_keys={self.live_keys}, segments={self.segments}, "
+            f"file_size={self.file_size}, dead_bytes={self.dead_bytes}, "
+            f"cache_hit_rate={self.cache_hit_rate})"
+        )
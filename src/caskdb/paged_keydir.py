@@ -0,0 +1,516 @@
+"""
+paged_keydir module implements PagedKeyDir, a KeyDir which lives in files on the disk
+rather than in the memory of the process.
+
+The other KeyDirs hold every key in memory, so the number of keys a store can have is
+capped by the RAM, and the startup has to read all of them. PagedKeyDir keeps the same
+open addressing hash table as CompactKeyDir, but in two memory mapped files next to
+the data file:
+
+    - `<file_name>.index` has the slots of the hash table. A slot has the entry of a
+      key, and where its key is in the keys file
+    - `<file_name>.index.keys` has the key bytes, one after another
+
+The OS pages the parts of the files we touch in and out of its page cache, so the
+process uses only as much memory as the pages which are hot. A lookup touches one or
+two slots and the key, a page or two. A small LRU cache of the hot entries sits in
+front of the files, and saves even that for the popular keys.
+
+The files are updated in place, as the store is written to. So at any moment they are
+only as durable as the OS made them, and after a crash they can't be trusted. A clean
+`close` flushes them and then writes `<file_name>.index.meta`, with the counters of
+the table and the size and the live bytes of every segment at that moment. Its
+presence says the index is complete; the first write after the open removes it. On the
+next startup, DiskStorage finds the meta file, checks that the segments are still the
+ones it describes, and starts without reading a single key: the startup costs the same
+for a thousand keys and for a hundred million. (DiskStorage seals the active segment
+on close, so that the keys of the active segment don't have to be read either.) If the
+meta file is missing or doesn't match the segments, the index is rebuilt from the
+segments, like the other KeyDirs are, but into the files.
+
+Pair it with Bloom filters (`bloom_fp_rate`), so that the lookups of the missing keys
+don't have to touch the files at all.
+
+Typical usage example:
+
+    disk = DiskStorage(file_name="books.db", key_dir_type="paged", bloom_fp_rate=0.01)
+"""
+
+import collections
+import mmap
+import os
+import struct
+import threading
+import typing
+import zlib
+
+from caskdb.cache import CacheStats
+from caskdb.format import KeyEntry, decode_key, encode_key
+
+# the index of a data file is stored next to it, with this suffix. The keys and the
+# meta files are named after the index file, with their own suffixes
+INDEX_FILE_SUFFIX: typing.Final[str] = ".index"
+KEYS_FILE_SUFFIX: typing.Final[str] = ".keys"
+META_FILE_SUFFIX: typing.Final[str] = ".meta"
+
+# number of the entries in the hot cache, by default
+DEFAULT_CACHE_ENTRIES: typing.Final[int] = 1 << 16
+
+# a slot of the hash table:
+#
+# ┌───────┬─────┬────────────┬──────────┬───────────┬──────────┬────────────┬─────────┐
+# │ state │ tag │ key_offset │ key_size │ timestamp │ position │ total_size │ file_id │
+# └───────┴─────┴────────────┴──────────┴───────────┴──────────┴────────────┴─────────┘
+# ├── 4 ──┼─ 4 ─┼──── 8 ─────┼─── 4 ────┼──── 4 ────┼──── 8 ───┼───── 4 ────┼─── 4 ───┤
+#
+# The tag is a second hash of the key, so that a probe compares the key bytes only
+# when the tags match. A new file is all zeros, i.e. all the slots are empty
+SLOT: typing.Final[struct.Struct] = struct.Struct("<LLQLLQLL")
+SLOT_SIZE: typing.Final[int] = SLOT.size
+
+# the states of a slot
+_EMPTY: typing.Final[int] = 0
+_LIVE: typing.Final[int] = 1
+_DELETED: typing.Final[int] = 2
+
+# the meta file has the counters of the table, followed by every segment
+_META_HEADER: typing.Final[struct.Struct] = struct.Struct("<QQQQ")
+_META_SEGMENT: typing.Final[struct.Struct] = struct.Struct("<LQQ")
+
+_MIN_CAPACITY: typing.Final[int] = 1024
+_MIN_KEYS_CAPACITY: typing.Final[int] = 64 << 10
+
+
+class IndexMeta:
+    """
+    IndexMeta is what the meta file of a cleanly closed index says
+
+    Attributes:
+        used (int): slots of the table which are not empty
+        live (int): keys in the table
+        keys_end (int): bytes of the keys file in use
+        file_sizes (dict[int, int]): size of every segment when the index was closed
+        live_bytes (dict[int, int]): live bytes of every segment
+    """
+
+    def __init__(
+        self,
+        used: int,
+        live: int,
+        keys_end: int,
+        file_sizes: dict[int, int],
+        live_bytes: dict[int, int],
+    ):
+        self.used: int = used
+        self.live: int = live
+        self.keys_end: int = keys_end
+        self.file_sizes: dict[int, int] = file_sizes
+        self.live_bytes: dict[int, int] = live_bytes
+
+
+def _hashes(key_bytes: bytes) -> tuple[int, int]:
+    # the slot hash and the tag. Both have to be the same in every process, since
+    # the table is saved
+    return zlib.crc32(key_bytes), zlib.adler32(key_bytes)
+
+
+def _map(path: str, size: int) -> tuple[typing.BinaryIO, mmap.mmap]:
+    # opens (or creates) the file, grows it to the size, and maps it
+    f: typing.BinaryIO = open(path, "r+b" if os.path.exists(path) else "w+b")
+    if os.fstat(f.fileno()).st_size < size:
+        f.truncate(size)
+    return f, mmap.mmap(f.fileno(), 0)
+
+
+class _Pages:
+    """
+    _Pages holds the mapped files of PagedKeyDir. A slot is read and written with a
+    single `unpack_from` and `pack_into`, so a reader never sees a half written one.
+    When the table is full, a new _Pages is built and swapped in with a single
+    assignment; the readers still using the old one keep its mappings alive.
+    """
+
+    def __init__(self, path: str, keys_path: str, capacity: int, keys_capacity: int):
+        self.file, self.slots = _map(path, capacity * SLOT_SIZE)
+        self.capacity: int = len(self.slots) // SLOT_SIZE
+        self.mask: int = self.capacity - 1
+        self.keys_file, self.keys = _map(keys_path, keys_capacity)
+        self.used: int = 0
+        self.live: int = 0
+        self.keys_end: int = 0
+
+    def find(self, key_bytes: bytes) -> int:
+        # returns the slot of the key, or -1 if the key is not present
+        h, tag = _hashes(key_bytes)
+        slots: mmap.mmap = self.slots
+        unpack = SLOT.unpack_from
+        i: int = h & self.mask
+        while True:
+            state, slot_tag, offset, size, _, _, _, _ = unpack(slots, i * SLOT_SIZE)
+            if state == _EMPTY:
+                return -1
+            if (
+                state == _LIVE
+                and slot_tag == tag
+                and size == len(key_bytes)
+                and self.keys[offset : offset + size] == key_bytes
+            ):
+                return i
+            i = (i + 1) & self.mask
+
+    def free_slot(self, key_bytes: bytes) -> int:
+        # returns the first slot on the probe sequence which can take a new key
+        i: int = zlib.crc32(key_bytes) & self.mask
+        while self.slots[i * SLOT_SIZE] == _LIVE:
+            i = (i + 1) & self.mask
+        return i
+
+    def entry(self, slot: int) -> KeyEntry:
+        _, _, _, _, timestamp, position, total_size, file_id = SLOT.unpack_from(
+            self.slots, slot * SLOT_SIZE
+        )
+        return KeyEntry(timestamp, position, total_size, file_id)
+
+    def key(self, slot: int) -> str:
+        _, _, offset, size, _, _, _, _ = SLOT.unpack_from(self.slots, slot * SLOT_SIZE)
+        return decode_key(self.keys[offset : offset + size])
+
+    def write(self, slot: int, key_bytes: bytes, offset: int, kv: KeyEntry) -> None:
+        SLOT.pack_into(
+            self.slots,
+            slot * SLOT_SIZE,
+            _LIVE,
+            _hashes(key_bytes)[1],
+            offset,
+            len(key_bytes),
+            kv.timestamp,
+            kv.position,
+            kv.total_size,
+            kv.file_id,
+        )
+
+    def append_key(self, key_bytes: bytes) -> int:
+        # the keys file is grown by doubling. The old mapping stays valid for the
+        # readers which hold it, and the new one maps the old bytes too
+        offset: int = self.keys_end
+        if offset + len(key_bytes) > len(self.keys):
+            size: int = len(self.keys)
+            while offset + len(key_bytes) > size:
+                size *= 2
+            self.keys_file.truncate(size)
+            self.keys = mmap.mmap(self.keys_file.fileno(), 0)
+        self.keys[offset : offset + len(key_bytes)] = key_bytes
+        self.keys_end += len(key_bytes)
+        return offset
+
+    def live_slots(self) -> typing.Iterator[int]:
+        slots: mmap.mmap = self.slots
+        for i in range(self.capacity):
+            if slots[i * SLOT_SIZE] == _LIVE:
+                yield i
+
+    def flush(self) -> None:
+        self.slots.flush()
+        self.keys.flush()
+
+    def close(self) -> None:
+        # the mappings are closed along with the objects, once no reader holds them
+        self.file.close()
+        self.keys_file.close()
+
+
+class PagedKeyDir(typing.MutableMapping[str, KeyEntry]):
+    """
+    PagedKeyDir is a KeyDir which keeps the entries in memory mapped files, check the
+    module documentation. It behaves like a dict of KeyEntry, except that the KeyEntry
+    objects it returns are created on every lookup, like the ones of CompactKeyDir.
+
+    The KeyDir can be read from many threads while one thread writes to it. Multiple
+    writers need to be serialised by the caller, DiskStorage does that with its write
+    lock.
+
+    Args:
+        path (str): path of the index file. The keys and the meta files are next to
+            it
+        cache_entries (int): number of the hot entries kept in memory. 0 turns the
+            cache off
+
+    Attributes:
+        meta (typing.Optional[IndexMeta]): what the meta file said, if the index was
+            closed cleanly. DiskStorage decides whether it can use the index as is
+        cache_stats (CacheStats): counters of the hot cache
+    """
+
+    def __init__(self, path: str, cache_entries: int = DEFAULT_CACHE_ENTRIES):
+        if cache_entries < 0:
+            raise ValueError("cache_entries must not be negative")
+        self.path: str = path
+        self._keys_path: str = path + KEYS_FILE_SUFFIX
+        self._meta_path: str = path + META_FILE_SUFFIX
+        self.meta: typing.Optional[IndexMeta] = load_meta(self._meta_path)
+        self.cache_stats: CacheStats = CacheStats()
+        self._cache_entries: int = cache_entries
+        self._cache: collections.OrderedDict[str, KeyEntry] = collections.OrderedDict()
+        self._cache_lock: threading.Lock = threading.Lock()
+        # bumped by every write, so that a reader doesn't cache an entry which was
+        # replaced while it was looking it up
+        self._version: int = 0
+        # the meta file is removed by the first write, the files are not complete
+        # from then on till they are saved again
+        self._clean: bool = self.meta is not None
+        if self.meta is None:
+            self._pages: _Pages = self._new_pages(_MIN_CAPACITY, _MIN_KEYS_CAPACITY)
+        else:
+            self._pages = _Pages(
+                path, self._keys_path, _MIN_CAPACITY, _MIN_KEYS_CAPACITY
+            )
+            self._pages.used = self.meta.used
+            self._pages.live = self.meta.live
+            self._pages.keys_end = self.meta.keys_end
+
+    def __getitem__(self, key: str) -> KeyEntry:
+        kv: typing.Optional[KeyEntry] = self.get(key)
+        if kv is None:
+            raise KeyError(key)
+        return kv
+
+    def get(  # type: ignore[override]
+        self, key: str, default: typing.Optional[KeyEntry] = None
+    ) -> typing.Optional[KeyEntry]:
+        if self._cache_entries:
+            with self._cache_lock:
+                cached: typing.Optional[KeyEntry] = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    self.cache_stats.hits += 1
+                    return cached
+                self.cache_stats.misses += 1
+        version: int = self._version
+        pages: _Pages = self._pages
+        slot: int = pages.find(encode_key(key))
+        if slot < 0:
+            return default
+        kv: KeyEntry = pages.entry(slot)
+        if self._cache_entries:
+            with self._cache_lock:
+                if version == self._version:
+                    self._cache[key] = kv
+                    if len(self._cache) > self._cache_entries:
+                        self._cache.popitem(last=False)
+                        self.cache_stats.evictions += 1
+        return kv
+
+    def __setitem__(self, key: str, kv: KeyEntry) -> None:
+        self._dirty()
+        pages: _Pages = self._pages
+        key_bytes: bytes = encode_key(key)
+        slot: int = pages.find(key_bytes)
+        if slot >= 0:
+            # the key keeps its bytes in the keys file, only the entry is replaced
+            _, _, offset, _, _, _, _, _ = SLOT.unpack_from(
+                pages.slots, slot * SLOT_SIZE
+            )
+        else:
+            offset = pages.append_key(key_bytes)
+            slot = pages.free_slot(key_bytes)
+            if pages.slots[slot * SLOT_SIZE] == _EMPTY:
+                pages.used += 1
+            pages.live += 1
+        pages.write(slot, key_bytes, offset, kv)
+        self._invalidate(key)
+        self._maybe_rebuild()
+
+    def __delitem__(self, key: str) -> None:
+        pages: _Pages = self._pages
+        slot: int = pages.find(encode_key(key))
+        if slot < 0:
+            raise KeyError(key)
+        self._dirty()
+        # the key bytes stay in the keys file as garbage, till the next rebuild
+        pages.slots[slot * SLOT_SIZE] = _DELETED
+        pages.live -= 1
+        self._invalidate(key)
+
+    def __iter__(self) -> typing.Iterator[str]:
+        pages: _Pages = self._pages
+        for slot in pages.live_slots():
+            yield pages.key(slot)
+
+    def __len__(self) -> int:
+        return self._pages.live
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        return self.get(key) is not None
+
+    def values(self) -> "typing.ValuesView[KeyEntry]":
+        return _PagedValues(self)
+
+    def items(self) -> "typing.ItemsView[str, KeyEntry]":
+        return _PagedItems(self)
+
+    def clear(self) -> None:
+        self._dirty()
+        old: _Pages = self._pages
+        self._pages = self._new_pages(_MIN_CAPACITY, _MIN_KEYS_CAPACITY)
+        old.close()
+        with self._cache_lock:
+            self._version += 1
+            self._cache.clear()
+
+    def segment_items(self, file_id: int) -> typing.Iterator[tuple[str, KeyEntry]]:
+        pages: _Pages = self._pages
+        # the slots are unpacked in one go, and only the keys of the segment are read
+        with memoryview(pages.slots) as view:
+            for slot in SLOT.iter_unpack(view[: pages.capacity * SLOT_SIZE]):
+                state, _, offset, size, timestamp, position, total_size, fid = slot
+                if state == _LIVE and fid == file_id:
+                    kv: KeyEntry = KeyEntry(timestamp, position, total_size, fid)
+                    yield decode_key(pages.keys[offset : offset + size]), kv
+
+    def save(self, file_sizes: dict[int, int], live_bytes: dict[int, int]) -> None:
+        """
+        save makes the index durable, along with the sizes and the live bytes of the
+        segments it describes. The next open can use it without reading the segments
+
+        Args:
+            file_sizes (dict[int, int]): size of every segment
+            live_bytes (dict[int, int]): live bytes of every segment
+        """
+        pages: _Pages = self._pages
+        pages.flush()
+        self.meta = IndexMeta(
+            pages.used, pages.live, pages.keys_end, dict(file_sizes), dict(live_bytes)
+        )
+        save_meta(self._meta_path, self.meta)
+        self._clean = True
+
+    def close(self) -> None:
+        self._pages.close()
+
+    def _dirty(self) -> None:
+        # the first write after an open (or a save) makes the saved index stale. The
+        # meta file has to be gone for good before any page of the index changes, so
+        # the removal is synced along with the directory
+        if not self._clean:
+            return
+        self._clean = False
+        self.meta = None
+        if os.path.exists(self._meta_path):
+            os.remove(self._meta_path)
+            _sync_directory(self._meta_path)
+
+    def _invalidate(self, key: str) -> None:
+        if not self._cache_entries:
+            return
+        with self._cache_lock:
+            self._version += 1
+            self._cache.pop(key, None)
+
+    def _new_pages(self, capacity: int, keys_capacity: int) -> _Pages:
+        # a new table is written to temporary files, and renamed over the old ones
+        temp_path: str = self.path + ".tmp"
+        temp_keys_path: str = self._keys_path + ".tmp"
+        for path in (temp_path, temp_keys_path):
+            if os.path.exists(path):
+                os.remove(path)
+        pages: _Pages = _Pages(temp_path, temp_keys_path, capacity, keys_capacity)
+        os.replace(temp_path, self.path)
+        os.replace(temp_keys_path, self._keys_path)
+        return pages
+
+    def _maybe_rebuild(self) -> None:
+        pages: _Pages = self._pages
+        # keep the load under 2/3. The deleted slots count too, since they don't
+        # end a probe
+        if pages.used * 3 < pages.capacity * 2:
+            return
+        capacity: int = _MIN_CAPACITY
+        while capacity < pages.live * 2:
+            capacity *= 2
+        keys_capacity: int = max(_MIN_KEYS_CAPACITY, pages.keys_end)
+        new_pages: _Pages = self._new_pages(capacity, keys_capacity)
+        for slot in pages.live_slots():
+            _, _, offset, size, _, _, _, _ = SLOT.unpack_from(
+                pages.slots, slot * SLOT_SIZE
+            )
+            key_bytes: bytes = pages.keys[offset : offset + size]
+            new_slot: int = new_pages.free_slot(key_bytes)
+            new_offset: int = new_pages.append_key(key_bytes)
+            new_pages.write(new_slot, key_bytes, new_offset, pages.entry(slot))
+        new_pages.used = new_pages.live = pages.live
+        self._pages = new_pages
+        pages.close()
+
+
+class _PagedValues(typing.ValuesView[KeyEntry]):
+    # iterates over the slots directly, instead of looking up every key again
+    _mapping: PagedKeyDir
+
+    def __iter__(self) -> typing.Iterator[KeyEntry]:
+        pages: _Pages = self._mapping._pages
+        for slot in pages.live_slots():
+            yield pages.entry(slot)
+
+
+class _PagedItems(typing.ItemsView[str, KeyEntry]):
+    _mapping: PagedKeyDir
+
+    def __iter__(self) -> typing.Iterator[tuple[str, KeyEntry]]:
+        pages: _Pages = self._mapping._pages
+        for slot in pages.live_slots():
+            yield pages.key(slot), pages.entry(slot)
+
+
+def load_meta(path: str) -> typing.Optional[IndexMeta]:
+    """
+    load_meta returns what the meta file at the path says, or None if there is no such
+    file, or it is not complete
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        data: bytes = f.read()
+    if len(data) < _META_HEADER.size:
+        return None
+    used, live, keys_end, count = _META_HEADER.unpack_from(data)
+    if len(data) != _META_HEADER.size + count * _META_SEGMENT.size:
+        return None
+    file_sizes: dict[int, int] = {}
+    live_bytes: dict[int, int] = {}
+    for offset in range(_META_HEADER.size, len(data), _META_SEGMENT.size):
+        file_id, size, live_size = _META_SEGMENT.unpack_from(data, offset)
+        file_sizes[file_id] = size
+        live_bytes[file_id] = live_size
+    return IndexMeta(used, live, keys_end, file_sizes, live_bytes)
+
+
+def save_meta(path: str, meta: IndexMeta) -> None:
+    """
+    save_meta writes the meta file. Like the hint files, it is written to a temporary
+    file first and renamed
+    """
+    data: bytearray = bytearray(
+        _META_HEADER.pack(meta.used, meta.live, meta.keys_end, len(meta.file_sizes))
+    )
+    for file_id, size in meta.file_sizes.items():
+        data += _META_SEGMENT.pack(file_id, size, meta.live_bytes.get(file_id, 0))
+    temp_path: str = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def _sync_directory(path: str) -> None:
+    # makes a removal or a rename in the directory of the path durable. Windows can't
+    # open a directory, and doesn't need it
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd: int = os.open(os.path.dirname(path) or ".", os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,163 @@
+"""
+resp module implements the parts of RESP, the protocol of Redis, which the caskdb
+server speaks: parsing the commands of the clients, and encoding the replies.
+
+A client sends a command as an array of bulk strings, i.e. the name of the command and
+its arguments, each prefixed with its length:
+
+    *3\\r\\n$3\\r\\nSET\\r\\n$4\\r\\nname\\r\\n$4\\r\\njojo\\r\\n
+
+So the arguments are binary safe, they can hold any bytes. The server replies with
+one of these:
+
+    +OK\\r\\n                      simple string
+    -ERR unknown command\\r\\n     error
+    :3\\r\\n                       integer
+    $4\\r\\njojo\\r\\n             bulk string, $-1\\r\\n for a missing value
+    *2\\r\\n$1\\r\\na\\r\\n$-1\\r\\n   array of the above
+
+The tools like telnet or redis-cli may also send "inline" commands, a line of words
+separated by spaces, which are parsed too.
+
+A client may send many commands without waiting for the replies (pipelining), and a
+read from the socket may end in the middle of a command. CommandParser is fed the bytes
+as they come, and hands out the commands which are complete.
+
+Typical usage example:
+
+    parser = CommandParser()
+    parser.feed(b"*2\\r\\n$3\\r\\nGET\\r\\n$4\\r\\nname\\r\\n")
+    for command in parser:
+        reply: bytes = encode_bulk(b"jojo")
+"""
+
+import typing
+
+# the largest bulk string and the longest array a client may send, as Redis does. A
+# larger one is most likely garbage, which would make us buffer it forever
+MAX_BULK_SIZE: typing.Final[int] = 512 * 1024 * 1024
+MAX_ARRAY_SIZE: typing.Final[int] = 1024 * 1024
+
+# the longest line we wait for, e.g. an inline command or the length of a bulk string
+MAX_LINE_SIZE: typing.Final[int] = 64 * 1024
+
+CRLF: typing.Final[bytes] = b"\r\n"
+
+OK: typing.Final[bytes] = b"+OK\r\n"
+NULL: typing.Final[bytes] = b"$-1\r\n"
+
+
+class ProtocolError(ValueError):
+    """
+    ProtocolError is raised when a client sends bytes which are not a RESP command.
+    There is no telling where the next command starts after them, so the connection is
+    closed
+    """
+
+
+class CommandParser:
+    """
+    CommandParser parses the commands out of the bytes a client sends. Iterating over
+    it returns the commands which are complete, as lists of their arguments, the name
+    of the command being the first one. The bytes of an incomplete command are kept
+    till the rest of it is fed
+    """
+
+    def __init__(self) -> None:
+        self._buffer: bytearray = bytearray()
+        # position of the first byte not parsed yet
+        self._position: int = 0
+
+    def feed(self, data: bytes) -> None:
+        # the commands parsed already are dropped first, so that the buffer doesn't
+        # grow with the connection
+        if self._position:
+            del self._buffer[: self._position]
+            self._position = 0
+        self._buffer += data
+
+    def __iter__(self) -> typing.Iterator[list[bytes]]:
+        while True:
+            command: typing.Optional[list[bytes]] = self._parse()
+            if command is None:
+                return
+            # an empty inline command (i.e. an empty line) is skipped
+            if command:
+                yield command
+
+    def _line(self, position: int) -> int:
+        # _line returns the position of the CRLF which ends the line at the position,
+        # or -1 if the line is not complete yet
+        end: int = self._buffer.find(CRLF, position)
+        if end < 0 and len(self._buffer) - position > MAX_LINE_SIZE:
+            raise ProtocolError("line too long")
+        return end
+
+    def _number(self, position: int, end: int, limit: int) -> int:
+        try:
+            number: int = int(self._buffer[position + 1 : end])
+        except ValueError:
+            raise ProtocolError("invalid length") from None
+        if number > limit:
+            raise ProtocolError("length too large")
+        return number
+
+    def _parse(self) -> typing.Optional[list[bytes]]:
+        buffer: bytearray = self._buffer
+        position: int = self._position
+        if position >= len(buffer):
+            return None
+        end: int = self._line(position)
+        if end < 0:
+            return None
+        if buffer[position] != ord("*"):
+            # an inline command
+            self._position = end + len(CRLF)
+            return bytes(buffer[position:end]).split()
+        count: int = self._number(position, end, MAX_ARRAY_SIZE)
+        position = end + len(CRLF)
+        args: list[bytes] = []
+        for _ in range(count):
+            if position >= len(buffer):
+                return None
+            if buffer[position] != ord("$"):
+                raise ProtocolError(f"expected '$', got {chr(buffer[position])!r}")
+            end = self._line(position)
+            if end < 0:
+                return None
+            size: int = self._number(position, end, MAX_BULK_SIZE)
+            position = end + len(CRLF)
+            if position + size + len(CRLF) > len(buffer):
+                return None
+            if buffer[position + size : position + size + len(CRLF)] != CRLF:
+                raise ProtocolError("bulk string not followed by CRLF")
+            args.append(bytes(buffer[position : position + size]))
+            position += size + len(CRLF)
+        self._position = position
+        return args
+
+
+def encode_simple(value: str) -> bytes:
+    return b"+" + value.encode("utf-8") + CRLF
+
+
+def encode_error(message: str) -> bytes:
+    # an error is a single line, so the message can't have line breaks
+    return b"-" + message.replace("\r", " ").replace("\n", " ").encode("utf-8") + CRLF
+
+
+def encode_integer(value: int) -> bytes:
+    return b":%d\r\n" % value
+
+
+def encode_bulk(value: typing.Optional[bytes]) -> bytes:
+    if value is None:
+        return NULL
+    return b"$%d\r\n%b\r\n" % (len(value), value)
+
+
+def encode_array(items: typing.Sequence[bytes]) -> bytes:
+    """
+    encode_array encodes an array of the replies, which are encoded already
+    """
+    return b"*%d\r\n" % len(items) + b"".join(items)
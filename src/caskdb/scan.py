@@ -0,0 +1,475 @@
+"""
+scan module reads the records of the segments at the startup, to build the KeyDir from
+them, on one core or on many.
+
+The scan reads only the headers and the keys of the records. Still, for a store
+without hint files (e.g. after a crash), it is bound by the CPU rather than the disk:
+every header is unpacked, every record is checked against its checksum, and every key
+is decoded, one record at a time. DiskStorage with `startup_workers` spreads this work
+over a pool of processes (threads wouldn't do, the scan holds the GIL).
+
+The parts of the segments which need to be scanned are split into chunks, and every
+chunk is scanned by a worker. A segment has no markers between its records though, so
+a worker can't tell where the first record of its chunk starts. It looks for it: the
+first offset at which a record with a known version and a valid checksum starts, and
+is followed by another valid record. The worker of the previous chunk reads past the
+end of its chunk, till the end of the record (or the batch) which crosses it, so it
+knows where the next record really starts. The two are compared when the chunks are
+merged. If they disagree (say, a value held a whole valid record, or the chunk started
+inside a batch), the chunk is scanned again from the right position. So a wrong guess
+costs time, never correctness.
+
+A worker sends back only the last record of every key in its chunk, as a list of the
+keys and arrays of their timestamps, positions and sizes, which are cheap to pickle.
+The chunks are merged in the order of the segments and of the positions, so a later
+record of a key still replaces an earlier one, like in the sequential scan.
+
+Typical usage example:
+
+    with concurrent.futures.ProcessPoolExecutor(4) as pool:
+        futures = [
+            pool.submit(scan_chunk, path, 0, start, stop, start == 0)
+            for start, stop in plan_chunks(0, os.path.getsize(path), 4)
+        ]
+        entries: dict[str, KeyEntry] = {}
+        end: int = merge_chunks(path, 0, 0, (f.result() for f in futures), entries)
+"""
+
+import array
+import itertools
+import logging
+import os
+import struct
+import typing
+import zlib
+
+from caskdb.format import (
+    BATCH_MARKER,
+    CRC_SIZE,
+    FORMAT_VERSION,
+    HEADER,
+    HEADER_SIZE,
+    TOMBSTONE,
+    FormatError,
+    KeyEntry,
+    decode_key,
+    record_size,
+)
+
+# the scan reads the segments in chunks of this size
+SCAN_CHUNK_SIZE: typing.Final[int] = 1 << 20
+
+# the parallel scan splits a segment into chunks of at least this size. A part which
+# fits in one chunk is scanned without the workers, since sending it over costs more
+# than it saves
+PARALLEL_MIN_CHUNK: typing.Final[int] = 1 << 20
+
+# a segment is split into up to these many chunks per worker, so that a worker which
+# is done early picks up the chunks of a slow one
+CHUNKS_PER_WORKER: typing.Final[int] = 4
+
+# a worker looks for the first record of its chunk in windows of this size
+FIND_WINDOW_SIZE: typing.Final[int] = 64 * 1024
+
+# the header of the records before they had a crc and a version: the timestamp, the
+# key size and the value size. check_format looks for it, to tell an old store apart
+# from a corrupt one
+LEGACY_HEADER: typing.Final[struct.Struct] = struct.Struct("<LLL")
+
+# check_format follows the legacy headers for at most these many records
+LEGACY_CHECK_RECORDS: typing.Final[int] = 1000
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+def scan_records(
+    path: str,
+    file_id: int,
+    position: int,
+    entries: typing.MutableMapping[str, KeyEntry],
+    verify: bool = True,
+    stop: typing.Optional[int] = None,
+    progress: typing.Optional[typing.Callable[[int], None]] = None,
+) -> int:
+    """
+    scan_records reads the records of the segment from the position onwards into
+    entries, and returns the end of the last good record
+
+    Args:
+        path (str): path of the segment
+        file_id (int): id of the segment, for the KeyEntries
+        position (int): position of the first record to read
+        entries (typing.MutableMapping[str, KeyEntry]): the last record of every key
+            read goes here. It may be a KeyDir, which the startup streams into
+        verify (bool): whether the records are checked against their checksums
+        stop (typing.Optional[int]): if set, the scan stops at the first record which
+            starts at this position or after it, outside a batch. By default, it reads
+            till the end of the segment
+        progress (typing.Optional[typing.Callable[[int], None]]): if set, it is called
+            with the position whenever a chunk of the segment is read
+
+    Returns:
+        int: the position after the last good record. If it is before the stop (or
+            the end of the segment), the record there is torn or corrupt
+    """
+    # Only the headers and the keys are needed to build the KeyDir. So we read the
+    # segment in large chunks, and pick the headers and the keys out of them, without
+    # decoding or even copying the values. A value which is larger than a chunk is not
+    # read at all, the next read starts after it.
+    #
+    # With verify, every record is checked against its checksum, which needs the value
+    # too, so a value larger than a chunk is read along with its record. The scan stops
+    # at the first record which fails the check, like it does at a torn one. The
+    # startup decides what to do with it.
+    unpack_header = HEADER.unpack_from
+    crc32 = zlib.crc32
+    # the records of a batch are collected on the side, and applied only once the
+    # whole batch is read. A batch which is torn or corrupt is dropped entirely
+    batch: typing.Optional[dict[str, KeyEntry]] = None
+    batch_start: int = 0
+    batch_end: int = 0
+    with open(path, "rb") as f:
+        file_size: int = os.fstat(f.fileno()).st_size
+        if stop is None or stop > file_size:
+            stop = file_size
+        chunk: bytes = b""
+        view: memoryview = memoryview(chunk)
+        # position in the segment of the first byte of the chunk
+        chunk_start: int = position
+        while position + HEADER_SIZE <= file_size and (
+            position < stop or batch is not None
+        ):
+            offset: int = position - chunk_start
+            if offset + HEADER_SIZE > len(chunk):
+                f.seek(position)
+                chunk, chunk_start, offset = f.read(SCAN_CHUNK_SIZE), position, 0
+                view = memoryview(chunk)
+                if progress is not None:
+                    progress(position)
+            crc, version, _, timestamp, key_size, value_size = unpack_header(
+                chunk, offset
+            )
+            if version != FORMAT_VERSION or (
+                verify
+                and key_size == BATCH_MARKER
+                and crc32(view[offset + CRC_SIZE : offset + HEADER_SIZE]) != crc
+            ):
+                logger.warning(
+                    "segment %d has a corrupt record at %d", file_id, position
+                )
+                break
+            if key_size == BATCH_MARKER:
+                # the records of the batch follow, unless we crashed while writing
+                # them. A torn batch is dropped, and the startup truncates the
+                # segment so that we don't append after it
+                if position + HEADER_SIZE + value_size > file_size:
+                    logger.warning("dropped incomplete batch in segment %d", file_id)
+                    break
+                batch, batch_start = {}, position
+                batch_end = position + HEADER_SIZE + value_size
+                position += HEADER_SIZE
+                continue
+            total_size: int = record_size(key_size, value_size)
+            if position + total_size > file_size or (
+                batch is not None and position + total_size > batch_end
+            ):
+                break
+            needed: int = total_size if verify else HEADER_SIZE + key_size
+            if offset + needed > len(chunk):
+                f.seek(position)
+                chunk = f.read(max(SCAN_CHUNK_SIZE, needed))
+                chunk_start, offset = position, 0
+                view = memoryview(chunk)
+            if verify and crc32(view[offset + CRC_SIZE : offset + total_size]) != crc:
+                logger.warning(
+                    "segment %d has a corrupt record at %d", file_id, position
+                )
+                break
+            key_start: int = offset + HEADER_SIZE
+            key: str = decode_key(chunk[key_start : key_start + key_size])
+            # a tombstone goes into the entries too, so that it hides the key from
+            # the older segments, and makes it into the hint file
+            (entries if batch is None else batch)[key] = KeyEntry(
+                timestamp,
+                position,
+                TOMBSTONE if value_size == TOMBSTONE else total_size,
+                file_id,
+            )
+            position += total_size
+            if batch is not None and position == batch_end:
+                entries.update(batch)
+                batch = None
+    if batch is not None:
+        return batch_start
+    return position
+
+
+def _record_end(f: typing.BinaryIO, position: int, file_size: int) -> int:
+    # _record_end returns the end of the record at the position, or -1 if no valid
+    # record starts there. A batch marker "ends" where its first record starts
+    if position + HEADER_SIZE > file_size:
+        return -1
+    f.seek(position)
+    header: bytes = f.read(HEADER_SIZE)
+    crc, version, _, _, key_size, value_size = HEADER.unpack(header)
+    if version != FORMAT_VERSION:
+        return -1
+    if key_size == BATCH_MARKER:
+        if zlib.crc32(header[CRC_SIZE:]) != crc:
+            return -1
+        return position + HEADER_SIZE
+    total_size: int = record_size(key_size, value_size)
+    if position + total_size > file_size:
+        return -1
+    rest: bytes = f.read(total_size - HEADER_SIZE)
+    if zlib.crc32(rest, zlib.crc32(header[CRC_SIZE:])) != crc:
+        return -1
+    return position + total_size
+
+
+def _is_legacy(f: typing.BinaryIO, file_size: int) -> bool:
+    # the records of the old format have no checksum to check, but their headers
+    # chain: every record starts right where the one before it ends, and the last one
+    # ends with the segment. Records of the current format read as old headers hardly
+    # ever do so
+    position: int = 0
+    for _ in range(LEGACY_CHECK_RECORDS):
+        if position == file_size:
+            return True
+        if position + LEGACY_HEADER.size > file_size:
+            return False
+        f.seek(position)
+        _, key_size, value_size = LEGACY_HEADER.unpack(f.read(LEGACY_HEADER.size))
+        position += LEGACY_HEADER.size + key_size + value_size
+    return position <= file_size
+
+
+def check_format(path: str) -> None:
+    """
+    check_format checks that the segment was written in the record format of this
+    version, by its first record. An empty segment, or one whose first record is good
+    or just torn, passes
+
+    Raises:
+        FormatError: if the segment is in the old format, without the crc and the
+            version, or in a version we don't know
+    """
+    with open(path, "rb") as f:
+        file_size: int = os.fstat(f.fileno()).st_size
+        if file_size == 0 or _record_end(f, 0, file_size) >= 0:
+            return
+        if _is_legacy(f, file_size):
+            raise FormatError(
+                f"{path} was written in the old record format, without checksums. "
+                f"It has to be migrated to the format version {FORMAT_VERSION}"
+            )
+        f.seek(CRC_SIZE)
+        version: bytes = f.read(1)
+    # the first record may just be corrupt. If no record of our version follows it,
+    # the segment is not ours
+    if version and version[0] != FORMAT_VERSION and find_record(path, 1, file_size) < 0:
+        raise FormatError(f"{path} has records of an unknown version {version[0]}")
+
+
+def find_record(path: str, start: int, stop: int) -> int:
+    """
+    find_record returns the position of the first record of the segment which starts
+    between start and stop, or -1 if it finds none
+
+    A record is recognised by its version byte and its checksum, which is checked
+    whether the store verifies the checksums or not, and it must be followed by
+    another valid record (or the end of the segment). The bytes of a value may still
+    look like a record, so the caller must confirm the position it gets
+    """
+    version: bytes = bytes([FORMAT_VERSION])
+    with open(path, "rb") as f:
+        file_size: int = os.fstat(f.fileno()).st_size
+        window_start: int = start
+        while window_start < stop:
+            # the version byte of a record follows its crc. The window has CRC_SIZE
+            # bytes more, for the records which start at the end of it
+            f.seek(window_start)
+            window: bytes = f.read(FIND_WINDOW_SIZE + CRC_SIZE)
+            if len(window) <= CRC_SIZE:
+                break
+            index: int = window.find(version, CRC_SIZE)
+            while index >= 0:
+                position: int = window_start + index - CRC_SIZE
+                if position >= stop:
+                    return -1
+                end: int = _record_end(f, position, file_size)
+                if end >= 0 and (
+                    end == file_size or _record_end(f, end, file_size) >= 0
+                ):
+                    return position
+                index = window.find(version, index + 1)
+            window_start += FIND_WINDOW_SIZE
+    return -1
+
+
+def next_record(path: str, position: int) -> int:
+    """
+    next_record returns the position of the first valid record after the bad one at
+    the position, or -1 if there is none. A batch whose header is good is skipped as
+    a whole, since its records are applied all together or not at all
+    """
+    start: int = position + 1
+    with open(path, "rb") as f:
+        file_size: int = os.fstat(f.fileno()).st_size
+        if position + HEADER_SIZE <= file_size:
+            f.seek(position)
+            header: bytes = f.read(HEADER_SIZE)
+            crc, version, _, _, key_size, value_size = HEADER.unpack(header)
+            if (
+                version == FORMAT_VERSION
+                and key_size == BATCH_MARKER
+                and zlib.crc32(header[CRC_SIZE:]) == crc
+            ):
+                start = position + HEADER_SIZE + value_size
+    if start >= file_size:
+        return -1
+    return find_record(path, start, file_size)
+
+
+def plan_chunks(start: int, size: int, workers: int) -> list[tuple[int, int]]:
+    """
+    plan_chunks splits the part of a segment between start and size into the chunks
+    which the workers scan, as (start, stop) pairs. A part which is too small to be
+    worth splitting is a single chunk
+    """
+    length: int = size - start
+    if length <= 0:
+        return []
+    chunk_size: int = max(
+        PARALLEL_MIN_CHUNK, -(-length // (workers * CHUNKS_PER_WORKER))
+    )
+    return [
+        (position, min(position + chunk_size, size))
+        for position in range(start, size, chunk_size)
+    ]
+
+
+class ScannedChunk:
+    """
+    ScannedChunk is what a worker found in a chunk of a segment: the last record of
+    every key in it
+
+    Attributes:
+        stop (int): end of the chunk. The worker reads past it, till the end of the
+            record (or the batch) which crosses it
+        first (int): position of the first record of the chunk, or -1 if the worker
+            found none
+        end (int): position after the last good record read. Unless it is before the
+            stop, the records of the next chunk start there
+        keys (list[str]): the keys, in the order of the arrays below
+        timestamps (array.array): timestamps of the last records of the keys
+        positions (array.array): positions of the records
+        sizes (array.array): total sizes of the records, TOMBSTONE for the tombstones
+    """
+
+    def __init__(self, stop: int, first: int, end: int, entries: dict[str, KeyEntry]):
+        self.stop: int = stop
+        self.first: int = first
+        self.end: int = end
+        # pickling a KeyEntry per key would cost more than scanning the key again,
+        # so the entries travel as flat arrays instead
+        self.keys: list[str] = list(entries)
+        self.timestamps: array.array[int] = array.array(
+            "L", [kv.timestamp for kv in entries.values()]
+        )
+        self.positions: array.array[int] = array.array(
+            "Q", [kv.position for kv in entries.values()]
+        )
+        self.sizes: array.array[int] = array.array(
+            "L", [kv.total_size for kv in entries.values()]
+        )
+
+    def apply(
+        self, file_id: int, entries: typing.MutableMapping[str, KeyEntry]
+    ) -> None:
+        """
+        apply adds the records of the chunk to the entries of the segment, over the
+        ones of the chunks before it
+        """
+        # this runs in the startup itself, for every key of every chunk, so the loop
+        # is left to zip and map, which run in C
+        entries.update(
+            zip(
+                self.keys,
+                map(
+                    KeyEntry,
+                    self.timestamps,
+                    self.positions,
+                    self.sizes,
+                    itertools.repeat(file_id),
+                ),
+            )
+        )
+
+
+def scan_chunk(
+    path: str, file_id: int, start: int, stop: int, known: bool, verify: bool = True
+) -> ScannedChunk:
+    """
+    scan_chunk is run by the workers: it scans the records of the segment which start
+    between start and stop
+
+    Args:
+        path (str): path of the segment
+        file_id (int): id of the segment
+        start (int): start of the chunk
+        stop (int): end of the chunk
+        known (bool): whether a record starts right at the start (e.g. the chunk is
+            the first one). If not, the worker looks for the first record
+        verify (bool): whether the records are checked against their checksums
+
+    Returns:
+        ScannedChunk: the last records of the keys of the chunk
+    """
+    entries: dict[str, KeyEntry] = {}
+    first: int = start if known else find_record(path, start, stop)
+    if first < 0:
+        return ScannedChunk(stop, first, start, entries)
+    end: int = scan_records(path, file_id, first, entries, verify, stop)
+    return ScannedChunk(stop, first, end, entries)
+
+
+def merge_chunks(
+    path: str,
+    file_id: int,
+    start: int,
+    chunks: typing.Iterable[ScannedChunk],
+    entries: typing.MutableMapping[str, KeyEntry],
+    verify: bool = True,
+    progress: typing.Optional[typing.Callable[[int], None]] = None,
+) -> int:
+    """
+    merge_chunks applies the chunks of the segment to its entries, in order, and
+    returns the end of the last good record, like scan_records does
+
+    The first record a worker found is trusted only if the chunk before it ended right
+    there. Otherwise, the chunk is scanned again here, from where the chunk before it
+    ended. The chunks after a torn or corrupt record are ignored
+    """
+    position: int = start
+    for chunk in chunks:
+        if position >= chunk.stop:
+            # the chunk before read past this one entirely, e.g. a large value
+            continue
+        if chunk.first == position:
+            chunk.apply(file_id, entries)
+            end: int = chunk.end
+        else:
+            logger.info(
+                "segment %d: a worker started at %d instead of %d, scanning again",
+                file_id,
+                chunk.first,
+                position,
+            )
+            end = scan_records(path, file_id, position, entries, verify, chunk.stop)
+        if progress is not None:
+            progress(end)
+        if end < chunk.stop:
+            return end
+        position = end
+    return position
@@ -0,0 +1,456 @@
+"""
+server module implements the caskdb server, which serves a DiskStorage over TCP, with
+the protocol of Redis (check the resp module). So the Redis clients and tools, like
+redis-cli and redis-benchmark, work with it, and many processes can share one store,
+and its warm KeyDir, instead of each of them opening it.
+
+Start it with:
+
+    python -m caskdb --file books.db --port 6379
+
+and talk to it with any Redis client:
+
+    redis-cli -p 6379 SET othello shakespeare
+    redis-benchmark -p 6379 -t set,get -P 16
+
+It supports these commands:
+
+    GET key                 the value, or nil if the key doesn't exist
+    SET key value           no options (like EX or NX)
+    DEL key [key ...]       the number of the keys removed, each counted once
+    MGET key [key ...]      the values, nil for the keys which don't exist
+    MSET key value [...]    written as a single batch, so atomically
+    SCAN cursor [MATCH pattern] [COUNT count]
+    INFO [section]
+    PING [message]
+    QUIT
+
+The server runs on asyncio streams, in a single thread, and the store is used through
+AsyncDiskStorage. So the writes of all the clients are queued, and written in batches:
+all the writes which come in while a batch is being fsynced go into the next batch, and
+share its fsync (i.e. group commit). A client may pipeline its commands, and the writes
+among them are queued together, without waiting for each other's fsync. The commands of
+a client are still applied in order: a read waits for the writes sent before it, so it
+sees them, and the replies are sent in the order of the commands.
+
+SCAN returns the keys in sorted order, and the cursor is the last key returned, as an
+integer. So a key which exists all through a scan is returned exactly once, however the
+store changes meanwhile. A store with a lot of keys should use the `sorted` KeyDir, the
+others sort all the keys on every SCAN.
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import logging
+import os
+import signal
+import time
+import typing
+
+from caskdb.async_store import AsyncDiskStorage
+from caskdb.disk_store import DiskStorage
+from caskdb.durability import SyncPolicy
+from caskdb.format import decode_key, encode_key
+from caskdb.keydir import DICT, KEY_DIR_TYPES
+from caskdb.resp import (
+    NULL,
+    OK,
+    CommandParser,
+    ProtocolError,
+    encode_array,
+    encode_bulk,
+    encode_error,
+    encode_integer,
+    encode_simple,
+)
+
+DEFAULT_HOST: typing.Final[str] = "127.0.0.1"
+DEFAULT_PORT: typing.Final[int] = 6379
+
+# bytes read from a client at a time
+READ_SIZE: typing.Final[int] = 64 * 1024
+
+# keys looked at by a SCAN, unless the client asks for another COUNT
+DEFAULT_SCAN_COUNT: typing.Final[int] = 10
+
+# the commands which write. The writes of a pipeline are queued together, and the
+# other commands wait for them. DEL is not one of them, it replies with the number of
+# the keys which existed, so it has to see the writes before it
+WRITE_COMMANDS: typing.Final[frozenset[bytes]] = frozenset({b"SET", b"MSET"})
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class CommandError(Exception):
+    """
+    CommandError is raised for a command which the server can't run, e.g. it has the
+    wrong number of arguments. The client gets it as an error reply, and the connection
+    stays open
+    """
+
+
+def encode_cursor(key: str) -> int:
+    # the cursor is the key as a big-endian integer, with a 1 byte in front so that
+    # the leading zero bytes of the key are kept. Zero means the scan is done
+    return int.from_bytes(b"\x01" + encode_key(key), "big")
+
+
+def decode_cursor(cursor: int) -> typing.Optional[str]:
+    if cursor == 0:
+        return None
+    data: bytes = cursor.to_bytes((cursor.bit_length() + 7) // 8, "big")
+    if data[0] != 1:
+        raise CommandError("ERR invalid cursor")
+    return decode_key(data[1:])
+
+
+class Server:
+    """
+    Server serves a store to the Redis clients
+
+    Args:
+        store (AsyncDiskStorage): the store to serve. The server doesn't close it
+
+    Attributes:
+        store (AsyncDiskStorage): the store
+        connected_clients (int): the clients connected now
+        total_connections (int): the clients connected since the start
+        total_commands (int): the commands run since the start
+    """
+
+    def __init__(self, store: AsyncDiskStorage):
+        self.store: AsyncDiskStorage = store
+        self.connected_clients: int = 0
+        self.total_connections: int = 0
+        self.total_commands: int = 0
+        self._started: float = time.monotonic()
+        self._port: int = 0
+
+    async def start(
+        self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT
+    ) -> asyncio.Server:
+        """
+        start listens on the host and the port, and returns the asyncio server. Port 0
+        picks a free port
+        """
+        server: asyncio.Server = await asyncio.start_server(self.handle, host, port)
+        self._port = server.sockets[0].getsockname()[1]
+        return server
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        handle serves a client till it disconnects
+        """
+        self.connected_clients += 1
+        self.total_connections += 1
+        parser = CommandParser()
+        try:
+            while data := await reader.read(READ_SIZE):
+                parser.feed(data)
+                commands: list[list[bytes]] = []
+                error: typing.Optional[ProtocolError] = None
+                # the commands which came before a malformed one are still run and
+                # replied to, then the error is sent and the connection closed
+                try:
+                    for command in parser:
+                        commands.append(command)
+                except ProtocolError as e:
+                    error = e
+                quit: bool = await self._run_pipeline(commands, writer)
+                if error is not None and not quit:
+                    writer.write(encode_error(f"ERR Protocol error: {error}"))
+                await writer.drain()
+                if quit or error is not None:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.connected_clients -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _run_pipeline(
+        self, commands: list[list[bytes]], writer: asyncio.StreamWriter
+    ) -> bool:
+        # _run_pipeline runs the commands read in one go, and writes their replies
+        # in order. It returns True if the client asked to QUIT.
+        #
+        # The writes are started as tasks, so that they queue up in the store
+        # without waiting for each other, and get written as a single batch. The
+        # tasks start in the order they were created, so the writes are applied in
+        # order. A read waits for the writes before it
+        replies: list[typing.Union[bytes, asyncio.Future[bytes]]] = []
+        writes: list[asyncio.Future[bytes]] = []
+        quit: bool = False
+        for command in commands:
+            self.total_commands += 1
+            name: bytes = command[0].upper()
+            if name == b"QUIT":
+                replies.append(OK)
+                quit = True
+                break
+            if name in WRITE_COMMANDS:
+                write: asyncio.Future[bytes] = asyncio.ensure_future(
+                    self._reply(name, command[1:])
+                )
+                writes.append(write)
+                replies.append(write)
+                continue
+            if writes:
+                await asyncio.wait(writes)
+                writes = []
+            replies.append(await self._reply(name, command[1:]))
+        for reply in replies:
+            writer.write(reply if isinstance(reply, bytes) else await reply)
+        return quit
+
+    async def _reply(self, name: bytes, args: list[bytes]) -> bytes:
+        # _reply runs the command, and returns its reply
+        handler: typing.Optional[
+            typing.Callable[[Server, list[bytes]], typing.Awaitable[bytes]]
+        ] = _COMMANDS.get(name)
+        if handler is None:
+            return encode_error(
+                f"ERR unknown command '{name.decode(errors='replace')}'"
+            )
+        try:
+            return await handler(self, args)
+        except CommandError as e:
+            return encode_error(str(e))
+        except Exception as e:
+            logger.exception("command %s failed", name)
+            return encode_error(f"ERR {e}")
+
+    @property
+    def _disk(self) -> DiskStorage:
+        return self.store.store
+
+    async def get(self, args: list[bytes]) -> bytes:
+        _arity(b"get", args, 1)
+        # get_bytes returns an empty value for a missing key. lookup_bytes tells the
+        # two apart in the same lookup, so a delete can't slip in between
+        value: typing.Optional[memoryview] = await self.store.lookup_bytes(args[0])
+        return NULL if value is None else encode_bulk(bytes(value))
+
+    async def set(self, args: list[bytes]) -> bytes:
+        if len(args) != 2:
+            raise CommandError(
+                "ERR wrong number of arguments for 'set' command, or the options "
+                "are not supported"
+            )
+        await self.store.set_bytes(args[0], args[1])
+        return OK
+
+    async def delete(self, args: list[bytes]) -> bytes:
+        _arity(b"del", args, 1, at_least=True)
+        # the deletes are queued together, so they go in the same flush of the store.
+        # The store tells which of them removed a key, so a key given twice, or
+        # deleted by another client meanwhile, is not counted again
+        removed: list[bool] = await asyncio.gather(
+            *(self.store.delete_bytes(key) for key in dict.fromkeys(args))
+        )
+        return encode_integer(sum(removed))
+
+    async def mget(self, args: list[bytes]) -> bytes:
+        _arity(b"mget", args, 1, at_least=True)
+        values: list[typing.Optional[memoryview]] = await self.store.lookup_many_bytes(
+            args
+        )
+        return encode_array(
+            [NULL if value is None else encode_bulk(bytes(value)) for value in values]
+        )
+
+    async def mset(self, args: list[bytes]) -> bytes:
+        if not args or len(args) % 2:
+            raise CommandError("ERR wrong number of arguments for 'mset' command")
+        await self.store.set_many_bytes(zip(args[::2], args[1::2]))
+        return OK
+
+    async def scan(self, args: list[bytes]) -> bytes:
+        _arity(b"scan", args, 1, at_least=True)
+        try:
+            cursor: int = int(args[0])
+        except ValueError:
+            raise CommandError("ERR invalid cursor") from None
+        pattern: typing.Optional[str] = None
+        count: int = DEFAULT_SCAN_COUNT
+        options: list[bytes] = args[1:]
+        if len(options) % 2:
+            raise CommandError("ERR syntax error")
+        for option, value in zip(options[::2], options[1::2]):
+            if option.upper() == b"MATCH":
+                pattern = decode_key(value)
+            elif option.upper() == b"COUNT":
+                try:
+                    count = int(value)
+                except ValueError:
+                    raise CommandError("ERR value is not an integer") from None
+                if count <= 0:
+                    raise CommandError("ERR syntax error")
+            else:
+                raise CommandError("ERR syntax error")
+        after: typing.Optional[str] = decode_cursor(cursor)
+        # the scan goes on from the key right after the last one returned
+        start: typing.Optional[str] = None if after is None else after + "\x00"
+        # the KeyDir may sort all the keys, so it is walked in the I/O threads
+        keys, last = await self.store.run(self._scan, start, pattern, count)
+        next_cursor: bytes = b"0" if last is None else b"%d" % encode_cursor(last)
+        return encode_array(
+            [
+                encode_bulk(next_cursor),
+                encode_array([encode_bulk(encode_key(key)) for key in keys]),
+            ]
+        )
+
+    def _scan(
+        self, start: typing.Optional[str], pattern: typing.Optional[str], count: int
+    ) -> tuple[list[str], typing.Optional[str]]:
+        # runs in a thread. It returns the matching keys, and the last key looked at,
+        # or None if there are no more keys
+        keys: list[str] = []
+        last: typing.Optional[str] = None
+        # COUNT is the number of the keys looked at, whether they match or not
+        for seen, key in enumerate(self._disk.keys(start)):
+            if seen == count:
+                break
+            last = key
+            if pattern is None or fnmatch.fnmatchcase(key, pattern):
+                keys.append(key)
+        else:
+            last = None
+        return keys, last
+
+    def _persistence(self) -> tuple[int, int, int]:
+        # runs in a thread, since it stats every segment. It returns the number of
+        # the segments, their total size and the number of the keys
+        disk: DiskStorage = self._disk
+        file_ids: list[int] = disk.file_ids()
+        data_bytes: int = sum(
+            os.path.getsize(disk.segment_path(file_id)) for file_id in file_ids
+        )
+        return len(file_ids), data_bytes, len(disk.key_dir)
+
+    async def info(self, args: list[bytes]) -> bytes:
+        segments, data_bytes, keys = await self.store.run(self._persistence)
+        sections: dict[str, list[tuple[str, object]]] = {
+            "server": [
+                ("caskdb_mode", "standalone"),
+                ("process_id", os.getpid()),
+                ("tcp_port", self._port),
+                ("uptime_in_seconds", int(time.monotonic() - self._started)),
+            ],
+            "clients": [("connected_clients", self.connected_clients)],
+            "stats": [
+                ("total_connections_received", self.total_connections),
+                ("total_commands_processed", self.total_commands),
+            ],
+            "persistence": [("segments", segments), ("data_bytes", data_bytes)],
+            "keyspace": [("db0", f"keys={keys},expires=0,avg_ttl=0")],
+        }
+        wanted: typing.Optional[str] = args[0].decode().lower() if args else None
+        lines: list[str] = []
+        for section, fields in sections.items():
+            if wanted not in (None, "all", "everything", section):
+                continue
+            lines.append(f"# {section.capitalize()}")
+            lines.extend(f"{name}:{value}" for name, value in fields)
+            lines.append("")
+        return encode_bulk("\r\n".join(lines).encode("utf-8"))
+
+    async def ping(self, args: list[bytes]) -> bytes:
+        if args:
+            return encode_bulk(args[0])
+        return encode_simple("PONG")
+
+
+def _arity(name: bytes, args: list[bytes], count: int, at_least: bool = False) -> None:
+    if len(args) < count or (not at_least and len(args) != count):
+        raise CommandError(
+            f"ERR wrong number of arguments for '{name.decode()}' command"
+        )
+
+
+_COMMANDS: typing.Final[
+    dict[bytes, typing.Callable[[Server, list[bytes]], typing.Awaitable[bytes]]]
+] = {
+    b"GET": Server.get,
+    b"SET": Server.set,
+    b"DEL": Server.delete,
+    b"MGET": Server.mget,
+    b"MSET": Server.mset,
+    b"SCAN": Server.scan,
+    b"INFO": Server.info,
+    b"PING": Server.ping,
+}
+
+_SYNC_POLICIES: typing.Final[dict[str, typing.Callable[[], SyncPolicy]]] = {
+    "always": SyncPolicy.always,
+    "os": SyncPolicy.os_managed,
+}
+
+
+async def serve(args: argparse.Namespace) -> None:
+    """
+    serve opens the store and serves it till the process gets SIGINT or SIGTERM
+    """
+    store: AsyncDiskStorage = await AsyncDiskStorage.open(
+        args.file,
+        sync_policy=(
+            SyncPolicy.every_ms(args.sync_ms)
+            if args.sync_ms
+            else _SYNC_POLICIES[args.sync]()
+        ),
+        key_dir_type=args.key_dir_type,
+        max_file_size=args.max_file_size,
+        merge_threshold=args.merge_threshold,
+    )
+    server = Server(store)
+    listener: asyncio.AbstractServer = await server.start(args.host, args.port)
+    logger.info("serving %s on %s:%d", args.file, args.host, server._port)
+    stop: asyncio.Event = asyncio.Event()
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except NotImplementedError:
+            # Windows has no signal handlers in asyncio, Ctrl+C stops the loop instead
+            pass
+    try:
+        await stop.wait()
+    finally:
+        listener.close()
+        await listener.wait_closed()
+        await store.close()
+
+
+def main(argv: typing.Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="caskdb", description="serves a caskdb store with the Redis protocol"
+    )
+    parser.add_argument("--file", default="data.db", help="data file of the store")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--sync",
+        choices=sorted(_SYNC_POLICIES),
+        default="always",
+        help="fsync every batch of writes, or leave it to the OS",
+    )
+    parser.add_argument(
+        "--sync-ms", type=int, default=0, help="fsync every these many milliseconds"
+    )
+    parser.add_argument("--key-dir-type", choices=KEY_DIR_TYPES, default=DICT)
+    parser.add_argument("--max-file-size", type=int, default=None)
+    parser.add_argument("--merge-threshold", type=float, default=None)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
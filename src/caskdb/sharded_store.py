@@ -0,0 +1,531 @@
+"""
+sharded_store module implements ShardedStorage, which spreads the keys over a few
+independent DiskStorage shards.
+
+A DiskStorage has one active segment and one write lock, so its writes go through a
+single file, and its fsyncs through a single disk. ShardedStorage partitions the keys
+over N stores instead, each with its own files, lock and fsyncs. The shards may live
+in different directories, or on different disks, and write in parallel: `set_many`
+and `get_many` split the keys by their shards, and send every part to its shard from a
+pool of threads (a write spends most of its time in fsync, and a read in pread, both
+of which release the GIL).
+
+The keys are assigned to the shards with consistent hashing. Every shard is placed on
+a ring of 64 bit hashes at `vnodes` points, picked by hashing its name, and a key goes
+to the shard whose point follows the hash of the key on the ring. Adding a shard takes
+over only the arcs before its points, i.e. about 1/N of the keys, from all the other
+shards evenly, and removing one hands its arcs to the shards after them. With a plain
+`hash(key) % N`, almost every key would move. The many points per shard even out the
+arcs, which would vary a lot with a single point each.
+
+The shards are placed by their names, not by their file names, so a shard can be
+moved to another disk without moving its keys. The set of the shards isn't stored
+anywhere: open the store with the same names every time. `add_shard` and
+`remove_shard` move the keys which change their shard right away. If they are
+interrupted, reopen the store with the new set of the shards and call `rebalance`.
+
+Only the writes to a single shard are atomic: a `set_many` spanning a few shards is
+a batch per shard, and a crash may keep some of them and drop the others.
+
+Typical usage example:
+
+    store = ShardedStorage({"a": "/disk1/books.db", "b": "/disk2/books.db"})
+    store.set_many([("othello", "shakespeare"), ("hamlet", "shakespeare")])
+    authors: list[str] = store.get_many(["othello", "hamlet"])
+    store.add_shard("c", "/disk3/books.db")
+"""
+
+import bisect
+import collections
+import concurrent.futures
+import hashlib
+import heapq
+import operator
+import threading
+import typing
+
+from caskdb.disk_store import DiskStorage, prefix_end
+from caskdb.durability import done_future
+from caskdb.format import Buffer, encode_key
+
+# points of every shard on the ring, by default
+DEFAULT_VNODES: typing.Final[int] = 256
+
+# a rebalance moves the keys to their new shards in batches of this many
+REBALANCE_BATCH_SIZE: typing.Final[int] = 1000
+
+_T = typing.TypeVar("_T")
+
+
+def _hash(data: bytes) -> int:
+    # the keys are spread by this hash, so it has to be the same in every process,
+    # unlike the built-in `hash`. BLAKE2 with 8 bytes of digest is quick enough, and
+    # spreads the similar names and keys evenly, which CRC32 does not
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+class HashRing:
+    """
+    HashRing assigns the keys to the shards with consistent hashing
+
+    Args:
+        names (typing.Iterable[str]): names of the shards
+        vnodes (int): points of every shard on the ring
+
+    Raises:
+        ValueError: if vnodes is not positive
+
+    Attributes:
+        vnodes (int): points of every shard on the ring
+    """
+
+    def __init__(self, names: typing.Iterable[str] = (), vnodes: int = DEFAULT_VNODES):
+        if vnodes <= 0:
+            raise ValueError("vnodes must be positive")
+        self.vnodes: int = vnodes
+        self._names: set[str] = set()
+        # the points of all the shards, sorted, and the shard of every point
+        self._points: list[int] = []
+        self._owners: list[str] = []
+        for name in names:
+            self.add(name)
+
+    @property
+    def names(self) -> list[str]:
+        return sorted(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._names
+
+    def add(self, name: str) -> None:
+        """
+        add places the shard on the ring
+
+        Raises:
+            ValueError: if the ring has the shard already
+        """
+        if name in self._names:
+            raise ValueError(f"shard {name!r} exists already")
+        self._names.add(name)
+        self._place()
+
+    def remove(self, name: str) -> None:
+        """
+        remove takes the shard off the ring
+
+        Raises:
+            KeyError: if the ring doesn't have the shard
+        """
+        self._names.remove(name)
+        self._place()
+
+    def _place(self) -> None:
+        # two points may collide, in theory. Sorting by the name too keeps the owner
+        # of such a point the same whatever the order the shards were added in
+        points: list[tuple[int, str]] = sorted(
+            (_hash(f"{name}#{i}".encode("utf-8")), name)
+            for name in self._names
+            for i in range(self.vnodes)
+        )
+        self._points = [point for point, _ in points]
+        self._owners = [name for _, name in points]
+
+    def shard_for(self, key: bytes) -> str:
+        """
+        shard_for returns the name of the shard of the key, given as bytes
+
+        Raises:
+            LookupError: if the ring has no shards
+        """
+        if not self._points:
+            raise LookupError("the ring has no shards")
+        index: int = bisect.bisect(self._points, _hash(key))
+        # past the last point, the ring wraps around to the first one
+        return self._owners[index % len(self._owners)]
+
+
+class ShardedStorage:
+    """
+    ShardedStorage is a KV store made of a few DiskStorage shards, with the keys
+    partitioned among them by consistent hashing
+
+    Args:
+        shards (typing.Mapping[str, str]): name of every shard, and the file name of
+            its store. The names place the shards on the hash ring
+        vnodes (int): points of every shard on the ring
+        max_workers (typing.Optional[int]): threads which send the requests to the
+            shards. Defaults to one per shard
+        options (typing.Any): options of the DiskStorage of every shard, e.g.
+            sync_policy or max_file_size
+
+    Raises:
+        ValueError: if there are no shards, or vnodes is not positive
+
+    Attributes:
+        shards (dict[str, DiskStorage]): the stores of the shards, by their names
+        ring (HashRing): the ring which assigns the keys to the shards
+    """
+
+    def __init__(
+        self,
+        shards: typing.Mapping[str, str],
+        vnodes: int = DEFAULT_VNODES,
+        max_workers: typing.Optional[int] = None,
+        **options: typing.Any,
+    ):
+        if not shards:
+            raise ValueError("there must be at least one shard")
+        self.ring: HashRing = HashRing(shards, vnodes)
+        # add_shard and remove_shard replace the ring and the shards under this lock
+        self._lock: threading.Lock = threading.Lock()
+        self._options: dict[str, typing.Any] = options
+        self._executor: concurrent.futures.ThreadPoolExecutor = (
+            concurrent.futures.ThreadPoolExecutor(
+                max_workers or len(shards), thread_name_prefix="caskdb-shard"
+            )
+        )
+        # the shards start up in parallel. If one of them fails to, the ones which
+        # did are closed
+        futures: dict[str, concurrent.futures.Future[DiskStorage]] = {
+            name: self._executor.submit(self._open, file_name)
+            for name, file_name in shards.items()
+        }
+        concurrent.futures.wait(futures.values())
+        self.shards: dict[str, DiskStorage] = {
+            name: future.result()
+            for name, future in futures.items()
+            if future.exception() is None
+        }
+        if len(self.shards) < len(shards):
+            self.close()
+            for future in futures.values():
+                future.result()
+
+    def _open(self, file_name: str) -> DiskStorage:
+        return DiskStorage(file_name=file_name, **self._options)
+
+    def shard_for(self, key: str) -> DiskStorage:
+        """
+        shard_for returns the store of the shard which has the key
+        """
+        return self.shards[self.ring.shard_for(encode_key(key))]
+
+    def _group(self, keys: typing.Iterable[bytes]) -> dict[str, list[int]]:
+        # _group returns the indexes of the keys, by the names of their shards
+        groups: collections.defaultdict[str, list[int]] = collections.defaultdict(list)
+        shard_for = self.ring.shard_for
+        for index, key in enumerate(keys):
+            groups[shard_for(key)].append(index)
+        return groups
+
+    def _fan_out(
+        self, calls: list[tuple[typing.Callable[..., _T], tuple[typing.Any, ...]]]
+    ) -> list[_T]:
+        # _fan_out makes the calls to the shards in parallel, and returns their
+        # results in order. A single call is made right here
+        if len(calls) == 1:
+            fn, args = calls[0]
+            return [fn(*args)]
+        futures = [self._executor.submit(fn, *args) for fn, args in calls]
+        return [future.result() for future in futures]
+
+    def set(self, key: str, value: str) -> "concurrent.futures.Future[None]":
+        """
+        set stores the key and value in the shard of the key, check DiskStorage.set
+        """
+        return self.shard_for(key).set(key, value)
+
+    def set_bytes(self, key: bytes, value: Buffer) -> "concurrent.futures.Future[None]":
+        """
+        set_bytes stores the key and value given as bytes, check DiskStorage.set_bytes
+        """
+        return self.shards[self.ring.shard_for(key)].set_bytes(key, value)
+
+    def set_many(
+        self, items: typing.Iterable[tuple[str, str]]
+    ) -> "concurrent.futures.Future[None]":
+        """
+        set_many stores the KV pairs, with a batch per shard, written to the shards in
+        parallel. Every batch is atomic, but the set_many as a whole is not
+
+        Args:
+            items (typing.Iterable[tuple[str, str]]): the KV pairs. If a key repeats,
+                the last value wins
+
+        Returns:
+            a future which resolves once the batches of all the shards are durable
+        """
+        pairs: list[tuple[str, str]] = list(items)
+        groups: dict[str, list[int]] = self._group(encode_key(key) for key, _ in pairs)
+        return _gather(
+            self._fan_out(
+                [
+                    (self.shards[name].set_many, ([pairs[i] for i in indexes],))
+                    for name, indexes in groups.items()
+                ]
+            )
+        )
+
+    def set_many_bytes(
+        self, items: typing.Iterable[tuple[bytes, Buffer]]
+    ) -> "concurrent.futures.Future[None]":
+        """
+        set_many_bytes is set_many for the KV pairs given as bytes
+        """
+        pairs: list[tuple[bytes, Buffer]] = list(items)
+        groups: dict[str, list[int]] = self._group(key for key, _ in pairs)
+        return _gather(
+            self._fan_out(
+                [
+                    (self.shards[name].set_many_bytes, ([pairs[i] for i in indexes],))
+                    for name, indexes in groups.items()
+                ]
+            )
+        )
+
+    def delete(self, key: str) -> "concurrent.futures.Future[None]":
+        """
+        delete removes the key from its shard, check DiskStorage.delete
+        """
+        return self.shard_for(key).delete(key)
+
+    def delete_bytes(self, key: bytes) -> "concurrent.futures.Future[None]":
+        """
+        delete_bytes removes the key given as bytes
+        """
+        return self.shards[self.ring.shard_for(key)].delete_bytes(key)
+
+    def get(self, key: str) -> str:
+        """
+        get retrieves the value of the key from its shard. If the key does not exist
+        then it returns an empty string
+        """
+        return self.shard_for(key).get(key)
+
+    def get_bytes(self, key: bytes) -> memoryview:
+        """
+        get_bytes retrieves the value of the key given as bytes, check
+        DiskStorage.get_bytes
+        """
+        return self.shards[self.ring.shard_for(key)].get_bytes(key)
+
+    def lookup_bytes(self, key: bytes) -> typing.Optional[memoryview]:
+        """
+        lookup_bytes is get_bytes with None for a missing key, check
+        DiskStorage.lookup_bytes
+        """
+        return self.shards[self.ring.shard_for(key)].lookup_bytes(key)
+
+    def get_many(self, keys: typing.Sequence[str]) -> list[str]:
+        """
+        get_many retrieves the values of all the keys. The keys of every shard are
+        read with one DiskStorage.get_many, and the shards are read in parallel. The
+        values are returned in the same order as the keys, with an empty string for
+        the keys which don't exist
+        """
+        return self._get_many(keys, [encode_key(key) for key in keys], "get_many")
+
+    def get_many_bytes(self, keys: typing.Sequence[bytes]) -> list[memoryview]:
+        """
+        get_many_bytes is get_many for the keys given as bytes
+        """
+        return self._get_many(keys, keys, "get_many_bytes")
+
+    def lookup_many_bytes(
+        self, keys: typing.Sequence[bytes]
+    ) -> list[typing.Optional[memoryview]]:
+        """
+        lookup_many_bytes is get_many_bytes with None for the keys which don't exist
+        """
+        return self._get_many(keys, keys, "lookup_many_bytes")
+
+    def _get_many(
+        self,
+        keys: typing.Sequence[typing.Any],
+        encoded: typing.Sequence[bytes],
+        method: str,
+    ) -> list[_T]:
+        # the method is looked up on every shard, rather than on DiskStorage, so that
+        # an instrumented shard times the call
+        groups: dict[str, list[int]] = self._group(encoded)
+        results: list[list[_T]] = self._fan_out(
+            [
+                (getattr(self.shards[name], method), ([keys[i] for i in indexes],))
+                for name, indexes in groups.items()
+            ]
+        )
+        values: list[typing.Any] = [None] * len(keys)
+        for indexes, part in zip(groups.values(), results):
+            for index, value in zip(indexes, part):
+                values[index] = value
+        return values
+
+    def scan(
+        self,
+        start: typing.Optional[str] = None,
+        end: typing.Optional[str] = None,
+        reverse: bool = False,
+    ) -> typing.Iterator[tuple[str, str]]:
+        """
+        scan returns the KV pairs whose keys are from start (inclusive) till end
+        (exclusive), in the order of the keys, check DiskStorage.scan. The hashing
+        scatters a range of keys over all the shards, so all of them are scanned,
+        and their pairs are merged
+        """
+        return heapq.merge(
+            *(store.scan(start, end, reverse) for store in self.shards.values()),
+            key=operator.itemgetter(0),
+            reverse=reverse,
+        )
+
+    def prefix(
+        self, prefix: str, reverse: bool = False
+    ) -> typing.Iterator[tuple[str, str]]:
+        """
+        prefix returns the KV pairs whose keys start with the prefix, in the order of
+        the keys
+        """
+        return self.scan(prefix, prefix_end(prefix), reverse)
+
+    def __len__(self) -> int:
+        return sum(len(store.key_dir) for store in self.shards.values())
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and key in self.shard_for(key).key_dir
+
+    def add_shard(self, name: str, file_name: str) -> int:
+        """
+        add_shard adds a shard, and moves to it the keys it takes over from the other
+        shards. It must not run along with the writes
+
+        Args:
+            name (str): name of the shard, which places it on the ring
+            file_name (str): file name of the store of the shard
+
+        Returns:
+            int: number of the keys moved
+
+        Raises:
+            ValueError: if there is a shard of the name already
+        """
+        with self._lock:
+            if name in self.shards:
+                raise ValueError(f"shard {name!r} exists already")
+            self.shards[name] = self._open(file_name)
+            self.ring.add(name)
+        return self.rebalance()
+
+    def remove_shard(self, name: str) -> int:
+        """
+        remove_shard moves the keys of the shard to the other shards, and closes it.
+        Its files are left on the disk. It must not run along with the writes
+
+        Args:
+            name (str): name of the shard
+
+        Returns:
+            int: number of the keys moved
+
+        Raises:
+            KeyError: if there is no shard of the name
+            ValueError: if it is the last shard
+        """
+        with self._lock:
+            if name not in self.shards:
+                raise KeyError(name)
+            if len(self.shards) == 1:
+                raise ValueError("can't remove the last shard")
+            self.ring.remove(name)
+        moved: int = self.rebalance()
+        with self._lock:
+            self.shards.pop(name).close()
+        return moved
+
+    def rebalance(self) -> int:
+        """
+        rebalance moves every key which is not in the shard the ring assigns it to,
+        to that shard. The key is written to its new shard before it is deleted from
+        the old one, so it is never lost. It must not run along with the writes
+
+        Returns:
+            int: number of the keys moved
+        """
+        moved: int = 0
+        for name, store in list(self.shards.items()):
+            # the keys of every shard which now belong to another one, by the
+            # other one
+            leaving: collections.defaultdict[str, list[bytes]] = (
+                collections.defaultdict(list)
+            )
+            for key in list(store.key_dir):
+                key_bytes: bytes = encode_key(key)
+                owner: str = self.ring.shard_for(key_bytes)
+                if owner != name:
+                    leaving[owner].append(key_bytes)
+            for owner, keys in leaving.items():
+                for i in range(0, len(keys), REBALANCE_BATCH_SIZE):
+                    batch: list[bytes] = keys[i : i + REBALANCE_BATCH_SIZE]
+                    values: list[memoryview] = store.get_many_bytes(batch)
+                    self.shards[owner].set_many_bytes(zip(batch, values)).result()
+                    for key_bytes in batch:
+                        store.delete_bytes(key_bytes)
+                    moved += len(batch)
+        return moved
+
+    def sync(self) -> None:
+        """
+        sync makes all the writes to all the shards durable
+        """
+        self._fan_out([(DiskStorage.sync, (store,)) for store in self.shards.values()])
+
+    def close(self) -> None:
+        """
+        close closes all the shards
+        """
+        for store in self.shards.values():
+            store.close()
+        self._executor.shutdown()
+
+    def __setitem__(self, key: str, value: str) -> None:
+        self.set(key, value)
+
+    def __getitem__(self, item: str) -> str:
+        return self.get(item)
+
+    def __delitem__(self, key: str) -> None:
+        self.shard_for(key).__delitem__(key)
+
+
+def _gather(
+    futures: list["concurrent.futures.Future[None]"],
+) -> "concurrent.futures.Future[None]":
+    # _gather returns a future which resolves once all the futures do, with the first
+    # error among them, if any
+    pending: list[concurrent.futures.Future[None]] = [
+        future for future in futures if not future.done() or future.exception()
+    ]
+    if not pending:
+        return done_future()
+    if len(pending) == 1:
+        return pending[0]
+    result: concurrent.futures.Future[None] = concurrent.futures.Future()
+    lock: threading.Lock = threading.Lock()
+    left: list[int] = [len(pending)]
+
+    def resolve(future: "concurrent.futures.Future[None]") -> None:
+        with lock:
+            left[0] -= 1
+            if result.done():
+                return
+            error: typing.Optional[BaseException] = future.exception()
+            if error is not None:
+                result.set_exception(error)
+            elif left[0] == 0:
+                result.set_result(None)
+
+    for future in pending:
+        future.add_done_callback(resolve)
+    return result
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import tempfile
+import typing
+import unittest
+
+from caskdb import AsyncDiskStorage, DiskStorage
+
+
+class TestAsyncDiskStorage(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    async def test_get_set(self) -> None:
+        store = await AsyncDiskStorage.open(self.path)
+        await store.set("name", "jojo")
+        self.assertEqual(await store.get("name"), "jojo")
+        await store.set_many([("a", "1"), ("b", "2")])
+        self.assertEqual(await store.get_many(["a", "b", "c"]), ["1", "2", ""])
+        self.assertTrue(await store.delete("a"))
+        self.assertFalse(await store.delete("a"))
+        self.assertEqual(await store.get("a"), "")
+        await store.close()
+
+        store = AsyncDiskStorage(DiskStorage(self.path))
+        self.assertEqual(await store.get("name"), "jojo")
+        self.assertEqual(await store.get("b"), "2")
+        await store.close()
+
+    async def test_batched_writes(self) -> None:
+        store = await AsyncDiskStorage.open(self.path)
+        batches: list[int] = []
+        set_many_bytes = store.store.set_many_bytes
+
+        def counting_set_many(items: typing.Any) -> typing.Any:
+            batches.append(len(items))
+            return set_many_bytes(items)
+
+        store.store.set_many_bytes = counting_set_many  # type: ignore[method-assign]
+        await asyncio.gather(*(store.set(f"key{i}", f"value{i}") for i in range(100)))
+        self.assertEqual(sum(batches), 100)
+        self.assertLess(len(batches), 100)
+        for i in range(100):
+            self.assertEqual(await store.get(f"key{i}"), f"value{i}")
+        await store.close()
+
+    async def test_order(self) -> None:
+        async with await AsyncDiskStorage.open(self.path) as store:
+            await asyncio.gather(
+                store.set("name", "jojo"),
+                store.delete("name"),
+                store.set("other", "dio"),
+                store.set("other", "kars"),
+                store.delete("other"),
+                store.set("other", "wamuu"),
+            )
+            self.assertEqual(await store.get("name"), "")
+            self.assertEqual(await store.get("other"), "wamuu")
+
+    async def test_close_waits_for_writes(self) -> None:
+        store = await AsyncDiskStorage.open(self.path)
+        tasks = [asyncio.ensure_future(store.set(f"k{i}", "v")) for i in range(10)]
+        await asyncio.sleep(0)
+        await store.close()
+        await asyncio.gather(*tasks)
+        disk = DiskStorage(self.path)
+        self.assertEqual(len(disk.key_dir), 10)
+        disk.close()
+
+    async def test_write_error(self) -> None:
+        store = await AsyncDiskStorage.open(self.path)
+        with self.assertRaises(AttributeError):
+            await store.set_many([(1, 2)])  # type: ignore[list-item]
+        await store.set("name", "jojo")
+        self.assertEqual(await store.get("name"), "jojo")
+        await store.close()
+
+    async def test_write_error_in_batch(self) -> None:
+        store = await AsyncDiskStorage.open(self.path)
+        results = await asyncio.gather(
+            store.set("good", "ok"),
+            store.set("bad", 123),  # type: ignore[arg-type]
+            store.set_bytes(b"raw", "not bytes"),  # type: ignore[arg-type]
+            return_exceptions=True,
+        )
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], AttributeError)
+        self.assertIsInstance(results[2], TypeError)
+        self.assertEqual(await store.get("good"), "ok")
+        self.assertEqual(await store.get("bad"), "")
+        await store.close()
+
+    async def test_failed_batch(self) -> None:
+        # a batch which fails in the store is retried write by write, and only the
+        # failing write gets the error
+        store = await AsyncDiskStorage.open(self.path)
+        set_many_bytes = store.store.set_many_bytes
+
+        def failing(items: typing.Any) -> typing.Any:
+            if any(key == b"bad" for key, _ in items):
+                raise OSError("disk full")
+            return set_many_bytes(items)
+
+        store.store.set_many_bytes = failing  # type: ignore[method-assign]
+        results = await asyncio.gather(
+            store.set("a", "1"),
+            store.set("bad", "2"),
+            store.set("b", "3"),
+            return_exceptions=True,
+        )
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], OSError)
+        self.assertIsNone(results[2])
+        self.assertEqual(await store.get_many(["a", "bad", "b"]), ["1", "", "3"])
+        await store.close()
@@ -0,0 +1,179 @@
+import os
+import tempfile
+import typing
+import unittest
+
+from caskdb import DiskStorage
+from caskdb.bloom import (
+    BloomFilter,
+    BloomFilters,
+    GrowingBloomFilter,
+    load_bloom_filter,
+    save_bloom_filter,
+)
+
+
+class TestBloomFilter(unittest.TestCase):
+    def test_no_false_negatives(self) -> None:
+        keys: list[str] = [f"key{i}" for i in range(10_000)]
+        bloom: BloomFilter = BloomFilter.from_keys(keys, 0.01)
+        self.assertEqual(bloom.count, len(keys))
+        for key in keys:
+            self.assertIn(key, bloom)
+
+    def test_false_positive_rate(self) -> None:
+        for rate in (0.1, 0.01, 0.001):
+            with self.subTest(rate=rate):
+                bloom: BloomFilter = BloomFilter.from_keys(
+                    [f"key{i}" for i in range(10_000)], rate
+                )
+                missing: int = 20_000
+                positives: int = sum(f"other{i}" in bloom for i in range(missing))
+                self.assertLess(positives / missing, rate * 2)
+
+    def test_memory(self) -> None:
+        # about 10 bits per key at 1%, and 15 at 0.1%
+        self.assertAlmostEqual(BloomFilter(80_000, 0.01).memory_bytes, 95_851, -2)
+        self.assertAlmostEqual(BloomFilter(80_000, 0.001).memory_bytes, 143_776, -2)
+        # an empty segment still gets a tiny filter
+        self.assertEqual(BloomFilter(0).memory_bytes, 8)
+
+    def test_bytes_keys(self) -> None:
+        bloom = BloomFilter(10)
+        bloom.add("\udcff")
+        self.assertIn("\udcff", bloom)
+        self.assertNotIn(b"\xff", bloom)
+
+    def test_save_and_load(self) -> None:
+        bloom: BloomFilter = BloomFilter.from_keys(["othello", "hamlet"])
+        with tempfile.TemporaryDirectory() as path:
+            file_name: str = os.path.join(path, "test.bloom")
+            save_bloom_filter(file_name, bloom, 100)
+            loaded = load_bloom_filter(file_name, 100)
+            assert loaded is not None
+            self.assertIn("othello", loaded)
+            self.assertEqual(loaded.num_hashes, bloom.num_hashes)
+            self.assertEqual(loaded.count, 2)
+            # the filter of a segment of another size is stale
+            self.assertIsNone(load_bloom_filter(file_name, 101))
+            self.assertIsNone(load_bloom_filter(file_name + ".missing", 100))
+            with open(file_name, "r+b") as f:
+                f.truncate(30)
+            self.assertIsNone(load_bloom_filter(file_name, 100))
+
+    def test_invalid(self) -> None:
+        self.assertRaises(ValueError, BloomFilter, -1)
+        self.assertRaises(ValueError, BloomFilter, 10, 0)
+        self.assertRaises(ValueError, BloomFilter, 10, 1)
+        self.assertRaises(ValueError, BloomFilters, 1.5)
+        self.assertRaises(ValueError, BloomFilter.from_bytes, b"short")
+
+
+class TestGrowingBloomFilter(unittest.TestCase):
+    def test_grows(self) -> None:
+        bloom = GrowingBloomFilter(0.01, capacity=1000)
+        keys: list[str] = [f"key{i}" for i in range(20_000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertEqual(bloom.count, len(keys))
+        for key in keys:
+            self.assertIn(key, bloom)
+        missing: int = 20_000
+        positives: int = sum(f"other{i}" in bloom for i in range(missing))
+        self.assertLess(positives / missing, 0.01 * 2)
+        # a few bits per key more than a filter sized for the keys
+        self.assertLess(bloom.memory_bytes, 3 * BloomFilter(len(keys)).memory_bytes)
+
+
+class TestDiskStorageBloom(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def open(self, **options: typing.Any) -> DiskStorage:
+        return DiskStorage(
+            file_name=self.path, max_file_size=200, bloom_fp_rate=0.01, **options
+        )
+
+    def test_lookups(self) -> None:
+        store: DiskStorage = self.open()
+        for i in range(20):
+            store.set(f"key{i}", f"value{i}")
+        store.delete("key3")
+        filters = store.bloom_filters
+        assert filters is not None
+        # every sealed segment has a filter, saved next to it, and the keys of the
+        # active one are in the growing filter
+        self.assertEqual(len(filters), len(store.file_ids()) - 1)
+        self.assertIn("key19", filters.active)
+        self.assertNotIn("key0", filters.active)
+        self.assertTrue(os.path.exists(store.bloom_path(0)))
+        self.assertGreater(filters.memory_bytes, 0)
+        for i in range(20):
+            self.assertEqual(store.get(f"key{i}"), "" if i == 3 else f"value{i}")
+        self.assertEqual(
+            store.get_many(["key1", "missing", "key19"]), ["value1", "", "value19"]
+        )
+        for i in range(100):
+            self.assertEqual(store.get(f"missing{i}"), "")
+        self.assertGreater(filters.stats.negatives, 90)
+        # the deleted key is still in the filter of its segment
+        self.assertGreaterEqual(filters.stats.false_positives, 1)
+        self.assertLess(filters.stats.false_positive_rate, 0.1)
+        store.close()
+
+    def test_reopen(self) -> None:
+        store: DiskStorage = self.open()
+        for i in range(20):
+            store.set(f"key{i}", f"value{i}")
+        store.close()
+        # a stale filter is rebuilt, rather than trusted
+        with open(self.path + ".bloom", "wb") as f:
+            f.write(BloomFilter(1).to_bytes(os.path.getsize(self.path) + 1))
+        store = self.open()
+        for i in range(20):
+            self.assertEqual(store.get(f"key{i}"), f"value{i}")
+        self.assertEqual(store.get("missing"), "")
+        bloom = load_bloom_filter(self.path + ".bloom", os.path.getsize(self.path))
+        assert bloom is not None
+        self.assertIn("key0", bloom)
+        store.close()
+
+    def test_merge(self) -> None:
+        store: DiskStorage = self.open()
+        for i in range(40):
+            store.set(f"key{i % 10}", f"value{i}")
+        old: list[int] = store.file_ids()
+        store.merge()
+        filters = store.bloom_filters
+        assert filters is not None
+        for file_id in old:
+            self.assertIsNone(filters.get(file_id))
+            self.assertFalse(os.path.exists(store.bloom_path(file_id)))
+        for i in range(10):
+            self.assertEqual(store.get(f"key{i}"), f"value{30 + i}")
+        self.assertEqual(store.get("missing"), "")
+        store.close()
+
+    def test_read_only(self) -> None:
+        writer: DiskStorage = self.open()
+        writer.set("key0", "value0")
+        reader: DiskStorage = self.open(read_only=True)
+        for i in range(1, 20):
+            writer.set(f"key{i}", f"value{i}")
+        reader.refresh()
+        filters = reader.bloom_filters
+        assert filters is not None
+        self.assertEqual(len(filters), len(writer.file_ids()) - 1)
+        for i in range(20):
+            self.assertEqual(reader.get(f"key{i}"), f"value{i}")
+        self.assertEqual(reader.get("missing"), "")
+        writer.merge()
+        reader.refresh()
+        for i in range(20):
+            self.assertEqual(reader.get(f"key{i}"), f"value{i}")
+        reader.close()
+        writer.close()
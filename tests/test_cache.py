@@ -0,0 +1,202 @@
+import os
+import random
+import tempfile
+import unittest
+
+from caskdb import DiskStorage
+from caskdb.cache import (
+    Cache,
+    CountMinSketch,
+    FIFOCache,
+    LFUCache,
+    LRUCache,
+    TinyLFUCache,
+    new_cache,
+)
+
+
+class TestNewCache(unittest.TestCase):
+    def test_policies(self) -> None:
+        self.assertIsInstance(new_cache("fifo", 100), FIFOCache)
+        self.assertIsInstance(new_cache("lru", 100), LRUCache)
+        self.assertIsInstance(new_cache("lfu", 100), LFUCache)
+        self.assertIsInstance(new_cache("tinylfu", 100), TinyLFUCache)
+        self.assertRaises(ValueError, new_cache, "random", 100)
+        self.assertRaises(ValueError, new_cache, "lru", 0)
+
+    def test_abstract(self) -> None:
+        class Concrete(FIFOCache):
+            pass
+
+        class Partial(Cache):
+            def __len__(self) -> int:
+                return 0
+
+        Concrete(100)
+        self.assertRaises(TypeError, Cache, 100)
+        self.assertRaises(TypeError, Partial, 100)
+
+
+class TestCaches(unittest.TestCase):
+    def check_basics(self, cache: Cache) -> None:
+        self.assertIsNone(cache.get("name"))
+        cache.put("name", "jojo")
+        self.assertEqual(cache.get("name"), "jojo")
+        cache.put("name", "")
+        self.assertEqual(cache.get("name"), "")
+        cache.invalidate("name")
+        self.assertIsNone(cache.get("name"))
+        self.assertEqual(cache.stats.hits, 2)
+        self.assertEqual(cache.stats.misses, 2)
+        self.assertEqual(cache.stats.hit_rate, 0.5)
+        # values larger than the budget are not cached at all
+        cache.put("big", "x" * cache.max_bytes)
+        self.assertIsNone(cache.get("big"))
+        cache.put("name", "jojo")
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+    def check_budget(self, cache: Cache) -> None:
+        rng = random.Random(3)
+        for _ in range(5000):
+            key: str = f"key{rng.randrange(300)}"
+            if cache.get(key) is None:
+                cache.put(key, "v" * rng.randrange(50))
+            self.assertLessEqual(cache.size, cache.max_bytes)
+        self.assertGreater(cache.stats.evictions, 0)
+
+    def test_all(self) -> None:
+        for policy in ("fifo", "lru", "lfu", "tinylfu"):
+            with self.subTest(policy=policy):
+                self.check_basics(new_cache(policy, 1000))
+                self.check_budget(new_cache(policy, 1000))
+
+    def test_fifo(self) -> None:
+        cache = FIFOCache(max_bytes=20)
+        cache.put("a", "123456789")
+        cache.put("b", "123456789")
+        cache.get("a")
+        cache.put("c", "123456789")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), "123456789")
+        self.assertEqual(cache.stats.evictions, 1)
+
+    def test_lru(self) -> None:
+        cache = LRUCache(max_bytes=20)
+        cache.put("a", "123456789")
+        cache.put("b", "123456789")
+        cache.get("a")
+        cache.put("c", "123456789")
+        self.assertEqual(cache.get("a"), "123456789")
+        self.assertIsNone(cache.get("b"))
+
+    def test_lfu(self) -> None:
+        cache = LFUCache(max_bytes=20)
+        cache.put("a", "123456789")
+        cache.put("b", "123456789")
+        cache.get("a")
+        cache.get("a")
+        cache.get("b")
+        cache.put("c", "123456789")
+        self.assertIsNone(cache.get("b"))
+        cache.put("d", "123456789")
+        # c and d were read equally often, and c longer ago
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.get("a"), "123456789")
+
+    def test_tinylfu_keeps_hot_keys(self) -> None:
+        # a scan of keys seen only once should not push the hot keys out
+        cache = TinyLFUCache(max_bytes=10_000, expected_entries=1000)
+        hot: list[str] = [f"hot{i}" for i in range(50)]
+        for _ in range(10):
+            for key in hot:
+                if cache.get(key) is None:
+                    cache.put(key, "v" * 90)
+        for i in range(1000):
+            cache.put(f"cold{i}", "v" * 90)
+        found: int = sum(cache.get(key) is not None for key in hot)
+        self.assertGreaterEqual(found, 45)
+
+
+class TestCountMinSketch(unittest.TestCase):
+    def test_estimate(self) -> None:
+        sketch = CountMinSketch(width=1024, sample_size=10_000)
+        for _ in range(5):
+            sketch.increment("hot")
+        sketch.increment("cold")
+        self.assertGreaterEqual(sketch.estimate("hot"), 5)
+        self.assertGreaterEqual(sketch.estimate("cold"), 1)
+        self.assertLess(sketch.estimate("cold"), 5)
+
+    def test_aging(self) -> None:
+        sketch = CountMinSketch(width=64, sample_size=20)
+        for _ in range(12):
+            sketch.increment("hot")
+        for i in range(8):
+            sketch.increment(f"key{i}")
+        self.assertLessEqual(sketch.estimate("hot"), 7)
+
+
+class TestDiskStorageCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_get(self) -> None:
+        cache = LRUCache(max_bytes=1000)
+        store = DiskStorage(file_name=self.path, cache=cache)
+        store.set("name", "jojo")
+        self.assertEqual(store.get("name"), "jojo")
+        self.assertEqual(store.get("name"), "jojo")
+        self.assertEqual(cache.stats.hits, 1)
+        self.assertEqual(cache.stats.misses, 1)
+        # missing keys are not cached
+        self.assertEqual(store.get("some key"), "")
+        self.assertEqual(len(cache), 1)
+        store.close()
+
+    def test_set_invalidates(self) -> None:
+        cache = LRUCache(max_bytes=1000)
+        store = DiskStorage(file_name=self.path, cache=cache)
+        store.set("name", "jojo")
+        store.set("other", "dio")
+        self.assertEqual(store.get("name"), "jojo")
+        self.assertEqual(store.get("other"), "dio")
+        store.set("name", "jotaro")
+        self.assertEqual(store.get("name"), "jotaro")
+        store.set_many([("name", "josuke"), ("other", "kira")])
+        self.assertEqual(store.get_many(["name", "other", "x"]), ["josuke", "kira", ""])
+        with store.batch() as batch:
+            batch["name"] = "giorno"
+        self.assertEqual(store.get("name"), "giorno")
+        store.close()
+
+    def test_get_many(self) -> None:
+        cache = LFUCache(max_bytes=1000)
+        store = DiskStorage(file_name=self.path, cache=cache)
+        for i in range(10):
+            store.set(f"key{i}", f"value{i}")
+        store.get("key3")
+        keys: list[str] = [f"key{i}" for i in range(10)]
+        self.assertEqual(store.get_many(keys), [f"value{i}" for i in range(10)])
+        self.assertEqual(cache.stats.hits, 1)
+        self.assertEqual(len(cache), 10)
+        self.assertEqual(store.get_many(keys), [f"value{i}" for i in range(10)])
+        self.assertEqual(cache.stats.hits, 11)
+        store.close()
+
+    def test_merge(self) -> None:
+        cache = TinyLFUCache(max_bytes=10_000, expected_entries=100)
+        store = DiskStorage(file_name=self.path, max_file_size=100, cache=cache)
+        for i in range(50):
+            store.set(f"key{i % 5}", f"value{i}")
+        for i in range(5):
+            self.assertEqual(store.get(f"key{i}"), f"value{45 + i}")
+        store.merge()
+        for i in range(5):
+            self.assertEqual(store.get(f"key{i}"), f"value{45 + i}")
+        store.close()
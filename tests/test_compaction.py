@@ -0,0 +1,218 @@
+import os
+import tempfile
+import threading
+import time
+import typing
+import unittest
+
+from caskdb import DiskStorage
+from caskdb.compaction import Compactor, MergeStats
+
+
+class TestMergeStats(unittest.TestCase):
+    def test_record(self) -> None:
+        stats = MergeStats()
+        stats.record(100, 0.5)
+        stats.record(50, 0.25)
+        self.assertEqual(stats.merges, 2)
+        self.assertEqual(stats.bytes_reclaimed, 150)
+        self.assertEqual(stats.last_duration, 0.25)
+        self.assertEqual(stats.total_duration, 0.75)
+
+
+class TestMerge(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def disk_usage(self, store: DiskStorage) -> int:
+        return sum(os.path.getsize(store.segment_path(i)) for i in store.file_ids())
+
+    def test_merge_single_file(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        for i in range(100):
+            store.set("name", f"jojo{i}")
+        store.set("other", "value")
+        before: int = self.disk_usage(store)
+        reclaimed: int = store.merge()
+        self.assertGreater(reclaimed, 0)
+        self.assertEqual(self.disk_usage(store), before - reclaimed)
+        self.assertEqual(store.get("name"), "jojo99")
+        self.assertEqual(store.get("other"), "value")
+        self.assertEqual(store.merge_stats.merges, 1)
+        self.assertEqual(store.merge_stats.bytes_reclaimed, reclaimed)
+        # the old segment is deleted
+        self.assertFalse(os.path.exists(self.path))
+        store.set("name", "dio")
+        store.close()
+
+        store = DiskStorage(file_name=self.path)
+        self.assertEqual(store.get("name"), "dio")
+        self.assertEqual(store.get("other"), "value")
+        store.close()
+
+    def test_merge_segments(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=256)
+        for round in range(5):
+            for i in range(20):
+                store.set(f"key{i}", f"value{round}-{i}")
+        ratios: dict[int, float] = store.dead_byte_ratios()
+        self.assertEqual(ratios[store.file_ids()[0]], 1.0)
+        sealed: list[int] = store.merge_candidates(0.5)
+        self.assertTrue(sealed)
+        store.merge(sealed)
+        for file_id in sealed:
+            self.assertFalse(os.path.exists(store.segment_path(file_id)))
+            self.assertFalse(os.path.exists(store.hint_path(file_id)))
+        for i in range(20):
+            self.assertEqual(store.get(f"key{i}"), f"value4-{i}")
+        store.close()
+
+        store = DiskStorage(file_name=self.path, max_file_size=256)
+        for i in range(20):
+            self.assertEqual(store.get(f"key{i}"), f"value4-{i}")
+        store.close()
+
+    def test_merge_writes_hint_files(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=128)
+        for i in range(20):
+            store.set(f"key{i}", "x" * 10)
+        store.merge()
+        for file_id in store.file_ids()[:-1]:
+            self.assertTrue(os.path.exists(store.hint_path(file_id)))
+        store.close()
+
+    def test_writes_during_merge(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=512)
+        for i in range(200):
+            store.set(f"key{i % 20}", f"old{i}")
+        done = threading.Event()
+
+        def write() -> None:
+            i: int = 0
+            while not done.is_set():
+                store.set(f"key{i % 20}", f"new{i}")
+                i += 1
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            for _ in range(3):
+                store.merge()
+        finally:
+            done.set()
+            writer.join()
+        expected: dict[str, str] = {f"key{i}": store.get(f"key{i}") for i in range(20)}
+        store.close()
+
+        store = DiskStorage(file_name=self.path, max_file_size=512)
+        for k, v in expected.items():
+            self.assertEqual(store.get(k), v)
+        store.close()
+
+    def test_crash_before_delete(self) -> None:
+        # simulate a crash after the merged segments are written, but before the
+        # old segments are deleted: both of them are present at the startup
+        store = DiskStorage(file_name=self.path, max_file_size=128)
+        for i in range(30):
+            store.set(f"key{i % 5}", f"value{i}")
+        saved: dict[int, bytes] = {}
+        for file_id in store.file_ids():
+            with open(store.segment_path(file_id), "rb") as f:
+                saved[file_id] = f.read()
+        store.merge()
+        store.set("key0", "latest")
+        store.close()
+        for file_id, data in saved.items():
+            with open(store.segment_path(file_id), "wb") as f:
+                f.write(data)
+
+        store = DiskStorage(file_name=self.path, max_file_size=128)
+        self.assertEqual(store.get("key0"), "latest")
+        for i in range(1, 5):
+            self.assertEqual(store.get(f"key{i}"), f"value{25 + i}")
+        store.close()
+
+
+class TestCompactor(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_bad_threshold(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        self.assertRaises(ValueError, Compactor, store, 0)
+        self.assertRaises(ValueError, Compactor, store, 1.5)
+        store.close()
+
+    def test_auto_merge(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=256, merge_threshold=0.5)
+        for round in range(10):
+            for i in range(10):
+                store.set(f"key{i}", f"value{round}-{i}")
+        deadline: float = time.time() + 5
+        while store.merge_stats.merges == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertGreater(store.merge_stats.merges, 0)
+        self.assertGreater(store.merge_stats.bytes_reclaimed, 0)
+        for i in range(10):
+            self.assertEqual(store.get(f"key{i}"), f"value9-{i}")
+        store.close()
+
+    def test_segments_bounded(self) -> None:
+        # repeated merges must not leave empty segments behind
+        store = DiskStorage(
+            file_name=self.path, max_file_size=4096, merge_threshold=0.5
+        )
+        for round in range(200):
+            for i in range(20):
+                store.set(f"key{i}", f"value{round}-{i}")
+        deadline: float = time.time() + 5
+        while store.merge_candidates(0.5) and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertGreater(store.merge_stats.merges, 0)
+        self.assertLessEqual(len(store.file_ids()), 10)
+        store.close()
+        self.assertLessEqual(len(os.listdir(self.dir.name)), 20)
+
+        store = DiskStorage(file_name=self.path, max_file_size=4096)
+        for i in range(20):
+            self.assertEqual(store.get(f"key{i}"), f"value199-{i}")
+        store.close()
+
+    def test_failed_merge(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=256)
+        for round in range(10):
+            for i in range(10):
+                store.set(f"key{i}", f"value{round}-{i}")
+        merge = store.merge
+        calls: list[int] = []
+
+        def failing(file_ids: typing.Optional[list[int]] = None) -> int:
+            calls.append(len(calls))
+            if len(calls) == 1:
+                raise OSError("disk full")
+            return merge(file_ids)
+
+        store.merge = failing  # type: ignore[method-assign]
+        compactor = Compactor(store, 0.5)
+        with self.assertLogs("caskdb.compaction", "ERROR") as logs:
+            compactor.trigger()
+            deadline: float = time.time() + 5
+            while not logs.output and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertIn("disk full", logs.output[0])
+        # the compactor survives, and merges on the next trigger
+        compactor.trigger()
+        deadline = time.time() + 5
+        while store.merge_stats.merges == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(store.merge_stats.merges, 1)
+        compactor.close()
+        store.close()
@@ -0,0 +1,123 @@
+import json
+import os
+import tempfile
+import unittest
+
+from caskdb import DiskStorage
+from caskdb.compression import (
+    DICTIONARY_FLAG,
+    HAS_ZSTD,
+    NONE,
+    ZLIB,
+    Compressor,
+    Decompressor,
+    train_dictionary,
+)
+
+
+def make_value(i: int) -> bytes:
+    document = {
+        "id": i,
+        "name": f"user{i}",
+        "email": f"user{i}@example.com",
+        "active": i % 2 == 0,
+        "roles": ["reader", "writer"],
+    }
+    return json.dumps(document).encode("utf-8")
+
+
+class TestCompressor(unittest.TestCase):
+    def test_codecs(self) -> None:
+        value: bytes = make_value(1) * 10
+        codecs: list[str] = ["zlib", "lzma"] + (["zstd"] if HAS_ZSTD else [])
+        for codec in codecs:
+            with self.subTest(codec=codec):
+                flags, data = Compressor(codec, threshold=0).compress(value)
+                self.assertNotEqual(flags, NONE)
+                self.assertLess(len(data), len(value))
+                self.assertEqual(Decompressor().decompress(flags, data), value)
+
+    def test_threshold(self) -> None:
+        compressor = Compressor("zlib", threshold=1000)
+        value: bytes = make_value(1)
+        self.assertEqual(compressor.compress(value), (NONE, value))
+        self.assertEqual(compressor.compress(value * 10)[0], ZLIB)
+        # a value which doesn't get smaller is stored as is
+        random_value: bytes = os.urandom(2000)
+        self.assertEqual(compressor.compress(random_value), (NONE, random_value))
+
+    def test_dictionary(self) -> None:
+        dictionary: bytes = train_dictionary(make_value(i) for i in range(100))
+        plain = Compressor("zlib", threshold=0)
+        trained = Compressor("zlib", threshold=0, dictionary=dictionary)
+        value: bytes = make_value(1000)
+        flags, data = trained.compress(value)
+        self.assertEqual(flags, ZLIB | DICTIONARY_FLAG)
+        # a small value compresses much better with the dictionary
+        self.assertLess(len(data), len(value) // 2)
+        self.assertLess(len(data), len(plain.compress(value)[1]) // 2)
+        self.assertEqual(Decompressor(dictionary).decompress(flags, data), value)
+        self.assertRaises(ValueError, Decompressor().decompress, flags, data)
+
+    def test_invalid(self) -> None:
+        self.assertRaises(ValueError, Compressor, "snappy")
+        self.assertRaises(ValueError, Compressor, "lzma", dictionary=b"dictionary")
+        self.assertRaises(ValueError, Compressor, "zlib", threshold=-1)
+        self.assertRaises(ValueError, Decompressor().decompress, 15, b"")
+        if not HAS_ZSTD:
+            self.assertRaises(ValueError, Compressor, "zstd")
+
+
+class TestDiskStorageCompression(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_compressed(self) -> None:
+        values: dict[str, str] = {
+            f"key{i}": make_value(i).decode("utf-8") * 5 for i in range(50)
+        }
+        store = DiskStorage(file_name=self.path, compressor=Compressor("zlib"))
+        for key, value in values.items():
+            store.set(key, value)
+        store.set("small", "jojo")
+        self.assertLess(store.write_position, sum(len(v) for v in values.values()))
+        self.assertEqual(store.get("key1"), values["key1"])
+        self.assertEqual(store.get_view("key2"), values["key2"].encode("utf-8"))
+        self.assertEqual(store.get_many(list(values)), list(values.values()))
+        self.assertEqual(store.get("small"), "jojo")
+        store.close()
+
+        # the records of different codecs are read along each other, and without a
+        # compressor too
+        store = DiskStorage(file_name=self.path, compressor=Compressor("lzma"))
+        store.set_many([("key1", values["key3"]), ("key4", values["key1"])])
+        store.merge()
+        store.close()
+        store = DiskStorage(file_name=self.path)
+        self.assertEqual(store.get("key1"), values["key3"])
+        self.assertEqual(store.get("key4"), values["key1"])
+        self.assertEqual(store.get("key5"), values["key5"])
+        self.assertEqual(store.get("small"), "jojo")
+        store.close()
+
+    def test_dictionary(self) -> None:
+        dictionary: bytes = train_dictionary(make_value(i) for i in range(100))
+        compressor = Compressor("zlib", threshold=0, dictionary=dictionary)
+        store = DiskStorage(file_name=self.path, compressor=compressor)
+        store.set_bytes(b"key", make_value(1000))
+        store.close()
+
+        # the dictionary was saved, so the store can be read without the compressor
+        store = DiskStorage(file_name=self.path, use_mmap=True)
+        self.assertEqual(store.get_bytes(b"key"), make_value(1000))
+        store.close()
+        other = Compressor("zlib", dictionary=train_dictionary([b"other"]))
+        self.assertRaises(
+            ValueError, DiskStorage, file_name=self.path, compressor=other
+        )
+        # the failed open must not leave the store locked
+        DiskStorage(file_name=self.path, compressor=compressor).close()
@@ -1,9 +1,17 @@
+import io
 import os
+import struct
+import sys
 import tempfile
+import threading
 import typing
 import unittest
 
-from caskdb import DiskStorage
+from caskdb import ChecksumError, DiskStorage, FormatError, SyncPolicy
+from caskdb.disk_store import HINT_FILE_SUFFIX, _ReadPool, prefix_end
+from caskdb.format import HEADER_SIZE, TOMBSTONE, KeyEntry
+from caskdb.locking import LOCK_FILE_SUFFIX
+from caskdb.scan import SCAN_CHUNK_SIZE
 
 
 class TempStorageFile:
@@ -37,6 +45,17 @@ class TempStorageFile:
         # will delete our database file. Having a separate method would give us better
         # control.
         os.remove(self.path)
+        for suffix in (HINT_FILE_SUFFIX, LOCK_FILE_SUFFIX):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+
+def crash(store: DiskStorage) -> None:
+    # simulates a crash of the writer: the active segment gets no hint file, and the
+    # lock is released, like the OS would do when the process dies
+    store.file.close()
+    assert store._file_lock is not None
+    store._file_lock.release()
 
 
 class TestDiskCaskDB(unittest.TestCase):
@@ -124,3 +143,920 @@ class TestDiskCaskDBExistingFile(unittest.TestCase):
         self.assertEqual(store.get("name"), "jojo")
         store.close()
         t.clean_up()
+
+
+class TestDiskCaskDBHintFile(unittest.TestCase):
+    def setUp(self) -> None:
+        self.file: TempStorageFile = TempStorageFile()
+        self.tests: dict[str, str] = {
+            "crime and punishment": "dostoevsky",
+            "anna karenina": "tolstoy",
+            "war and peace": "tolstoy",
+            "hamlet": "shakespeare",
+        }
+
+    def tearDown(self) -> None:
+        self.file.clean_up()
+
+    def test_hint_file_written_on_close(self) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        for k, v in self.tests.items():
+            store.set(k, v)
+        store.close()
+        self.assertTrue(os.path.exists(self.file.path + HINT_FILE_SUFFIX))
+
+        store = DiskStorage(file_name=self.file.path)
+        for k, v in self.tests.items():
+            self.assertEqual(store.get(k), v)
+        self.assertEqual(store.write_position, os.path.getsize(self.file.path))
+        store.close()
+
+    def test_tail_after_hint(self) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        for k, v in self.tests.items():
+            store.set(k, v)
+        store.close()
+
+        # simulate a crash: records written after the hint file, but the store was
+        # never closed, so the hint file covers only a prefix of the data file
+        store = DiskStorage(file_name=self.file.path)
+        store.set("hamlet", "william shakespeare")
+        store.set("dune", "frank herbert")
+        crash(store)
+
+        store = DiskStorage(file_name=self.file.path)
+        self.assertEqual(store.get("hamlet"), "william shakespeare")
+        self.assertEqual(store.get("dune"), "frank herbert")
+        self.assertEqual(store.get("anna karenina"), "tolstoy")
+        store.close()
+
+    def test_hint_file_from_key_dir(self) -> None:
+        # the active segment keeps only the tombstones of the keys still deleted, its
+        # hint file is built from the KeyDir once it is sealed
+        store = DiskStorage(file_name=self.file.path)
+        for i in range(1000):
+            store.set(f"key{i}", f"value{i}")
+        store.set_many([("key0", "new"), ("key1", "new")])
+        self.assertEqual(store._active_tombstones, {})
+        store.delete("key1")
+        store.delete("key2")
+        store.set("key2", "again")
+        self.assertEqual(list(store._active_tombstones), ["key1"])
+        store.close()
+
+        store = DiskStorage(file_name=self.file.path)
+        entries: dict[str, KeyEntry] = {}
+        self.assertEqual(
+            store._load_hint_file(0, entries), os.path.getsize(self.file.path)
+        )
+        self.assertEqual(len(entries), 1000)
+        self.assertEqual(entries["key1"].total_size, TOMBSTONE)
+        self.assertEqual(store.get("key0"), "new")
+        self.assertEqual(store.get("key1"), "")
+        self.assertEqual(store.get("key2"), "again")
+        self.assertEqual(len(store.key_dir), 999)
+        self.assertEqual(list(store._active_tombstones), ["key1"])
+        store.close()
+
+    def test_hint_file_of_other_data_file(self) -> None:
+        store = DiskStorage(file_name=self.file.path)
+        for k, v in self.tests.items():
+            store.set(k, v)
+        store.close()
+
+        # replace the data file with a smaller one, the hint file no longer matches
+        os.remove(self.file.path)
+        store = DiskStorage(file_name=self.file.path)
+        store.set("dune", "frank herbert")
+        crash(store)
+
+        store = DiskStorage(file_name=self.file.path)
+        self.assertEqual(store.get("dune"), "frank herbert")
+        self.assertEqual(store.get("hamlet"), "")
+        store.close()
+
+
+class TestDiskCaskDBSegments(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_rollover(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=100)
+        for i in range(50):
+            store.set(f"key{i}", f"value{i}")
+        self.assertGreater(len(store.file_ids()), 1)
+        for file_id in store.file_ids():
+            self.assertLessEqual(os.path.getsize(store.segment_path(file_id)), 100)
+        # sealed segments have their hint files
+        for file_id in store.file_ids()[:-1]:
+            self.assertTrue(os.path.exists(store.hint_path(file_id)))
+        for i in range(50):
+            self.assertEqual(store.get(f"key{i}"), f"value{i}")
+        store.close()
+
+        store = DiskStorage(file_name=self.path, max_file_size=100)
+        for i in range(50):
+            self.assertEqual(store.get(f"key{i}"), f"value{i}")
+        store.close()
+
+    def test_overwrite_across_segments(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=64)
+        for i in range(10):
+            store.set("name", f"jojo{i}")
+            store.set(f"filler{i}", "x" * 30)
+        self.assertEqual(store.get("name"), "jojo9")
+        # simulate a crash, the active segment has no hint file
+        crash(store)
+
+        store = DiskStorage(file_name=self.path, max_file_size=64)
+        self.assertEqual(store.get("name"), "jojo9")
+        store.close()
+
+    def test_large_record(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=32)
+        store.set("small", "a")
+        store.set("large", "b" * 100)
+        store.set("small", "c")
+        self.assertEqual(store.get("large"), "b" * 100)
+        self.assertEqual(store.get("small"), "c")
+        self.assertEqual(len(store.file_ids()), 3)
+        store.close()
+
+    def test_max_open_files(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=32, max_open_files=2)
+        for i in range(10):
+            store.set(f"key{i}", "x" * 20)
+        for _ in range(2):
+            for i in range(10):
+                self.assertEqual(store.get(f"key{i}"), "x" * 20)
+        assert isinstance(store._readers, _ReadPool)
+        self.assertLessEqual(len(store._readers.files), 2)
+        store.close()
+
+    def test_bad_options(self) -> None:
+        self.assertRaises(ValueError, DiskStorage, self.path, max_file_size=0)
+        self.assertRaises(ValueError, DiskStorage, self.path, max_open_files=0)
+
+
+class TestDiskCaskDBMmap(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_get(self) -> None:
+        store = DiskStorage(file_name=self.path, use_mmap=True)
+        store.set("name", "jojo")
+        self.assertEqual(store.get("name"), "jojo")
+        # the active segment grows past the mapping, so it is mapped again
+        store.set("othello", "shakespeare")
+        self.assertEqual(store.get("othello"), "shakespeare")
+        self.assertEqual(store.get("name"), "jojo")
+        self.assertEqual(store.get("some key"), "")
+        store.close()
+
+        store = DiskStorage(file_name=self.path, use_mmap=True)
+        self.assertEqual(store.get("othello"), "shakespeare")
+        store.close()
+
+    def test_get_view(self) -> None:
+        for use_mmap in (False, True):
+            store = DiskStorage(file_name=self.path, use_mmap=use_mmap)
+            store.set("name", "jojo")
+            view: memoryview = store.get_view("name")
+            self.assertEqual(bytes(view), b"jojo")
+            self.assertEqual(bytes(store.get_view("some key")), b"")
+            store.close()
+
+    def test_segments(self) -> None:
+        store = DiskStorage(
+            file_name=self.path, max_file_size=64, max_open_files=2, use_mmap=True
+        )
+        for i in range(20):
+            store.set(f"key{i}", f"value{i}")
+        for i in range(20):
+            self.assertEqual(store.get(f"key{i}"), f"value{i}")
+        self.assertLessEqual(len(store._readers.maps), 2)  # type: ignore[union-attr]
+        store.merge()
+        for i in range(20):
+            self.assertEqual(store.get(f"key{i}"), f"value{i}")
+        store.close()
+
+
+class TestDiskCaskDBBatch(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+        self.tests: dict[str, str] = {
+            "crime and punishment": "dostoevsky",
+            "anna karenina": "tolstoy",
+            "war and peace": "tolstoy",
+            "hamlet": "shakespeare",
+        }
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_set_many(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        future = store.set_many(self.tests.items())
+        self.assertTrue(future.done())
+        self.assertTrue(store.set_many([]).done())
+        for k, v in self.tests.items():
+            self.assertEqual(store.get(k), v)
+        store.close()
+
+        store = DiskStorage(file_name=self.path)
+        for k, v in self.tests.items():
+            self.assertEqual(store.get(k), v)
+        store.close()
+
+    def test_write_batch(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        with store.batch() as batch:
+            for k, v in self.tests.items():
+                batch[k] = v
+            batch.set("hamlet", "william shakespeare")
+            self.assertEqual(len(batch), len(self.tests))
+            # nothing is visible till the batch is committed
+            self.assertEqual(store.get("hamlet"), "")
+        self.assertEqual(store.get("hamlet"), "william shakespeare")
+
+        with self.assertRaises(RuntimeError):
+            with store.batch() as batch:
+                batch["dune"] = "frank herbert"
+                raise RuntimeError("abort")
+        self.assertEqual(store.get("dune"), "")
+        store.close()
+
+    def test_torn_batch(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        store.set("name", "jojo")
+        store.set_many(self.tests.items())
+        crash(store)
+        # simulate a crash in the middle of writing the batch
+        size: int = os.path.getsize(self.path)
+        os.truncate(self.path, size - 5)
+
+        store = DiskStorage(file_name=self.path)
+        self.assertEqual(store.get("name"), "jojo")
+        for k in self.tests:
+            self.assertEqual(store.get(k), "")
+        store.set("dune", "frank herbert")
+        store.close()
+
+        store = DiskStorage(file_name=self.path)
+        self.assertEqual(store.get("name"), "jojo")
+        self.assertEqual(store.get("dune"), "frank herbert")
+        store.close()
+
+    def test_batch_with_segments(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=64)
+        store.set_many((f"key{i}", f"value{i}") for i in range(10))
+        store.set_many((f"key{i}", f"new{i}") for i in range(5))
+        store.merge()
+        for i in range(10):
+            self.assertEqual(store.get(f"key{i}"), f"new{i}" if i < 5 else f"value{i}")
+        store.close()
+
+        store = DiskStorage(file_name=self.path, max_file_size=64)
+        for i in range(10):
+            self.assertEqual(store.get(f"key{i}"), f"new{i}" if i < 5 else f"value{i}")
+        store.close()
+
+
+class TestDiskCaskDBGetMany(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_get_many(self) -> None:
+        for use_mmap in (False, True):
+            store = DiskStorage(
+                file_name=self.path, max_file_size=256, use_mmap=use_mmap
+            )
+            for i in range(100):
+                store.set(f"key{i}", f"value{i}")
+            keys: list[str] = [f"key{i}" for i in range(99, -1, -3)]
+            keys += ["some key", "key5", "key5"]
+            expected: list[str] = [store.get(k) for k in keys]
+            self.assertEqual(store.get_many(keys), expected)
+            self.assertEqual(expected[-3:], ["", "value5", "value5"])
+            self.assertEqual(store.get_many([]), [])
+            store.close()
+
+    def test_coalesced_reads(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        for i in range(100):
+            store.set(f"key{i}", f"value{i}")
+        reads: list[int] = []
+        read = store._readers.read
+
+        def counting_read(file_id: int, position: int, size: int) -> bytes:
+            reads.append(size)
+            return read(file_id, position, size)  # type: ignore[return-value]
+
+        store._readers.read = counting_read  # type: ignore[method-assign]
+        keys: list[str] = [f"key{i}" for i in range(0, 100, 2)]
+        self.assertEqual(store.get_many(keys), [f"value{i}" for i in range(0, 100, 2)])
+        # all the records are close to each other, a single read fetches them
+        self.assertEqual(len(reads), 1)
+        store.close()
+
+
+class TestDiskCaskDBStartupScan(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_values_larger_than_chunk(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        big: str = "v" * (SCAN_CHUNK_SIZE + 100)
+        for i in range(3):
+            store.set(f"big{i}", big)
+            store.set(f"small{i}", f"value{i}")
+        # no close, so that the startup has no hint file and scans the segment
+        crash(store)
+
+        store = DiskStorage(file_name=self.path)
+        for i in range(3):
+            self.assertEqual(store.get(f"big{i}"), big)
+            self.assertEqual(store.get(f"small{i}"), f"value{i}")
+        store.close()
+
+    def test_progress(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=1000)
+        for i in range(200):
+            store.set(f"key{i}", f"value{i}")
+        crash(store)
+
+        calls: list[tuple[int, int]] = []
+        store = DiskStorage(
+            file_name=self.path,
+            progress=lambda done, total: calls.append((done, total)),
+        )
+        total: int = sum(
+            os.path.getsize(store.segment_path(i)) for i in store.file_ids()
+        )
+        self.assertEqual(calls[-1], (total, total))
+        self.assertEqual([done for done, _ in calls], sorted(done for done, _ in calls))
+        store.close()
+
+    def test_torn_record(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        store.set("name", "jojo")
+        store.set("other", "dio")
+        crash(store)
+        # simulate a crash in the middle of writing the last record
+        size: int = os.path.getsize(self.path)
+        os.truncate(self.path, size - 2)
+
+        store = DiskStorage(file_name=self.path)
+        self.assertEqual(store.get("name"), "jojo")
+        self.assertEqual(store.get("other"), "")
+        self.assertEqual(os.path.getsize(self.path), store.write_position)
+        store.set("other", "kars")
+        store.close()
+
+        store = DiskStorage(file_name=self.path)
+        self.assertEqual(store.get("other"), "kars")
+        store.close()
+
+
+class TestDiskCaskDBChecksum(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def flip(self, position: int) -> None:
+        with open(self.path, "r+b") as f:
+            f.seek(position)
+            byte: bytes = f.read(1)
+            f.seek(position)
+            f.write(bytes([byte[0] ^ 0x01]))
+
+    def test_get(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        store.set("name", "jojo")
+        store.set("other", "dio")
+        # the hint file spares the record from the startup scan
+        store.close()
+        self.flip(os.path.getsize(self.path) - 1)
+
+        store = DiskStorage(file_name=self.path)
+        self.assertEqual(store.get("name"), "jojo")
+        self.assertRaises(ChecksumError, store.get, "other")
+        self.assertRaises(ChecksumError, store.get_many, ["name", "other"])
+        self.assertRaises(ChecksumError, store.get_view, "other")
+        store.close()
+
+        store = DiskStorage(file_name=self.path, verify_checksums=False)
+        self.assertEqual(store.get("other"), "din")
+        store.close()
+
+    def test_startup_skips_corrupt_record(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        store.set("name", "jojo")
+        end: int = store.write_position
+        store.set("other", "dio")
+        store.set("another", "kars")
+        crash(store)
+        size: int = os.path.getsize(self.path)
+        # the value of the second record rots. The records after it are still good
+        self.flip(end + HEADER_SIZE + len("other"))
+
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                store = DiskStorage(file_name=self.path, startup_workers=workers)
+                self.assertEqual(store.get("name"), "jojo")
+                self.assertEqual(store.get("other"), "")
+                self.assertEqual(store.get("another"), "kars")
+                self.assertEqual(os.path.getsize(self.path), size)
+                self.assertEqual(store.write_position, size)
+                crash(store)
+
+    def test_startup_skips_corrupt_sealed_tail(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=100)
+        for i in range(10):
+            store.set(f"key{i}", f"value{i}")
+        crash(store)
+        first: str = store.segment_path(0)
+        os.remove(store.hint_path(0))
+        size: int = os.path.getsize(first)
+        # the last record of a sealed segment is no torn write, it is never truncated
+        self.flip(size - 1)
+
+        store = DiskStorage(file_name=self.path, max_file_size=100)
+        self.assertEqual(os.path.getsize(first), size)
+        self.assertEqual(store.get("key0"), "value0")
+        self.assertEqual(store.get("key9"), "value9")
+        self.assertEqual(len(store.key_dir), 9)
+        store.close()
+
+    def test_old_format(self) -> None:
+        # a store of the old format, with the 12 byte header and no checksums
+        with open(self.path, "wb") as f:
+            for i in range(10):
+                key, value = f"key{i}".encode(), f"value{i}".encode()
+                f.write(struct.pack("<LLL", i, len(key), len(value)) + key + value)
+        size: int = os.path.getsize(self.path)
+        self.assertRaises(FormatError, DiskStorage, file_name=self.path)
+        self.assertEqual(os.path.getsize(self.path), size)
+        # the lock was released, the store can be opened once it is migrated
+        os.remove(self.path)
+        DiskStorage(file_name=self.path).close()
+
+    def test_unknown_version(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        store.set("name", "jojo")
+        store.set("other", "dio")
+        crash(store)
+        with open(self.path, "r+b") as f:
+            data: bytes = f.read()
+            f.seek(0)
+            # every record claims a version from the future
+            f.write(data.replace(b"\x01\x00", b"\x02\x00"))
+        size: int = os.path.getsize(self.path)
+        self.assertRaises(FormatError, DiskStorage, file_name=self.path)
+        self.assertEqual(os.path.getsize(self.path), size)
+
+    def test_startup_drops_corrupt_batch(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        store.set("name", "jojo")
+        end: int = store.write_position
+        store.set_many([(f"key{i}", f"value{i}") for i in range(10)])
+        crash(store)
+        self.flip(os.path.getsize(self.path) - 20)
+
+        store = DiskStorage(file_name=self.path)
+        self.assertEqual(store.get("name"), "jojo")
+        for i in range(10):
+            self.assertEqual(store.get(f"key{i}"), "")
+        self.assertEqual(os.path.getsize(self.path), end)
+        store.close()
+
+
+class TestDiskCaskDBBytes(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_non_ascii(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        store.set("ключ", "значение")
+        store.set("名前", "ジョジョ")
+        store.set_many([("🙂", "😀"), ("ascii", "ünïcödé")])
+        crash(store)
+        # once without the hint file, and once with it
+        for _ in range(2):
+            store = DiskStorage(file_name=self.path)
+            self.assertEqual(store.get("ключ"), "значение")
+            self.assertEqual(store.get("名前"), "ジョジョ")
+            self.assertEqual(store.get_many(["🙂", "ascii"]), ["😀", "ünïcödé"])
+            self.assertEqual(
+                store.get_bytes("名前".encode("utf-8")), "ジョジョ".encode()
+            )
+            store.close()
+
+    def test_binary(self) -> None:
+        key: bytes = b"\xff\x00\x80key"
+        value: bytes = bytes(range(256))
+        for key_dir_type in ("dict", "compact", "sorted"):
+            with self.subTest(key_dir_type=key_dir_type):
+                store = DiskStorage(file_name=self.path, key_dir_type=key_dir_type)
+                store.set_bytes(key, value)
+                store.set_bytes(b"name", memoryview(b"jojo"))
+                store.set_many_bytes(
+                    [(b"\x01", b"\x02"), (b"\x03", bytearray(b"\x04"))]
+                )
+                view: memoryview = store.get_bytes(key)
+                self.assertIsInstance(view, memoryview)
+                self.assertEqual(view, value)
+                # a UTF-8 key is the same key, be it bytes or str
+                self.assertEqual(store.get("name"), "jojo")
+                self.assertEqual(
+                    store.get_many_bytes([b"\x01", b"missing", b"\x03"]),
+                    [b"\x02", b"", b"\x04"],
+                )
+                store.delete_bytes(b"\x01")
+                store.close()
+
+                store = DiskStorage(file_name=self.path, key_dir_type=key_dir_type)
+                self.assertEqual(store.get_bytes(key), value)
+                self.assertEqual(store.get_bytes(b"\x01"), b"")
+                self.assertEqual(store.get_bytes(b"\x03"), b"\x04")
+                store.close()
+                for name in os.listdir(self.dir.name):
+                    os.remove(os.path.join(self.dir.name, name))
+
+    def test_lookup(self) -> None:
+        # lookup tells a missing key apart from an empty value
+        for use_mmap in (False, True):
+            with self.subTest(use_mmap=use_mmap):
+                store = DiskStorage(file_name=self.path, use_mmap=use_mmap)
+                store.set_many_bytes([(b"name", b"jojo"), (b"empty", b"")])
+                self.assertEqual(store.lookup_bytes(b"name"), b"jojo")
+                self.assertEqual(store.lookup_bytes(b"empty"), b"")
+                self.assertIsNone(store.lookup_bytes(b"missing"))
+                self.assertEqual(
+                    store.lookup_many_bytes([b"empty", b"missing", b"name"]),
+                    [b"", None, b"jojo"],
+                )
+                store.delete_bytes(b"name")
+                self.assertIsNone(store.lookup_bytes(b"name"))
+                store.close()
+
+
+class TestDiskCaskDBScan(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_scan(self) -> None:
+        for key_dir_type in ("dict", "compact", "sorted"):
+            with self.subTest(key_dir_type=key_dir_type):
+                store = DiskStorage(file_name=self.path, key_dir_type=key_dir_type)
+                for i in range(100):
+                    store.set(f"key{i:03d}", f"value{i}")
+                self.assertEqual(
+                    list(store.scan("key010", "key013")),
+                    [
+                        ("key010", "value10"),
+                        ("key011", "value11"),
+                        ("key012", "value12"),
+                    ],
+                )
+                self.assertEqual(
+                    [k for k, _ in store.scan("key097", reverse=True)],
+                    ["key099", "key098", "key097"],
+                )
+                self.assertEqual(len(list(store.scan())), 100)
+                self.assertEqual(
+                    [k for k, _ in store.prefix("key05")],
+                    [f"key05{i}" for i in range(10)],
+                )
+                self.assertEqual(list(store.prefix("nope")), [])
+                store.close()
+
+    def test_lazy(self) -> None:
+        store = DiskStorage(file_name=self.path, key_dir_type="sorted")
+        for i in range(100):
+            store.set(f"key{i:03d}", f"value{i}")
+        reads: list[str] = []
+        get = store.get
+
+        def counting_get(key: str) -> str:
+            reads.append(key)
+            return get(key)
+
+        store.get = counting_get  # type: ignore[method-assign]
+        pairs = store.scan()
+        self.assertEqual(next(pairs), ("key000", "value0"))
+        self.assertEqual(next(pairs), ("key001", "value1"))
+        self.assertEqual(reads, ["key000", "key001"])
+        store.close()
+
+    def test_prefix_end(self) -> None:
+        self.assertEqual(prefix_end("ab"), "ac")
+        self.assertEqual(prefix_end("a" + chr(sys.maxunicode)), "b")
+        self.assertIsNone(prefix_end(""))
+
+
+class TestDiskCaskDBDelete(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_delete(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        store.set("name", "jojo")
+        store.set("other", "dio")
+        store.delete("name")
+        self.assertEqual(store.get("name"), "")
+        self.assertNotIn("name", store.key_dir)
+        del store["other"]
+        self.assertRaises(KeyError, store.__delitem__, "other")
+        size: int = store.write_position
+        # deleting a missing key writes nothing
+        store.delete("nope")
+        self.assertEqual(store.write_position, size)
+        # discard tells whether the key existed
+        self.assertIsNone(store.discard("nope"))
+        store.set("name", "jotaro")
+        self.assertIsNotNone(store.discard("name"))
+        self.assertIsNone(store.discard("name"))
+        store.set("name", "jotaro")
+        store.close()
+
+        store = DiskStorage(file_name=self.path)
+        self.assertEqual(store.get("name"), "jotaro")
+        self.assertNotIn("other", store.key_dir)
+        store.close()
+
+    def test_startup_without_hint(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        for i in range(10):
+            store.set(f"key{i}", f"value{i}")
+        for i in range(0, 10, 2):
+            store.delete(f"key{i}")
+        crash(store)
+
+        store = DiskStorage(file_name=self.path)
+        self.assertEqual(sorted(store.key_dir), [f"key{i}" for i in range(1, 10, 2)])
+        store.close()
+
+    def test_tombstone_hides_older_segments(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=100)
+        for i in range(20):
+            store.set(f"key{i}", f"value{i}")
+        store.delete("key3")
+        store.close()
+
+        # once from the hint files, once from the segments
+        for remove_hints in (False, True):
+            if remove_hints:
+                for file_id in store.file_ids():
+                    if os.path.exists(store.hint_path(file_id)):
+                        os.remove(store.hint_path(file_id))
+            store = DiskStorage(file_name=self.path, max_file_size=100)
+            self.assertEqual(store.get("key3"), "")
+            self.assertEqual(len(store.key_dir), 19)
+            store.close()
+
+    def test_startup_drops_tombstones_from_key_dir(self) -> None:
+        # the startup streams the tombstones into the KeyDir, and drops them once all
+        # the segments are read. Those of the active segment are kept for its hint
+        for key_dir_type in ("dict", "compact", "sorted", "paged"):
+            with self.subTest(key_dir_type=key_dir_type):
+                path: str = os.path.join(self.dir.name, f"{key_dir_type}.db")
+                store = DiskStorage(
+                    file_name=path, max_file_size=100, key_dir_type=key_dir_type
+                )
+                for i in range(20):
+                    store.set(f"key{i}", f"value{i}")
+                store.delete("key3")
+                store.set("key3", "again")
+                store.delete("key5")
+                live: dict[int, int] = dict(store._live_bytes)
+                crash(store)
+
+                store = DiskStorage(
+                    file_name=path, max_file_size=100, key_dir_type=key_dir_type
+                )
+                self.assertEqual(store.get("key3"), "again")
+                self.assertEqual(store.get("key5"), "")
+                self.assertEqual(len(store.key_dir), 19)
+                self.assertTrue(
+                    all(kv.total_size != TOMBSTONE for kv in store.key_dir.values())
+                )
+                self.assertEqual(list(store._active_tombstones), ["key5"])
+                self.assertEqual(store._live_bytes, live)
+                store.close()
+
+    def test_merge_drops_tombstones(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=100)
+        for i in range(20):
+            store.set(f"key{i}", f"value{i}")
+        for i in range(10):
+            store.delete(f"key{i}")
+        store.merge()
+        total: int = sum(
+            os.path.getsize(store.segment_path(i)) for i in store.file_ids()
+        )
+        live: int = sum(kv.total_size for kv in store.key_dir.values())
+        self.assertEqual(total, live)
+        store.close()
+
+        store = DiskStorage(file_name=self.path, max_file_size=100)
+        self.assertEqual(
+            sorted(store.key_dir), sorted(f"key{i}" for i in range(10, 20))
+        )
+        store.close()
+
+    def test_partial_merge_keeps_tombstones(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=100)
+        for i in range(20):
+            store.set(f"key{i}", f"value{i}")
+        first: int = store.file_id
+        store.delete("key0")
+        store.delete("key1")
+        store.set("key1", "again")
+        # merge only the segments of the tombstones, the older ones survive
+        store.merge([i for i in store.file_ids() if i >= first])
+        store.close()
+
+        store = DiskStorage(file_name=self.path, max_file_size=100)
+        self.assertEqual(store.get("key0"), "")
+        self.assertEqual(store.get("key1"), "again")
+        self.assertEqual(len(store.key_dir), 19)
+        store.close()
+
+
+class TestDiskCaskDBThreads(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_readers_with_writer_and_merge(self) -> None:
+        store = DiskStorage(
+            file_name=self.path,
+            sync_policy=SyncPolicy.os_managed(),
+            max_file_size=2000,
+            max_open_files=2,
+        )
+        keys: list[str] = [f"key{i}" for i in range(50)]
+        for key in keys:
+            store.set(key, f"{key}:0")
+        stop = threading.Event()
+        errors: list[str] = []
+
+        def reader() -> None:
+            while not stop.is_set():
+                for key in keys:
+                    value: str = store.get(key)
+                    # every value of a key starts with the key, unless it is deleted
+                    if value and not value.startswith(key + ":"):
+                        errors.append(f"{key}={value}")
+                for key, value in zip(keys, store.get_many(keys)):
+                    if value and not value.startswith(key + ":"):
+                        errors.append(f"{key}={value}")
+
+        def merger() -> None:
+            while not stop.is_set():
+                store.merge(store.file_ids()[:-1])
+
+        threads: list[threading.Thread] = [
+            threading.Thread(target=reader) for _ in range(4)
+        ]
+        threads.append(threading.Thread(target=merger))
+        for t in threads:
+            t.start()
+        for version in range(1, 30):
+            for i, key in enumerate(keys):
+                if (i + version) % 7 == 0:
+                    store.delete(key)
+                else:
+                    store.set(key, f"{key}:{version}")
+        stop.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertGreater(store.merge_stats.merges, 0)
+        for i, key in enumerate(keys):
+            expected: str = "" if (i + 29) % 7 == 0 else f"{key}:29"
+            self.assertEqual(store.get(key), expected)
+        store.close()
+
+
+class TestDiskCaskDBReadOnly(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_single_writer(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        self.assertRaises(BlockingIOError, DiskStorage, file_name=self.path)
+        reader = DiskStorage(file_name=self.path, read_only=True)
+        reader.close()
+        store.close()
+        # the lock is released on close
+        store = DiskStorage(file_name=self.path)
+        store.close()
+
+    def test_refresh(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=200)
+        store.set("name", "jojo")
+        reader = DiskStorage(file_name=self.path, read_only=True)
+        self.assertEqual(reader.get("name"), "jojo")
+        store.set("name", "jotaro")
+        store.set_many([(f"key{i}", f"value{i}") for i in range(20)])
+        store.delete("key3")
+        # the reader sees the new writes only after a refresh
+        self.assertEqual(reader.get("key1"), "")
+        self.assertGreater(reader.refresh(), 0)
+        self.assertGreater(len(store.file_ids()), 1)
+        self.assertEqual(reader.get("name"), "jotaro")
+        self.assertEqual(reader.get("key3"), "")
+        for i in range(20):
+            if i != 3:
+                self.assertEqual(reader.get(f"key{i}"), f"value{i}")
+        self.assertEqual(reader.refresh(), 0)
+        store.close()
+        reader.close()
+
+    def test_refresh_after_merge(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=100)
+        for i in range(50):
+            store.set(f"key{i % 5}", f"value{i}")
+        store.delete("key0")
+        reader = DiskStorage(file_name=self.path, read_only=True, use_mmap=True)
+        store.merge()
+        store.set("key1", "new")
+        reader.refresh()
+        self.assertEqual(reader.get("key0"), "")
+        self.assertEqual(reader.get("key1"), "new")
+        for i in range(2, 5):
+            self.assertEqual(reader.get(f"key{i}"), f"value{45 + i}")
+        store.close()
+        reader.close()
+
+    def test_writes_fail(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        store.set("name", "jojo")
+        store.close()
+        reader = DiskStorage(file_name=self.path, read_only=True)
+        self.assertRaises(io.UnsupportedOperation, reader.set, "name", "dio")
+        self.assertRaises(io.UnsupportedOperation, reader.set_many, [("name", "dio")])
+        self.assertRaises(io.UnsupportedOperation, reader.delete, "name")
+        self.assertRaises(io.UnsupportedOperation, reader.merge)
+        self.assertEqual(reader.get("name"), "jojo")
+        reader.close()
+        self.assertRaises(
+            ValueError,
+            DiskStorage,
+            file_name=self.path,
+            read_only=True,
+            merge_threshold=0.5,
+        )
+
+    def test_torn_tail_is_kept(self) -> None:
+        # a read only store must not truncate the record the writer is writing
+        store = DiskStorage(file_name=self.path)
+        store.set("name", "jojo")
+        with open(self.path, "ab") as f:
+            f.write(b"\x00" * 5)
+        reader = DiskStorage(file_name=self.path, read_only=True)
+        self.assertEqual(reader.get("name"), "jojo")
+        self.assertEqual(os.path.getsize(self.path), reader.write_position + 5)
+        reader.close()
+        store.close()
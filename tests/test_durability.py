@@ -0,0 +1,148 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from caskdb import DiskStorage
+from caskdb.durability import GroupCommit, SyncPolicy
+
+
+class TestSyncPolicy(unittest.TestCase):
+    def test_modes(self) -> None:
+        self.assertEqual(SyncPolicy.always().mode, "always")
+        self.assertEqual(SyncPolicy.every_ms(5).interval_ms, 5)
+        self.assertEqual(SyncPolicy.every_bytes(10).max_bytes, 10)
+        self.assertEqual(SyncPolicy.os_managed().mode, "os")
+
+    def test_bad(self) -> None:
+        self.assertRaises(ValueError, SyncPolicy, "sometimes")
+        self.assertRaises(ValueError, SyncPolicy.every_ms, 0)
+        self.assertRaises(ValueError, SyncPolicy.every_bytes, -1)
+
+
+class TestGroupCommit(unittest.TestCase):
+    def setUp(self) -> None:
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.file = open(self.path, "a+b")
+
+    def tearDown(self) -> None:
+        self.file.close()
+        os.remove(self.path)
+
+    def append(self, commit: GroupCommit, data: bytes) -> int:
+        self.file.write(data)
+        self.file.flush()
+        return commit.appended(len(data))
+
+    def test_always(self) -> None:
+        commit = GroupCommit(self.file, SyncPolicy.always())
+        future = commit.commit(self.append(commit, b"hello"))
+        self.assertTrue(future.done())
+        self.assertEqual(commit.synced, 5)
+        self.assertEqual(commit.sync_count, 1)
+        commit.close()
+
+    def test_coalesce(self) -> None:
+        # the second write is appended before anyone syncs, so a single fsync
+        # makes both the writes durable
+        commit = GroupCommit(self.file, SyncPolicy.always())
+        first = self.append(commit, b"hello")
+        second = self.append(commit, b"world")
+        commit.commit(second)
+        commit.commit(first)
+        self.assertEqual(commit.sync_count, 1)
+        commit.close()
+
+    def test_bytes(self) -> None:
+        commit = GroupCommit(self.file, SyncPolicy.every_bytes(8))
+        future = commit.commit(self.append(commit, b"hello"))
+        self.assertFalse(future.done())
+        commit.commit(self.append(commit, b"world"))
+        self.assertTrue(future.done())
+        self.assertEqual(commit.sync_count, 1)
+        commit.close()
+
+    def test_interval(self) -> None:
+        commit = GroupCommit(self.file, SyncPolicy.every_ms(1))
+        future = commit.commit(self.append(commit, b"hello"))
+        future.result(timeout=5)
+        commit.close()
+
+    def test_os(self) -> None:
+        commit = GroupCommit(self.file, SyncPolicy.os_managed())
+        future = commit.commit(self.append(commit, b"hello"))
+        self.assertFalse(future.done())
+        commit.sync()
+        self.assertTrue(future.done())
+        future = commit.commit(self.append(commit, b"world"))
+        commit.close()
+        self.assertTrue(future.done())
+
+    def test_pending_bounded(self) -> None:
+        # the writes waiting for the same fsync share a future, however many
+        # of them there are
+        for policy in (SyncPolicy.os_managed(), SyncPolicy.every_bytes(1 << 30)):
+            with self.subTest(mode=policy.mode):
+                commit = GroupCommit(self.file, policy)
+                futures = {
+                    id(commit.commit(self.append(commit, b"hello")))
+                    for _ in range(1000)
+                }
+                self.assertEqual(len(futures), 1)
+                self.assertIsNotNone(commit._pending)
+                future = commit.commit(self.append(commit, b"hello"))
+                commit.sync()
+                self.assertTrue(future.done())
+                self.assertIsNone(commit._pending)
+                self.assertIsNot(commit.commit(self.append(commit, b"world")), future)
+                commit.close()
+
+
+class TestDiskStorageSyncPolicy(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_policies(self) -> None:
+        policies = [
+            SyncPolicy.always(),
+            SyncPolicy.every_ms(1),
+            SyncPolicy.every_bytes(64),
+            SyncPolicy.os_managed(),
+        ]
+        for i, policy in enumerate(policies):
+            store = DiskStorage(file_name=self.path, sync_policy=policy)
+            future = store.set(f"key{i}", policy.mode)
+            self.assertEqual(store.get(f"key{i}"), policy.mode)
+            store.sync()
+            self.assertTrue(future.done())
+            store.close()
+
+        store = DiskStorage(file_name=self.path)
+        for i, policy in enumerate(policies):
+            self.assertEqual(store.get(f"key{i}"), policy.mode)
+        store.close()
+
+    def test_concurrent_writers(self) -> None:
+        store = DiskStorage(file_name=self.path)
+
+        def write(n: int) -> None:
+            for i in range(50):
+                store.set(f"{n}-{i}", str(i))
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        store.close()
+
+        store = DiskStorage(file_name=self.path)
+        for n in range(4):
+            for i in range(50):
+                self.assertEqual(store.get(f"{n}-{i}"), str(i))
+        store.close()
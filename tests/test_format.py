@@ -9,8 +9,23 @@ from caskdb.format import (
     encode_header,
     decode_header,
     encode_kv,
+    encode_kv_into,
+    encode_batch_header,
+    encode_tombstone,
+    record_size,
     decode_kv,
+    split_kv,
+    encode_hint,
+    decode_hint_header,
+    BATCH_MARKER,
+    TOMBSTONE,
     HEADER_SIZE,
+    HINT_HEADER_SIZE,
+    ChecksumError,
+    decode_key,
+    encode_key,
+    encode_kv_bytes,
+    verify_record,
 )
 from caskdb.format import KeyEntry
 
@@ -95,6 +110,15 @@ class TestEncodeKV(unittest.TestCase):
             self.kv_test(tt)
 
 
+class TestHint(unittest.TestCase):
+    def test_hint_serialisation(self) -> None:
+        data = encode_hint(10, "hamlet", 2**40, 30)
+        self.assertEqual(len(data), HINT_HEADER_SIZE + len("hamlet"))
+        t, k, p, sz = decode_hint_header(data[:HINT_HEADER_SIZE])
+        self.assertEqual((t, k, p, sz), (10, len("hamlet"), 2**40, 30))
+        self.assertEqual(data[HINT_HEADER_SIZE:], b"hamlet")
+
+
 class TestKeyEntry(unittest.TestCase):
     # dumb test to increase the coverage
     def test_init(self) -> None:
@@ -102,3 +126,97 @@ class TestKeyEntry(unittest.TestCase):
         self.assertEqual(ke.timestamp, 10)
         self.assertEqual(ke.position, 10)
         self.assertEqual(ke.total_size, 10)
+        self.assertEqual(ke.file_id, 0)
+
+
+class TestSplitKV(unittest.TestCase):
+    def test_split(self) -> None:
+        _, data = encode_kv(10, "hello", "world")
+        t, k, v = split_kv(memoryview(data))
+        self.assertEqual(t, 10)
+        self.assertEqual(bytes(k), b"hello")
+        self.assertEqual(bytes(v), b"world")
+        self.assertEqual(decode_kv(memoryview(data)), (10, "hello", "world"))
+
+
+class TestBatch(unittest.TestCase):
+    def test_encode_kv_into(self) -> None:
+        buffer = bytearray(HEADER_SIZE * 2 + 20)
+        sz = encode_kv_into(buffer, 0, 10, b"hello", b"world")
+        self.assertEqual(sz, HEADER_SIZE + 10)
+        encode_kv_into(buffer, sz, 11, b"caskdb", b"rocks")
+        self.assertEqual(bytes(buffer[:sz]), encode_kv(10, "hello", "world")[1])
+        self.assertEqual(decode_kv(bytes(buffer[sz:])), (11, "caskdb", "rocks"))
+
+    def test_batch_header(self) -> None:
+        t, k, v = decode_header(encode_batch_header(10, 100))
+        self.assertEqual((t, k, v), (10, BATCH_MARKER, 100))
+
+
+class TestTombstone(unittest.TestCase):
+    def test_encode_tombstone(self) -> None:
+        sz, data = encode_tombstone(10, "hello")
+        self.assertEqual(sz, HEADER_SIZE + 5)
+        self.assertEqual(decode_header(data[:HEADER_SIZE]), (10, 5, TOMBSTONE))
+        self.assertEqual(data[HEADER_SIZE:], b"hello")
+
+    def test_record_size(self) -> None:
+        self.assertEqual(record_size(5, TOMBSTONE), HEADER_SIZE + 5)
+        self.assertEqual(record_size(5, 0), HEADER_SIZE + 5)
+        self.assertEqual(record_size(5, 10), HEADER_SIZE + 15)
+
+
+class TestChecksum(unittest.TestCase):
+    def test_verify(self) -> None:
+        _, data = encode_kv(10, "hello", "world")
+        verify_record(data)
+        self.assertEqual(decode_kv(data, verify=True), (10, "hello", "world"))
+        _, tombstone = encode_tombstone(10, "hello")
+        verify_record(tombstone)
+        verify_record(encode_batch_header(10, 100))
+        buffer = bytearray(HEADER_SIZE + 10)
+        encode_kv_into(buffer, 0, 10, b"hello", b"world")
+        verify_record(bytes(buffer))
+
+    def test_corrupt(self) -> None:
+        _, data = encode_kv(10, "hello", "world")
+        # every flipped bit, be it in the header, the key or the value, is caught
+        for i in range(len(data)):
+            corrupt = bytearray(data)
+            corrupt[i] ^= 0x10
+            self.assertRaises(ChecksumError, verify_record, bytes(corrupt))
+        self.assertRaises(ChecksumError, decode_kv, data[:-1], True)
+        # without verify, the corruption goes unnoticed
+        corrupt = bytearray(data)
+        corrupt[-1] ^= 0x10
+        self.assertEqual(decode_kv(bytes(corrupt)), (10, "hello", "worlt"))
+
+
+class TestBytes(unittest.TestCase):
+    def test_non_ascii(self) -> None:
+        # the sizes in the header are byte lengths, not the number of characters
+        sz, data = encode_kv(10, "ключ", "値")
+        self.assertEqual(sz, HEADER_SIZE + 8 + 3)
+        self.assertEqual(decode_header(data[:HEADER_SIZE]), (10, 8, 3))
+        self.assertEqual(decode_kv(data, verify=True), (10, "ключ", "値"))
+
+    def test_encode_kv_bytes(self) -> None:
+        value = bytes(range(256))
+        sz, data = encode_kv_bytes(10, b"\xff\x00key", memoryview(value))
+        self.assertEqual(sz, HEADER_SIZE + 5 + 256)
+        t, k, v = split_kv(data, verify=True)
+        self.assertEqual((t, bytes(k), bytes(v)), (10, b"\xff\x00key", value))
+        self.assertEqual(
+            encode_kv_bytes(10, b"name", b"jojo"), encode_kv(10, "name", "jojo")
+        )
+
+    def test_keys(self) -> None:
+        for key in (
+            b"",
+            b"name",
+            "ключ".encode("utf-8"),
+            b"\xff\xfe\x80",
+            bytes(range(256)),
+        ):
+            self.assertEqual(encode_key(decode_key(key)), key)
+        self.assertEqual(decode_key(b"name"), "name")
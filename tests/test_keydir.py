@@ -0,0 +1,157 @@
+import os
+import random
+import tempfile
+import unittest
+
+from caskdb import DiskStorage
+from caskdb.format import KeyEntry
+from caskdb.keydir import CompactKeyDir, SortedKeyDir, new_key_dir, segment_items
+
+
+class TestNewKeyDir(unittest.TestCase):
+    def test_types(self) -> None:
+        self.assertIsInstance(new_key_dir("dict"), dict)
+        self.assertIsInstance(new_key_dir("compact"), CompactKeyDir)
+        self.assertIsInstance(new_key_dir("sorted"), SortedKeyDir)
+        self.assertRaises(ValueError, new_key_dir, "btree")
+
+    def test_segment_items(self) -> None:
+        for key_dir_type in ("dict", "compact", "sorted"):
+            with self.subTest(key_dir_type=key_dir_type):
+                key_dir = new_key_dir(key_dir_type)
+                for i in range(100):
+                    key_dir[f"key{i}"] = KeyEntry(i, i, 10, i % 3)
+                del key_dir["key3"]
+                key_dir["key6"] = KeyEntry(6, 6, 10, 1)
+                self.assertEqual(
+                    dict(segment_items(key_dir, 0)),
+                    {
+                        f"key{i}": KeyEntry(i, i, 10, 0)
+                        for i in range(0, 100, 3)
+                        if i not in (3, 6)
+                    },
+                )
+                self.assertEqual(list(segment_items(key_dir, 5)), [])
+
+
+class TestCompactKeyDir(unittest.TestCase):
+    def test_get_set(self) -> None:
+        key_dir = CompactKeyDir()
+        key_dir["name"] = KeyEntry(1, 2, 3, 4)
+        self.assertEqual(key_dir["name"], KeyEntry(1, 2, 3, 4))
+        self.assertEqual(key_dir.get("name"), KeyEntry(1, 2, 3, 4))
+        self.assertIsNone(key_dir.get("some key"))
+        self.assertRaises(KeyError, lambda: key_dir["some key"])
+        self.assertIn("name", key_dir)
+        self.assertNotIn("some key", key_dir)
+        key_dir["name"] = KeyEntry(5, 6, 7, 8)
+        self.assertEqual(key_dir["name"], KeyEntry(5, 6, 7, 8))
+        self.assertEqual(len(key_dir), 1)
+        del key_dir["name"]
+        self.assertEqual(len(key_dir), 0)
+        self.assertNotIn("name", key_dir)
+        self.assertRaises(KeyError, key_dir.__delitem__, "name")
+
+    def test_unicode(self) -> None:
+        key_dir = CompactKeyDir()
+        key_dir["ಕನ್ನಡ"] = KeyEntry(1, 2, 3)
+        self.assertEqual(list(key_dir), ["ಕನ್ನಡ"])
+
+    def test_against_dict(self) -> None:
+        # random operations on both, they should always agree
+        rng = random.Random(7)
+        key_dir = CompactKeyDir()
+        expected: dict[str, KeyEntry] = {}
+        for i in range(20000):
+            key: str = f"key{rng.randrange(2000)}"
+            if rng.random() < 0.2 and key in expected:
+                del key_dir[key]
+                del expected[key]
+            else:
+                kv = KeyEntry(i, rng.randrange(2**40), rng.randrange(2**20), i % 7)
+                key_dir[key] = kv
+                expected[key] = kv
+        self.assertEqual(len(key_dir), len(expected))
+        self.assertEqual(dict(key_dir.items()), expected)
+        self.assertEqual(sorted(key_dir), sorted(expected))
+        self.assertEqual(
+            sorted(kv.timestamp for kv in key_dir.values()),
+            sorted(kv.timestamp for kv in expected.values()),
+        )
+        key_dir.clear()
+        self.assertEqual(len(key_dir), 0)
+
+
+class TestSortedKeyDir(unittest.TestCase):
+    def test_against_dict(self) -> None:
+        rng = random.Random(11)
+        key_dir = SortedKeyDir()
+        expected: dict[str, KeyEntry] = {}
+        for i in range(20000):
+            key: str = f"key{rng.randrange(3000)}"
+            if rng.random() < 0.2 and key in expected:
+                del key_dir[key]
+                del expected[key]
+            else:
+                kv = KeyEntry(i, i, i)
+                key_dir[key] = kv
+                expected[key] = kv
+        self.assertEqual(len(key_dir), len(expected))
+        self.assertEqual(list(key_dir), sorted(expected))
+        self.assertEqual(list(reversed(key_dir)), sorted(expected, reverse=True))
+        self.assertEqual(dict(key_dir.items()), expected)
+        self.assertEqual(key_dir.get("key1"), expected.get("key1"))
+        key_dir.clear()
+        self.assertEqual(list(key_dir), [])
+
+    def test_irange(self) -> None:
+        key_dir = SortedKeyDir()
+        key_dir.update((f"{i:05d}", KeyEntry(i, i, i)) for i in range(0, 5000, 2))
+        keys: list[str] = [f"{i:05d}" for i in range(0, 5000, 2)]
+        for start, end in [("00100", "00200"), ("00101", "00201"), ("04990", "09999")]:
+            expected: list[str] = [k for k in keys if start <= k < end]
+            self.assertEqual(list(key_dir.irange(start, end)), expected)
+            self.assertEqual(
+                list(key_dir.irange(start, end, reverse=True)), expected[::-1]
+            )
+        self.assertEqual(list(key_dir.irange(end="00010")), keys[:5])
+        self.assertEqual(list(key_dir.irange(start="04990")), keys[-5:])
+        self.assertEqual(list(key_dir.irange("2", "1")), [])
+
+    def test_modified_while_iterating(self) -> None:
+        key_dir = SortedKeyDir()
+        for i in range(0, 3000, 3):
+            key_dir[f"{i:05d}"] = KeyEntry(i, i, i)
+        seen: list[str] = []
+        for key in key_dir:
+            seen.append(key)
+            if len(seen) == 10:
+                # enough inserts to split the sublists after us
+                for i in range(1, 3000, 3):
+                    key_dir[f"{i:05d}"] = KeyEntry(i, i, i)
+        self.assertEqual(seen, sorted(set(seen)))
+        self.assertEqual(seen[-1], "02998")
+
+
+class TestDiskStorageCompactKeyDir(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_persistence(self) -> None:
+        store = DiskStorage(file_name=self.path, key_dir_type="compact")
+        self.assertIsInstance(store.key_dir, CompactKeyDir)
+        for i in range(100):
+            store.set(f"key{i % 10}", f"value{i}")
+        store.merge()
+        for i in range(10):
+            self.assertEqual(store.get(f"key{i}"), f"value{90 + i}")
+        store.close()
+
+        store = DiskStorage(file_name=self.path, key_dir_type="compact")
+        for i in range(10):
+            self.assertEqual(store.get(f"key{i}"), f"value{90 + i}")
+        store.close()
@@ -0,0 +1,180 @@
+import os
+import tempfile
+import unittest
+
+from caskdb import DiskStorage, SyncPolicy
+from caskdb.cache import LRUCache
+from caskdb.metrics import (
+    BUCKETS,
+    SUB_BUCKETS,
+    Histogram,
+    Metrics,
+    StoreStats,
+    bucket_index,
+    bucket_start,
+)
+
+
+class TestHistogram(unittest.TestCase):
+    def test_buckets(self) -> None:
+        # the buckets are contiguous, and every latency falls in its own
+        previous: int = -1
+        for index in range(BUCKETS):
+            start: int = bucket_start(index)
+            self.assertGreater(start, previous)
+            self.assertEqual(bucket_index(start), index)
+            if index + 1 < BUCKETS:
+                self.assertEqual(bucket_index(bucket_start(index + 1) - 1), index)
+            previous = start
+        for ns in (0, 1, 7, 8, 9, 1000, 123_456_789):
+            width: int = bucket_start(bucket_index(ns) + 1) - bucket_start(
+                bucket_index(ns)
+            )
+            self.assertLessEqual(width, max(1, ns // SUB_BUCKETS))
+        self.assertEqual(bucket_index(10**18), BUCKETS - 1)
+
+    def test_percentile(self) -> None:
+        histogram = Histogram()
+        self.assertEqual(histogram.percentile(99), 0.0)
+        for us in range(1, 1001):
+            histogram.record(us / 1e6, 10)
+        self.assertEqual(histogram.count, 1000)
+        self.assertEqual(histogram.bytes, 10_000)
+        self.assertAlmostEqual(histogram.mean, 500.5e-6)
+        self.assertEqual(histogram.max, 1e-3)
+        for p, expected in ((50, 500e-6), (99, 990e-6), (100, 1e-3)):
+            with self.subTest(p=p):
+                self.assertGreaterEqual(histogram.percentile(p), expected)
+                self.assertLessEqual(histogram.percentile(p), expected * 1.125)
+        self.assertRaises(ValueError, histogram.percentile, 101)
+
+    def test_copy(self) -> None:
+        histogram = Histogram()
+        histogram.record(0.5)
+        copy: Histogram = histogram.copy()
+        histogram.record(1.0)
+        self.assertEqual(copy.count, 1)
+        self.assertEqual(copy.max, 0.5)
+        self.assertEqual(copy.percentile(100), 0.5)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_observe(self) -> None:
+        seen: list[tuple[str, float, int]] = []
+        metrics = Metrics([lambda *args: seen.append(args)])
+        metrics.observe("get", 0.25, 3)
+        metrics.observe("get", 0.75)
+        self.assertEqual(seen, [("get", 0.25, 3), ("get", 0.75, 0)])
+        histograms: dict[str, Histogram] = metrics.histograms()
+        self.assertEqual(list(histograms), ["get"])
+        self.assertEqual(histograms["get"].count, 2)
+        self.assertEqual(histograms["get"].bytes, 3)
+        metrics.reset()
+        self.assertEqual(metrics.histograms(), {})
+
+    def test_timed(self) -> None:
+        metrics = Metrics()
+
+        def upper(value: str) -> str:
+            if not value:
+                raise ValueError("empty")
+            return value.upper()
+
+        timed = metrics.timed("upper", upper, len)
+        self.assertEqual(timed("abc"), "ABC")
+        self.assertRaises(ValueError, timed, "")
+        histogram: Histogram = metrics.histograms()["upper"]
+        self.assertEqual(histogram.count, 1)
+        self.assertEqual(histogram.bytes, 3)
+        self.assertEqual(timed.__name__, "upper")
+
+
+class TestStoreStats(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_uninstrumented(self) -> None:
+        store = DiskStorage(file_name=self.path)
+        # the store keeps its plain methods
+        self.assertNotIn("get", vars(store))
+        store.set("name", "jojo")
+        store.set("name", "jojo")
+        store.set("nick", "jojo")
+        stats: StoreStats = store.stats()
+        self.assertEqual(stats.live_keys, 2)
+        self.assertEqual(stats.segments, 1)
+        self.assertEqual(stats.file_size, os.path.getsize(self.path))
+        self.assertEqual(stats.bytes_written, stats.file_size)
+        self.assertEqual(stats.syncs, 3)
+        # the first record of name is dead
+        self.assertEqual(stats.dead_bytes, stats.file_size // 3)
+        self.assertAlmostEqual(stats.dead_byte_ratio, 1 / 3)
+        self.assertIsNone(stats.cache_hit_rate)
+        self.assertIsNone(stats.bloom_false_positive_rate)
+        self.assertEqual(stats.operations, {})
+        store.close()
+
+    def test_instrumented(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=256)
+        for i in range(20):
+            store.set(f"key{i}", "value")
+        store.close()
+        seen: list[str] = []
+        metrics = Metrics([lambda op, seconds, size: seen.append(op)])
+        store = DiskStorage(
+            file_name=self.path,
+            max_file_size=256,
+            cache=LRUCache(max_bytes=1 << 20),
+            bloom_fp_rate=0.01,
+            metrics=metrics,
+        )
+        self.assertEqual(seen, ["startup"])
+        store.set("name", "jojo")
+        store.set_bytes(b"name", b"jojo")
+        store.set_many([("a", "1"), ("b", "2")])
+        self.assertEqual(store.get("name"), "jojo")
+        self.assertEqual(store.get("name"), "jojo")
+        self.assertEqual(store["missing"], "")
+        self.assertEqual(bytes(store.get_bytes(b"key1")), b"value")
+        self.assertEqual(store.get_many(["a", "b", "key2"]), ["1", "2", "value"])
+        store.delete_bytes(b"a")
+        store.merge()
+        stats: StoreStats = store.stats()
+        operations: dict[str, Histogram] = stats.operations
+        self.assertEqual(operations["startup"].count, 1)
+        self.assertGreater(operations["startup"].bytes, 0)
+        self.assertEqual(operations["set"].count, 2)
+        self.assertEqual(operations["set_many"].count, 1)
+        # every get is observed once, get_bytes doesn't count as a get_view too
+        self.assertEqual(operations["get"].count, 4)
+        self.assertEqual(operations["get"].bytes, 13)
+        self.assertEqual(operations["get_many"].count, 1)
+        self.assertEqual(operations["get_many"].bytes, 7)
+        self.assertEqual(operations["delete"].count, 1)
+        self.assertEqual(operations["merge"].count, 1)
+        self.assertEqual(operations["merge"].bytes, stats.bytes_reclaimed)
+        self.assertEqual(operations["fsync"].count, stats.syncs)
+        self.assertEqual(stats.merges, 1)
+        # one hit: the second get. get_many goes through the cache too
+        self.assertEqual(stats.cache_hit_rate, 1 / 6)
+        self.assertIsNotNone(stats.bloom_false_positive_rate)
+        self.assertEqual(seen.count("set"), 2)
+        self.assertEqual(stats.as_dict()["operations"]["set"]["count"], 2)
+        store.close()
+
+    def test_read_only(self) -> None:
+        writer = DiskStorage(file_name=self.path, sync_policy=SyncPolicy.os_managed())
+        writer.set("name", "jojo")
+        writer.sync()
+        reader = DiskStorage(file_name=self.path, read_only=True, metrics=Metrics())
+        reader.get("name")
+        stats: StoreStats = reader.stats()
+        self.assertEqual(stats.live_keys, 1)
+        self.assertEqual(stats.bytes_written, 0)
+        self.assertEqual(stats.operations["get"].count, 1)
+        reader.close()
+        writer.close()
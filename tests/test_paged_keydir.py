@@ -0,0 +1,202 @@
+import os
+import random
+import tempfile
+import threading
+import unittest
+
+from caskdb import DiskStorage
+from caskdb.format import KeyEntry
+from caskdb.keydir import new_key_dir, segment_items
+from caskdb.paged_keydir import PagedKeyDir
+
+
+class TestPagedKeyDir(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db.index")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_new_key_dir(self) -> None:
+        key_dir = new_key_dir("paged", self.path)
+        self.assertIsInstance(key_dir, PagedKeyDir)
+        self.assertRaises(ValueError, new_key_dir, "paged")
+        self.assertRaises(ValueError, PagedKeyDir, self.path, -1)
+
+    def test_get_set(self) -> None:
+        key_dir = PagedKeyDir(self.path)
+        key_dir["name"] = KeyEntry(1, 2, 3, 4)
+        self.assertEqual(key_dir["name"], KeyEntry(1, 2, 3, 4))
+        self.assertIsNone(key_dir.get("some key"))
+        self.assertRaises(KeyError, lambda: key_dir["some key"])
+        self.assertIn("name", key_dir)
+        key_dir["name"] = KeyEntry(5, 6, 7, 8)
+        self.assertEqual(key_dir["name"], KeyEntry(5, 6, 7, 8))
+        self.assertEqual(len(key_dir), 1)
+        del key_dir["name"]
+        self.assertNotIn("name", key_dir)
+        self.assertRaises(KeyError, key_dir.__delitem__, "name")
+        self.assertEqual(len(key_dir), 0)
+        key_dir.close()
+
+    def test_grows(self) -> None:
+        # enough keys to rebuild the table a few times, with some deleted on the way
+        key_dir = PagedKeyDir(self.path, cache_entries=100)
+        expected: dict[str, KeyEntry] = {}
+        rng = random.Random(42)
+        for i in range(20_000):
+            key: str = f"key{rng.randrange(10_000)}"
+            if i % 7 == 0 and key in expected:
+                del key_dir[key]
+                del expected[key]
+            else:
+                key_dir[key] = expected[key] = KeyEntry(i, i * 10, i % 100, i % 3)
+        self.assertEqual(len(key_dir), len(expected))
+        self.assertEqual(dict(key_dir.items()), expected)
+        self.assertEqual(sorted(key_dir), sorted(expected))
+        self.assertEqual(
+            sorted(kv.position for kv in key_dir.values()),
+            sorted(kv.position for kv in expected.values()),
+        )
+        for key, kv in expected.items():
+            self.assertEqual(key_dir.get(key), kv)
+        self.assertEqual(
+            dict(segment_items(key_dir, 1)),
+            {key: kv for key, kv in expected.items() if kv.file_id == 1},
+        )
+        key_dir.close()
+
+    def test_cache(self) -> None:
+        key_dir = PagedKeyDir(self.path, cache_entries=2)
+        for i in range(3):
+            key_dir[f"key{i}"] = KeyEntry(i, i, i)
+        for key in ("key0", "key1", "key0", "key2", "key0"):
+            key_dir.get(key)
+        stats = key_dir.cache_stats
+        self.assertEqual((stats.hits, stats.misses, stats.evictions), (2, 3, 1))
+        # a write replaces the cached entry
+        key_dir["key0"] = KeyEntry(9, 9, 9)
+        self.assertEqual(key_dir["key0"], KeyEntry(9, 9, 9))
+        key_dir.close()
+
+    def test_save(self) -> None:
+        key_dir = PagedKeyDir(self.path)
+        for i in range(2000):
+            key_dir[f"key{i}"] = KeyEntry(i, i, i)
+        self.assertIsNone(key_dir.meta)
+        key_dir.save({0: 100, 1: 200}, {0: 50, 1: 150})
+        key_dir.close()
+
+        key_dir = PagedKeyDir(self.path)
+        meta = key_dir.meta
+        assert meta is not None
+        self.assertEqual(meta.file_sizes, {0: 100, 1: 200})
+        self.assertEqual(meta.live_bytes, {0: 50, 1: 150})
+        self.assertEqual(len(key_dir), 2000)
+        self.assertEqual(key_dir["key1999"], KeyEntry(1999, 1999, 1999))
+        # the first write makes the saved index stale
+        key_dir["key0"] = KeyEntry(1, 1, 1)
+        self.assertIsNone(key_dir.meta)
+        key_dir.close()
+        self.assertIsNone(PagedKeyDir(self.path).meta)
+
+    def test_readers_with_writer(self) -> None:
+        key_dir = PagedKeyDir(self.path, cache_entries=10)
+        for i in range(100):
+            key_dir[f"key{i}"] = KeyEntry(0, i, 10)
+        errors: list[str] = []
+        done = threading.Event()
+
+        def read() -> None:
+            while not done.is_set():
+                for i in range(100):
+                    kv = key_dir.get(f"key{i}")
+                    if kv is None or kv.position != i:
+                        errors.append(f"key{i}: {kv}")
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        # new keys rebuild the table under the readers
+        for i in range(5000):
+            key_dir[f"key{i % 100}"] = KeyEntry(i, i % 100, 10)
+            key_dir[f"other{i}"] = KeyEntry(i, i, 10)
+        done.set()
+        for reader in readers:
+            reader.join()
+        self.assertEqual(errors, [])
+        key_dir.close()
+
+
+class TestDiskStoragePagedKeyDir(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def open(self, progress: list[int]) -> DiskStorage:
+        return DiskStorage(
+            file_name=self.path,
+            key_dir_type="paged",
+            max_file_size=500,
+            bloom_fp_rate=0.01,
+            progress=lambda done, total: progress.append(done),
+        )
+
+    def test_resume(self) -> None:
+        progress: list[int] = []
+        store: DiskStorage = self.open(progress)
+        for i in range(100):
+            store.set(f"key{i % 30}", f"value{i}")
+        store.delete("key5")
+        store.merge()
+        store.set("key0", "last")
+        ratios: dict[int, float] = store.dead_byte_ratios()
+        store.close()
+
+        # the saved index is used as is, no segment is scanned
+        store = self.open(progress)
+        self.assertEqual(progress, [])
+        self.assertIsInstance(store.key_dir, PagedKeyDir)
+        self.assertEqual(len(store.key_dir), 29)
+        self.assertEqual(store.get("key0"), "last")
+        self.assertEqual(store.get("key5"), "")
+        for i in range(70, 100):
+            if i % 30 not in (0, 5):
+                self.assertEqual(store.get(f"key{i % 30}"), f"value{i}")
+        self.assertEqual(store.dead_byte_ratios(), ratios)
+        store.set("key1", "again")
+        store.merge()
+        self.assertEqual(store.get("key1"), "again")
+        store.close()
+
+    def test_rebuilt_after_crash(self) -> None:
+        progress: list[int] = []
+        store: DiskStorage = self.open(progress)
+        for i in range(50):
+            store.set(f"key{i}", f"value{i}")
+        store.close()
+        store = self.open(progress)
+        store.set("key0", "new")
+        # a crash: the index was written to, and never saved
+        store.file.close()
+        assert store._file_lock is not None
+        store._file_lock.release()
+
+        store = self.open(progress)
+        self.assertNotEqual(progress, [])
+        self.assertEqual(store.get("key0"), "new")
+        self.assertEqual(store.get("key49"), "value49")
+        store.close()
+
+    def test_read_only(self) -> None:
+        self.assertRaises(
+            ValueError,
+            DiskStorage,
+            file_name=self.path,
+            key_dir_type="paged",
+            read_only=True,
+        )
@@ -0,0 +1,63 @@
+import unittest
+
+from caskdb.resp import (
+    CommandParser,
+    ProtocolError,
+    encode_array,
+    encode_bulk,
+    encode_error,
+    encode_integer,
+    encode_simple,
+)
+
+
+class TestCommandParser(unittest.TestCase):
+    def test_commands(self) -> None:
+        parser = CommandParser()
+        parser.feed(b"*2\r\n$3\r\nGET\r\n$4\r\nname\r\n*1\r\n$4\r\nPING\r\n")
+        self.assertEqual(list(parser), [[b"GET", b"name"], [b"PING"]])
+        self.assertEqual(list(parser), [])
+
+    def test_partial(self) -> None:
+        data: bytes = b"*3\r\n$3\r\nSET\r\n$4\r\nname\r\n$6\r\nj\r\no\x00o\r\n"
+        parser = CommandParser()
+        commands: list[list[bytes]] = []
+        # the command is complete only with its last byte, whatever the reads
+        for i in range(len(data)):
+            parser.feed(data[i : i + 1])
+            commands.extend(parser)
+            self.assertEqual(commands != [], i == len(data) - 1)
+        self.assertEqual(commands, [[b"SET", b"name", b"j\r\no\x00o"]])
+
+    def test_inline(self) -> None:
+        parser = CommandParser()
+        parser.feed(b"SET name jojo\r\n\r\nGET na")
+        self.assertEqual(list(parser), [[b"SET", b"name", b"jojo"]])
+        parser.feed(b"me\r\n")
+        self.assertEqual(list(parser), [[b"GET", b"name"]])
+
+    def test_errors(self) -> None:
+        for data in (
+            b"*1\r\n:3\r\n",
+            b"*x\r\n",
+            b"*1\r\n$3\r\nGETX\r\n",
+            b"*1\r\n$999999999999\r\n",
+            b"x" * 100_000,
+        ):
+            with self.subTest(data=data[:20]):
+                parser = CommandParser()
+                parser.feed(data)
+                self.assertRaises(ProtocolError, list, parser)
+
+
+class TestEncode(unittest.TestCase):
+    def test_replies(self) -> None:
+        self.assertEqual(encode_simple("OK"), b"+OK\r\n")
+        self.assertEqual(encode_error("ERR bad\r\nthing"), b"-ERR bad  thing\r\n")
+        self.assertEqual(encode_integer(-3), b":-3\r\n")
+        self.assertEqual(encode_bulk(b"a\r\nb"), b"$4\r\na\r\nb\r\n")
+        self.assertEqual(encode_bulk(None), b"$-1\r\n")
+        self.assertEqual(
+            encode_array([encode_bulk(b"a"), encode_bulk(None)]),
+            b"*2\r\n$1\r\na\r\n$-1\r\n",
+        )
@@ -0,0 +1,188 @@
+import os
+import random
+import tempfile
+import unittest
+
+from caskdb import DiskStorage
+from caskdb.format import (
+    KeyEntry,
+    encode_batch_header,
+    encode_kv,
+    encode_kv_bytes,
+    encode_tombstone,
+)
+from caskdb.scan import (
+    PARALLEL_MIN_CHUNK,
+    find_record,
+    merge_chunks,
+    next_record,
+    plan_chunks,
+    scan_chunk,
+    scan_records,
+)
+
+
+class TestScan(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+        # a segment with overwrites, tombstones, batches and a few large values
+        rng = random.Random(7)
+        data: bytearray = bytearray()
+        for i in range(2000):
+            key: str = f"key{rng.randrange(300)}"
+            if i % 50 == 0:
+                batch: bytes = b"".join(
+                    encode_kv(i, f"batch{i}-{j}", "v" * j)[1] for j in range(5)
+                )
+                data += encode_batch_header(i, len(batch)) + batch
+            elif i % 13 == 0:
+                data += encode_tombstone(i, key)[1]
+            else:
+                size: int = 5000 if i % 97 == 0 else rng.randrange(1, 100)
+                data += encode_kv(i, key, "x" * size)[1]
+        with open(self.path, "wb") as f:
+            f.write(data)
+        self.size: int = len(data)
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def scan_in_chunks(self, chunk_size: int) -> tuple[dict[str, KeyEntry], int]:
+        chunks = [
+            scan_chunk(
+                self.path, 3, start, min(start + chunk_size, self.size), not start
+            )
+            for start in range(0, self.size, chunk_size)
+        ]
+        entries: dict[str, KeyEntry] = {}
+        return entries, merge_chunks(self.path, 3, 0, chunks, entries)
+
+    def test_chunks_match_sequential_scan(self) -> None:
+        expected: dict[str, KeyEntry] = {}
+        self.assertEqual(scan_records(self.path, 3, 0, expected), self.size)
+        # the chunks start in the middle of records, batches and large values
+        for chunk_size in (333, 1000, 4096, self.size):
+            with self.subTest(chunk_size=chunk_size):
+                entries, end = self.scan_in_chunks(chunk_size)
+                self.assertEqual(end, self.size)
+                self.assertEqual(entries, expected)
+
+    def test_torn_tail(self) -> None:
+        os.truncate(self.path, self.size - 3)
+        expected: dict[str, KeyEntry] = {}
+        end: int = scan_records(self.path, 3, 0, expected)
+        self.size -= 3
+        self.assertLess(end, self.size)
+        self.assertEqual(self.scan_in_chunks(1000), (expected, end))
+
+    def test_corrupt_record(self) -> None:
+        with open(self.path, "r+b") as f:
+            f.seek(self.size // 2)
+            f.write(b"\xff\xff")
+        expected: dict[str, KeyEntry] = {}
+        end: int = scan_records(self.path, 3, 0, expected)
+        self.assertLess(end, self.size // 2)
+        self.assertEqual(self.scan_in_chunks(500), (expected, end))
+
+    def test_next_record(self) -> None:
+        with open(self.path, "r+b") as f:
+            f.seek(self.size // 2)
+            f.write(b"\xff\xff")
+        entries: dict[str, KeyEntry] = {}
+        end: int = scan_records(self.path, 3, 0, entries)
+        found: int = next_record(self.path, end)
+        self.assertGreater(found, self.size // 2)
+        # the scan resumes at the next record, and reads the segment to its end
+        self.assertEqual(scan_records(self.path, 3, found, entries), self.size)
+        self.assertEqual(next_record(self.path, self.size - 3), -1)
+
+    def test_next_record_skips_batch(self) -> None:
+        batch: bytes = b"".join(encode_kv(1, f"key{i}", "v")[1] for i in range(3))
+        after: bytes = encode_kv(2, "after", "v")[1]
+        data: bytearray = bytearray(encode_batch_header(1, len(batch)) + batch + after)
+        # the last record of the batch rots, the batch is skipped as a whole
+        data[-len(after) - 1] ^= 0x01
+        with open(self.path, "wb") as f:
+            f.write(data)
+        self.assertEqual(scan_records(self.path, 3, 0, {}), 0)
+        self.assertEqual(next_record(self.path, 0), len(data) - len(after))
+
+    def test_value_holding_records(self) -> None:
+        # the values look like records, so a worker starting inside one of them
+        # guesses wrong
+        inner: bytes = encode_kv(1, "fake", "a")[1] + encode_kv(2, "fake", "b")[1]
+        data: bytes = b"".join(
+            encode_kv_bytes(i, f"key{i}".encode(), inner * 20)[1] for i in range(20)
+        )
+        with open(self.path, "wb") as f:
+            f.write(data)
+        self.size = len(data)
+        self.assertNotEqual(find_record(self.path, 10, self.size), -1)
+        expected: dict[str, KeyEntry] = {}
+        scan_records(self.path, 3, 0, expected)
+        self.assertNotIn("fake", expected)
+        self.assertEqual(self.scan_in_chunks(100), (expected, self.size))
+
+    def test_stop(self) -> None:
+        entries: dict[str, KeyEntry] = {}
+        end: int = scan_records(self.path, 3, 0, entries, stop=1000)
+        self.assertGreaterEqual(end, 1000)
+        self.assertEqual(find_record(self.path, 1000, self.size), end)
+        self.assertEqual(find_record(self.path, self.size - 1, self.size), -1)
+
+    def test_plan_chunks(self) -> None:
+        self.assertEqual(plan_chunks(10, 10, 4), [])
+        self.assertEqual(plan_chunks(10, 100, 4), [(10, 100)])
+        size: int = 20 * PARALLEL_MIN_CHUNK + 5
+        chunks = plan_chunks(5, size, 2)
+        self.assertEqual(len(chunks), 8)
+        self.assertEqual(chunks[0][0], 5)
+        self.assertEqual(chunks[-1][1], size)
+        for (_, stop), (start, _) in zip(chunks, chunks[1:]):
+            self.assertEqual(stop, start)
+
+
+class TestDiskStorageParallelStartup(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "test.db")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def test_startup(self) -> None:
+        store = DiskStorage(file_name=self.path, max_file_size=3 * PARALLEL_MIN_CHUNK)
+        for i in range(0, 60_000, 1000):
+            store.set_many(
+                [(f"key{j % 25_000}", f"value{j}" * 10) for j in range(i, i + 1000)]
+            )
+        store.delete("key7")
+        # no close, so that the startup has no hint file and scans the segments
+        store.file.close()
+        assert store._file_lock is not None
+        store._file_lock.release()
+
+        store = DiskStorage(file_name=self.path)
+        expected: dict[str, KeyEntry] = dict(store.key_dir.items())
+        store.close()
+        for i in store.file_ids():
+            os.remove(store.hint_path(i))
+
+        progress: list[int] = []
+        store = DiskStorage(
+            file_name=self.path,
+            startup_workers=2,
+            progress=lambda done, total: progress.append(done),
+        )
+        self.assertEqual(dict(store.key_dir.items()), expected)
+        self.assertNotIn("key7", store.key_dir)
+        self.assertEqual(store.get("key24999"), "value49999" * 10)
+        self.assertEqual(progress, sorted(progress))
+        store.set("key7", "back")
+        store.close()
+
+    def test_bad_options(self) -> None:
+        self.assertRaises(
+            ValueError, DiskStorage, file_name=self.path, startup_workers=0
+        )
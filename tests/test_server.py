@@ -0,0 +1,219 @@
+import asyncio
+import os
+import tempfile
+import threading
+import typing
+import unittest
+
+from caskdb import AsyncDiskStorage
+from caskdb.resp import encode_array, encode_bulk
+from caskdb.server import Server, decode_cursor, encode_cursor
+
+Reply = typing.Union[None, int, bytes, str, list[typing.Any], Exception]
+
+
+def command(*args: typing.Union[str, bytes]) -> bytes:
+    return encode_array(
+        [encode_bulk(arg.encode() if isinstance(arg, str) else arg) for arg in args]
+    )
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Reply:
+    # a client's side of the resp module: simple strings come back as str, errors as
+    # exceptions, and bulk strings as bytes
+    line: bytes = (await reader.readuntil(b"\r\n"))[:-2]
+    kind, rest = line[:1], line[1:]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return Exception(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        if int(rest) < 0:
+            return None
+        return (await reader.readexactly(int(rest) + 2))[:-2]
+    assert kind == b"*", line
+    return [await read_reply(reader) for _ in range(int(rest))]
+
+
+class TestServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = await AsyncDiskStorage.open(
+            os.path.join(self.dir.name, "test.db"), key_dir_type="sorted"
+        )
+        self.server = Server(self.store)
+        self.listener = await self.server.start("127.0.0.1", 0)
+        self.port: int = self.listener.sockets[0].getsockname()[1]
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+
+    async def asyncTearDown(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.listener.close()
+        await self.listener.wait_closed()
+        await self.store.close()
+        self.dir.cleanup()
+
+    async def call(self, *args: typing.Union[str, bytes]) -> Reply:
+        self.writer.write(command(*args))
+        return await read_reply(self.reader)
+
+    async def pipeline(self, *commands: tuple[str, ...]) -> list[Reply]:
+        self.writer.write(b"".join(command(*args) for args in commands))
+        return [await read_reply(self.reader) for _ in commands]
+
+    async def test_get_set_del(self) -> None:
+        self.assertEqual(await self.call("PING"), "PONG")
+        self.assertEqual(await self.call("SET", "name", "jojo"), "OK")
+        self.assertEqual(await self.call("GET", "name"), b"jojo")
+        self.assertIsNone(await self.call("GET", "missing"))
+        self.assertEqual(await self.call("SET", "empty", ""), "OK")
+        self.assertEqual(await self.call("GET", "empty"), b"")
+        self.assertEqual(await self.call("DEL", "name", "missing", "empty"), 2)
+        self.assertIsNone(await self.call("GET", "name"))
+        # the keys and the values are binary safe
+        self.assertEqual(await self.call("SET", b"\xff\r\n", b"\x00\r\n"), "OK")
+        self.assertEqual(await self.call("GET", b"\xff\r\n"), b"\x00\r\n")
+
+    async def test_del_counts_removed_keys(self) -> None:
+        await self.call("MSET", "a", "1", "b", "2")
+        # a key given twice is removed, and counted, once
+        self.assertEqual(await self.call("DEL", "a", "a"), 1)
+        # of the clients deleting the same key at once, only one removes it
+        clients = [
+            await asyncio.open_connection("127.0.0.1", self.port) for _ in range(5)
+        ]
+        for _, writer in clients:
+            writer.write(command("DEL", "b"))
+        removed: list[Reply] = [await read_reply(reader) for reader, _ in clients]
+        self.assertEqual(sorted(removed), [0, 0, 0, 0, 1])
+        for _, writer in clients:
+            writer.close()
+
+    async def test_mget_mset(self) -> None:
+        self.assertEqual(await self.call("MSET", "a", "1", "b", "2"), "OK")
+        self.assertEqual(await self.call("MGET", "a", "x", "b"), [b"1", None, b"2"])
+
+    async def test_errors(self) -> None:
+        for args in (
+            ("GET",),
+            ("SET", "a"),
+            ("SET", "a", "b", "EX", "10"),
+            ("MSET", "a"),
+        ):
+            with self.subTest(args=args):
+                self.assertIsInstance(await self.call(*args), Exception)
+        reply: Reply = await self.call("FLUSHALL")
+        self.assertIsInstance(reply, Exception)
+        self.assertIn("unknown command", str(reply))
+        # the connection is still usable
+        self.assertEqual(await self.call("PING", "hello"), b"hello")
+
+    async def test_protocol_error(self) -> None:
+        self.writer.write(b"*1\r\n:1\r\n")
+        self.assertIsInstance(await read_reply(self.reader), Exception)
+        self.assertEqual(await self.reader.read(), b"")
+
+    async def test_protocol_error_in_pipeline(self) -> None:
+        # the commands before the malformed one are run and replied to first
+        self.writer.write(
+            command("SET", "name", "jojo") + command("GET", "name") + b"*1\r\n:1\r\n"
+        )
+        self.assertEqual(await read_reply(self.reader), "OK")
+        self.assertEqual(await read_reply(self.reader), b"jojo")
+        self.assertIsInstance(await read_reply(self.reader), Exception)
+        self.assertEqual(await self.reader.read(), b"")
+        self.assertEqual(self.store.store.get("name"), "jojo")
+
+    async def test_pipeline(self) -> None:
+        batches: list[int] = []
+        set_many_bytes = self.store.store.set_many_bytes
+
+        def counting(items: typing.Any) -> typing.Any:
+            batches.append(len(items))
+            return set_many_bytes(items)
+
+        self.store.store.set_many_bytes = counting  # type: ignore[method-assign]
+        replies: list[Reply] = await self.pipeline(
+            *(("SET", f"key{i}", f"value{i}") for i in range(100)),
+            ("GET", "key99"),
+            ("SET", "key0", "new"),
+            ("DEL", "key0"),
+            ("GET", "key0"),
+            ("MGET", "key1", "key0"),
+        )
+        self.assertEqual(replies[:100], ["OK"] * 100)
+        # the reads see the writes sent before them
+        self.assertEqual(replies[100:], [b"value99", "OK", 1, None, [b"value1", None]])
+        # and the writes sent together are written together
+        self.assertEqual(batches[0], 100)
+
+    async def test_clients_share_batches(self) -> None:
+        clients = [
+            await asyncio.open_connection("127.0.0.1", self.port) for _ in range(5)
+        ]
+        for i, (_, writer) in enumerate(clients):
+            writer.write(command("SET", f"key{i}", f"value{i}"))
+        for reader, _ in clients:
+            self.assertEqual(await read_reply(reader), "OK")
+        info: Reply = await self.call("INFO")
+        assert isinstance(info, bytes)
+        self.assertIn(b"connected_clients:6", info)
+        self.assertIn(b"db0:keys=5,", info)
+        keyspace: Reply = await self.call("INFO", "keyspace")
+        assert isinstance(keyspace, bytes)
+        self.assertNotIn(b"# Server", keyspace)
+        for reader, writer in clients:
+            writer.write(command("QUIT"))
+            self.assertEqual(await read_reply(reader), "OK")
+            self.assertEqual(await reader.read(), b"")
+            writer.close()
+
+    async def test_scan(self) -> None:
+        await self.call("MSET", *(f"{k}{i}" for i in range(50) for k in ("key", "v")))
+        await self.call("MSET", *(f"other{i}" for i in range(20)))
+        keys: list[bytes] = []
+        cursor: bytes = b"0"
+        while True:
+            reply = await self.call("SCAN", cursor, "MATCH", "key*", "COUNT", "7")
+            assert isinstance(reply, list)
+            cursor, part = reply
+            keys.extend(part)
+            # a key deleted while we scan doesn't disturb the cursor
+            await self.call("DEL", "key25")
+            if cursor == b"0":
+                break
+        self.assertEqual(
+            sorted(keys), sorted(f"key{i}".encode() for i in range(50) if i != 25)
+        )
+        self.assertIsInstance(await self.call("SCAN", "x"), Exception)
+
+    async def test_scan_info_off_the_loop(self) -> None:
+        # SCAN and INFO walk the KeyDir and stat the segments in the I/O threads
+        await self.call("SET", "name", "jojo")
+        threads: list[str] = []
+        keys = self.store.store.keys
+        file_ids = self.store.store.file_ids
+
+        def recording_keys(*args: typing.Any) -> typing.Any:
+            threads.append(threading.current_thread().name)
+            return keys(*args)
+
+        def recording_file_ids() -> list[int]:
+            threads.append(threading.current_thread().name)
+            return file_ids()
+
+        self.store.store.keys = recording_keys  # type: ignore[method-assign,assignment]
+        self.store.store.file_ids = recording_file_ids  # type: ignore[method-assign]
+        self.assertEqual(await self.call("SCAN", "0"), [b"0", [b"name"]])
+        self.assertIsInstance(await self.call("INFO"), bytes)
+        self.assertEqual(len(threads), 2)
+        for name in threads:
+            self.assertTrue(name.startswith("caskdb-io"), name)
+
+    def test_cursor(self) -> None:
+        for key in ("a", "\x00key", "\udcff"):
+            self.assertEqual(decode_cursor(encode_cursor(key)), key)
+        self.assertIsNone(decode_cursor(0))
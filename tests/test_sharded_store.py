@@ -0,0 +1,174 @@
+import collections
+import os
+import tempfile
+import unittest
+
+from caskdb import ShardedStorage
+from caskdb.metrics import GET_MANY, Metrics
+from caskdb.sharded_store import HashRing
+
+
+class TestHashRing(unittest.TestCase):
+    def test_balance(self) -> None:
+        ring = HashRing([f"shard{i}" for i in range(8)])
+        counts = collections.Counter(
+            ring.shard_for(f"key{i}".encode()) for i in range(40_000)
+        )
+        self.assertEqual(len(counts), 8)
+        # with 256 points per shard, the shares are within about 10% of even
+        for count in counts.values():
+            self.assertLess(abs(count - 5000), 750)
+
+    def test_minimal_movement(self) -> None:
+        keys: list[bytes] = [f"key{i}".encode() for i in range(20_000)]
+        ring = HashRing(["a", "b", "c", "d"])
+        before: list[str] = [ring.shard_for(key) for key in keys]
+        ring.add("e")
+        after: list[str] = [ring.shard_for(key) for key in keys]
+        moved: list[tuple[str, str]] = [
+            (old, new) for old, new in zip(before, after) if old != new
+        ]
+        # only the keys the new shard takes over move, about a fifth of them
+        self.assertTrue(all(new == "e" for _, new in moved))
+        self.assertLess(abs(len(moved) / len(keys) - 0.2), 0.05)
+        ring.remove("e")
+        self.assertEqual([ring.shard_for(key) for key in keys], before)
+
+    def test_order_independent(self) -> None:
+        one = HashRing(["a", "b", "c"])
+        other = HashRing(["c", "a", "b"])
+        for i in range(1000):
+            key: bytes = f"key{i}".encode()
+            self.assertEqual(one.shard_for(key), other.shard_for(key))
+
+    def test_invalid(self) -> None:
+        self.assertRaises(ValueError, HashRing, ["a"], 0)
+        self.assertRaises(LookupError, HashRing().shard_for, b"key")
+        ring = HashRing(["a"])
+        self.assertRaises(ValueError, ring.add, "a")
+        self.assertRaises(KeyError, ring.remove, "b")
+
+
+class TestShardedStorage(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def path(self, name: str) -> str:
+        # every shard gets a directory of its own, like it would get a disk
+        os.makedirs(os.path.join(self.dir.name, name), exist_ok=True)
+        return os.path.join(self.dir.name, name, "test.db")
+
+    def open(self, names: str = "abc") -> ShardedStorage:
+        return ShardedStorage({name: self.path(name) for name in names})
+
+    def test_get_set(self) -> None:
+        store = self.open()
+        store.set("name", "jojo")
+        store["other"] = "dio"
+        self.assertEqual(store.get("name"), "jojo")
+        self.assertEqual(store["other"], "dio")
+        self.assertEqual(store.get("missing"), "")
+        self.assertIn("name", store)
+        del store["name"]
+        self.assertNotIn("name", store)
+        self.assertRaises(KeyError, store.__delitem__, "name")
+        store.set_bytes(b"\xff", b"\x00\x01")
+        self.assertEqual(bytes(store.get_bytes(b"\xff")), b"\x00\x01")
+        store.delete_bytes(b"\xff")
+        self.assertIsNone(store.lookup_bytes(b"\xff"))
+        self.assertEqual(len(store), 1)
+        store.close()
+
+    def test_many(self) -> None:
+        store = self.open()
+        store.set_many([(f"key{i}", f"value{i}") for i in range(300)]).result()
+        # every shard got a part of the keys
+        for shard in store.shards.values():
+            self.assertGreater(len(shard.key_dir), 50)
+        keys: list[str] = [f"key{i}" for i in range(299, -1, -3)] + ["missing"]
+        self.assertEqual(
+            store.get_many(keys), [f"value{i}" for i in range(299, -1, -3)] + [""]
+        )
+        store.set_many_bytes([(b"k1", b"v1"), (b"k2", b"v2")])
+        self.assertEqual(
+            [bytes(v) for v in store.get_many_bytes([b"k2", b"k1"])], [b"v2", b"v1"]
+        )
+        self.assertEqual(
+            store.lookup_many_bytes([b"k2", b"missing", b"k1"]), [b"v2", None, b"v1"]
+        )
+        self.assertEqual(store.get_many([]), [])
+        store.close()
+
+    def test_many_metrics(self) -> None:
+        # the reads of every shard go through its timed methods
+        metrics = Metrics()
+        store = ShardedStorage(
+            {name: self.path(name) for name in "abc"}, metrics=metrics
+        )
+        store.set_many([(f"key{i}", f"value{i}") for i in range(30)]).result()
+        keys: list[str] = [f"key{i}" for i in range(30)]
+        store.get_many(keys)
+        store.get_many_bytes([key.encode() for key in keys])
+        store.lookup_many_bytes([key.encode() for key in keys])
+        self.assertEqual(metrics.histograms()[GET_MANY].count, 3 * len(store.shards))
+        store.close()
+
+    def test_scan(self) -> None:
+        store = self.open()
+        for i in range(50):
+            store.set(f"key{i:02d}", f"value{i}")
+        self.assertEqual(
+            [key for key, _ in store.scan("key10", "key20")],
+            [f"key{i}" for i in range(10, 20)],
+        )
+        self.assertEqual(
+            list(store.prefix("key4", reverse=True)),
+            [(f"key{i}", f"value{i}") for i in range(49, 39, -1)],
+        )
+        store.close()
+
+    def test_persistence(self) -> None:
+        store = self.open()
+        for i in range(100):
+            store.set(f"key{i}", f"value{i}")
+        store.close()
+        store = self.open()
+        for i in range(100):
+            self.assertEqual(store.get(f"key{i}"), f"value{i}")
+        store.close()
+
+    def test_add_and_remove_shard(self) -> None:
+        store = self.open("abc")
+        for i in range(1000):
+            store.set(f"key{i}", f"value{i}")
+        moved: int = store.add_shard("d", self.path("d"))
+        # the new shard takes over about a quarter of the keys, and only those move
+        self.assertEqual(moved, len(store.shards["d"].key_dir))
+        self.assertLess(abs(moved - 250), 100)
+        for i in range(1000):
+            self.assertEqual(store.get(f"key{i}"), f"value{i}")
+        self.assertEqual(len(store), 1000)
+        self.assertRaises(ValueError, store.add_shard, "d", self.path("d"))
+
+        moved = store.remove_shard("a")
+        self.assertNotIn("a", store.shards)
+        self.assertEqual(len(store), 1000)
+        store.close()
+        store = self.open("bcd")
+        self.assertEqual(store.rebalance(), 0)
+        for i in range(1000):
+            self.assertEqual(store.get(f"key{i}"), f"value{i}")
+        self.assertRaises(KeyError, store.remove_shard, "a")
+        store.close()
+
+    def test_invalid(self) -> None:
+        self.assertRaises(ValueError, ShardedStorage, {})
+        # a shard which fails to open closes the ones which did
+        os.makedirs(self.path("b"))
+        self.assertRaises(IsADirectoryError, self.open, "ab")
+        store = self.open("a")
+        self.assertRaises(ValueError, store.remove_shard, "a")
+        store.close()